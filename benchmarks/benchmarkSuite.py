@@ -0,0 +1,552 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2020, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+"""
+End-to-end benchmarks of the main ilastik hot paths on synthetic data, with machine-readable baselines.
+
+Cases:
+    pixel_classification_export   headless batch export of a trained pixel classification project
+    object_classification         object feature extraction, training and prediction
+    conservation_tracking         object extraction and conservation tracking of moving blobs (needs hytra + dpct)
+    project_open_save             opening and re-saving a pixel classification project
+    carving_preprocessing         filter, watershed and supervoxel graph of the carving workflow
+    data_selection_import         copying a tiff stack into hdf5
+
+Synthetic volumes and projects are generated once per --size in the work directory (excluded from the timings).
+Every run of a case happens in a fresh interpreter, so the reported peak RSS belongs to that case alone.
+
+Usage:
+    python benchmarks/benchmarkSuite.py [--size tiny|small|medium|large] [--cases a,b] [--repeat N] [--output FILE]
+    python benchmarks/benchmarkSuite.py --baseline BASELINE.json [--tolerance 0.15] [--rss-tolerance 0.15]
+    python benchmarks/benchmarkSuite.py --results RESULTS.json --baseline BASELINE.json
+
+With --baseline, the results are compared against a previous --output file, and the script exits with a non-zero
+status if a case got slower or needs more memory than allowed by the tolerances.
+"""
+import argparse
+import collections
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARK_DIR)
+RESULT_PREFIX = "BENCHMARK_RESULT "
+RESULTS_VERSION = 1
+
+SIZES = {
+    # "tiny" only checks that the cases run, e.g. in the test suite
+    "tiny": {"volume": (16, 48, 48), "blobs": 12, "frames": 3, "frame": (32, 32), "tracked": 3},
+    "small": {"volume": (32, 128, 128), "blobs": 60, "frames": 10, "frame": (128, 128), "tracked": 20},
+    "medium": {"volume": (64, 256, 256), "blobs": 300, "frames": 30, "frame": (256, 256), "tracked": 80},
+    "large": {"volume": (128, 512, 512), "blobs": 1500, "frames": 100, "frame": (512, 512), "tracked": 300},
+}
+
+OBJECT_FEATURES = {
+    "Standard Object Features": {
+        name: {} for name in ["Count", "RegionCenter", "Mean", "Variance", "Coord<Minimum>", "Coord<Maximum>"]
+    }
+}
+
+
+class CaseSkipped(Exception):
+    """Raised by a case whose optional dependencies are not installed."""
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+##
+## Synthetic data (setup phase, not timed)
+##
+
+
+def setup_blobs(workdir, size):
+    import syntheticData
+
+    raw_path = os.path.join(workdir, "blobs.h5")
+    if not os.path.exists(raw_path):
+        raw, labels = syntheticData.blobs_volume(SIZES[size]["volume"], SIZES[size]["blobs"])
+        syntheticData.write_h5(raw_path, raw[..., None], "zyxc")
+        syntheticData.write_h5(os.path.join(workdir, "blobs_labels.h5"), labels, "zyx")
+    return raw_path
+
+
+def setup_pixel_classification(workdir, size):
+    import syntheticData
+
+    setup_blobs(workdir, size)
+    project_path = os.path.join(workdir, "pixelClassification.ilp")
+    if not os.path.exists(project_path):
+        labels = syntheticData.read_h5(os.path.join(workdir, "blobs_labels.h5"))
+        syntheticData.create_pixel_classification_project(
+            project_path, os.path.join(workdir, "blobs.h5/data"), labels
+        )
+
+
+def setup_tracking(workdir, size):
+    import h5py
+    import syntheticData
+
+    path = os.path.join(workdir, "tracking.h5")
+    if not os.path.exists(path):
+        raw, binary = syntheticData.moving_blobs(SIZES[size]["frames"], SIZES[size]["frame"], SIZES[size]["tracked"])
+        with h5py.File(path, "w") as f:
+            f.create_dataset("raw", data=raw)
+            f.create_dataset("binary", data=binary)
+
+
+def setup_stack(workdir, size):
+    import syntheticData
+
+    stack_dir = os.path.join(workdir, "stack")
+    if not os.path.exists(stack_dir):
+        raw, _ = syntheticData.blobs_volume(SIZES[size]["volume"], SIZES[size]["blobs"])
+        syntheticData.write_tiff_stack(stack_dir, raw)
+
+
+##
+## Cases (run phase). Each returns (seconds, counts) for the timed part only.
+##
+
+
+def run_pixel_classification_export(workdir, size):
+    import ilastik_main
+    from lazyflow.utility import Timer
+
+    export_dir = tempfile.mkdtemp(dir=workdir)
+    args = [
+        "--headless",
+        "--project=" + os.path.join(workdir, "pixelClassification.ilp"),
+        "--output_format=hdf5",
+        "--output_filename_format=" + os.path.join(export_dir, "{nickname}_Probabilities.h5"),
+        os.path.join(workdir, "blobs.h5/data"),
+    ]
+    try:
+        parsed_args, workflow_cmdline_args = ilastik_main.parse_known_args(args)
+        with Timer() as timer:
+            shell = ilastik_main.main(parsed_args, workflow_cmdline_args, init_logging=False)
+        shell.closeCurrentProject()
+    finally:
+        shutil.rmtree(export_dir)
+    return timer.seconds(), {"voxels": _num_voxels(SIZES[size]["volume"])}
+
+
+def run_object_classification(workdir, size):
+    import numpy
+    import syntheticData
+    import vigra
+    from lazyflow.graph import Graph
+    from lazyflow.utility import Timer
+    from ilastik.applets.objectClassification.opObjectClassification import OpObjectPredict, OpObjectTrain
+    from ilastik.applets.objectExtraction.opObjectExtraction import OpObjectExtraction
+
+    raw = syntheticData.read_h5(os.path.join(workdir, "blobs.h5"))[..., 0]
+    binary = (syntheticData.read_h5(os.path.join(workdir, "blobs_labels.h5")) > 0).astype(numpy.uint8)
+
+    graph = Graph()
+    opExtraction = OpObjectExtraction(graph=graph)
+    opExtraction.RawImage.setValue(vigra.taggedView(raw.T[None, ..., None], "txyzc"))
+    opExtraction.BinaryImage.setValue(vigra.taggedView(binary.T[None, ..., None], "txyzc"))
+    opExtraction.Features.setValue(OBJECT_FEATURES)
+
+    with Timer() as timer:
+        features = opExtraction.RegionFeatures([0]).wait()
+        sizes = features[0]["Standard Object Features"]["Count"][:, 0]
+
+        # Label every fourth object by size, like a user would
+        labels = numpy.zeros(len(sizes))
+        labels[1::4] = numpy.where(sizes[1::4] > numpy.median(sizes[1:]), 2, 1)
+
+        opTrain = OpObjectTrain(graph=graph)
+        opTrain.Features.resize(1)
+        opTrain.Features[0].connect(opExtraction.RegionFeatures)
+        opTrain.SelectedFeatures.setValue(OBJECT_FEATURES)
+        opTrain.LabelsCount.setValue(2)
+        opTrain.Labels.resize(1)
+        opTrain.Labels.setValues([{0: labels}])
+        opTrain.FixClassifier.setValue(False)
+
+        opPredict = OpObjectPredict(graph=graph)
+        opPredict.Features.connect(opExtraction.RegionFeatures)
+        opPredict.SelectedFeatures.setValue(OBJECT_FEATURES)
+        opPredict.Classifier.connect(opTrain.Classifier)
+        opPredict.LabelsCount.setValue(2)
+        opPredict.Predictions([0]).wait()
+    return timer.seconds(), {"voxels": raw.size, "objects": len(sizes) - 1}
+
+
+def run_conservation_tracking(workdir, size):
+    import h5py
+    import numpy
+    import vigra
+    from lazyflow.graph import Graph, Operator
+    from lazyflow.utility import Timer
+    from ilastik.applets.objectExtraction.opObjectExtraction import OpObjectExtraction
+
+    try:
+        from ilastik.applets.tracking.conservation.opConservationTracking import OpConservationTracking
+    except ImportError as e:
+        raise CaseSkipped(str(e))
+
+    class OpStub(Operator):
+        """
+        Stands in for the workflow and the applet operator: OpConservationTracking reports its progress to
+        self.parent.parent.trackingApplet.
+        """
+
+        def setupOutputs(self):
+            pass
+
+        def propagateDirty(self, slot, subindex, roi):
+            pass
+
+    with h5py.File(os.path.join(workdir, "tracking.h5"), "r") as f:
+        # tyx -> txyzc
+        raw = vigra.taggedView(f["raw"][()].transpose(0, 2, 1)[..., None, None], "txyzc")
+        binary = vigra.taggedView(f["binary"][()].transpose(0, 2, 1)[..., None, None], "txyzc")
+    num_frames, size_x, size_y = raw.shape[:3]
+    max_objects = 2
+
+    graph = Graph()
+    opExtraction = OpObjectExtraction(graph=graph)
+    opExtraction.RawImage.setValue(raw)
+    opExtraction.BinaryImage.setValue(binary)
+    opExtraction.Features.setValue(OBJECT_FEATURES)
+
+    opWorkflow = OpStub(graph=graph)
+    opWorkflow.trackingApplet = collections.namedtuple("TrackingApplet", "progressSignal")(lambda progress: None)
+    opTracking = OpConservationTracking(parent=OpStub(parent=opWorkflow))
+    opTracking.RawImage.setValue(raw)
+    opTracking.LabelImage.connect(opExtraction.LabelImage)
+    opTracking.ObjectFeatures.connect(opExtraction.RegionFeatures)
+    opTracking.ComputedFeatureNames.setValue(OBJECT_FEATURES)
+    opTracking.NumLabels.setValue(max_objects + 1)
+
+    with Timer() as timer:
+        features = opExtraction.RegionFeatures(list(range(num_frames))).wait()
+
+        # Every detection is most likely a single object
+        probabilities = {}
+        for t, frame_features in features.items():
+            num_rows = len(frame_features["Standard Object Features"]["Count"])
+            probabilities[t] = numpy.tile([0.05, 0.9, 0.05], (num_rows, 1))
+        opTracking.DetectionProbabilities.setValue(probabilities)
+
+        opTracking.track(
+            time_range=list(range(num_frames)),
+            x_range=(0, size_x),
+            y_range=(0, size_y),
+            z_range=(0, 1),
+            maxDist=15,
+            maxObj=max_objects,
+            withDivisions=False,
+            withOpticalCorrection=False,
+            withClassifierPrior=True,
+            withMergerResolution=False,
+            ndim=2,
+        )
+        opTracking.Output[:].wait()
+    num_objects = sum(len(f["Standard Object Features"]["Count"]) - 1 for f in features.values())
+    return timer.seconds(), {"voxels": raw.size, "objects": num_objects}
+
+
+def run_project_open_save(workdir, size):
+    from lazyflow.utility import Timer
+    from ilastik.shell.headless.headlessShell import HeadlessShell
+
+    project_path = os.path.join(workdir, "pixelClassification_copy.ilp")
+    shutil.copy(os.path.join(workdir, "pixelClassification.ilp"), project_path)
+    try:
+        shell = HeadlessShell()
+        with Timer() as timer:
+            shell.openProjectFile(project_path)
+            shell.projectManager.saveProject(force_all_save=True)
+            shell.closeCurrentProject()
+        num_bytes = os.path.getsize(project_path)
+    finally:
+        os.remove(project_path)
+    return timer.seconds(), {"bytes": num_bytes}
+
+
+def run_carving_preprocessing(workdir, size):
+    import syntheticData
+    from lazyflow.utility import Timer
+    from ilastik.workflows.carving import CarvingWorkflow
+
+    project_path = os.path.join(workdir, "carving.ilp")
+    try:
+        shell = syntheticData.create_project(project_path, CarvingWorkflow, os.path.join(workdir, "blobs.h5/data"))
+        opPreprocessing = shell.workflow.preprocessingApplet.topLevelOperator.getLane(0)
+        with Timer() as timer:
+            opPreprocessing.PreprocessedData[:].wait()
+        shell.closeCurrentProject()
+    finally:
+        if os.path.exists(project_path):
+            os.remove(project_path)
+    return timer.seconds(), {"voxels": _num_voxels(SIZES[size]["volume"])}
+
+
+def run_data_selection_import(workdir, size):
+    from lazyflow.utility import Timer
+    from ilastik.applets.dataSelection.dataSelectionApplet import DataSelectionApplet
+
+    cache_dir = tempfile.mkdtemp(dir=workdir)
+    try:
+        with Timer() as timer:
+            DataSelectionApplet.convertStacksToH5([os.path.join(workdir, "stack", "slice_*.tiff")], cache_dir)
+    finally:
+        shutil.rmtree(cache_dir)
+    return timer.seconds(), {"voxels": _num_voxels(SIZES[size]["volume"])}
+
+
+def _num_voxels(shape):
+    count = 1
+    for s in shape:
+        count *= s
+    return count
+
+
+Case = collections.namedtuple("Case", "setup run")
+
+CASES = collections.OrderedDict(
+    [
+        ("pixel_classification_export", Case(setup_pixel_classification, run_pixel_classification_export)),
+        ("object_classification", Case(setup_blobs, run_object_classification)),
+        ("conservation_tracking", Case(setup_tracking, run_conservation_tracking)),
+        ("project_open_save", Case(setup_pixel_classification, run_project_open_save)),
+        ("carving_preprocessing", Case(setup_blobs, run_carving_preprocessing)),
+        ("data_selection_import", Case(setup_stack, run_data_selection_import)),
+    ]
+)
+
+
+##
+## Child process: one phase of one case
+##
+
+
+def run_phase(case_name, phase, workdir, size):
+    sys.path.insert(0, REPO_ROOT)
+    threads = os.environ.get("LAZYFLOW_THREADS")
+    if threads:
+        from lazyflow.request import Request
+
+        Request.reset_thread_pool(int(threads))
+
+    case = CASES[case_name]
+    try:
+        if phase == "setup":
+            case.setup(workdir, size)
+            result = {}
+        else:
+            seconds, counts = case.run(workdir, size)
+            result = {"seconds": seconds, "counts": counts, "peak_rss_mb": peak_rss_mb()}
+    except CaseSkipped as e:
+        result = {"skipped": str(e)}
+    print(RESULT_PREFIX + json.dumps(result))
+
+
+def run_child(case_name, phase, workdir, size, verbose):
+    command = [sys.executable, os.path.abspath(__file__), "--run-case", case_name, "--phase", phase]
+    command += ["--workdir", workdir, "--size", size]
+    completed = subprocess.run(
+        command, cwd=REPO_ROOT, stdout=subprocess.PIPE, stderr=None if verbose else subprocess.PIPE
+    )
+    lines = completed.stdout.decode("utf-8").splitlines()
+    results = [line[len(RESULT_PREFIX) :] for line in lines if line.startswith(RESULT_PREFIX)]
+    if completed.returncode != 0 or not results:
+        error = (completed.stderr or b"").decode("utf-8").strip().splitlines()
+        return {"error": error[-1] if error else "exit status {}".format(completed.returncode)}
+    return json.loads(results[-1])
+
+
+def run_case(case_name, workdir, size, repeat, verbose):
+    setup = run_child(case_name, "setup", workdir, size, verbose)
+    if setup:  # error or skipped
+        return setup
+
+    runs = []
+    for _ in range(repeat):
+        result = run_child(case_name, "run", workdir, size, verbose)
+        if "seconds" not in result:
+            return result
+        runs.append(result)
+
+    seconds = statistics.median(run["seconds"] for run in runs)
+    rss = [run["peak_rss_mb"] for run in runs if run["peak_rss_mb"] is not None]
+    counts = runs[0]["counts"]
+    return {
+        "seconds": seconds,
+        "runs": [run["seconds"] for run in runs],
+        "peak_rss_mb": max(rss) if rss else None,
+        "counts": counts,
+        "throughput": {"{}_per_second".format(name): count / seconds for name, count in counts.items()},
+    }
+
+
+##
+## Reporting
+##
+
+
+def format_throughput(throughput):
+    return ", ".join("{:.4g} {}".format(value, name.replace("_per_second", "/s")) for name, value in throughput.items())
+
+
+def print_results(results):
+    print("{:<30} {:>10} {:>14}  {}".format("case", "time [s]", "peak RSS [MB]", "throughput"))
+    for name, case in results["cases"].items():
+        if "seconds" not in case:
+            status = "skipped: " + case["skipped"] if "skipped" in case else "ERROR: " + case["error"]
+            print("{:<30} {}".format(name, status))
+            continue
+        rss = "-" if case["peak_rss_mb"] is None else "{:.0f}".format(case["peak_rss_mb"])
+        print("{:<30} {:>10.3f} {:>14}  {}".format(name, case["seconds"], rss, format_throughput(case["throughput"])))
+
+
+def compare(results, baseline, tolerance, rss_tolerance):
+    """
+    Prints the relative time and peak RSS of every case compared to the baseline. Returns the regressed case names.
+    """
+    if results.get("size") != baseline.get("size"):
+        print("WARNING: comparing size {!r} to a baseline of size {!r}".format(results["size"], baseline.get("size")))
+    if results.get("host") != baseline.get("host"):
+        print("WARNING: the baseline was recorded on a different host: {}".format(baseline.get("host")))
+
+    print("{:<30} {:>10} {:>10} {:>10}  {}".format("case", "time", "baseline", "peak RSS", "verdict"))
+    regressions = []
+    for name, case in results["cases"].items():
+        base = baseline["cases"].get(name, {})
+        if "seconds" not in case or "seconds" not in base:
+            print("{:<30} {:>10} {:>10} {:>10}  not comparable".format(name, "-", "-", "-"))
+            continue
+
+        time_ratio = case["seconds"] / base["seconds"]
+        rss_ratio = None
+        if case["peak_rss_mb"] and base.get("peak_rss_mb"):
+            rss_ratio = case["peak_rss_mb"] / base["peak_rss_mb"]
+
+        verdict = []
+        if time_ratio > 1 + tolerance:
+            verdict.append("SLOWER")
+        elif time_ratio < 1 - tolerance:
+            verdict.append("faster")
+        if rss_ratio is not None and rss_ratio > 1 + rss_tolerance:
+            verdict.append("MORE MEMORY")
+        if "SLOWER" in verdict or "MORE MEMORY" in verdict:
+            regressions.append(name)
+
+        print(
+            "{:<30} {:>9.3f}s {:>9.3f}s {:>10}  {}".format(
+                name,
+                case["seconds"],
+                base["seconds"],
+                "-" if rss_ratio is None else "{:+.0%}".format(rss_ratio - 1),
+                ", ".join(verdict) or "ok",
+            )
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", choices=sorted(SIZES), default="small")
+    parser.add_argument("--cases", default=",".join(CASES), help="Comma-separated list of cases to run")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs per case (median is reported)")
+    parser.add_argument("--workdir", help="Directory for the synthetic data (kept for later runs). Default: temporary")
+    parser.add_argument("--output", help="Write the results (a baseline for later comparisons) to this json file")
+    parser.add_argument("--baseline", help="Compare the results to this json file")
+    parser.add_argument("--results", help="Compare this json file instead of running the benchmarks")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative slowdown")
+    parser.add_argument("--rss-tolerance", type=float, default=0.15, help="Allowed relative peak RSS increase")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the benchmarked code")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    parser.add_argument("--phase", choices=["setup", "run"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        run_phase(args.run_case, args.phase, args.workdir, args.size)
+        return
+
+    if args.results:
+        with open(args.results) as f:
+            results = json.load(f)
+    else:
+        case_names = [name.strip() for name in args.cases.split(",") if name.strip()]
+        unknown = set(case_names) - set(CASES)
+        if unknown:
+            parser.error("Unknown cases: {}. Available: {}".format(", ".join(sorted(unknown)), ", ".join(CASES)))
+
+        workdir = args.workdir or tempfile.mkdtemp(prefix="ilastik_benchmarks_")
+        os.makedirs(os.path.join(workdir, args.size), exist_ok=True)
+        results = {
+            "version": RESULTS_VERSION,
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "size": args.size,
+            "repeat": args.repeat,
+            "lazyflow_threads": os.environ.get("LAZYFLOW_THREADS"),
+            "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+            "cases": collections.OrderedDict(),
+        }
+        try:
+            for name in case_names:
+                results["cases"][name] = run_case(
+                    name, os.path.join(workdir, args.size), args.size, args.repeat, args.verbose
+                )
+        finally:
+            if not args.workdir:
+                shutil.rmtree(workdir)
+
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+
+    print_results(results)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print()
+        regressions = compare(results, baseline, args.tolerance, args.rss_tolerance)
+        if regressions:
+            print("FAIL: regressions in {}".format(", ".join(regressions)))
+            sys.exit(1)
+        print("OK: no regressions")
+
+    if any("error" in case for case in results["cases"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2020, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+"""
+Synthetic volumes and projects for the benchmark suite (see benchmarkSuite.py).
+
+All generators are deterministic for a given seed, so baselines recorded on different days measure the same work.
+"""
+import os
+
+import h5py
+import numpy
+
+PIXEL_CLASSIFICATION_FEATURES = ["GaussianSmoothing", "LaplacianOfGaussian", "GaussianGradientMagnitude"]
+PIXEL_CLASSIFICATION_SCALES = [0.7, 1.0, 1.6, 3.5]
+
+
+def blobs_volume(shape, num_blobs, seed=0):
+    """
+    A zyx volume with num_blobs spheres of random size and two brightness classes on a noisy background.
+
+    Returns (raw, labels): raw is uint8, labels is uint32 with one label per sphere (touching spheres keep
+    separate labels; their connected component is a single object).
+    """
+    random = numpy.random.RandomState(seed)
+    labels = numpy.zeros(shape, dtype=numpy.uint32)
+    brightness = numpy.zeros(shape, dtype=numpy.float32)
+    for label in range(1, num_blobs + 1):
+        radius = random.randint(3, 9)
+        center = [random.randint(0, s) for s in shape]
+        start = [max(0, c - radius) for c in center]
+        stop = [min(s, c + radius + 1) for c, s in zip(center, shape)]
+        grid = numpy.ogrid[tuple(slice(b, e) for b, e in zip(start, stop))]
+        inside = sum((g - c) ** 2 for g, c in zip(grid, center)) <= radius ** 2
+
+        region = tuple(slice(b, e) for b, e in zip(start, stop))
+        free = inside & (labels[region] == 0)
+        labels[region][free] = label
+        brightness[region][free] = 120 if label % 2 else 190
+
+    raw = 40 + brightness + random.normal(0, 15, shape)
+    return numpy.clip(raw, 0, 255).astype(numpy.uint8), labels
+
+
+def moving_blobs(num_frames, frame_shape, num_objects, radius=4, seed=0):
+    """
+    A tyx time series of num_objects disks on a grid that move with a common drift and a small per-object jitter.
+    Disks that leave the frame re-enter on the opposite side.
+
+    Returns (raw, binary), both uint8.
+    """
+    random = numpy.random.RandomState(seed)
+    per_row = int(numpy.ceil(numpy.sqrt(num_objects)))
+    spacing = numpy.array(frame_shape, dtype=float) / per_row
+    grid = numpy.array([(i // per_row, i % per_row) for i in range(num_objects)], dtype=float)
+    positions = (grid + 0.5) * spacing
+    drift = numpy.array([0.8, 1.3])
+
+    raw = numpy.zeros((num_frames,) + tuple(frame_shape), dtype=numpy.uint8)
+    binary = numpy.zeros_like(raw)
+    yy, xx = numpy.ogrid[: frame_shape[0], : frame_shape[1]]
+    for t in range(num_frames):
+        frame_positions = (positions + t * drift + random.uniform(-0.5, 0.5, positions.shape)) % frame_shape
+        for y, x in frame_positions:
+            binary[t][(yy - y) ** 2 + (xx - x) ** 2 <= radius ** 2] = 1
+        raw[t] = numpy.clip(30 + 170 * binary[t] + random.normal(0, 10, frame_shape), 0, 255)
+    return raw, binary
+
+
+def write_h5(path, data, axes, inner_path="data"):
+    import vigra
+
+    with h5py.File(path, "w") as f:
+        dataset = f.create_dataset(inner_path, data=data, chunks=True)
+        dataset.attrs["axistags"] = vigra.defaultAxistags(axes).toJSON()
+    return "{}/{}".format(path, inner_path)
+
+
+def read_h5(path, inner_path="data"):
+    with h5py.File(path, "r") as f:
+        return f[inner_path][()]
+
+
+def write_tiff_stack(directory, volume):
+    """
+    Writes a zyx volume as one tiff per z slice and returns the globstring of the stack.
+    """
+    import vigra
+
+    os.makedirs(directory, exist_ok=True)
+    for z, image in enumerate(volume):
+        vigra.impex.writeImage(vigra.taggedView(image, "yx"), os.path.join(directory, "slice_{:05}.tiff".format(z)))
+    return os.path.join(directory, "slice_*.tiff")
+
+
+def sparse_training_labels(labels, z):
+    """
+    Brush-stroke-like labels for slice z of a blobs_volume: 1 on a sparse background grid, 2 inside the blobs.
+    """
+    training = numpy.zeros(labels.shape[1:], dtype=numpy.uint8)
+    training[::7, ::7] = 1
+    training[labels[z] > 0] = 2
+    return training
+
+
+def create_project(project_path, workflow_class, dataset_path):
+    """
+    Creates a project for workflow_class with a single dataset and returns the open headless shell.
+    """
+    from ilastik.applets.dataSelection.opDataSelection import FilesystemDatasetInfo
+    from ilastik.shell.headless.headlessShell import HeadlessShell
+    from ilastik.shell.projectManager import ProjectManager
+
+    shell = HeadlessShell()
+    ProjectManager.createBlankProjectFile(project_path, workflow_class, []).close()
+    shell.openProjectFile(project_path)
+
+    opDataSelection = shell.workflow.dataSelectionApplet.topLevelOperator
+    opDataSelection.DatasetGroup.resize(1)
+    opDataSelection.DatasetGroup[0][0].setValue(FilesystemDatasetInfo(filePath=dataset_path))
+    return shell
+
+
+def create_pixel_classification_project(project_path, dataset_path, labels):
+    """
+    Creates and trains a pixel classification project on a zyxc dataset written by write_h5,
+    with labels from sparse_training_labels on every 8th slice.
+    """
+    from ilastik.workflows.pixelClassification import PixelClassificationWorkflow
+
+    shell = create_project(project_path, PixelClassificationWorkflow, dataset_path)
+    workflow = shell.workflow
+
+    opFeatures = workflow.featureSelectionApplet.topLevelOperator
+    opFeatures.Scales.setValue(PIXEL_CLASSIFICATION_SCALES)
+    opFeatures.FeatureIds.setValue(PIXEL_CLASSIFICATION_FEATURES)
+    selections = numpy.ones((len(PIXEL_CLASSIFICATION_FEATURES), len(PIXEL_CLASSIFICATION_SCALES)), dtype=bool)
+    opFeatures.SelectionMatrix.setValue(selections)
+
+    opPixelClass = workflow.pcApplet.topLevelOperator
+    opPixelClass.LabelNames.setValue(["Background", "Blobs"])
+    for z in range(0, labels.shape[0], 8):
+        opPixelClass.LabelInputs[0][z : z + 1, ..., 0:1] = sparse_training_labels(labels, z)[None, ..., None]
+
+    opPixelClass.FreezePredictions.setValue(False)
+    _ = opPixelClass.Classifier.value
+
+    shell.projectManager.saveProject()
+    shell.closeCurrentProject()
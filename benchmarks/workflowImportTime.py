@@ -0,0 +1,96 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2020, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#           http://ilastik.org/license.html
+###############################################################################
+"""
+Measures the import time of the workflow registry and of each registered workflow.
+
+Every measurement runs in a fresh interpreter, so module caching does not hide import costs.
+
+Usage:
+    python benchmarks/workflowImportTime.py [--repeat N] [--max-startup-seconds S]
+
+With --max-startup-seconds, the script exits with a non-zero status if importing the registry and
+resolving the pixel classification workflow (the headless batch processing startup path) takes longer.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+STARTUP_SNIPPET = """
+import time
+t0 = time.perf_counter()
+import ilastik.workflows
+from ilastik.workflow import getWorkflowFromName
+registry = time.perf_counter()
+getWorkflowFromName({name!r})
+print(registry - t0, time.perf_counter() - t0)
+"""
+
+LIST_SNIPPET = """
+import ilastik.workflows
+for entry in ilastik.workflows.available_workflow_entries():
+    print(entry.class_name)
+"""
+
+
+def run_python(snippet):
+    output = subprocess.check_output([sys.executable, "-c", snippet], stderr=subprocess.DEVNULL)
+    return output.decode("utf-8").strip().splitlines()
+
+
+def time_startup(workflow_name, repeat):
+    registry_times, total_times = [], []
+    for _ in range(repeat):
+        registry_time, total_time = map(float, run_python(STARTUP_SNIPPET.format(name=workflow_name))[-1].split())
+        registry_times.append(registry_time)
+        total_times.append(total_time)
+    return statistics.median(registry_times), statistics.median(total_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs per measurement (median is reported)")
+    parser.add_argument("--max-startup-seconds", type=float, default=None)
+    args = parser.parse_args()
+
+    print("{:<55} {:>12} {:>12}".format("workflow", "registry [s]", "total [s]"))
+    results = {}
+    for class_name in run_python(LIST_SNIPPET):
+        registry_time, total_time = time_startup(class_name, args.repeat)
+        results[class_name] = total_time
+        print("{:<55} {:>12.3f} {:>12.3f}".format(class_name, registry_time, total_time))
+
+    if args.max_startup_seconds is not None:
+        startup = results.get("PixelClassificationWorkflow")
+        if startup is None:
+            startup = time_startup("PixelClassificationWorkflow", args.repeat)[1]
+        if startup > args.max_startup_seconds:
+            print(
+                "FAIL: pixel classification startup took {:.3f}s (limit: {:.3f}s)".format(
+                    startup, args.max_startup_seconds
+                )
+            )
+            sys.exit(1)
+        print("OK: pixel classification startup took {:.3f}s".format(startup))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,309 @@
 """
 hdf5-to-mesh.py
 
-Usage: python hdf5-to-mesh.py [--label=<N>] <input-file.h5>
+Usage: python hdf5-to-mesh.py [--label=<N> ...] [--all-labels] [--format=obj|ply] [--decimate=<S>]
+                              [--block-shape=<Z,Y,X>] [--workers=<W>] [--dataset=<path>] [--output=<prefix>]
+                              <input-file.h5>
 
-Exports a mesh for the given hdf5 file, in .obj format,
-which is suitable for input into Blender.
-If --label=N is provided, then only the pixels with value N will be converted into the mesh.
-Otherwise, all nonzero pixels are used.
+Exports meshes for the given hdf5 file, in .obj (suitable for input into Blender) or binary .ply format.
+If --label=N is provided, then only the pixels with value N will be converted into the mesh (repeat it for several
+labels). With --all-labels, one mesh per nonzero label is written. Otherwise, all nonzero pixels are used.
+
+The volume is never loaded as a whole: it is meshed in blocks (--block-shape) by --workers threads, with a one-voxel
+overlap between neighbouring blocks. Vertices on the block faces are stitched, so each label yields a single
+watertight mesh, and the meshes are written to <prefix>_<label>.<format> while the blocks are processed.
+With --decimate=S, only every S-th voxel along each axis is meshed, which reduces the number of triangles by
+about S**2.
 """
-from __future__ import print_function
+import os
+import shutil
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from sys import exit as sysexit, stderr
 
-# import os
-# import sys
-# import argparse
-# from functools import partial
-# import shutil
-# import tempfile
+import numpy
+from h5py import Dataset, File
 
-from os.path import splitext
-from sys import stderr, exit as sysexit
-from argparse import ArgumentParser
-from numpy import unique
+try:
+    from skimage.measure import marching_cubes
+except ImportError:  # scikit-image < 0.19
+    from skimage.measure import marching_cubes_lewiner as marching_cubes
+
+ALL_NONZERO = 1  # label of the mesh that covers all nonzero pixels
+
+
+def iter_blocks(shape, block_shape):
+    """
+    Yields the (start, stop) of all blocks of block_shape that tile shape, in C order.
+    """
+    ranges = [range(0, size, step) for size, step in zip(shape, block_shape)]
+    for start in product(*ranges):
+        stop = tuple(min(b + step, size) for b, step, size in zip(start, block_shape, shape))
+        yield start, stop
+
+
+class BlockwiseMesher(object):
+    """
+    Marching cubes over a (possibly decimated) 3D dataset, one block of cells at a time.
+
+    Coordinates are those of the volume padded with one voxel of background on each side, so that all surfaces
+    are closed. Cell i lies between padded voxels i and i + 1; a block of cells [start, stop) therefore reads the
+    voxels [start, stop + 1), i.e. neighbouring blocks overlap by one voxel and compute identical vertices on
+    their common face.
+    """
+
+    def __init__(self, dataset, labels=None, merge_labels=False, decimate=1):
+        self.dataset = dataset
+        self.labels = None if labels is None else set(labels)
+        self.merge_labels = merge_labels
+        self.decimate = decimate
+
+        # Singleton axes (e.g. t and c of an ilastik export) are dropped
+        self._axes = [axis for axis, size in enumerate(dataset.shape) if size > 1]
+        if len(self._axes) != 3:
+            raise ValueError("Expected a 3D volume, got a dataset of shape {}".format(dataset.shape))
+        self.shape = tuple(-(-dataset.shape[axis] // decimate) for axis in self._axes)
+        self.cell_shape = tuple(size + 1 for size in self.shape)
+
+    def read(self, start, stop):
+        """
+        Reads the padded voxels [start, stop) of the decimated volume.
+        """
+        data_start = [max(0, b - 1) for b in start]
+        data_stop = [min(size, e - 1) for e, size in zip(stop, self.shape)]
+        block = numpy.zeros(tuple(e - b for b, e in zip(start, stop)), dtype=self.dataset.dtype)
+        if any(b >= e for b, e in zip(data_start, data_stop)):
+            return block
+
+        index = [0] * len(self.dataset.shape)
+        for axis, b, e in zip(self._axes, data_start, data_stop):
+            index[axis] = slice(b * self.decimate, e * self.decimate, self.decimate)
+        offset = tuple(slice(b + 1 - s, e + 1 - s) for b, e, s in zip(data_start, data_stop, start))
+        block[offset] = self.dataset[tuple(index)]
+        return block
+
+    def mesh_block(self, start, stop):
+        """
+        Returns a list of (label, vertices, faces, on_boundary) for the cells [start, stop).
+        Vertices are in padded voxel coordinates (zyx); on_boundary marks the vertices on the block faces.
+        """
+        block = self.read(start, tuple(e + 1 for e in stop))
+        if self.merge_labels:
+            block = (block != 0).astype(numpy.uint8)
+            labels = [ALL_NONZERO]
+        else:
+            labels = numpy.unique(block)
+            labels = [label for label in labels if label != 0 and (self.labels is None or label in self.labels)]
+
+        block_size = numpy.array(stop) - numpy.array(start)
+        meshes = []
+        for label in labels:
+            mask = (block == label).astype(numpy.uint8)
+            if mask.all() or not mask.any():
+                continue
+            vertices, faces = marching_cubes(mask, level=0.5, allow_degenerate=False)[:2]
+            on_boundary = ((vertices == 0) | (vertices == block_size)).any(axis=1)
+            meshes.append((int(label), vertices + start, faces, on_boundary))
+        return meshes
+
+
+class MeshWriter(object):
+    """
+    Appends the vertices and faces of one mesh to its .obj file as they arrive.
+    Vertices are given in zyx order and written in xyz order.
+    """
+
+    def __init__(self, path, name):
+        self.path = path
+        with open(path, "w") as f:
+            f.write("o {}\n".format(name))
+
+    def write(self, vertices, faces):
+        with open(self.path, "a") as f:
+            numpy.savetxt(f, vertices[:, ::-1], fmt="v %.6g %.6g %.6g")
+            # Reversing the axes flips the orientation, so the faces are reversed, too (obj indices start at 1)
+            numpy.savetxt(f, faces[:, ::-1] + 1, fmt="f %d %d %d")
+
+    def close(self):
+        pass
 
-# import h5py
-# from PyQt5.QtCore import QTimer
-# from PyQt5.QtWidgets import QApplication
 
-from h5py import File
-from volumina.view3d.meshgenerator import labeling_to_mesh, mesh_to_obj
+class PlyMeshWriter(object):
+    """
+    Like MeshWriter, for binary .ply files. The header needs the final vertex and face counts, so vertices and
+    faces are collected in two temporary files that are concatenated by close().
+    """
+
+    FACE_DTYPE = numpy.dtype([("count", "u1"), ("vertices", "<i4", (3,))])
+
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        self.num_vertices = 0
+        self.num_faces = 0
+        for suffix in (".vertices", ".faces"):
+            open(path + suffix, "wb").close()
+
+    def write(self, vertices, faces):
+        with open(self.path + ".vertices", "ab") as f:
+            f.write(numpy.ascontiguousarray(vertices[:, ::-1], dtype="<f4").tobytes())
+        records = numpy.empty(len(faces), dtype=self.FACE_DTYPE)
+        records["count"] = 3
+        records["vertices"] = faces[:, ::-1]
+        with open(self.path + ".faces", "ab") as f:
+            f.write(records.tobytes())
+        self.num_vertices += len(vertices)
+        self.num_faces += len(faces)
+
+    def close(self):
+        header = (
+            "ply\nformat binary_little_endian 1.0\ncomment {}\n"
+            "element vertex {}\nproperty float x\nproperty float y\nproperty float z\n"
+            "element face {}\nproperty list uchar int vertex_indices\nend_header\n"
+        ).format(self.name, self.num_vertices, self.num_faces)
+        with open(self.path, "wb") as f:
+            f.write(header.encode("ascii"))
+            for suffix in (".vertices", ".faces"):
+                with open(self.path + suffix, "rb") as part:
+                    shutil.copyfileobj(part, f)
+                os.remove(self.path + suffix)
+
+
+class MeshStitcher(object):
+    """
+    Merges the block meshes of each label into a single mesh: vertices on block faces that were already written
+    by a neighbouring block are replaced by the index of the written vertex.
+
+    Blocks must be added in C order, announced by start_block(). A vertex can then only be shared with a later
+    block if it lies on or after the first plane of the current slab of blocks along axis 0, so only the boundary
+    vertices of the current and the previous slab are kept.
+    """
+
+    def __init__(self, output_prefix, writer_class, extension, scale):
+        self.output_prefix = output_prefix
+        self.writer_class = writer_class
+        self.extension = extension
+        self.scale = scale
+        self._writers = {}
+        self._num_vertices = {}
+        self._boundary_vertices = {}
+        self._slab_start = None
+
+    def start_block(self, start):
+        """
+        Called before the meshes of the block that starts at start are added.
+        """
+        if start[0] == self._slab_start:
+            return
+        self._slab_start = start[0]
+        # Vertices before the first plane of this slab belong to blocks that are all stitched
+        first_key = 2 * start[0]
+        for label, known in self._boundary_vertices.items():
+            self._boundary_vertices[label] = {key: index for key, index in known.items() if key[0] >= first_key}
+
+    def add(self, label, vertices, faces, on_boundary):
+        if label not in self._writers:
+            path = "{}_{}.{}".format(self.output_prefix, label, self.extension)
+            self._writers[label] = self.writer_class(path, "label_{}".format(label))
+            self._num_vertices[label] = 0
+            self._boundary_vertices[label] = {}
+        known = self._boundary_vertices[label]
+
+        # Boundary vertices lie on voxel planes and at edge midpoints, so twice their coordinates are integers
+        boundary = numpy.flatnonzero(on_boundary)
+        keys = list(map(tuple, numpy.rint(2 * vertices[boundary]).astype(numpy.int64)))
+        index = numpy.empty(len(vertices), dtype=numpy.int64)
+        is_new = numpy.ones(len(vertices), dtype=bool)
+        for vertex, key in zip(boundary, keys):
+            existing = known.get(key)
+            if existing is not None:
+                index[vertex] = existing
+                is_new[vertex] = False
+
+        # New vertices get consecutive indices in the order in which they are written
+        new = numpy.flatnonzero(is_new)
+        index[new] = self._num_vertices[label] + numpy.arange(len(new))
+        self._num_vertices[label] += len(new)
+        for vertex, key in zip(boundary, keys):
+            if is_new[vertex]:
+                known[key] = index[vertex]
+
+        self._writers[label].write((vertices[is_new] - 1) * self.scale, index[faces])
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+        return sorted(self._writers)
+
+
+def mesh_dataset(mesher, stitcher, block_shape, num_workers):
+    """
+    Meshes all blocks with num_workers threads. At most 2 * num_workers blocks are in flight: a new block is
+    submitted as soon as the oldest one is stitched, and meshes are stitched in block order.
+    """
+    blocks = list(iter_blocks(mesher.cell_shape, block_shape))
+    window = 2 * num_workers
+    in_flight = deque()
+    num_stitched = 0
+
+    def stitch_oldest():
+        start, future = in_flight.popleft()
+        stitcher.start_block(start)
+        for mesh in future.result():
+            stitcher.add(*mesh)
+
+    with ThreadPoolExecutor(num_workers) as executor:
+        for start, stop in blocks:
+            if len(in_flight) == window:
+                stitch_oldest()
+                num_stitched += 1
+                if num_stitched % window == 0:
+                    print("Meshed {} of {} blocks".format(num_stitched, len(blocks)))
+            in_flight.append((start, executor.submit(mesher.mesh_block, start, stop)))
+        while in_flight:
+            stitch_oldest()
+        print("Meshed {} of {} blocks".format(len(blocks), len(blocks)))
+    return stitcher.close()
 
 
 if __name__ == "__main__":
     parser = ArgumentParser()
-    parser.add_argument("--label", type=int, required=False)
+    parser.add_argument("--label", type=int, action="append", help="Mesh only this label (may be repeated)")
+    parser.add_argument("--all-labels", action="store_true", help="Write one mesh per nonzero label")
+    parser.add_argument("--format", choices=["obj", "ply"], default="obj")
+    parser.add_argument("--decimate", type=int, default=1, help="Mesh only every N-th voxel along each axis")
+    parser.add_argument("--block-shape", default="128,128,128", help="Block shape in (decimated) voxels, zyx")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--dataset", help="Internal path of the dataset (required if the file has several)")
+    parser.add_argument("--output", help="Prefix of the output files (default: input file name without extension)")
     parser.add_argument("input_hdf5_file")
     parsed_args = parser.parse_args()
 
-    output_file = os.path.splitext(parsed_args.input_hdf5_file)[0] + ".obj"
+    output_prefix = parsed_args.output or os.path.splitext(parsed_args.input_hdf5_file)[0]
+    block_shape = tuple(int(size) for size in parsed_args.block_shape.split(","))
 
-    print("Loading volume...")
     with File(parsed_args.input_hdf5_file, "r") as f_input:
-        dataset_names = []
-        f_input.visit(dataset_names.append)
-        if len(dataset_names) != 1:
-            stderr.write("Input HDF5 file should have exactly 1 dataset.\n")
-            sysexit(1)
-        volume = f_input[dataset_names[0]][:].squeeze()
-
-    if parsed_args.label:
-        volume[:] = volume == parsed_args.label
-        labels = [parsed_args.label]
-    else:
-        volume[:] = volume != 0
-        labels = [label for label in unique(volume) if label != 0]
-
-    for label, mesh in labeling_to_mesh(volume, labels):
-        mesh_to_obj(mesh, "{}_{}.obj".format(output_file, label), label)
+        dataset_name = parsed_args.dataset
+        if dataset_name is None:
+            dataset_names = []
+            f_input.visititems(lambda name, obj: dataset_names.append(name) if isinstance(obj, Dataset) else None)
+            if len(dataset_names) != 1:
+                stderr.write("Input HDF5 file should have exactly 1 dataset (or use --dataset).\n")
+                sysexit(1)
+            dataset_name = dataset_names[0]
+
+        mesher = BlockwiseMesher(
+            f_input[dataset_name],
+            labels=parsed_args.label,
+            merge_labels=not (parsed_args.label or parsed_args.all_labels),
+            decimate=parsed_args.decimate,
+        )
+        writer_class = PlyMeshWriter if parsed_args.format == "ply" else MeshWriter
+        stitcher = MeshStitcher(output_prefix, writer_class, parsed_args.format, parsed_args.decimate)
+        print("Meshing volume of shape {} in blocks of {}...".format(mesher.shape, block_shape))
+        labels = mesh_dataset(mesher, stitcher, block_shape, parsed_args.workers)
+
+    for label in labels:
+        print("Wrote {}_{}.{}".format(output_prefix, label, parsed_args.format))
@@ -96,7 +96,9 @@ class BatchProcessingApplet(Applet):
 
         Returns:
             list containing either strings of paths to exported files,
-              or numpy.arrays (depending on export_to_array)
+              or numpy.arrays (depending on export_to_array).
+              With multi-target exports (see OpDataExport.ExportTargets), each entry is the list of paths
+              of the targets.
         """
         self.progressSignal(0)
         batches = list(zip(*role_data_dict.values()))
@@ -123,6 +125,63 @@ class BatchProcessingApplet(Applet):
         finally:
             self.progressSignal(100)
 
+    def run_export_concurrently(
+        self,
+        role_data_dict: Mapping[Hashable, Iterable[Union[str, DatasetInfo]]],
+        input_axes: Optional[str] = None,
+        export_to_array: bool = False,
+        sequence_axis: Optional[str] = None,
+    ) -> Union[List[str], List[numpy.array]]:
+        """Like run_export, but exports all datasets at the same time.
+
+        One lane is appended for each dataset and all of them are configured first. Then each lane is exported in
+        its own request, and the lanes are removed again once every export has finished. Lanes are added and
+        removed on the calling thread; only the exports run in parallel.
+        If any export fails, the first error is raised after all the others have finished.
+        """
+        self.progressSignal(0)
+        batches = list(zip(*role_data_dict.values()))
+        original_num_lanes = self.num_lanes
+        previous_axes_tags = self.get_previous_axes_tags()
+        progress = [0] * len(batches)
+
+        def laneProgressSignal(batch_index, p):
+            progress[batch_index] = p
+            self.progressSignal(sum(progress) / len(progress))
+
+        try:
+            self.dataExportApplet.prepare_for_entire_export()
+            lane_indexes = []
+            for role_inputs in batches:
+                lane_indexes.append(self._add_batch_lane(role_inputs, previous_axes_tags, input_axes, sequence_axis))
+
+            requests = []
+            for batch_index, lane_index in enumerate(lane_indexes):
+                export_lane = partial(
+                    self._export_lane, lane_index, export_to_array, partial(laneProgressSignal, batch_index)
+                )
+                requests.append(Request(export_lane))
+            for request in requests:
+                request.submit()
+
+            results, errors = [], []
+            for request in requests:
+                try:
+                    results.append(request.wait())
+                except Exception as e:
+                    errors.append(e)
+            if errors:
+                raise errors[0]
+
+            for lane_index in lane_indexes:
+                self.dataExportApplet.post_process_lane_export(lane_index)
+            self.dataExportApplet.post_process_entire_export()
+            return results
+        finally:
+            for lane_index in reversed(range(original_num_lanes, self.num_lanes)):
+                self.dataSelectionApplet.topLevelOperator.removeLane(lane_index, lane_index)
+            self.progressSignal(100)
+
     def get_previous_axes_tags(self) -> List[Optional[AxisTags]]:
         if self.num_lanes == 0:
             return [None] * len(self.role_names)
@@ -149,43 +208,65 @@ class BatchProcessingApplet(Applet):
         previous_axes_tags = self.get_previous_axes_tags()
         # Call customization hook
         self.dataExportApplet.prepare_for_entire_export()
+        try:
+            lane_index = self._add_batch_lane(role_inputs, previous_axes_tags, input_axes, sequence_axis)
+            result = self._export_lane(lane_index, export_to_array, progress_callback)
+            # Call customization hook
+            self.dataExportApplet.post_process_lane_export(lane_index)
+            return result
+        finally:
+            self.dataSelectionApplet.topLevelOperator.removeLane(original_num_lanes, original_num_lanes)
+
+    def _add_batch_lane(
+        self,
+        role_inputs: List[Union[str, DatasetInfo]],
+        previous_axes_tags: List[Optional[AxisTags]],
+        input_axes: Optional[str] = None,
+        sequence_axis: Optional[str] = None,
+    ) -> int:
+        """
+        Appends a lane for the given inputs and prepares it for export. Returns the index of the new lane.
+        """
         # Add a lane to the end of the workflow for batch processing
         # (Expanding OpDataSelection by one has the effect of expanding the whole workflow.)
         self.dataSelectionApplet.topLevelOperator.addLane(self.num_lanes)
         batch_lane = self.dataSelectionApplet.topLevelOperator.getLane(self.num_lanes - 1)
-        try:
-            for role_index, (role_input, role_axis_tags) in enumerate(zip(role_inputs, previous_axes_tags)):
-                if not role_input:
-                    continue
-                if isinstance(role_input, DatasetInfo):
-                    role_info = role_input
-                else:
-                    role_info = FilesystemDatasetInfo(
-                        filePath=role_input,
-                        project_file=None,
-                        axistags=vigra.defaultAxistags(input_axes) if input_axes else role_axis_tags,
-                        sequence_axis=sequence_axis,
-                        guess_tags_for_singleton_axes=True,  # FIXME: add cmd line param to negate this
-                    )
-                batch_lane.DatasetGroup[role_index].setValue(role_info)
-            self.workflow().handleNewLanesAdded()
-            # Call customization hook
-            self.dataExportApplet.prepare_lane_for_export(self.num_lanes - 1)
-            opDataExport = self.dataExportApplet.topLevelOperator.getLane(self.num_lanes - 1)
-            opDataExport.progressSignal.subscribe(progress_callback)
-            if export_to_array:
-                logger.info("Exporting to in-memory array.")
-                result = opDataExport.run_export_to_array()
+        for role_index, (role_input, role_axis_tags) in enumerate(zip(role_inputs, previous_axes_tags)):
+            if not role_input:
+                continue
+            if isinstance(role_input, DatasetInfo):
+                role_info = role_input
             else:
-                logger.info(f"Exporting to {opDataExport.ExportPath.value}")
-                opDataExport.run_export()
-                result = opDataExport.ExportPath.value
+                role_info = FilesystemDatasetInfo(
+                    filePath=role_input,
+                    project_file=None,
+                    axistags=vigra.defaultAxistags(input_axes) if input_axes else role_axis_tags,
+                    sequence_axis=sequence_axis,
+                    guess_tags_for_singleton_axes=True,  # FIXME: add cmd line param to negate this
+                )
+            batch_lane.DatasetGroup[role_index].setValue(role_info)
+        self.workflow().handleNewLanesAdded()
+        # Call customization hook
+        self.dataExportApplet.prepare_lane_for_export(self.num_lanes - 1)
+        return self.num_lanes - 1
 
-            # Call customization hook
-            self.dataExportApplet.post_process_lane_export(self.num_lanes - 1)
-            return result
-        finally:
-            self.dataSelectionApplet.topLevelOperator.removeLane(original_num_lanes, original_num_lanes)
+    def _export_lane(
+        self, lane_index: int, export_to_array: bool, progress_callback: Callable[[int], None]
+    ) -> Union[str, numpy.array]:
+        opDataExport = self.dataExportApplet.topLevelOperator.getLane(lane_index)
+        opDataExport.progressSignal.subscribe(progress_callback)
+        if export_to_array:
+            logger.info("Exporting to in-memory array.")
+            return opDataExport.run_export_to_array()
+        export_targets = getattr(opDataExport, "ExportTargets", None)
+        if export_targets is not None and export_targets.value:
+            # Multi-target export: one path per target
+            opDataExport.run_export()
+            logger.info(f"Exported to {', '.join(opDataExport.TargetExportPaths.value)}")
+            return list(opDataExport.TargetExportPaths.value)
+        logger.info(f"Exporting to {opDataExport.ExportPath.value}")
+        opDataExport.run_export()
+        return opDataExport.ExportPath.value
 
     @property
     def num_lanes(self) -> int:
@@ -21,14 +21,16 @@
 # Built-in
 from __future__ import division
 import logging
+from collections import OrderedDict
+from functools import partial
 
 # Third-party
 import numpy
 
 # lazyflow
 from lazyflow.graph import Operator, InputSlot, OutputSlot
-from lazyflow.request import RequestLock, RequestPool
-from lazyflow.roi import getIntersectingBlocks, getBlockBounds, getIntersection, roiToSlice, TinyVector
+from lazyflow.request import Request, RequestLock, RequestPool
+from lazyflow.roi import getIntersectingBlocks, getBlockBounds, getIntersection, roiToSlice
 from lazyflow.operators import OpSubRegion, OpMultiArrayStacker, OpBlockedArrayCache
 from lazyflow.stype import Opaque
 from lazyflow.rtype import List
@@ -51,6 +53,7 @@ traceLogger = logging.getLogger("TRACE." + __name__)
 class OpSingleBlockObjectPrediction(Operator):
     RawImage = InputSlot()
     BinaryImage = InputSlot()
+    BlockRoi = InputSlot()  # (start, stop) of the block in global coordinates, see retarget()
 
     SelectedFeatures = InputSlot(rtype=List, stype=Opaque)
 
@@ -110,6 +113,8 @@ class OpSingleBlockObjectPrediction(Operator):
 
         self.block_roi = block_roi  # In global coordinates
         self._halo_padding = halo_padding
+        self._retargeting = False
+        self.BlockRoi.setValue(self._as_tuples(block_roi))
 
         self._opBinarySubRegion = OpSubRegion(parent=self)
         self._opBinarySubRegion.Input.connect(self.BinaryImage)
@@ -152,7 +157,27 @@ class OpSingleBlockObjectPrediction(Operator):
         self._opProbabilityCache = OpBlockedArrayCache(parent=self)
         self._opProbabilityCache.Input.connect(self._opProbabilityChannelStacker.Output)
 
+        # Forward dirty regions to our own output
+        self._opPredictionImage.Output.notifyDirty(self._handleDirtyPrediction)
+
+    def retarget(self, block_roi):
+        """
+        Reuse this pipeline for a different block.
+        The internal caches are invalidated, but no dirty notifications are sent for the old block.
+        """
+        self._retargeting = True
+        try:
+            self.BlockRoi.setValue(self._as_tuples(block_roi))
+        finally:
+            self._retargeting = False
+
+    @staticmethod
+    def _as_tuples(block_roi):
+        # Plain tuples, so that the value slot can tell whether the roi changed
+        return tuple(tuple(int(x) for x in coords) for coords in block_roi)
+
     def setupOutputs(self):
+        self.block_roi = self.BlockRoi.value
         tagged_input_shape = self.RawImage.meta.getTaggedShape()
         self._halo_roi = self.computeHaloRoi(
             tagged_input_shape, self._halo_padding, self.block_roi
@@ -186,9 +211,6 @@ class OpSingleBlockObjectPrediction(Operator):
         self._opPredictionCache.BlockShape.setValue(self._opPredictionCache.Input.meta.shape)
         self._opProbabilityCache.BlockShape.setValue(self._opProbabilityCache.Input.meta.shape)
 
-        # Forward dirty regions to our own output
-        self._opPredictionImage.Output.notifyDirty(self._handleDirtyPrediction)
-
     def execute(self, slot, subindex, roi, destination):
         assert slot is self.PredictionImage or slot is self.ProbabilityChannelImage, "Unknown input slot"
         assert (numpy.array(roi.stop) <= slot.meta.shape).all(), "Roi is out-of-bounds"
@@ -214,6 +236,8 @@ class OpSingleBlockObjectPrediction(Operator):
         Foward dirty notifications from our internal output slot to the external one,
         but first discard the halo and offset the roi to compensate for the halo.
         """
+        if self._retargeting:
+            return
         # Discard halo.  dirtyRoi is in internal coordinates (i.e. relative to halo start)
         dirtyRoi = getIntersection((roi.start, roi.stop), self._output_roi, assertIntersect=False)
         if dirtyRoi is not None:
@@ -250,6 +274,11 @@ class OpSingleBlockObjectPrediction(Operator):
 class OpBlockwiseObjectClassification(Operator):
     """
     Handles prediction ONLY.  Training must be provided externally and loaded via the serializer.
+
+    Each block is processed by its own OpSingleBlockObjectPrediction pipeline. At most MaxBlockPipelines
+    pipelines are kept (default: one per worker thread, at least 2). When a new block is requested and the pool
+    is full, the least recently used pipeline that is not busy is retargeted to the new block, so the memory
+    held by the pipelines stays constant during a blockwise export of the whole volume.
     """
 
     RawImage = InputSlot()
@@ -259,6 +288,7 @@ class OpBlockwiseObjectClassification(Operator):
     SelectedFeatures = InputSlot(rtype=List, stype=Opaque)
     BlockShape3dDict = InputSlot(value={"x": 512, "y": 512, "z": 512})  # A dict of SPATIAL block dims
     HaloPadding3dDict = InputSlot(value={"x": 64, "y": 64, "z": 64})  # A dict of spatial block dims
+    MaxBlockPipelines = InputSlot(optional=True)
 
     PredictionImage = OutputSlot()
     ProbabilityChannelImage = OutputSlot()
@@ -266,7 +296,8 @@ class OpBlockwiseObjectClassification(Operator):
 
     def __init__(self, *args, **kwargs):
         super(self.__class__, self).__init__(*args, **kwargs)
-        self._blockPipelines = {}  # indexed by blockstart
+        self._blockPipelines = OrderedDict()  # indexed by blockstart, least recently used first
+        self._blockUsers = {}  # blockstart -> number of requests currently using its pipeline
         self._lock = RequestLock()
 
     def setupOutputs(self):
@@ -334,14 +365,19 @@ class OpBlockwiseObjectClassification(Operator):
         block_starts = getIntersectingBlocks(block_shape, roi_one_channel)
         block_starts = list(map(tuple, block_starts))
 
-        # Ensure that block pipelines exist (create first if necessary)
-        for block_start in block_starts:
-            self._ensurePipelineExists(block_start)
-
-        # Retrieve result from each block, and write into the appropriate region of the destination
+        # Retrieve result from each block, and write into the appropriate region of the destination.
+        # Each block holds on to a pipeline only while it is being computed (see _acquirePipelines).
         pool = RequestPool()
         for block_start in block_starts:
-            opBlockPipeline = self._blockPipelines[block_start]
+            pool.add(Request(partial(self._executeBlock, slot, roi, roi_one_channel, block_start, destination)))
+        pool.wait()
+
+        return destination
+
+    def _executeBlock(self, slot, roi, roi_one_channel, block_start, destination):
+        # Ensure that the block pipeline exists (create or retarget first if necessary)
+        (opBlockPipeline,) = self._acquirePipelines([block_start])
+        try:
             block_roi = opBlockPipeline.block_roi
             block_intersection = getIntersection(block_roi, roi_one_channel)
             block_relative_intersection = numpy.subtract(block_intersection, block_roi[0])
@@ -356,12 +392,9 @@ class OpBlockwiseObjectClassification(Operator):
 
             # Request the data
             destination_slice = roiToSlice(*destination_relative_intersection)
-            req = block_slot(*block_relative_intersection)
-            req.writeInto(destination[destination_slice])
-            pool.add(req)
-        pool.wait()
-
-        return destination
+            block_slot(*block_relative_intersection).writeInto(destination[destination_slice]).wait()
+        finally:
+            self._releasePipelines([block_start])
 
     def _executeBlockwiseRegionFeatures(self, roi, destination):
         """
@@ -371,7 +404,7 @@ class OpBlockwiseObjectClassification(Operator):
                    (1,20,30,40,5) should be requested via roi [(1,2,3,4,5),(2,3,4,5,6)]
 
         Note: It is assumed that you will request these features for debug purposes, AFTER requesting the prediction image.
-              Therefore, it is considered an error to request features that are not already computed.
+              Blocks whose pipeline has been recycled in the meantime are computed again.
         """
         axiskeys = self.RawImage.meta.getAxisKeys()
         # Find the corresponding block start coordinates
@@ -380,63 +413,102 @@ class OpBlockwiseObjectClassification(Operator):
         block_starts = getIntersectingBlocks(block_shape, pixel_roi)
         block_starts = list(map(tuple, block_starts))
 
-        # TODO: Parallelize this?
+        # Blocks are computed concurrently, each one writes a separate element of the destination
+        pool = RequestPool()
         for block_start in block_starts:
-            assert (
-                block_start in self._blockPipelines
-            ), "Not allowed to request region features for blocks that haven't yet been processed."  # See note above
-
-            # Discard spatial axes to get (t,c) index for region slot roi
-            tagged_block_start = list(zip(axiskeys, block_start))
-            tagged_block_start_tc = [k_v for k_v in tagged_block_start if k_v[0] in "tc"]
-            block_start_tc = [k_v1[1] for k_v1 in tagged_block_start_tc]
-            block_roi_tc = (block_start_tc, block_start_tc + numpy.array([1, 1]))
-            block_roi_t = (block_roi_tc[0][:-1], block_roi_tc[1][:-1])
-
-            assert sys.version_info.major == 2, (
-                "Alert! This loop has not been tested "
-                "under python 3. Please remove this assetion and be wary of any strnage behavior you encounter"
+            execute_block = partial(
+                self._executeBlockRegionFeatures, axiskeys, block_shape, block_start, roi, destination
             )
-            destination_start = numpy.array(block_start) // block_shape - roi.start
-            destination_stop = destination_start + numpy.array([1] * len(axiskeys))
+            pool.add(Request(execute_block))
+        pool.wait()
+
+        return destination
+
+    def _executeBlockRegionFeatures(self, axiskeys, block_shape, block_start, roi, destination):
+        # Discard spatial axes to get (t,c) index for region slot roi
+        tagged_block_start = list(zip(axiskeys, block_start))
+        tagged_block_start_tc = [k_v for k_v in tagged_block_start if k_v[0] in "tc"]
+        block_start_tc = [k_v1[1] for k_v1 in tagged_block_start_tc]
+        block_roi_tc = (block_start_tc, block_start_tc + numpy.array([1, 1]))
+        block_roi_t = (block_roi_tc[0][:-1], block_roi_tc[1][:-1])
 
-            opBlockPipeline = self._blockPipelines[block_start]
+        destination_start = numpy.array(block_start) // block_shape - roi.start
+        destination_stop = destination_start + numpy.array([1] * len(axiskeys))
+
+        (opBlockPipeline,) = self._acquirePipelines([block_start])
+        try:
             req = opBlockPipeline.BlockwiseRegionFeatures(*block_roi_t)
             destination_without_channel = destination[roiToSlice(destination_start, destination_stop)]
             destination_with_channel = destination_without_channel[..., block_roi_tc[0][-1] : block_roi_tc[1][-1]]
             req.writeInto(destination_with_channel)
             req.wait()
+        finally:
+            self._releasePipelines([block_start])
 
-        return destination
+    def _maxBlockPipelines(self):
+        if self.MaxBlockPipelines.ready():
+            return max(1, self.MaxBlockPipelines.value)
+        return max(2, Request.global_thread_pool.num_workers)
 
-    def _ensurePipelineExists(self, block_start):
-        if block_start in self._blockPipelines:
-            return
+    def _acquirePipelines(self, block_starts):
+        """
+        Returns the pipelines for the given blocks and marks them as busy until _releasePipelines() is called.
+        Missing pipelines are taken from the least recently used idle pipeline (if the pool is full) or created.
+        """
         with self._lock:
-            if block_start in self._blockPipelines:
-                return
-
-            logger.debug("Creating pipeline for block: {}".format(block_start))
-
-            block_shape = self._getFullShape(self._block_shape_dict)
-            halo_padding = self._getFullShape(self._halo_padding_dict)
-
-            input_shape = self.RawImage.meta.shape
-            block_stop = getBlockBounds(input_shape, block_shape, block_start)[1]
-            block_roi = (block_start, block_stop)
-
-            # Instantiate pipeline
-            opBlockPipeline = OpSingleBlockObjectPrediction(block_roi, halo_padding, parent=self)
-            opBlockPipeline.RawImage.connect(self.RawImage)
-            opBlockPipeline.BinaryImage.connect(self.BinaryImage)
-            opBlockPipeline.Classifier.connect(self.Classifier)
-            opBlockPipeline.LabelsCount.connect(self.LabelsCount)
-            opBlockPipeline.SelectedFeatures.connect(self.SelectedFeatures)
-
-            # Forward dirtyness
-            opBlockPipeline.PredictionImage.notifyDirty(bind(self._handleDirtyBlock, block_start))
-
-            self._blockPipelines[block_start] = opBlockPipeline
+            pipelines = []
+            for block_start in block_starts:
+                opBlockPipeline = self._blockPipelines.get(block_start)
+                if opBlockPipeline is None:
+                    opBlockPipeline = self._recycleIdlePipeline(block_start)
+                if opBlockPipeline is None:
+                    opBlockPipeline = self._createPipeline(block_start)
+                self._blockPipelines[block_start] = opBlockPipeline
+                self._blockPipelines.move_to_end(block_start)
+                self._blockUsers[block_start] = self._blockUsers.get(block_start, 0) + 1
+                pipelines.append(opBlockPipeline)
+            return pipelines
+
+    def _releasePipelines(self, block_starts):
+        with self._lock:
+            for block_start in block_starts:
+                users = self._blockUsers.pop(block_start, 0) - 1
+                if users > 0:
+                    self._blockUsers[block_start] = users
+
+            # While all pipelines were busy, the pool may have grown beyond its size
+            excess = max(0, len(self._blockPipelines) - self._maxBlockPipelines())
+            idle_block_starts = [b for b in self._blockPipelines if b not in self._blockUsers]
+            for block_start in idle_block_starts[:excess]:
+                logger.debug("Deleting pipeline for block: {}".format(block_start))
+                self._blockPipelines.pop(block_start).cleanUp()
+
+    def _recycleIdlePipeline(self, block_start):
+        if len(self._blockPipelines) < self._maxBlockPipelines():
+            return None
+        for old_block_start in self._blockPipelines:
+            if old_block_start not in self._blockUsers:
+                logger.debug("Moving pipeline from block {} to block: {}".format(old_block_start, block_start))
+                opBlockPipeline = self._blockPipelines.pop(old_block_start)
+                opBlockPipeline.retarget(self.get_block_roi(block_start))
+                return opBlockPipeline
+        return None
+
+    def _createPipeline(self, block_start):
+        logger.debug("Creating pipeline for block: {}".format(block_start))
+        halo_padding = self._getFullShape(self._halo_padding_dict)
+
+        # Instantiate pipeline
+        opBlockPipeline = OpSingleBlockObjectPrediction(self.get_block_roi(block_start), halo_padding, parent=self)
+        opBlockPipeline.RawImage.connect(self.RawImage)
+        opBlockPipeline.BinaryImage.connect(self.BinaryImage)
+        opBlockPipeline.Classifier.connect(self.Classifier)
+        opBlockPipeline.LabelsCount.connect(self.LabelsCount)
+        opBlockPipeline.SelectedFeatures.connect(self.SelectedFeatures)
+
+        # Forward dirtyness (to the block the pipeline is currently working on)
+        opBlockPipeline.PredictionImage.notifyDirty(bind(self._handleDirtyBlock, opBlockPipeline))
+        return opBlockPipeline
 
     def get_blockshape(self):
         return self._getFullShape(self.BlockShape3dDict.value)
@@ -449,10 +521,15 @@ class OpBlockwiseObjectClassification(Operator):
         return block_roi
 
     def is_in_block(self, block_start, coord):
-        block_roi = self.get_block_roi(block_start)
-        coord_roi = (coord, TinyVector(coord) + 1)
-        intersection = getIntersection(block_roi, coord_roi, False)
-        return intersection is not None
+        return bool(self.are_in_block(block_start, [coord])[0])
+
+    def are_in_block(self, block_start, coords):
+        """
+        Vectorized version of is_in_block(): returns a boolean mask for an array of coordinates (shape (N, ndim)).
+        """
+        block_start, block_stop = map(numpy.asarray, self.get_block_roi(block_start))
+        coords = numpy.asarray(coords).reshape((-1, len(block_start)))
+        return ((coords >= block_start) & (coords < block_stop)).all(axis=1)
 
     def _getFullShape(self, spatialShapeDict):
         # 't' should match raw input
@@ -475,8 +552,9 @@ class OpBlockwiseObjectClassification(Operator):
     def _deleteAllPipelines(self):
         logger.debug("Deleting all pipelines.")
         oldBlockPipelines = self._blockPipelines
-        self._blockPipelines = {}
+        self._blockPipelines = OrderedDict()
         with self._lock:
+            self._blockUsers.clear()
             for opBlockPipeline in list(oldBlockPipelines.values()):
                 opBlockPipeline.cleanUp()
 
@@ -485,9 +563,9 @@ class OpBlockwiseObjectClassification(Operator):
             self._deleteAllPipelines()
             self.PredictionImage.setDirty(slice(None))
 
-    def _handleDirtyBlock(self, block_start, slot, roi):
+    def _handleDirtyBlock(self, opBlockPipeline, slot, roi):
         # Convert roi from block coords to global coords
         block_relative_roi = (roi.start, roi.stop)
-        global_roi = block_relative_roi + numpy.array(block_start)
+        global_roi = block_relative_roi + numpy.array(opBlockPipeline.block_roi[0])
         logger.debug("Setting roi dirty: {}".format(global_roi))
         self.PredictionImage.setDirty(*global_roi)
@@ -31,6 +31,7 @@ from ilastik.utility import OpMultiLaneWrapper
 from ilastik.utility.commandLineProcessing import ParseListFromString
 from .dataExportSerializer import DataExportSerializer
 from .opDataExport import OpDataExport
+from .multiTargetExport import ExportTarget, MultiTargetExporter
 
 
 class DataExportApplet(Applet):
@@ -169,6 +170,20 @@ class DataExportApplet(Applet):
             required=False,
         )
 
+        arg_parser.add_argument(
+            "--export_target",
+            help=(
+                "Export this source together with the other targets in a single pass over the data "
+                "(can be repeated, replaces --export_source). Per-target settings may follow the source name, e.g. "
+                '"Simple Segmentation,dtype=uint8,filename={dataset_dir}/{nickname}_seg,internal_path=seg". '
+                "Settings that are not given are taken from the other export options. "
+                'All targets must be exported to "hdf5" or "compressed hdf5" (format=...).'
+            ),
+            dest="export_targets",
+            action="append",
+            required=False,
+        )
+
         arg_parser.add_argument("--table_only", help="Export only csv/HDF5 table.", action="store_true", default=False)
 
         return arg_parser
@@ -242,6 +257,13 @@ class DataExportApplet(Applet):
                 msg += "Didn't understand export_dtype: {}".format(parsed_args.export_dtype)
                 raise Exception(msg)
 
+        if parsed_args.export_targets:
+            try:
+                parsed_args.export_targets = [ExportTarget.from_string(t) for t in parsed_args.export_targets]
+            except (ValueError, TypeError) as e:
+                msg += "Didn't understand export_target: {}".format(e)
+                raise Exception(msg)
+
         if parsed_args.output_axis_order:
             output_axis_order = parsed_args.output_axis_order.lower()
             if any([a not in "txyzc" for a in output_axis_order]):
@@ -326,5 +348,25 @@ class DataExportApplet(Applet):
         if parsed_args.table_only:
             opDataExport.TableOnly.setValue(True)
 
+        if parsed_args.export_targets:
+            if not hasattr(opDataExport, "ExportTargets"):
+                raise Exception("Multiple export targets are not supported by {}".format(type(opDataExport).__name__))
+            source_choices = list(map(str.lower, opDataExport.SelectionNames.value))
+            for target in parsed_args.export_targets:
+                output_format = target.output_format or opDataExport.OutputFormat.value
+                if output_format not in MultiTargetExporter.HDF5_COMPRESSION:
+                    raise Exception(
+                        "Invalid option for --export_target: '{}'\n"
+                        "Export targets can only be written to: {}".format(
+                            target.selection_name, list(MultiTargetExporter.HDF5_COMPRESSION)
+                        )
+                    )
+                if target.selection_name.lower() not in source_choices:
+                    raise Exception(
+                        "Invalid option for --export_target: '{}'\n"
+                        "Valid options are: {}".format(target.selection_name, source_choices)
+                    )
+            opDataExport.ExportTargets.setValue(parsed_args.export_targets)
+
         # Re-connect the 'transaction' slot to apply all settings at once.
         opDataExport.TransactionSlot.setValue(True)
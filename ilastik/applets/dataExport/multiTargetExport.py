@@ -0,0 +1,299 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2020, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+"""
+Export of several results of a lane in a single pass over the data.
+
+Exporting e.g. probabilities, simple segmentation and uncertainty one after the other runs the whole
+pipeline (features and prediction) once per result. The exporter here walks over the data block by block
+instead and produces all requested results of a block before it moves on, so upstream operators that
+share their results (see :class:`ilastik.utility.opSharedResultBuffer.OpSharedResultBuffer`) compute
+each block only once.
+
+Only hdf5 targets can be written block by block, so all targets must be exported to "hdf5" (uncompressed) or
+"compressed hdf5" (gzip).
+"""
+import logging
+import time
+from collections import OrderedDict
+from functools import partial
+from typing import List, Optional
+
+import h5py
+import numpy
+
+from lazyflow.operators.ioOperators import OpFormattedDataExport
+from lazyflow.request import Request, RequestLock, RequestPool
+from lazyflow.roi import determineBlockShape, getBlockBounds, getIntersectingBlocks
+from lazyflow.utility import PathComponents, getPathVariants
+
+from .opDataExport import DataExportPathFormatter
+
+logger = logging.getLogger(__name__)
+
+
+class ExportTarget(object):
+    """
+    One result that is exported as part of a multi-target export.
+
+    selection_name:
+        name of the exported source, one of OpDataExport.SelectionNames (case-insensitive)
+    output_format, export_dtype, filename_format, internal_path:
+        override the corresponding OpDataExport settings for this target.
+        The output format must be one of MultiTargetExporter.HDF5_COMPRESSION ("hdf5" or "compressed hdf5").
+        Filename and internal path may use the same placeholders, e.g. {result_type}.
+    """
+
+    KEYS = ("format", "dtype", "filename", "internal_path")
+
+    def __init__(
+        self,
+        selection_name: str,
+        output_format: Optional[str] = None,
+        export_dtype=None,
+        filename_format: Optional[str] = None,
+        internal_path: Optional[str] = None,
+    ):
+        self.selection_name = selection_name
+        self.output_format = output_format
+        self.export_dtype = None if export_dtype is None else numpy.dtype(export_dtype).type
+        self.filename_format = filename_format
+        self.internal_path = internal_path
+
+    @classmethod
+    def from_string(cls, description: str) -> "ExportTarget":
+        """
+        Parse a target from the command line, e.g. "Simple Segmentation,format=compressed hdf5,dtype=uint8"
+        """
+        name, *options = [part.strip() for part in description.split(",")]
+        if not name:
+            raise ValueError(f"Export target without source name: {description!r}")
+        kwargs = {}
+        for option in options:
+            key, sep, value = option.partition("=")
+            if not sep or key not in cls.KEYS:
+                raise ValueError(f"Invalid export target option {option!r}, expected one of {cls.KEYS} as key=value")
+            kwargs[key] = value
+        return cls(
+            name,
+            output_format=kwargs.get("format"),
+            export_dtype=kwargs.get("dtype"),
+            filename_format=kwargs.get("filename"),
+            internal_path=kwargs.get("internal_path"),
+        )
+
+    def __repr__(self):
+        return (
+            f"ExportTarget({self.selection_name!r}, output_format={self.output_format!r}, "
+            f"export_dtype={self.export_dtype!r}, filename_format={self.filename_format!r}, "
+            f"internal_path={self.internal_path!r})"
+        )
+
+
+class MultiTargetExporter(object):
+    """
+    Exports several inputs of an OpDataExport in one pass.
+
+    Every target gets its own OpFormattedDataExport, configured like the parent operator except for the
+    overrides of the target. All targets are written block by block, all targets of a block within the
+    same request. Targets must be exported to one of the HDF5_COMPRESSION formats; other formats are rejected.
+    """
+
+    #: Approximate number of pixels (excluding channels) of the blocks that are computed at once
+    BLOCK_VOLUME = 128 ** 3
+
+    #: The supported export formats and the compression settings of their datasets (as for OpExportSlot)
+    HDF5_COMPRESSION = {"hdf5": {}, "compressed hdf5": {"compression": "gzip", "compression_opts": 1}}
+
+    def __init__(self, opDataExport, targets: List[ExportTarget], num_workers: Optional[int] = None):
+        self._opDataExport = opDataExport
+        self._targets = list(targets)
+        self._num_workers = num_workers or max(1, Request.global_thread_pool.num_workers)
+        self._write_lock = RequestLock()
+        self._export_ops = []
+
+    def run_export(self) -> List[str]:
+        """
+        Exports all targets and returns their export paths, in the order of the targets.
+        """
+        try:
+            self._export_ops = [self._make_export_op(target) for target in self._targets]
+            self._check_formats()
+            self._check_paths()
+            self._export_hdf5_blockwise(self._export_ops)
+            return [op.ExportPath.value for op in self._export_ops]
+        finally:
+            for op in self._export_ops:
+                op.cleanUp()
+            self._export_ops = []
+
+    def _selection_index(self, name):
+        names = [n.lower() for n in self._opDataExport.SelectionNames.value]
+        try:
+            return names.index(name.lower())
+        except ValueError:
+            raise ValueError(f"Invalid export target '{name}'. Valid options are: {names}")
+
+    def _make_export_op(self, target):
+        parent = self._opDataExport
+        selection_index = self._selection_index(target.selection_name)
+        path_formatter = DataExportPathFormatter(
+            dataset_info=parent.RawDatasetInfo.value,
+            working_dir=parent.WorkingDirectory.value,
+            result_type=parent.SelectionNames.value[selection_index],
+        )
+
+        op = OpFormattedDataExport(parent=parent)
+        for name in (
+            "RegionStart",
+            "RegionStop",
+            "InputMin",
+            "InputMax",
+            "ExportMin",
+            "ExportMax",
+            "ExportDtype",
+            "OutputAxisOrder",
+        ):
+            getattr(op, name).connect(getattr(parent, name))
+        if target.export_dtype is not None:
+            op.ExportDtype.disconnect()
+            op.ExportDtype.setValue(target.export_dtype)
+        op.OutputFormat.setValue(target.output_format or parent.OutputFormat.value)
+
+        filename_format = target.filename_format or parent.OutputFilenameFormat.value
+        abs_path, _ = getPathVariants(path_formatter.format_path(filename_format), parent.WorkingDirectory.value)
+        op.OutputFilenameFormat.setValue(abs_path)
+        internal_path_format = target.internal_path or parent.OutputInternalPath.value
+        op.OutputInternalPath.setValue(path_formatter.format_path(internal_path_format))
+        op.Input.connect(parent.Inputs[selection_index])
+        op.TransactionSlot.setValue(True)
+        return op
+
+    def _check_formats(self):
+        unsupported = [
+            f"{target.selection_name} ({op.OutputFormat.value})"
+            for target, op in zip(self._targets, self._export_ops)
+            if op.OutputFormat.value not in self.HDF5_COMPRESSION
+        ]
+        if unsupported:
+            raise ValueError(
+                f"Export targets can only be written to {' or '.join(self.HDF5_COMPRESSION)}, "
+                f"not: {', '.join(unsupported)}. "
+                "Export other formats separately with --export_source."
+            )
+
+    def _check_paths(self):
+        export_paths = [op.ExportPath.value for op in self._export_ops]
+        duplicates = {path for path in export_paths if export_paths.count(path) > 1}
+        if duplicates:
+            raise ValueError(
+                f"Several export targets would be written to the same location: {sorted(duplicates)}. "
+                "Use {result_type} in the filename or internal path to keep them apart."
+            )
+
+    def _spatial_blocks(self, ops):
+        """
+        Block rois in the (channel-less) coordinates shared by all targets, as ordered dicts axis -> (start, stop).
+        """
+        tagged_shapes = [op.ImageToExport.meta.getTaggedShape() for op in ops]
+        spatial_shape = OrderedDict((k, v) for k, v in tagged_shapes[0].items() if k != "c")
+        for tagged_shape in tagged_shapes[1:]:
+            other = OrderedDict((k, v) for k, v in tagged_shape.items() if k != "c")
+            if dict(other) != dict(spatial_shape):
+                raise ValueError(f"Can't export targets of different shapes together: {spatial_shape} vs {other}")
+
+        shape = tuple(spatial_shape.values())
+        max_block_shape = tuple(1 if k == "t" else s for k, s in spatial_shape.items())
+        block_shape = determineBlockShape(max_block_shape, self.BLOCK_VOLUME)
+        for block_start in getIntersectingBlocks(block_shape, ((0,) * len(shape), shape)):
+            start, stop = getBlockBounds(shape, block_shape, block_start)
+            yield OrderedDict((k, (int(b), int(e))) for k, b, e in zip(spatial_shape.keys(), start, stop))
+
+    @staticmethod
+    def _target_roi(op, spatial_roi):
+        start, stop = [], []
+        for key, size in op.ImageToExport.meta.getTaggedShape().items():
+            begin, end = spatial_roi[key] if key != "c" else (0, size)
+            start.append(begin)
+            stop.append(end)
+        return start, stop
+
+    def _create_dataset(self, op, files):
+        path_components = PathComponents(op.ExportPath.value)
+        external_path = path_components.externalPath
+        if external_path not in files:
+            files[external_path] = h5py.File(external_path, "a")
+        h5_file = files[external_path]
+        internal_path = path_components.internalPath or op.OutputInternalPath.value
+        if internal_path in h5_file:
+            del h5_file[internal_path]
+
+        meta = op.ImageToExport.meta
+        tagged_chunk_shape = OrderedDict(meta.getTaggedShape())
+        for key in "tc":
+            if key in tagged_chunk_shape:
+                tagged_chunk_shape[key] = 1
+        chunks = determineBlockShape(list(tagged_chunk_shape.values()), 512000 / numpy.dtype(meta.dtype).itemsize)
+        dataset = h5_file.create_dataset(
+            internal_path,
+            shape=meta.shape,
+            dtype=meta.dtype,
+            chunks=tuple(int(c) for c in chunks),
+            **self.HDF5_COMPRESSION[op.OutputFormat.value],
+        )
+        dataset.attrs["axistags"] = meta.axistags.toJSON()
+        if meta.drange is not None:
+            dataset.attrs["drange"] = meta.drange
+        return dataset
+
+    def _export_block(self, ops, datasets, spatial_roi):
+        results = []
+        for op in ops:
+            start, stop = self._target_roi(op, spatial_roi)
+            data = op.ImageToExport(start, stop).wait()
+            results.append((start, stop, data))
+        with self._write_lock:
+            for dataset, (start, stop, data) in zip(datasets, results):
+                dataset[tuple(slice(b, e) for b, e in zip(start, stop))] = data
+
+    def _export_hdf5_blockwise(self, ops):
+        files = {}
+        try:
+            datasets = [self._create_dataset(op, files) for op in ops]
+            blocks = list(self._spatial_blocks(ops))
+            logger.info(
+                f"Exporting {len(ops)} targets in {len(blocks)} blocks with {self._num_workers} workers: "
+                + ", ".join(op.ExportPath.value for op in ops)
+            )
+
+            start_time = time.perf_counter()
+            self._opDataExport.progressSignal(0)
+            # Keep the number of blocks in flight bounded, so shared results can't pile up in memory
+            for batch_begin in range(0, len(blocks), self._num_workers):
+                pool = RequestPool()
+                for spatial_roi in blocks[batch_begin : batch_begin + self._num_workers]:
+                    pool.add(Request(partial(self._export_block, ops, datasets, spatial_roi)))
+                pool.wait()
+                done = min(batch_begin + self._num_workers, len(blocks))
+                self._opDataExport.progressSignal(int(100 * done / len(blocks)))
+            logger.info(f"Exported {len(ops)} targets in {time.perf_counter() - start_time:.1f}s")
+        finally:
+            for h5_file in files.values():
+                h5_file.close()
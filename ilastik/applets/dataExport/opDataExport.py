@@ -100,7 +100,12 @@ class OpDataExport(Operator):
     TableOnlyName = InputSlot(value="Table-Only")
     TableOnly = InputSlot(value=False)
 
+    # Optional list of ExportTarget objects (see multiTargetExport.py).
+    # If given, run_export() exports all of them in a single pass instead of the selected input.
+    ExportTargets = InputSlot(value=())
+
     ExportPath = OutputSlot()  # Location of the saved file after export is complete.
+    TargetExportPaths = OutputSlot()  # Locations written by the last multi-target export, one per ExportTargets entry
 
     ConvertedImage = OutputSlot()  # Cropped image, not yet re-ordered (useful for guis)
     ImageToExport = OutputSlot()  # The image that will be exported
@@ -157,6 +162,7 @@ class OpDataExport(Operator):
         self.progressSignal = opFormattedExport.progressSignal
 
         self.Dirty.setValue(True)  # Default to Dirty
+        self.TargetExportPaths.setValue(())
 
         # We don't export the raw data, but we connect it to it's own op
         #  so it can be displayed alongside the data to export in the same viewer.
@@ -248,9 +254,21 @@ class OpDataExport(Operator):
     def run_export(self):
         # If Table-Only is disabled or we're not dirty, we don't have to do anything.
         if not self.TableOnly.value and self.Dirty.value:
-            self._opFormattedExport.run_export()
+            if self.ExportTargets.value:
+                self.run_multi_target_export()
+            else:
+                self._opFormattedExport.run_export()
             self.Dirty.setValue(False)
 
+    def run_multi_target_export(self):
+        """
+        Export all ExportTargets with a single pass over the data.
+        """
+        from .multiTargetExport import MultiTargetExporter
+
+        export_paths = MultiTargetExporter(self, self.ExportTargets.value).run_export()
+        self.TargetExportPaths.setValue(tuple(export_paths))
+
     def run_export_to_array(self):
         # This function can be used to export the results to an in-memory array, instead of to disk
         # (Typically used from pure-python clients in batch mode.)
@@ -35,6 +35,7 @@ from lazyflow.utility import PathComponents, isUrl
 from ilastik.applets.base.applet import Applet
 from .opDataSelection import OpMultiLaneDataSelectionGroup, FilesystemDatasetInfo
 from .dataSelectionSerializer import DataSelectionSerializer, Ilastik05DataSelectionDeserializer
+from .stackImport import StackImportSettings
 
 
 class DataSelectionApplet(Applet):
@@ -56,11 +57,16 @@ class DataSelectionApplet(Applet):
         instructionText=DEFAULT_INSTRUCTIONS,
         max_lanes=None,
         show_axis_details=False,
+        stack_import_settings=None,
     ):
         self.__topLevelOperator = OpMultiLaneDataSelectionGroup(parent=workflow, forceAxisOrder=forceAxisOrder)
         super(DataSelectionApplet, self).__init__(title, syncWithImageIndex=False)
 
-        self._serializableItems = [DataSelectionSerializer(self.topLevelOperator, projectFileGroupName)]
+        self._serializableItems = [
+            DataSelectionSerializer(
+                self.topLevelOperator, projectFileGroupName, stack_import_settings=stack_import_settings
+            )
+        ]
         if supportIlastik05Import:
             self._serializableItems.append(Ilastik05DataSelectionDeserializer(self.topLevelOperator))
 
@@ -72,6 +78,17 @@ class DataSelectionApplet(Applet):
         self.busy = False
         self.show_axis_details = show_axis_details
 
+    @property
+    def stack_import_settings(self) -> StackImportSettings:
+        """
+        Settings used when image stacks are copied into the project file.
+        """
+        return self._serializableItems[0].stack_import_settings
+
+    @stack_import_settings.setter
+    def stack_import_settings(self, settings: StackImportSettings):
+        self._serializableItems[0].stack_import_settings = settings
+
     #
     # GUI
     #
@@ -143,6 +160,25 @@ class DataSelectionApplet(Applet):
         )
         arg_parser.add_argument("--input_axes", help="Explicitly specify the axes of your dataset.", required=False)
         arg_parser.add_argument("--stack_along", help="Sequence axis along which to stack", type=str, default="z")
+        arg_parser.add_argument(
+            "--stack_import_chunking",
+            help="Chunk layout of image stacks that are copied into hdf5 (project file or --preconvert_stacks)."
+            " '2d': slice-wise chunks, '3d': block-wise chunks, 'auto': 3d for volumes, 2d otherwise.",
+            choices=StackImportSettings.CHUNK_LAYOUTS,
+            default="auto",
+        )
+        arg_parser.add_argument(
+            "--stack_import_compression",
+            help="Compression of image stacks that are copied into hdf5.",
+            choices=StackImportSettings.COMPRESSIONS,
+            default="gzip",
+        )
+        arg_parser.add_argument(
+            "--stack_import_workers",
+            help="Number of stack slabs that are decoded and compressed in parallel (default: lazyflow threads).",
+            type=int,
+            default=None,
+        )
 
         parsed_args, unused_args = arg_parser.parse_known_args(cmdline_args)
 
@@ -232,6 +268,7 @@ class DataSelectionApplet(Applet):
         """
         role_names = self.topLevelOperator.DatasetRoles.value
         role_paths = self.role_paths_from_parsed_args(parsed_args)
+        self.stack_import_settings = self.stack_import_settings_from_parsed_args(parsed_args)
 
         for role_index, input_paths in list(role_paths.items()):
             # If the user doesn't want image stacks to be copied into the project file,
@@ -239,7 +276,9 @@ class DataSelectionApplet(Applet):
             if parsed_args.preconvert_stacks:
                 import tempfile
 
-                input_paths = self.convertStacksToH5(input_paths, tempfile.gettempdir())
+                input_paths = self.convertStacksToH5(
+                    input_paths, tempfile.gettempdir(), import_settings=self.stack_import_settings
+                )
 
             input_infos = [FilesystemDatasetInfo(filepath=p) if p else None for p in input_paths]
             if parsed_args.input_axes:
@@ -272,8 +311,16 @@ class DataSelectionApplet(Applet):
                     "*******************************************************************************************"
                 )
 
+    @staticmethod
+    def stack_import_settings_from_parsed_args(parsed_args) -> StackImportSettings:
+        return StackImportSettings(
+            chunk_layout=parsed_args.stack_import_chunking,
+            compression=parsed_args.stack_import_compression,
+            num_workers=parsed_args.stack_import_workers,
+        )
+
     @classmethod
-    def convertStacksToH5(cls, filePaths, stackVolumeCacheDir):
+    def convertStacksToH5(cls, filePaths, stackVolumeCacheDir, import_settings=None):
         """
         If any of the files in filePaths appear to be globstrings for a stack,
         convert the given stack to hdf5 format.
@@ -284,7 +331,8 @@ class DataSelectionApplet(Applet):
         import pickle
         import h5py
         from lazyflow.graph import Graph
-        from lazyflow.operators.ioOperators import OpStackToH5Writer
+        from lazyflow.operators.ioOperators import OpInputDataReader
+        from .stackImport import StackImporter
 
         filePaths = list(filePaths)
         for i, path in enumerate(filePaths):
@@ -299,7 +347,7 @@ class DataSelectionApplet(Applet):
             sha = hashlib.sha1()
             files = sorted([k.replace("\\", "/") for k in glob.glob(path)])
             for f in files:
-                sha.update(f)
+                sha.update(f.encode("utf-8"))
                 sha.update(pickle.dumps(os.stat(f).st_mtime, 0))
             stackFile = sha.hexdigest() + ".h5"
             stackPath = os.path.join(stackVolumeCacheDir, stackFile).replace("\\", "/")
@@ -318,15 +366,13 @@ class DataSelectionApplet(Applet):
                 if not os.path.exists(stackVolumeCacheDir):
                     os.makedirs(stackVolumeCacheDir)
 
-                with h5py.File(stackPath) as f:
-                    # Configure the conversion operator
-                    opWriter = OpStackToH5Writer(graph=Graph())
-                    opWriter.hdf5Group.setValue(f)
-                    opWriter.hdf5Path.setValue("volume/data")
-                    opWriter.GlobString.setValue(globstring)
-
-                    # Initiate the write
-                    success = opWriter.WriteImage.value
-                    assert success, "Something went wrong when generating an hdf5 file from an image sequence."
+                opReader = OpInputDataReader(graph=Graph(), FilePath=globstring)
+                try:
+                    with h5py.File(stackPath, "w") as f:
+                        importer = StackImporter(opReader.Output, settings=import_settings)
+                        dataset = importer.write_to(f, "volume/data")
+                        dataset.attrs["axistags"] = opReader.Output.meta.axistags.toJSON()
+                finally:
+                    opReader.cleanUp()
 
         return filePaths
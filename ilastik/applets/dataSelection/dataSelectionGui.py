@@ -61,6 +61,7 @@ from ilastik.widgets.stackFileSelectionWidget import StackFileSelectionWidget, S
 from .datasetDetailedInfoTableModel import DatasetDetailedInfoTableModel
 from .datasetDetailedInfoTableView import DatasetDetailedInfoTableView
 from .precomputedVolumeBrowser import PrecomputedVolumeBrowser
+from .stackImport import StackImportSettings
 from ilastik.widgets.ImageFileDialog import ImageFileDialog
 from lazyflow.slot import Slot
 
@@ -611,8 +612,17 @@ class DataSelectionGui(QWidget):
         try:
             # FIXME: do this inside a Request
             self.parentApplet.busy = True
+            default_settings = self.serializer.stack_import_settings
+            import_settings = StackImportSettings(
+                chunk_layout=stackDlg.chunk_layout,
+                compression=stackDlg.compression,
+                compression_level=default_settings.compression_level,
+                num_workers=default_settings.num_workers,
+            )
             inner_path = self.serializer.importStackAsLocalDataset(
-                abs_paths=stackDlg.selectedFiles, sequence_axis=stackDlg.sequence_axis
+                abs_paths=stackDlg.selectedFiles,
+                sequence_axis=stackDlg.sequence_axis,
+                import_settings=import_settings,
             )
             info = ProjectInternalDatasetInfo(inner_path=inner_path, nickname=nickname, project_file=self.project_file)
         finally:
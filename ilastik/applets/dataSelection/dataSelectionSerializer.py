@@ -26,6 +26,7 @@ from pathlib import Path
 
 from .opDataSelection import OpDataSelection, DatasetInfo, FilesystemDatasetInfo, RelativeFilesystemDatasetInfo
 from .opDataSelection import PreloadedArrayDatasetInfo, ProjectInternalDatasetInfo
+from .stackImport import StackImporter, StackImportSettings
 from lazyflow.operators.ioOperators import OpInputDataReader, OpStackLoader, OpH5N5WriterBigDataset
 from lazyflow.operators.ioOperators.opTiffReader import OpTiffReader
 from lazyflow.operators.ioOperators.opTiffSequenceReader import OpTiffSequenceReader
@@ -34,6 +35,7 @@ from lazyflow.operators.ioOperators.opStreamingH5N5SequenceReaderS import OpStre
 from lazyflow.graph import Graph
 
 import os
+import h5py
 import vigra
 import numpy
 from lazyflow.utility import PathComponents
@@ -64,11 +66,14 @@ class DataSelectionSerializer(AppletSerializer):
         RelativeFilesystemDatasetInfo.__name__: RelativeFilesystemDatasetInfo,
     }
 
-    def __init__(self, topLevelOperator, projectFileGroupName):
+    def __init__(self, topLevelOperator, projectFileGroupName, stack_import_settings: StackImportSettings = None):
         super(DataSelectionSerializer, self).__init__(projectFileGroupName)
         self.topLevelOperator = topLevelOperator
         self._dirty = False
 
+        #: Default settings used by importStackAsLocalDataset
+        self.stack_import_settings = stack_import_settings or StackImportSettings()
+
         self._projectFilePath = None
 
         self.version = "0.2"
@@ -131,9 +136,20 @@ class DataSelectionSerializer(AppletSerializer):
         self._dirty = False
 
     def importStackAsLocalDataset(
-        self, abs_paths: List[str], sequence_axis: str = "z", progress_signal: Callable[[int], None] = None
+        self,
+        abs_paths: List[str],
+        sequence_axis: str = "z",
+        progress_signal: Callable[[int], None] = None,
+        import_settings: StackImportSettings = None,
     ):
+        """
+        Copy the image stack given by abs_paths into the project file.
+
+        If no import_settings are given, the serializer's ``stack_import_settings`` are used.
+        Returns the inner path of the new dataset in the project file.
+        """
         progress_signal = progress_signal or self.progressSignal
+        import_settings = import_settings or self.stack_import_settings
         progress_signal(0)
         op_reader = None
         op_writer = None
@@ -145,16 +161,26 @@ class DataSelectionSerializer(AppletSerializer):
             axistags = op_reader.Output.meta.axistags
             inner_path = self.local_data_path.joinpath(DatasetInfo.generate_id()).as_posix()
             project_file = self.topLevelOperator.ProjectFile.value
-            op_writer = OpH5N5WriterBigDataset(
-                graph=self.topLevelOperator.graph,
-                h5N5File=project_file,
-                h5N5Path=inner_path,
-                CompressionEnabled=False,
-                BatchSize=1,
-                Image=op_reader.Output,
-            )
-            op_writer.progressSignal.subscribe(progress_signal)
-            success = op_writer.WriteImage.value
+            if isinstance(project_file, h5py.Group):
+                importer = StackImporter(
+                    op_reader.Output,
+                    settings=import_settings,
+                    sequence_axis=sequence_axis,
+                    progress_signal=progress_signal,
+                )
+                importer.write_to(project_file, inner_path)
+            else:
+                # Direct chunk writes are hdf5-only, let the generic writer handle other formats.
+                op_writer = OpH5N5WriterBigDataset(
+                    graph=self.topLevelOperator.graph,
+                    h5N5File=project_file,
+                    h5N5Path=inner_path,
+                    CompressionEnabled=import_settings.compression_enabled,
+                    BatchSize=import_settings.effective_num_workers,
+                    Image=op_reader.Output,
+                )
+                op_writer.progressSignal.subscribe(progress_signal)
+                success = op_writer.WriteImage.value
             for index, tag in enumerate(axistags):
                 project_file[inner_path].dims[index].label = tag.key
             project_file[inner_path].attrs["axistags"] = axistags.toJSON()
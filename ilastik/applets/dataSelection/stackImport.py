@@ -0,0 +1,259 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2020, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+"""
+Parallel import of image stacks into hdf5 datasets (usually inside the project file).
+
+The stack is read in slabs along the sequence axis, so that every slice of the stack is decoded exactly once.
+Slabs are decoded concurrently on the lazyflow thread pool. Each slab is cut into the chunks of the target
+dataset, which are compressed on the same worker thread (zlib releases the GIL). The calling thread hands the
+compressed chunks of finished slabs to hdf5 via ``write_direct_chunk`` (bypassing the single-threaded hdf5 filter
+pipeline), while the workers already decode the following slabs.
+"""
+import itertools
+import logging
+import time
+import zlib
+from collections import OrderedDict, deque
+from functools import partial
+from typing import Callable, Optional, Tuple
+
+import h5py
+import numpy
+
+from lazyflow.request import Request
+from lazyflow.roi import determineBlockShape, getBlockBounds, getIntersectingBlocks, roiToSlice
+
+logger = logging.getLogger(__name__)
+
+
+class StackImportSettings(object):
+    """
+    Options that control how an image stack is copied into an hdf5 dataset.
+
+    chunk_layout:
+        "2d" - chunks are single slices, best for slice-wise viewing and 2D workflows
+        "3d" - chunks are roughly isotropic blocks, best for 3D feature computation
+        "auto" - "3d" if the imported data has a z-axis with more than one slice, otherwise "2d"
+    compression:
+        "gzip" or "none"
+    compression_level:
+        gzip level (1-9), only used with gzip compression
+    num_workers:
+        number of slabs that are decoded and compressed concurrently.
+        Defaults to the number of lazyflow worker threads.
+    """
+
+    CHUNK_LAYOUTS = ("auto", "2d", "3d")
+    COMPRESSIONS = ("gzip", "none")
+
+    #: Approximate uncompressed size of a single dataset chunk in bytes
+    TARGET_CHUNK_BYTES = 512000
+
+    def __init__(
+        self,
+        chunk_layout: str = "auto",
+        compression: str = "gzip",
+        compression_level: int = 1,
+        num_workers: Optional[int] = None,
+    ):
+        if chunk_layout not in self.CHUNK_LAYOUTS:
+            raise ValueError(f"Unknown chunk layout {chunk_layout!r}, expected one of {self.CHUNK_LAYOUTS}")
+        if compression not in self.COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression!r}, expected one of {self.COMPRESSIONS}")
+        if not 0 <= compression_level <= 9:
+            raise ValueError(f"Invalid gzip compression level: {compression_level}")
+        if num_workers is not None and num_workers < 1:
+            raise ValueError(f"Invalid number of workers: {num_workers}")
+        self.chunk_layout = chunk_layout
+        self.compression = compression
+        self.compression_level = compression_level
+        self.num_workers = num_workers
+
+    @property
+    def compression_enabled(self) -> bool:
+        return self.compression != "none"
+
+    @property
+    def effective_num_workers(self) -> int:
+        if self.num_workers is not None:
+            return self.num_workers
+        return max(1, Request.global_thread_pool.num_workers)
+
+    def chunk_shape(self, tagged_shape: "OrderedDict[str, int]", dtype) -> Tuple[int, ...]:
+        """
+        Determine the chunk shape of the imported dataset for the configured access pattern.
+        Chunks never span several time points or channels.
+        """
+        tagged_maxshape = OrderedDict(tagged_shape)
+        for key in "tc":
+            if key in tagged_maxshape:
+                tagged_maxshape[key] = 1
+
+        layout = self.chunk_layout
+        if layout == "auto":
+            layout = "3d" if tagged_maxshape.get("z", 1) > 1 else "2d"
+        if layout == "2d" and "z" in tagged_maxshape:
+            tagged_maxshape["z"] = 1
+
+        target_volume = self.TARGET_CHUNK_BYTES / numpy.dtype(dtype).itemsize
+        return tuple(int(s) for s in determineBlockShape(list(tagged_maxshape.values()), target_volume))
+
+    def __repr__(self):
+        return (
+            f"StackImportSettings(chunk_layout={self.chunk_layout!r}, compression={self.compression!r}, "
+            f"compression_level={self.compression_level}, num_workers={self.num_workers})"
+        )
+
+
+class StackImporter(object):
+    """
+    Copies the data of ``image_slot`` into a new chunked hdf5 dataset.
+
+    Usage:
+        importer = StackImporter(op_reader.Output, settings, sequence_axis="z")
+        dataset = importer.write_to(h5_file, "some/inner/path")
+    """
+
+    def __init__(
+        self,
+        image_slot,
+        settings: StackImportSettings = None,
+        sequence_axis: str = "z",
+        progress_signal: Callable[[int], None] = None,
+    ):
+        self._image_slot = image_slot
+        self._settings = settings or StackImportSettings()
+        self._progress_signal = progress_signal or (lambda progress: None)
+
+        meta = image_slot.meta
+        self.shape = tuple(meta.shape)
+        self.dtype = numpy.dtype(meta.dtype)
+        self.chunk_shape = self._settings.chunk_shape(meta.getTaggedShape(), self.dtype)
+
+        axiskeys = meta.getAxisKeys()
+        self._slab_axis = axiskeys.index(sequence_axis) if sequence_axis in axiskeys else 0
+
+        self._dataset = None
+        self._bytes_written = 0
+        self._slabs_done = 0
+        self._num_slabs = 0
+
+    def iter_slabs(self):
+        """
+        Yields (start, stop) of the chunk-aligned slabs along the sequence axis.
+        """
+        axis = self._slab_axis
+        step = self.chunk_shape[axis]
+        for slab_begin in range(0, self.shape[axis], step):
+            start = [0] * len(self.shape)
+            stop = list(self.shape)
+            start[axis] = slab_begin
+            stop[axis] = min(slab_begin + step, self.shape[axis])
+            yield tuple(start), tuple(stop)
+
+    def write_to(self, h5_group: h5py.Group, inner_path: str) -> h5py.Dataset:
+        if inner_path in h5_group:
+            del h5_group[inner_path]
+        kwargs = {"shape": self.shape, "dtype": self.dtype, "chunks": self.chunk_shape}
+        if self._settings.compression_enabled:
+            kwargs["compression"] = "gzip"
+            kwargs["compression_opts"] = self._settings.compression_level
+        self._dataset = h5_group.create_dataset(inner_path, **kwargs)
+
+        slabs = list(self.iter_slabs())
+        self._num_slabs = len(slabs)
+        self._slabs_done = 0
+        self._bytes_written = 0
+        num_workers = self._settings.effective_num_workers
+        logger.info(
+            f"Importing stack of shape {self.shape} ({self.dtype}) with chunks {self.chunk_shape}, "
+            f"{self._num_slabs} slabs, {num_workers} workers, {self._settings}"
+        )
+
+        self._start_time = time.perf_counter()
+        self._progress_signal(0)
+        # Slabs are written in order as soon as they are encoded. At most num_workers slabs are
+        # being decoded at any time, so the workers keep reading while the oldest slab is written.
+        remaining_slabs = iter(slabs)
+        pending = deque(self._submit_slab(*slab) for slab in itertools.islice(remaining_slabs, num_workers))
+        while pending:
+            encoded_chunks = pending.popleft().wait()
+            next_slab = next(remaining_slabs, None)
+            if next_slab is not None:
+                pending.append(self._submit_slab(*next_slab))
+            self._write_chunks(encoded_chunks)
+
+        elapsed = max(time.perf_counter() - self._start_time, 1e-6)
+        raw_mb = numpy.prod(self.shape) * self.dtype.itemsize / 1e6
+        logger.info(
+            f"Imported {raw_mb:.1f} MB in {elapsed:.1f}s "
+            f"({raw_mb / elapsed:.1f} MB/s, {self.shape[self._slab_axis] / elapsed:.1f} slices/s), "
+            f"{self._bytes_written / 1e6:.1f} MB stored"
+        )
+        self._progress_signal(100)
+        return self._dataset
+
+    def _submit_slab(self, slab_start, slab_stop) -> Request:
+        request = Request(partial(self._encode_slab, slab_start, slab_stop))
+        request.submit()
+        return request
+
+    def _encode_slab(self, slab_start, slab_stop):
+        """
+        Decodes one slab and returns its compressed chunks as a list of (chunk offset, payload).
+        The decoded slab is released as soon as it has been encoded.
+        """
+        data = self._image_slot[roiToSlice(slab_start, slab_stop)].wait()
+        data = data.view(numpy.ndarray)
+        slab_start = numpy.array(slab_start)
+
+        encoded_chunks = []
+        for chunk_start in getIntersectingBlocks(self.chunk_shape, (slab_start, numpy.array(slab_stop))):
+            chunk_start, chunk_stop = getBlockBounds(self.shape, self.chunk_shape, chunk_start)
+            chunk = data[roiToSlice(chunk_start - slab_start, chunk_stop - slab_start)]
+            encoded_chunks.append((tuple(int(s) for s in chunk_start), self._encode_chunk(chunk)))
+        return encoded_chunks
+
+    def _write_chunks(self, encoded_chunks):
+        for offset, payload in encoded_chunks:
+            self._dataset.id.write_direct_chunk(offset, payload)
+            self._bytes_written += len(payload)
+        self._slabs_done += 1
+        elapsed = max(time.perf_counter() - self._start_time, 1e-6)
+        logger.debug(
+            f"Imported slab {self._slabs_done}/{self._num_slabs} "
+            f"({self._slabs_done * self.chunk_shape[self._slab_axis] / elapsed:.1f} slices/s)"
+        )
+        self._progress_signal(int(100 * self._slabs_done / self._num_slabs))
+
+    def _encode_chunk(self, chunk: numpy.ndarray) -> bytes:
+        """
+        Produce the bytes hdf5 expects for a chunk of the target dataset.
+        hdf5 always stores complete chunks, so chunks at the border of the dataset are zero-padded.
+        """
+        if chunk.shape != self.chunk_shape:
+            padded = numpy.zeros(self.chunk_shape, dtype=self.dtype)
+            padded[tuple(slice(0, s) for s in chunk.shape)] = chunk
+            chunk = padded
+        raw = numpy.ascontiguousarray(chunk, dtype=self.dtype).tobytes()
+        if self._settings.compression_enabled:
+            return zlib.compress(raw, self._settings.compression_level)
+        return raw
@@ -67,15 +67,20 @@ class ParameterDlg(QDialog):
         self.batch_edit.setText(str(topLevelOperator.Batch_Size.value))
         self.window_edit = QLineEdit(self)
         self.window_edit.setText(str(topLevelOperator.Window_Size.value))
+        self.halo_edit = QLineEdit(self)
+        self.halo_edit.setText(str(topLevelOperator.Halo_Size.value))
 
         block_label = QLabel("Block size [pixels]:", self)
         block_label.setToolTip("Max size of image blocks sent by Ilastik to the classifier.")
-        # Max size of image block (width and height) sent to the classifier for prediction. This will be a large value
-        # (typically larger than expected image sizes) because we want the neural network code, not Ilastik to split it into smaller blocks.
-        # The only advantage of chosing a smaller block size is that predictions are returned sooner to Ilastik, so it
-        # can show prediction progress more frequently. Note that the will be edge artefacts along the edges of these blocks,
-        # and that these artefacts are not smoothened at all, since those blocks are not averaged. (Because splitting in
-        # blocks happens in Ilastik, and averaging predictions happens in the neuralnets library itself.)
+        # Size of image block (width and height, without halo) sent to the classifier for prediction. Blocks are
+        # enlarged by the halo size on each side and their overlapping predictions are blended, so a medium block size
+        # does not cause edge artefacts. Smaller blocks are predicted in parallel and give more frequent progress updates.
+
+        halo_label = QLabel("Halo size [pixels]:", self)
+        halo_label.setToolTip(
+            "Overlap between neighbouring blocks. Should be at least twice the distance over which the network\n"
+            "needs context; overlapping predictions are blended to avoid artefacts along the block edges."
+        )
 
         batch_label = QLabel("Batch size [slices]:", self)
         batch_label.setToolTip("Batch size for the neural network")
@@ -91,6 +96,8 @@ class ParameterDlg(QDialog):
         layout = QVBoxLayout()
         layout.addWidget(block_label)
         layout.addWidget(self.block_edit)
+        layout.addWidget(halo_label)
+        layout.addWidget(self.halo_edit)
         layout.addWidget(batch_label)
         layout.addWidget(self.batch_edit)
         layout.addWidget(window_label)
@@ -116,9 +123,15 @@ class ParameterDlg(QDialog):
         except ValueError:
             window_size = 256
 
+        try:
+            halo_size = max(0, int(self.halo_edit.text()))
+        except ValueError:
+            halo_size = 32
+
         self.topLevelOperator.Block_Size.setValue(block_size)
         self.topLevelOperator.Batch_Size.setValue(batch_size)
         self.topLevelOperator.Window_Size.setValue(window_size)
+        self.topLevelOperator.Halo_Size.setValue(halo_size)
 
         # close dialog
         super(ParameterDlg, self).accept()
@@ -442,9 +455,9 @@ class DLClassGui(LayerViewerGui):
         self.drawer.comboBox.addItem(modelname)
 
         # Create neural network classifier object
-        # We do not want Ilastik's halo's. the neuralnet does its own overlapping and averaging, so we want to send
-        # a full image to the neural net - so we pick a very large block size here; so large that the full image fits
-        # in it and ilastik only does blocking on the z-planes, but not in x and y.
+        # Ilastik predicts the image in tiles of Block_Size pixels along y and x, each enlarged by Halo_Size pixels,
+        # and blends the overlapping tile predictions (see OpTiledPixelwisePredict). Tile predictions are cached, so
+        # the cache blocks below can be smaller than the tiles without predicting a tile more than once.
         model = DeepLearningLazyflowClassifier(None, filename, self.batch_size, self.window_size)
 
         block_shape = numpy.array([self.batch_size, self.block_size, self.block_size,
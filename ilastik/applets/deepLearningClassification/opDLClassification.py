@@ -9,10 +9,10 @@ import logging
 
 from lazyflow.graph import Operator, InputSlot, OutputSlot
 from lazyflow.operators.opBlockedArrayCache import OpBlockedArrayCache
-from lazyflow.operators.classifierOperators import OpPixelwiseClassifierPredict
 from lazyflow.operators import OpMultiArraySlicer2, OpMaxChannelIndicatorOperator
 
 from ilastik.utility.operatorSubView import OperatorSubView
+from .opTiledPrediction import OpTiledPixelwisePredict
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -52,18 +52,25 @@ class OpDLClassification(Operator):
     # FullModel = InputSlot(value=[])  # When full model serialization is enabled
     # SaveFullModel = InputSlot(stype="bool", value=False, nonlane=True)
     Batch_Size = InputSlot(value=1)
-    Block_Size = InputSlot(value=16 * 1024)
+    Block_Size = InputSlot(value=512)  # tile size (without halo) along y and x; tiles are predicted in parallel
     Window_Size = InputSlot(value=256)  # the neural net will break up large images (of size up to Block_size) into smaller overlapping windows of size Window_Size
+    Halo_Size = InputSlot(value=32)  # overlap (in pixels, on each side) between neighbouring blocks; overlapping predictions are blended
+    Tile_Batch_Size = InputSlot(value=4)  # number of blocks that are predicted by a single request
 
     def __init__(self, *args, **kwargs):
 
         super(OpDLClassification, self).__init__(*args, **kwargs)
 
-        self.predict = OpPixelwiseClassifierPredict(parent=self)
+        # Blocks of Block_Size pixels (plus halo) are sent to the classifier, and their overlaps are blended,
+        # so the cache can use medium-size blocks without edge artefacts along the block borders.
+        self.predict = OpTiledPixelwisePredict(parent=self)
         self.predict.name = "OpClassifierPredict"
         self.predict.Image.connect(self.InputImage)
         self.predict.Classifier.connect(self.Classifier)
         self.predict.LabelsCount.connect(self.NumClasses)
+        self.predict.TileShape.connect(self.Block_Size)
+        self.predict.Halo.connect(self.Halo_Size)
+        self.predict.TileBatchSize.connect(self.Tile_Batch_Size)
         self.PredictionProbabilities.connect(self.predict.PMaps)
 
         self.prediction_cache = OpBlockedArrayCache(parent=self)
@@ -0,0 +1,292 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2020, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+import logging
+from collections import OrderedDict
+from functools import partial
+
+import numpy
+
+from lazyflow.graph import Operator, InputSlot, OutputSlot
+from lazyflow.request import Request, RequestLock, RequestPool
+from lazyflow.roi import roiToSlice
+
+logger = logging.getLogger(__name__)
+
+
+def blend_weights_1d(start, stop, size, halo):
+    """
+    Blending weights along one axis for a tile covering [start, stop) of an axis of the given size.
+
+    Predictions in the outer half of the halo are discarded (weight 0), because the neural network
+    lacks context there. The remaining part of the overlap with the neighbouring tile is linearly
+    cross-faded. Edges that coincide with the image border have no neighbour and are not tapered.
+    The weights of two neighbouring tiles never vanish at the same position.
+    """
+    weights = numpy.ones(stop - start, dtype=numpy.float32)
+    if halo <= 0:
+        return weights
+
+    positions = numpy.arange(start, stop)
+    distance = numpy.full(stop - start, numpy.inf)
+    if start > 0:
+        distance = numpy.minimum(distance, positions - start)
+    if stop < size:
+        distance = numpy.minimum(distance, stop - 1 - positions)
+    ramp = (distance + 0.5 - halo / 2.0) / halo
+    return numpy.clip(ramp, 0.0, 1.0).astype(numpy.float32)
+
+
+class OpTiledPixelwisePredict(Operator):
+    """
+    Pixelwise prediction on a grid of overlapping tiles.
+
+    The image is split into tiles of TileShape pixels along the y and x axes. Each tile is enlarged by Halo
+    pixels on every side before it is handed to the classifier, and the overlapping predictions of neighbouring
+    tiles are blended (see :func:`blend_weights_1d`). The tile grid is anchored at the image origin, so the
+    prediction for a pixel does not depend on the requested roi: cache blocks of any size fit together without
+    seams, and large images can be predicted in parallel medium-size blocks.
+
+    The tiles needed for a request are submitted to the request pool in batches of TileBatchSize tiles.
+    Neighbouring output blocks need the same tiles (a tile contributes to all blocks its halo reaches), so the
+    blended tile predictions are kept in an LRU cache of at most MaxCachedBytes bytes, and a tile that is being
+    predicted for one request is waited for, not predicted again, by the others. The cache only has to bridge
+    neighbouring requests (finished blocks are kept by the downstream block cache), so it can stay small.
+    """
+
+    Image = InputSlot()
+    Classifier = InputSlot()
+    LabelsCount = InputSlot()
+    TileShape = InputSlot()  # Size of the tiles (without halo) along y and x, in pixels
+    Halo = InputSlot(value=0)  # Overlap added on each side of a tile, in pixels
+    TileBatchSize = InputSlot(value=4)  # Number of tiles predicted by a single request
+    MaxCachedBytes = InputSlot(value=256 * 1024 ** 2)  # Memory for tile predictions kept for neighbouring blocks
+
+    PMaps = OutputSlot()
+
+    TILED_AXES = "yx"
+
+    def __init__(self, *args, **kwargs):
+        super(OpTiledPixelwisePredict, self).__init__(*args, **kwargs)
+        self._cache_lock = RequestLock()
+        self._tile_cache = OrderedDict()  # (start, stop) -> (weighted probabilities, weights)
+        self._cached_bytes = 0
+        self._pending_tiles = {}  # (start, stop) -> Request that predicts the tile
+        self._cache_generation = 0
+
+    def _clear_tile_cache(self):
+        with self._cache_lock:
+            self._tile_cache.clear()
+            self._cached_bytes = 0
+            self._pending_tiles.clear()
+            self._cache_generation += 1
+
+    def setupOutputs(self):
+        self._clear_tile_cache()
+        axiskeys = self.Image.meta.getAxisKeys()
+        assert axiskeys[-1] == "c", "OpTiledPixelwisePredict expects the channel axis to be last, got {}".format(
+            axiskeys
+        )
+        num_classes = self.LabelsCount.value
+        self.PMaps.meta.assignFrom(self.Image.meta)
+        self.PMaps.meta.dtype = numpy.float32
+        self.PMaps.meta.shape = self.Image.meta.shape[:-1] + (num_classes,)
+        self.PMaps.meta.drange = (0.0, 1.0)
+        self.PMaps.meta.channel_names = None
+
+    def _tile_windows(self, roi_start, roi_stop):
+        """
+        Yields the (start, stop) of all halo-enlarged tiles that intersect the given roi.
+        The channel axis always spans all input channels; untiled axes are taken from the roi.
+        """
+        image_shape = self.Image.meta.shape
+        axiskeys = self.Image.meta.getAxisKeys()
+        tile_size = self.TileShape.value
+        halo = self.Halo.value
+
+        ranges_per_axis = []
+        for axis, key in enumerate(axiskeys):
+            if key == "c":
+                ranges_per_axis.append([(0, image_shape[axis])])
+            elif key in self.TILED_AXES:
+                first_tile = max(0, (roi_start[axis] - halo) // tile_size - 1)
+                last_tile = (roi_stop[axis] + halo) // tile_size + 1
+                windows = []
+                for tile_index in range(first_tile, last_tile + 1):
+                    begin = max(0, tile_index * tile_size - halo)
+                    end = min(image_shape[axis], (tile_index + 1) * tile_size + halo)
+                    if begin < end and begin < roi_stop[axis] and end > roi_start[axis]:
+                        windows.append((begin, end))
+                ranges_per_axis.append(windows)
+            else:
+                ranges_per_axis.append([(roi_start[axis], roi_stop[axis])])
+
+        def product(axis):
+            if axis == len(ranges_per_axis):
+                yield (), ()
+                return
+            for begin, end in ranges_per_axis[axis]:
+                for starts, stops in product(axis + 1):
+                    yield (begin,) + starts, (end,) + stops
+
+        for start, stop in product(0):
+            yield numpy.array(start), numpy.array(stop)
+
+    def _tile_weights(self, start, stop):
+        image_shape = self.Image.meta.shape
+        axiskeys = self.Image.meta.getAxisKeys()
+        halo = self.Halo.value
+        weights = numpy.ones((1,) * len(axiskeys), dtype=numpy.float32)
+        for axis, key in enumerate(axiskeys):
+            if key in self.TILED_AXES:
+                shape = [1] * len(axiskeys)
+                shape[axis] = stop[axis] - start[axis]
+                axis_weights = blend_weights_1d(start[axis], stop[axis], image_shape[axis], halo)
+                weights = weights * axis_weights.reshape(shape)
+        return weights
+
+    def _predict_tiles(self, tiles, generation):
+        """
+        Predicts the given (key, start, stop) tiles and returns {key: (weighted probabilities, weights)}.
+        """
+        classifier = self.Classifier.value
+        axistags = self.Image.meta.axistags
+        predictions = {}
+        try:
+            for key, start, stop in tiles:
+                data = self.Image(start, stop).wait()
+                predict_roi = (numpy.zeros_like(start), stop - start)
+                probabilities = classifier.predict_probabilities_pixelwise(data, predict_roi, axistags=axistags)
+                weights = self._tile_weights(start, stop)
+                predictions[key] = (numpy.asarray(probabilities, dtype=numpy.float32) * weights, weights)
+        finally:
+            with self._cache_lock:
+                for key, _, _ in tiles:
+                    self._pending_tiles.pop(key, None)
+                if generation == self._cache_generation:
+                    for key, prediction in predictions.items():
+                        self._tile_cache[key] = prediction
+                        self._cached_bytes += self._prediction_bytes(prediction)
+                    self._evict_tiles(self.MaxCachedBytes.value)
+        return predictions
+
+    @staticmethod
+    def _prediction_bytes(prediction):
+        weighted, weights = prediction
+        return weighted.nbytes + weights.nbytes
+
+    def _evict_tiles(self, max_bytes):
+        """
+        Drops the least recently used tile predictions until the cache fits into max_bytes (call with the lock held).
+        """
+        while self._tile_cache and self._cached_bytes > max_bytes:
+            _, prediction = self._tile_cache.popitem(last=False)
+            self._cached_bytes -= self._prediction_bytes(prediction)
+
+    def _get_tile_predictions(self, tiles):
+        """
+        Returns {key: (weighted probabilities, weights)} for the given (key, start, stop) tiles, from the cache,
+        from requests that are already predicting them, or from new requests of TileBatchSize tiles.
+        """
+        batch_size = max(1, self.TileBatchSize.value)
+        predictions = {}
+        requests = []
+        missing = []
+        with self._cache_lock:
+            for key, start, stop in tiles:
+                if key in self._tile_cache:
+                    self._tile_cache.move_to_end(key)
+                    predictions[key] = self._tile_cache[key]
+                elif key in self._pending_tiles:
+                    if self._pending_tiles[key] not in requests:
+                        requests.append(self._pending_tiles[key])
+                else:
+                    missing.append((key, start, stop))
+
+            new_requests = []
+            for batch_start in range(0, len(missing), batch_size):
+                batch = missing[batch_start : batch_start + batch_size]
+                request = Request(partial(self._predict_tiles, batch, self._cache_generation))
+                for key, _, _ in batch:
+                    self._pending_tiles[key] = request
+                new_requests.append(request)
+
+        logger.debug(f"{len(predictions)} of {len(tiles)} tiles cached, {len(missing)} to predict")
+        for request in new_requests:
+            request.submit()
+        for request in requests + new_requests:
+            predictions.update(request.wait())
+        return predictions
+
+    def execute(self, slot, subindex, roi, result):
+        num_classes = self.LabelsCount.value
+        roi_start = numpy.array(roi.start)
+        roi_stop = numpy.array(roi.stop)
+
+        spatial_shape = tuple(roi_stop[:-1] - roi_start[:-1])
+        accumulated = numpy.zeros(spatial_shape + (num_classes,), dtype=numpy.float32)
+        weight_sum = numpy.zeros(spatial_shape + (1,), dtype=numpy.float32)
+
+        tiles = [
+            ((tuple(start), tuple(stop)), start, stop) for start, stop in self._tile_windows(roi_start, roi_stop)
+        ]
+        predictions = self._get_tile_predictions(tiles)
+
+        for key, start, stop in tiles:
+            weighted, weights = predictions[key]
+
+            # Only the part of the tile that lies inside the requested roi is accumulated
+            inside_start = numpy.maximum(start[:-1], roi_start[:-1])
+            inside_stop = numpy.minimum(stop[:-1], roi_stop[:-1])
+            tile_slicing = roiToSlice(inside_start - start[:-1], inside_stop - start[:-1])
+            result_slicing = roiToSlice(inside_start - roi_start[:-1], inside_stop - roi_start[:-1])
+            accumulated[result_slicing] += weighted[tile_slicing]
+            weight_sum[result_slicing] += weights[tile_slicing]
+
+        accumulated /= weight_sum
+        result[...] = accumulated[..., roi_start[-1] : roi_stop[-1]]
+        return result
+
+    def propagateDirty(self, slot, subindex, roi):
+        if slot is self.MaxCachedBytes:
+            with self._cache_lock:
+                self._evict_tiles(self.MaxCachedBytes.value)
+            return
+        if slot is self.TileBatchSize:
+            return
+        self._clear_tile_cache()
+        if slot is self.Image:
+            # The halo makes the prediction depend on neighbouring pixels
+            halo = self.Halo.value
+            image_shape = self.Image.meta.shape
+            start = numpy.array(roi.start)
+            stop = numpy.array(roi.stop)
+            for axis, key in enumerate(self.Image.meta.getAxisKeys()):
+                if key in self.TILED_AXES:
+                    tile_size = self.TileShape.value
+                    reach = tile_size + 2 * halo
+                    start[axis] = max(0, start[axis] - reach)
+                    stop[axis] = min(image_shape[axis], stop[axis] + reach)
+                elif key == "c":
+                    start[axis] = 0
+                    stop[axis] = self.LabelsCount.value
+            self.PMaps.setDirty(start, stop)
+        else:
+            self.PMaps.setDirty()
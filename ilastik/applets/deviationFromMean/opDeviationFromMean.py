@@ -20,39 +20,117 @@
 ###############################################################################
 from __future__ import division
 from __future__ import print_function
+import logging
+
 from lazyflow.graph import Operator, InputSlot, OutputSlot
+from lazyflow.operators import OpBlockedArrayCache
+from lazyflow.request import RequestPool
+from lazyflow.roi import determineBlockShape
 import numpy
 from ilastik.utility import MultiLaneOperatorABC, OperatorSubView
 
+logger = logging.getLogger(__name__)
+
+
+class OpMeanImage(Operator):
+    """
+    Pixelwise mean of a set of images with equal shapes.
+
+    The lanes are read in batches of LaneBatchSize images at a time (in parallel) and summed into a single
+    float64 accumulator, so the memory needed for a request does not grow with the number of lanes.
+    With LaneBatchSize = 1, the lanes are streamed one after the other.
+    """
+
+    Input = InputSlot(level=1)
+    LaneBatchSize = InputSlot(value=4)  # Number of lanes read concurrently
+
+    Output = OutputSlot()
+
+    def __init__(self, *args, **kwargs):
+        super(OpMeanImage, self).__init__(*args, **kwargs)
+
+        # Adding or removing an image changes the mean everywhere
+        def markOutputDirty(*args):
+            self.Output.setDirty(slice(None))
+
+        self.Input.notifyInserted(markOutputDirty)
+        self.Input.notifyRemoved(markOutputDirty)
+
+    def setupOutputs(self):
+        if len(self.Input) == 0:
+            self.Output.meta.NOTREADY = True
+            return
+
+        # Ensure all inputs have the same shape
+        shape = self.Input[0].meta.shape
+        for islot in self.Input:
+            if islot.meta.shape != shape:
+                raise RuntimeError("Input images must have the same shape.")
+
+        self.Output.meta.assignFrom(self.Input[0].meta)
+
+    def execute(self, slot, subindex, roi, result):
+        accumulator = numpy.zeros(result.shape, dtype=numpy.float64)
+        batch_size = max(1, self.LaneBatchSize.value)
+        lanes = list(self.Input)
+        for batch_start in range(0, len(lanes), batch_size):
+            batch = lanes[batch_start : batch_start + batch_size]
+            if len(batch) == 1:
+                accumulator += batch[0].get(roi).wait()
+                continue
+
+            requests = [lane.get(roi) for lane in batch]
+            pool = RequestPool()
+            for request in requests:
+                pool.add(request)
+            pool.wait()
+            for request in requests:
+                accumulator += request.wait()
+            pool.clean()
+
+        accumulator /= len(lanes)
+        result[:] = accumulator
+        return result
+
+    def propagateDirty(self, slot, subindex, roi):
+        # A dirty region in any lane is dirty in the mean (the batch size does not change any values)
+        if slot == self.Input:
+            self.Output.setDirty(roi)
+
 
 class OpDeviationFromMean(Operator):
     """
     Multi-image operator.
     Calculates the pixelwise mean of a set of images, and produces a set of corresponding images for the difference from the mean.
     Note: Inputs must all have the same shape.
+
+    The mean image is held in a blockwise cache, so exporting all deviation images reads each input only once
+    for the mean. A dirty region in any lane invalidates only the overlapping blocks of the mean.
     """
 
     ScalingFactor = InputSlot()  # Scale after subtraction
     Offset = InputSlot()  # Offset final results
     Input = InputSlot(level=1)  # Multi-image input
+    LaneBatchSize = InputSlot(value=4)  # Number of lanes read concurrently when computing the mean
 
     Mean = OutputSlot()
     Output = OutputSlot(level=1)  # Multi-image output
 
-    def setupOutputs(self):
-        # Ensure all inputs have the same shape
-        if len(self.Input) > 0:
-            shape = self.Input[0].meta.shape
-            for islot in self.Input:
-                if islot.meta.shape != shape:
-                    raise RuntimeError("Input images must have the same shape.")
+    # Number of pixels in a block of the mean image cache
+    MEAN_CACHE_BLOCK_VOLUME = 128 ** 3
 
-        # Copy the meta info from each input to the corresponding output
-        self.Output.resize(len(self.Input))
-        for index, islot in enumerate(self.Input):
-            self.Output[index].meta.assignFrom(islot.meta)
+    def __init__(self, *args, **kwargs):
+        super(OpDeviationFromMean, self).__init__(*args, **kwargs)
+
+        self._opMean = OpMeanImage(parent=self)
+        self._opMean.Input.connect(self.Input)
+        self._opMean.LaneBatchSize.connect(self.LaneBatchSize)
 
-        self.Mean.meta.assignFrom(self.Input[0].meta)
+        self._opMeanCache = OpBlockedArrayCache(parent=self)
+        self._opMeanCache.Input.connect(self._opMean.Output)
+        self._opMeanCache.fixAtCurrent.setValue(False)
+
+        self.Mean.connect(self._opMeanCache.Output)
 
         def markAllOutputsDirty(*args):
             self.propagateDirty(self.Input, (), slice(None))
@@ -60,24 +138,26 @@ class OpDeviationFromMean(Operator):
         self.Input.notifyInserted(markAllOutputsDirty)
         self.Input.notifyRemoved(markAllOutputsDirty)
 
-    def execute(self, slot, subindex, roi, result):
-        """
-        Compute.  This is a simple implementation, without optimizations.
-        """
-        # Compute average of *all* inputs
-        result[:] = 0.0
-        for s in self.Input:
-            result[:] += s.get(roi).wait()
-        result[:] = result / len(self.Input)
+    def setupOutputs(self):
+        # Copy the meta info from each input to the corresponding output
+        self.Output.resize(len(self.Input))
+        for index, islot in enumerate(self.Input):
+            self.Output[index].meta.assignFrom(islot.meta)
 
-        # If the user wanted the mean, we're done.
-        if slot == self.Mean:
-            return result
+        if len(self.Input) == 0:
+            return
+        shape = self.Input[0].meta.shape
+        block_shape = tuple(int(s) for s in determineBlockShape(shape, self.MEAN_CACHE_BLOCK_VOLUME))
+        self._opMeanCache.BlockShape.setValue(block_shape)
 
+    def execute(self, slot, subindex, roi, result):
         assert slot == self.Output
 
+        # The mean of *all* inputs comes from the cache
+        mean = self._opMeanCache.Output.get(roi).wait()
+
         # Subtract average from the particular image being requested
-        result[:] = self.Input[subindex].get(roi).wait() - result
+        result[:] = self.Input[subindex].get(roi).wait() - mean
 
         # Scale
         result[:] = result * self.ScalingFactor.value
@@ -88,6 +168,10 @@ class OpDeviationFromMean(Operator):
         return result
 
     def propagateDirty(self, slot, subindex, roi):
+        # The batch size does not change any values
+        if slot == self.LaneBatchSize:
+            return
+
         # If the dirty slot is one of our two constants, then the entire image region is dirty
         if slot == self.Offset or slot == self.ScalingFactor:
             roi = slice(None)  # The whole image region
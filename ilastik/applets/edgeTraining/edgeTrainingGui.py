@@ -29,6 +29,9 @@ from PyQt5.QtWidgets import (
     QWidget,
     QVBoxLayout,
     QHBoxLayout,
+    QLabel,
+    QSpinBox,
+    QDoubleSpinBox,
     QSpacerItem,
     QSizePolicy,
     QPushButton,
@@ -128,6 +131,25 @@ class EdgeTrainingGui(LayerViewerGui):
         )
         configure_update_handlers(self.live_update_button.toggled, op.FreezeCache)
 
+        # Retrain debounce (see OpTrainEdgeClassifier)
+        self.retrain_threshold_box = QSpinBox(
+            minimum=0,
+            maximum=100000,
+            specialValueText="every change",
+            toolTip="Keep the current edge classifier until this many edge labels have changed.",
+        )
+        configure_update_handlers(self.retrain_threshold_box.valueChanged, op.RetrainLabelThreshold)
+        self.retrain_interval_box = QDoubleSpinBox(
+            decimals=1,
+            minimum=0.0,
+            maximum=3600.0,
+            singleStep=1.0,
+            suffix=" s",
+            specialValueText="off",
+            toolTip="Keep the current edge classifier until this many seconds have passed since it was trained.",
+        )
+        configure_update_handlers(self.retrain_interval_box.valueChanged, op.RetrainInterval)
+
         self.train_from_gt_button.clicked.connect(lambda: op.FreezeClassifier.setValue(False))
 
         def enable_live_update_on_edges_available(*args, **kwargs):
@@ -148,6 +170,15 @@ class EdgeTrainingGui(LayerViewerGui):
         layout.setSpacing(1)
         layout.addLayout(label_layout)
         layout.addWidget(self.live_update_button)
+        for label_text, widget in [
+            ("Retrain after labels:", self.retrain_threshold_box),
+            ("Retrain at most every:", self.retrain_interval_box),
+        ]:
+            row_layout = QHBoxLayout()
+            row_layout.addWidget(QLabel(label_text))
+            row_layout.addSpacerItem(QSpacerItem(10, 0, QSizePolicy.Expanding))
+            row_layout.addWidget(widget)
+            layout.addLayout(row_layout)
         layout.addSpacerItem(QSpacerItem(0, 10, QSizePolicy.Minimum, QSizePolicy.Expanding))
 
         # Finally, the whole drawer widget
@@ -303,6 +334,10 @@ class EdgeTrainingGui(LayerViewerGui):
             pen.setColor(color)
             self.probability_pen_table.append(pen)
 
+        # The same pens as an array, to look up the pens of all edges at once
+        self.probability_pens = np.empty(len(self.probability_pen_table), dtype=object)
+        self.probability_pens[:] = self.probability_pen_table
+
         # When the edge probabilities are dirty, update the probability edge layer pens
         op = self.topLevelOperatorView
         cleanup_fn = op.EdgeProbabilitiesDict.notifyDirty(self.update_probability_edges, defer=True)
@@ -314,10 +349,8 @@ class EdgeTrainingGui(LayerViewerGui):
             if not self.getLayerByName("Edge Probabilities"):
                 return
             edge_probs = op.EdgeProbabilitiesDict.value
-            new_pens = {}
-            for id_pair, probability in list(edge_probs.items()):
-                new_pens[id_pair] = self.probability_pen_table[int(probability * 100)]
-            self.apply_new_probability_edges(new_pens)
+            pens = self.probability_pens[(edge_probs.values * 100).astype(int)]
+            self.apply_new_probability_edges(edge_probs.to_dict(pens))
 
         # submit the worklaod in a request and return immediately
         req = Request(_impl).submit()
@@ -351,6 +384,8 @@ class EdgeTrainingGui(LayerViewerGui):
                 self.live_update_button.setIcon(QIcon(ilastikIcons.Play))
             else:
                 self.live_update_button.setIcon(QIcon(ilastikIcons.Pause))
+            self.retrain_threshold_box.setValue(int(op.RetrainLabelThreshold.value))
+            self.retrain_interval_box.setValue(float(op.RetrainInterval.value))
 
     def configure_operator_from_gui(self):
         if self._currently_updating:
@@ -358,6 +393,8 @@ class EdgeTrainingGui(LayerViewerGui):
         with self.set_updating():
             op = self.topLevelOperatorView
             op.FreezeClassifier.setValue(not self.live_update_button.isChecked())
+            op.RetrainLabelThreshold.setValue(self.retrain_threshold_box.value())
+            op.RetrainInterval.setValue(self.retrain_interval_box.value())
 
     def create_prefetch_menu(self, layer_name):
         def prefetch_layer(axis="z"):
@@ -161,6 +161,8 @@ class EdgeTrainingSerializer(AppletSerializer):
     def __init__(self, operator, projectFileGroupName):
         slots = [
             SerialDictSlot(operator.FeatureNames),
+            SerialSlot(operator.RetrainLabelThreshold),
+            SerialSlot(operator.RetrainInterval),
             SerialEdgeLabelsDictSlot(operator.EdgeLabelsDict),
             SerialRagSlot(operator.Rag, operator.opRagCache, operator.Superpixels),
             SerialCachedDataFrameSlot(
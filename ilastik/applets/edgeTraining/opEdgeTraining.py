@@ -1,5 +1,7 @@
 from builtins import range
 
+import threading
+import time
 from functools import partial
 
 import numpy as np
@@ -9,6 +11,7 @@ import vigra
 import ilastikrag
 
 from lazyflow.graph import Operator, InputSlot, OutputSlot
+from lazyflow.request import RequestLock
 from lazyflow.roi import roiToSlice
 from lazyflow.operators import OpValueCache, OpBlockedArrayCache
 from lazyflow.classifiers import ParallelVigraRfLazyflowClassifierFactory
@@ -16,6 +19,7 @@ from lazyflow.classifiers import ParallelVigraRfLazyflowClassifierFactory
 from ilastik.applets.base.applet import DatasetConstraintError
 from ilastik.utility.operatorSubView import OperatorSubView
 from ilastik.utility import OpMultiLaneWrapper
+from ilastik.utility.edgeTable import EdgeTable
 
 import logging
 
@@ -27,6 +31,8 @@ class OpEdgeTraining(Operator):
     DEFAULT_FEATURES = {"Grayscale": ["standard_edge_mean"]}
     FeatureNames = InputSlot(value=DEFAULT_FEATURES)
     FreezeClassifier = InputSlot(value=True)
+    RetrainLabelThreshold = InputSlot(value=0)  # See OpTrainEdgeClassifier
+    RetrainInterval = InputSlot(value=0.0)
 
     # Lane-wise
     EdgeLabelsDict = InputSlot(level=1, value={})
@@ -37,7 +43,7 @@ class OpEdgeTraining(Operator):
 
     Rag = OutputSlot(level=1)
     EdgeProbabilities = OutputSlot(level=1)
-    EdgeProbabilitiesDict = OutputSlot(level=1)  # A dict of id_pair -> probabilities
+    EdgeProbabilitiesDict = OutputSlot(level=1)  # An EdgeTable of id_pair -> probabilities
     NaiveSegmentation = OutputSlot(level=1)
 
     def __init__(self, *args, **kwargs):
@@ -64,6 +70,8 @@ class OpEdgeTraining(Operator):
         self.opTrainEdgeClassifier = OpTrainEdgeClassifier(parent=self)
         self.opTrainEdgeClassifier.EdgeLabelsDict.connect(self.EdgeLabelsDict)
         self.opTrainEdgeClassifier.EdgeFeaturesDataFrame.connect(self.opEdgeFeaturesCache.Output)
+        self.opTrainEdgeClassifier.RetrainLabelThreshold.connect(self.RetrainLabelThreshold)
+        self.opTrainEdgeClassifier.RetrainInterval.connect(self.RetrainInterval)
 
         # classifier cache input is set after training.
         self.opClassifierCache = OpValueCache(parent=self)
@@ -191,9 +199,7 @@ class OpEdgeTraining(Operator):
         logger.info("Computing edge decisions from groundtruth...")
         decisions = rag.edge_decisions_from_groundtruth(gt_vol, asdict=False)
         edge_labels = decisions.view(np.uint8) + 1
-        edge_ids = list(map(tuple, rag.edge_ids))
-        edge_labels_dict = dict(list(zip(edge_ids, edge_labels)))
-        op_view.EdgeLabelsDict.setValue(edge_labels_dict)
+        op_view.EdgeLabelsDict.setValue(EdgeTable(rag.edge_ids, edge_labels).to_dict())
 
     def addLane(self, laneIndex):
         numLanes = len(self.VoxelData)
@@ -288,64 +294,217 @@ class OpComputeEdgeFeatures(Operator):
         self.EdgeFeaturesDataFrame.setDirty()
 
 
+class _LaneTrainingData(object):
+    """
+    The labeled part of the training set of one lane: the labeled edges and their rows of the feature matrix.
+    """
+
+    def __init__(self, edge_features_df):
+        assert list(edge_features_df.columns[0:2]) == ["sp1", "sp2"]
+        self.edge_features_df = edge_features_df
+        self.feature_names = edge_features_df.columns[2:].values
+        self.features_table = EdgeTable(edge_features_df.iloc[:, 0:2].values, np.arange(len(edge_features_df)))
+
+        self.labels_dict = {}
+        self.labels = EdgeTable(np.zeros((0, 2), dtype=np.uint32), np.zeros((0,), dtype=np.uint8))
+        self.feature_matrix = edge_features_df.iloc[:0, 2:].values  # Omit 'sp1', 'sp2'
+
+    def update(self, labels_dict, lane_index):
+        """
+        Patches the labeled feature matrix to match the given labels: rows of edges whose label was removed or
+        changed are dropped, new labels are appended. Returns the number of changed labels.
+        """
+        new_labels = EdgeTable.from_dict(labels_dict, dtype=np.uint8)
+        new_labels = new_labels.select(new_labels.values != 0)  # Drop zero labels
+
+        # Labels that are still present with the same value keep their rows
+        rows_in_new = new_labels.indices(self.labels.edge_ids)
+        keep = rows_in_new >= 0
+        keep[keep] = new_labels.values[rows_in_new[keep]] == self.labels.values[keep]
+        unchanged = np.zeros(len(new_labels), dtype=bool)
+        unchanged[rows_in_new[keep]] = True
+        added = new_labels.select(~unchanged)
+
+        # Find the feature rows of the new labels
+        rows = self.features_table.indices(added.edge_ids)
+        known = rows >= 0
+        if not known.all():
+            logger.warning(
+                "Ignoring {} labels of edges that are not in the RAG of lane {}".format((~known).sum(), lane_index)
+            )
+        added = added.select(known)
+
+        num_changed = int((~keep).sum()) + len(added)
+        self.labels = EdgeTable(
+            np.concatenate([self.labels.edge_ids[keep], added.edge_ids]),
+            np.concatenate([self.labels.values[keep], added.values]),
+        )
+        added_features = self.edge_features_df.iloc[rows[known], 2:].values
+        self.feature_matrix = np.concatenate([self.feature_matrix[keep], added_features])
+        self.labels_dict = labels_dict
+        return num_changed
+
+
 class OpTrainEdgeClassifier(Operator):
+    """
+    Trains the edge classifier on the labeled edges of all lanes.
+
+    The labeled feature matrix of each lane is cached and patched for the edges whose label changed, so a new
+    label does not require a pass over the features of all edges. Lanes whose labels and features did not change
+    are reused as they are.
+
+    Retraining can optionally be debounced: with RetrainLabelThreshold=N and/or RetrainInterval=T (seconds),
+    the previous classifier is kept until N labels have changed or T seconds have passed since the last training.
+    Both default to 0, i.e. the classifier is retrained on every change.
+    Changes that were held back are not lost: the output is set dirty again once T seconds have passed since the
+    last training (or, without an interval, once no labels changed for TRAILING_RETRAIN_DELAY seconds), so the
+    next request trains on them.
+    """
+
+    #: Seconds without label changes after which held back changes are trained, if RetrainInterval is 0
+    TRAILING_RETRAIN_DELAY = 2.0
+
     EdgeLabelsDict = InputSlot(level=1)
     EdgeFeaturesDataFrame = InputSlot(level=1)
+    RetrainLabelThreshold = InputSlot(value=0)
+    RetrainInterval = InputSlot(value=0.0)
 
     EdgeClassifier = OutputSlot()
 
+    def __init__(self, *args, **kwargs):
+        super(OpTrainEdgeClassifier, self).__init__(*args, **kwargs)
+        self._lock = RequestLock()
+        self._lane_data = {}  # lane index -> _LaneTrainingData
+        self._classifier = None
+        self._trained_features = {}  # lane index -> edge features DataFrame the classifier was trained with
+        self._trained_feature_names = None
+        self._last_training_time = None
+        self._changes_since_training = 0
+        self._retrain_due = False
+        self._trailing_timer = None
+
     def setupOutputs(self):
         self.EdgeClassifier.meta.shape = (1,)
         self.EdgeClassifier.meta.dtype = object
 
     def execute(self, slot, subindex, roi, result):
-        all_features_and_labels_df = None
+        with self._lock:
+            result[0] = self._update_classifier()
 
+    def _update_classifier(self):
+        lane_data = {}
         for lane_index, (labels_dict_slot, features_slot) in enumerate(
             zip(self.EdgeLabelsDict, self.EdgeFeaturesDataFrame)
         ):
-            logger.info("Retrieving features for lane {}...".format(lane_index))
-
             labels_dict = labels_dict_slot.value.copy()  # Copy now to avoid threading issues.
             if not labels_dict:
                 continue
 
-            sp_columns = np.array(list(labels_dict.keys()))
+            # The features are cached upstream, so an unchanged lane gets the same DataFrame again.
+            # (Lanes may also have been inserted or removed, which changes the DataFrame of a lane index.)
             edge_features_df = features_slot.value
-            assert list(edge_features_df.columns[0:2]) == ["sp1", "sp2"]
-
-            labels_df = pd.DataFrame(sp_columns, columns=["sp1", "sp2"])
-            labels_df["label"] = list(labels_dict.values())
-
-            # Drop zero labels
-            labels_df = labels_df[labels_df["label"] != 0]
-
-            # Merge in features
-            features_and_labels_df = pd.merge(edge_features_df, labels_df, how="right", on=["sp1", "sp2"])
-            if all_features_and_labels_df is not None:
-                all_features_and_labels_df = all_features_and_labels_df.append(features_and_labels_df)
-            else:
-                all_features_and_labels_df = features_and_labels_df
-
-        if all_features_and_labels_df is None:
+            data = self._lane_data.get(lane_index)
+            if data is None or data.edge_features_df is not edge_features_df:
+                logger.info("Retrieving features for lane {}...".format(lane_index))
+                if data is not None:
+                    self._changes_since_training += len(data.labels)
+                data = _LaneTrainingData(edge_features_df)
+            if data.labels_dict != labels_dict:
+                self._changes_since_training += data.update(labels_dict, lane_index)
+            lane_data[lane_index] = data
+
+        # Labels of lanes that were cleared or removed are gone
+        for lane_index, data in self._lane_data.items():
+            if lane_index not in lane_data:
+                self._changes_since_training += len(data.labels)
+        self._lane_data = lane_data
+
+        num_labels = sum(len(data.labels) for data in lane_data.values())
+        if num_labels == 0:
             # No labels yet.
-            result[0] = None
-            return
-
-        assert list(all_features_and_labels_df.columns[0:2]) == ["sp1", "sp2"]
-        assert all_features_and_labels_df.columns[-1] == "label"
-
-        feature_matrix = all_features_and_labels_df.iloc[:, 2:-1].values  # Omit 'sp1', 'sp2', and 'label'
-        labels = all_features_and_labels_df.iloc[:, -1].values
+            self._cancel_trailing_retrain()
+            self._classifier = None
+            self._changes_since_training = 0
+            return None
+
+        # Only label changes may be held back: a classifier trained on other features can't predict the new ones
+        if self._classifier is not None and not self._features_changed(lane_data) and not self._should_retrain():
+            logger.info(
+                "Keeping the previous edge classifier ({} labels changed since it was trained)".format(
+                    self._changes_since_training
+                )
+            )
+            if self._changes_since_training > 0:
+                self._schedule_trailing_retrain()
+            return self._classifier
+
+        feature_matrix = np.concatenate([data.feature_matrix for data in lane_data.values()])
+        labels = np.concatenate([data.labels.values for data in lane_data.values()])
+        feature_names = next(iter(lane_data.values())).feature_names
 
         logger.info("Training classifier with {} labels...".format(len(labels)))
         # TODO: Allow factory to be configured via an input slot
         classifier_factory = ParallelVigraRfLazyflowClassifierFactory()
-        classifier = classifier_factory.create_and_train(
-            feature_matrix, labels, feature_names=all_features_and_labels_df.columns[2:-1].values
-        )
+        classifier = classifier_factory.create_and_train(feature_matrix, labels, feature_names=feature_names)
         assert set(classifier.known_classes).issubset(set([1, 2]))
-        result[0] = classifier
+
+        self._cancel_trailing_retrain()
+        self._classifier = classifier
+        self._trained_features = {lane_index: data.edge_features_df for lane_index, data in lane_data.items()}
+        self._trained_feature_names = feature_names
+        self._last_training_time = time.time()
+        self._changes_since_training = 0
+        return classifier
+
+    def _features_changed(self, lane_data):
+        """
+        Whether the features of a lane differ from those the current classifier was trained with.
+        """
+        for lane_index, data in lane_data.items():
+            if not np.array_equal(data.feature_names, self._trained_feature_names):
+                return True
+            trained_df = self._trained_features.get(lane_index)
+            if trained_df is not None and trained_df is not data.edge_features_df:
+                return True
+        return False
+
+    def _should_retrain(self):
+        label_threshold = self.RetrainLabelThreshold.value
+        interval = self.RetrainInterval.value
+        if self._retrain_due or (label_threshold <= 0 and interval <= 0):
+            return True
+        if label_threshold > 0 and self._changes_since_training >= label_threshold:
+            return True
+        return interval > 0 and time.time() - self._last_training_time >= interval
+
+    def _schedule_trailing_retrain(self):
+        """
+        (Re)starts the timer that retrains on the changes the last request held back.
+        """
+        interval = self.RetrainInterval.value
+        if interval > 0:
+            delay = max(0.0, interval - (time.time() - self._last_training_time))
+        else:
+            delay = self.TRAILING_RETRAIN_DELAY
+        self._cancel_trailing_retrain()
+        self._trailing_timer = threading.Timer(delay, self._retrain_pending_changes)
+        self._trailing_timer.daemon = True
+        self._trailing_timer.start()
+
+    def _cancel_trailing_retrain(self):
+        self._retrain_due = False
+        if self._trailing_timer is not None:
+            self._trailing_timer.cancel()
+            self._trailing_timer = None
+
+    def _retrain_pending_changes(self):
+        self._trailing_timer = None
+        self._retrain_due = True
+        self.EdgeClassifier.setDirty()
+
+    def cleanUp(self):
+        self._cancel_trailing_retrain()
+        super(OpTrainEdgeClassifier, self).cleanUp()
 
     def propagateDirty(self, slot, subindex, roi):
         self.EdgeClassifier.setDirty()
@@ -383,7 +542,7 @@ class OpPredictEdgeProbabilities(Operator):
 class OpEdgeProbabilitiesDict(Operator):
     """
     A little utility operator to combine a RAG's edge_ids
-    with an array of edge probabilities into a dict of id_pair -> probability
+    with an array of edge probabilities into an EdgeTable of id_pair -> probability
     """
 
     Rag = InputSlot()
@@ -395,17 +554,13 @@ class OpEdgeProbabilitiesDict(Operator):
         self.EdgeProbabilitiesDict.meta.dtype = object
 
     def execute(self, slot, subindex, roi, result):
-        logger.info("Converting edge probabilities to dict...")
         rag = self.Rag.value
         edge_probabilities = self.EdgeProbabilities.value
         if edge_probabilities is None:
             # Edge probabilities are 'None' if they haven't been loaded into the cache yet.
             # Just return 0.0 for all probabilities
-            result[0] = {tuple(edge_id): 0.0 for edge_id in rag.edge_ids}
-        else:
-            result[0] = dict(zip(map(tuple, rag.edge_ids), edge_probabilities))
-
-        logger.info("...done")
+            edge_probabilities = np.zeros((len(rag.edge_ids),), dtype=np.float32)
+        result[0] = EdgeTable(rag.edge_ids, edge_probabilities)
 
     def propagateDirty(self, slot, subindex, roi):
         self.EdgeProbabilitiesDict.setDirty()
@@ -10,6 +10,8 @@ class OpEdgeTrainingWithMulticut(Operator):
     # Edge Training parameters
     FeatureNames = InputSlot(value=OpEdgeTraining.DEFAULT_FEATURES)
     FreezeClassifier = InputSlot(value=True)
+    RetrainLabelThreshold = InputSlot(value=0)  # See OpTrainEdgeClassifier
+    RetrainInterval = InputSlot(value=0.0)
 
     # Multicut parameters
     Beta = InputSlot(value=0.5)
@@ -26,7 +28,7 @@ class OpEdgeTrainingWithMulticut(Operator):
     # EdgeTraining outputs
     Rag = OutputSlot(level=1)
     EdgeProbabilities = OutputSlot(level=1)
-    EdgeProbabilitiesDict = OutputSlot(level=1)  # A dict of id_pair -> probabilities
+    EdgeProbabilitiesDict = OutputSlot(level=1)  # An EdgeTable of id_pair -> probabilities
     NaiveSegmentation = OutputSlot(level=1)
 
     # Multicut Output
@@ -45,6 +47,8 @@ class OpEdgeTrainingWithMulticut(Operator):
 
         opEdgeTraining.FeatureNames.connect(self.FeatureNames)
         opEdgeTraining.FreezeClassifier.connect(self.FreezeClassifier)
+        opEdgeTraining.RetrainLabelThreshold.connect(self.RetrainLabelThreshold)
+        opEdgeTraining.RetrainInterval.connect(self.RetrainInterval)
         opEdgeTraining.RawData.connect(self.RawData)
         opEdgeTraining.VoxelData.connect(self.VoxelData)
         opEdgeTraining.Superpixels.connect(self.Superpixels)
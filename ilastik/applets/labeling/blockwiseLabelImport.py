@@ -0,0 +1,167 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2020, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+"""
+Streaming helpers for importing label volumes of any size into a label array.
+
+Both passes over the imported data (counting the label values and writing the remapped labels) process the data
+in blocks on the lazyflow thread pool, so only a few blocks are held in memory at any time.
+"""
+import logging
+import threading
+
+import numpy
+
+from lazyflow.roi import determineBlockShape, roiFromShape, roiToSlice
+from lazyflow.utility import BigRequestStreamer
+
+logger = logging.getLogger(__name__)
+
+#: Number of voxels in a block processed by a single request
+DEFAULT_BLOCK_VOLUME = 128 ** 3
+
+#: Blocks with label values below this limit are counted with numpy.bincount, otherwise with numpy.unique
+BINCOUNT_LIMIT = 2 ** 20
+
+#: Number of partial (label, count) entries that are collected before they are merged
+MERGE_THRESHOLD = 2 ** 20
+
+
+def label_block_shape(shape, block_volume=DEFAULT_BLOCK_VOLUME):
+    """
+    Roughly isotropic block shape for streaming a volume of the given shape.
+    """
+    return tuple(int(s) for s in determineBlockShape(list(shape), block_volume))
+
+
+def count_block_labels(data):
+    """
+    Returns the label values occurring in ``data`` (sorted) and the number of voxels of each.
+    """
+    data = numpy.asarray(data).reshape(-1)
+    if data.size == 0:
+        return numpy.zeros((0,), dtype=data.dtype), numpy.zeros((0,), dtype=numpy.int64)
+    if numpy.issubdtype(data.dtype, numpy.integer) and data.min() >= 0 and data.max() < BINCOUNT_LIMIT:
+        bincounts = numpy.bincount(data.astype(numpy.intp, copy=False))
+        labels = bincounts.nonzero()[0]
+        return labels.astype(data.dtype), bincounts[labels].astype(numpy.int64)
+    labels, counts = numpy.unique(data, return_counts=True)
+    return labels, counts.astype(numpy.int64)
+
+
+def merge_label_counts(labels_list, counts_list):
+    """
+    Combines several (labels, counts) pairs into one with sorted, unique labels.
+    """
+    if not labels_list:
+        return numpy.zeros((0,), dtype=numpy.int64), numpy.zeros((0,), dtype=numpy.int64)
+    labels, inverse = numpy.unique(numpy.concatenate(labels_list), return_inverse=True)
+    counts = numpy.bincount(inverse.reshape(-1), weights=numpy.concatenate(counts_list), minlength=len(labels))
+    return labels, counts.astype(numpy.int64)
+
+
+def count_labels(slot, blockshape=None, progress_callback=None):
+    """
+    Counts the voxels of every label value in ``slot``, block by block and in parallel.
+
+    :param slot: The slot providing the imported label data
+    :param blockshape: Shape of the blocks that are requested from ``slot``
+    :param progress_callback: Called with the progress in percent
+    :returns: (sorted label values, voxel count per label)
+    """
+    shape = slot.meta.shape
+    blockshape = blockshape or label_block_shape(shape)
+    lock = threading.Lock()
+    partial_labels = []
+    partial_counts = []
+    pending = [0]
+
+    def handle_block(roi, data):
+        labels, counts = count_block_labels(data)
+        with lock:
+            partial_labels.append(labels)
+            partial_counts.append(counts)
+            pending[0] += len(labels)
+            if pending[0] > MERGE_THRESHOLD:
+                merged = merge_label_counts(partial_labels, partial_counts)
+                partial_labels[:] = [merged[0]]
+                partial_counts[:] = [merged[1]]
+                pending[0] = len(merged[0])
+
+    streamer = BigRequestStreamer(slot, roiFromShape(shape), blockshape, allowParallelResults=True)
+    streamer.resultSignal.subscribe(handle_block)
+    if progress_callback is not None:
+        streamer.progressSignal.subscribe(progress_callback)
+    streamer.execute()
+
+    labels, counts = merge_label_counts(partial_labels, partial_counts)
+    logger.debug(f"Found {len(labels)} distinct label values in data of shape {shape}")
+    return labels.astype(slot.meta.dtype, copy=False), counts
+
+
+def write_labels(
+    source_slot, destination_slot, offset, read_labels, label_mapping=None, blockshape=None, progress_callback=None
+):
+    """
+    Copies the labels of ``source_slot`` into ``destination_slot`` at the given offset, block by block.
+
+    Blocks are remapped in parallel; blocks without any (mapped) label are not written at all, since writing zeros
+    into a label array does not change it.
+
+    :param source_slot: The imported label data, with the axis order of ``destination_slot``
+    :param destination_slot: The slot the labels are written to (via setInSlot)
+    :param offset: Position of the imported data in ``destination_slot``
+    :param read_labels: Sorted label values occurring in the source data (see :func:`count_labels`)
+    :param label_mapping: Dict from source label value to destination label, or None to copy the values as they are
+    :param blockshape: Shape of the blocks that are requested from ``source_slot``
+    :param progress_callback: Called with the progress in percent
+    :returns: The number of blocks that were written
+    """
+    shape = source_slot.meta.shape
+    blockshape = blockshape or label_block_shape(shape)
+    offset = numpy.asarray(offset)
+    read_labels = numpy.asarray(read_labels)
+    if label_mapping is not None:
+        new_labels = numpy.array([label_mapping[x] for x in read_labels], dtype=destination_slot.meta.dtype)
+    write_lock = threading.Lock()
+    written_blocks = [0]
+
+    def handle_block(roi, data):
+        if label_mapping is not None:
+            # There are other ways to do a relabeling (e.g skimage.segmentation.relabel_sequential)
+            # But this supports potentially huge values of read_labels (in the billions),
+            # without needing GB of RAM.
+            mapping_indexes = numpy.searchsorted(read_labels, data).clip(0, len(read_labels) - 1)
+            data = new_labels[mapping_indexes]
+        if not data.any():
+            return
+        start, stop = numpy.asarray(roi[0]), numpy.asarray(roi[1])
+        with write_lock:
+            destination_slot[roiToSlice(start + offset, stop + offset)] = data
+            written_blocks[0] += 1
+
+    streamer = BigRequestStreamer(source_slot, roiFromShape(shape), blockshape, allowParallelResults=True)
+    streamer.resultSignal.subscribe(handle_block)
+    if progress_callback is not None:
+        streamer.progressSignal.subscribe(progress_callback)
+    streamer.execute()
+
+    logger.debug(f"Wrote {written_blocks[0]} non-empty label blocks of shape {blockshape}")
+    return written_blocks[0]
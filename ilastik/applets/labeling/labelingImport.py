@@ -23,6 +23,7 @@
 from builtins import range
 import collections
 import os
+from functools import partial
 import numpy
 import vigra
 
@@ -47,8 +48,7 @@ from PyQt5.QtWidgets import (
 
 # lazyflow
 import lazyflow
-from lazyflow.utility import chunked_bincount
-from lazyflow.roi import TinyVector, roiToSlice, roiFromShape
+from lazyflow.request import Request
 from lazyflow.operators.ioOperators import OpInputDataReader
 from lazyflow.operators.opReorderAxes import OpReorderAxes
 from lazyflow.operators.opBlockedArrayCache import OpBlockedArrayCache
@@ -56,9 +56,32 @@ from lazyflow.operators.valueProviders import OpMetadataInjector
 
 # ilastik
 from ilastik.applets.dataSelection.dataSelectionGui import DataSelectionGui
+from ilastik.applets.labeling.blockwiseLabelImport import count_labels, write_labels
 from ilastik.widgets.ImageFileDialog import ImageFileDialog
 
 
+def _run_with_busy_dialog(parent_widget, text, func):
+    """
+    Run func in a background request and show a busy indicator until it is done.
+    Returns the result of func (or raises its exception).
+    """
+    busy_dlg = QProgressDialog(parent=parent_widget)
+    busy_dlg.setLabelText(text)
+    busy_dlg.setCancelButton(None)
+    busy_dlg.setMinimum(0)
+    busy_dlg.setMaximum(0)
+
+    def close_busy_dlg(*args):
+        QApplication.postEvent(busy_dlg, QCloseEvent())
+
+    req = Request(func)
+    req.notify_finished(close_busy_dlg)
+    req.notify_failed(close_busy_dlg)
+    req.submit()
+    busy_dlg.exec_()
+    return req.wait()
+
+
 def import_labeling_layer(labelLayer, labelingSlots, parent_widget=None):
     """
     Prompt the user for layer import settings, and perform the layer import.
@@ -96,54 +119,21 @@ def import_labeling_layer(labelLayer, labelingSlots, parent_widget=None):
 
         maxLabels = len(labelingSlots.labelNames.value)
 
-        # We don't bother with counting the label pixels
-        # (and caching the data) if it's big (1 GB)
+        # Small data is cached (compressed), so that the second pass over the data (when writing the labels)
+        # doesn't need to read the file again. Big data (1 GB) is streamed from the file twice instead.
         if numpy.prod(opImport.Output.meta.shape) > 1e9:
             reading_slot = opImport.Output
-
-            # For huge data, we don't go through and search for the pixel values,
-            # because that takes an annoyingly long amount of time.
-            # Instead, we make the reasonable assumption that the input labels are already 1,2,3..N
-            # and we don't tell the user what the label pixel counts are.
-            unique_read_labels = numpy.array(list(range(maxLabels + 1)))
-            readLabelCounts = numpy.array([-1] * (maxLabels + 1))
-            labelInfo = (maxLabels, (unique_read_labels, readLabelCounts))
         else:
             opCache.Input.connect(opImport.Output)
             opCache.CompressionEnabled.setValue(True)
             assert opCache.Output.ready()
             reading_slot = opCache.Output
 
-            # We'll show a little window with a busy indicator while the data is loading
-            busy_dlg = QProgressDialog(parent=parent_widget)
-            busy_dlg.setLabelText("Scanning Label Data...")
-            busy_dlg.setCancelButton(None)
-            busy_dlg.setMinimum(100)
-            busy_dlg.setMaximum(100)
-
-            def close_busy_dlg(*args):
-                QApplication.postEvent(busy_dlg, QCloseEvent())
-
-            # Load the data from file into our cache
-            # When it's done loading, close the progress dialog.
-            req = reading_slot[:]
-            req.notify_finished(close_busy_dlg)
-            req.notify_failed(close_busy_dlg)
-            req.submit()
-            busy_dlg.exec_()
-
-            readData = req.result
-
-            # Can't use return_counts feature because that requires numpy >= 1.9
-            # unique_read_labels, readLabelCounts = numpy.unique(readData, return_counts=True)
-
-            # This does the same as the above, albeit slower, and probably with more ram.
-            bincounts = chunked_bincount(readData)
-            unique_read_labels = bincounts.nonzero()[0].astype(readData.dtype, copy=False)
-            readLabelCounts = bincounts[unique_read_labels]
-
-            labelInfo = (maxLabels, (unique_read_labels, readLabelCounts))
-            del readData
+        # Count the label pixels blockwise, while showing a busy indicator
+        unique_read_labels, readLabelCounts = _run_with_busy_dialog(
+            parent_widget, "Scanning Label Data...", partial(count_labels, reading_slot)
+        )
+        labelInfo = (maxLabels, (unique_read_labels, readLabelCounts))
 
         opMetadataInjector.Input.connect(reading_slot)
         metadata = reading_slot.meta.copy()
@@ -194,22 +184,13 @@ def import_labeling_layer(labelLayer, labelingSlots, parent_widget=None):
         if list(labelMapping.keys()) == list(labelMapping.values()):
             labelMapping = None
 
+        # Remap and write the labels blockwise; blocks without labels are skipped.
         # If the data was already cached, this will be fast.
-        label_data = opReorderAxes.Output[:].wait()
-
-        # Map input labels to output labels
-        if labelMapping:
-            # There are other ways to do a relabeling (e.g skimage.segmentation.relabel_sequential)
-            # But this supports potentially huge values of unique_read_labels (in the billions),
-            # without needing GB of RAM.
-            mapping_indexes = numpy.searchsorted(unique_read_labels, label_data)
-            new_labels = numpy.array([labelMapping[x] for x in unique_read_labels])
-            label_data[:] = new_labels[mapping_indexes]
-
-        label_roi = numpy.array(roiFromShape(opReorderAxes.Output.meta.shape))
-        label_roi += imageOffsets
-        label_slice = roiToSlice(*label_roi)
-        writeSeeds[label_slice] = label_data
+        _run_with_busy_dialog(
+            parent_widget,
+            "Importing Label Data...",
+            partial(write_labels, opReorderAxes.Output, writeSeeds, imageOffsets, unique_read_labels, labelMapping),
+        )
 
     finally:
         opReorderAxes.cleanUp()
@@ -189,6 +189,10 @@ class MulticutGuiMixin(object):
             pen.setColor(color)
             self.probability_pen_table.append(pen)
 
+        # The same pens as an array, to look up the pens of all edges at once
+        self.probability_pens = np.empty(len(self.probability_pen_table), dtype=object)
+        self.probability_pens[:] = self.probability_pen_table
+
         # When the edge probabilities are dirty, update the probability edge layer pens
         op = self.__topLevelOperatorView
         op.EdgeProbabilitiesDict.notifyDirty(self.__update_probability_edges)
@@ -202,10 +206,8 @@ class MulticutGuiMixin(object):
             if not self.superpixel_edge_layer:
                 return
             edge_probs = op.EdgeProbabilitiesDict.value
-            new_pens = {}
-            for id_pair, probability in list(edge_probs.items()):
-                new_pens[id_pair] = self.probability_pen_table[int(probability * 100)]
-            self.__apply_new_probability_edges(new_pens)
+            pens = self.probability_pens[(edge_probs.values * 100).astype(int)]
+            self.__apply_new_probability_edges(edge_probs.to_dict(pens))
 
         # submit the worklaod in a request and return immediately
         Request(_impl).submit()
@@ -225,6 +227,8 @@ class MulticutGuiMixin(object):
             pen.setColor(color)
             pen.setWidth(3)
             self.disagreement_pen_table.append(pen)
+        self.disagreement_pens = np.empty(len(self.disagreement_pen_table), dtype=object)
+        self.disagreement_pens[:] = self.disagreement_pen_table
 
         op = self.topLevelOperatorView
         op.EdgeLabelDisagreementDict.notifyReady(self.__update_disagreement_edges)
@@ -245,10 +249,8 @@ class MulticutGuiMixin(object):
                 return
 
             edge_disagreements = op.EdgeLabelDisagreementDict.value
-            new_pens = {}
-            for id_pair, disagreement_label in list(edge_disagreements.items()):
-                new_pens[id_pair] = self.disagreement_pen_table[disagreement_label]
-            self.__apply_disagreement_edges(new_pens)
+            pens = self.disagreement_pens[edge_disagreements.values]
+            self.__apply_disagreement_edges(edge_disagreements.to_dict(pens))
 
         # submit the worklaod in a request and return immediately
         Request(_impl).submit()
@@ -11,6 +11,8 @@ if True:
     from lazyflow.operators import OpBlockedArrayCache, OpValueCache
     from lazyflow.utility import Timer
 
+    from ilastik.utility.edgeTable import EdgeTable
+
     import sys
     import subprocess
 
@@ -108,7 +110,7 @@ if True:
         Rag = InputSlot()  # value slot.  Rag object.
         Superpixels = InputSlot()
         EdgeProbabilities = InputSlot()
-        # A dict of id_pair -> probabilities (used by the GUI)
+        # An EdgeTable of id_pair -> probabilities (used by the GUI)
         EdgeProbabilitiesDict = InputSlot()
         RawData = InputSlot(optional=True)  # Used by the GUI for display only
 
@@ -213,7 +215,7 @@ if True:
             node_labels = self.NodeLabels.value
             if node_labels is None:
                 # This can happen when the cache doesn't have data yet.
-                result[0] = {}
+                result[0] = EdgeTable(np.zeros((0, 2), dtype=np.uint32), np.zeros((0,), dtype=np.uint8))
                 return
 
             rag = self.Rag.value
@@ -226,9 +228,7 @@ if True:
             edge_labels_from_probabilities = edge_probabilities > 0.5
 
             conflicts = np.where(edge_labels_from_nodes != edge_labels_from_probabilities)
-            conflict_edge_ids = edge_ids[conflicts]
-            conflict_labels = edge_labels_from_nodes[conflicts]
-            result[0] = dict(zip(map(tuple, conflict_edge_ids), conflict_labels))
+            result[0] = EdgeTable(edge_ids[conflicts], edge_labels_from_nodes[conflicts])
 
         def propagateDirty(self, slot, subindex, roi):
             self.EdgeLabelDisagreementDict.setDirty()
@@ -8,7 +8,7 @@ import numpy
 
 # import scipy
 from PyQt5 import QtCore, QtWidgets
-from PyQt5.QtGui import QCursor
+from PyQt5.QtGui import QCursor, QCloseEvent
 from PyQt5.QtCore import pyqtRemoveInputHook, pyqtRestoreInputHook
 
 from volumina.widgets import layerwidget
@@ -18,12 +18,16 @@ from volumina import colortables
 from volumina.api import createDataSource
 
 from ilastik.applets.pixelClassification import opPixelClassification
+from ilastik.applets.pixelClassification import featureCost
+from ilastik.applets.pixelClassification.featureSetEvaluation import FeatureSetSizeEvaluator
 from lazyflow.operators import OpFeatureMatrixCache
 from ilastik.utility import OpMultiLaneWrapper
 from lazyflow import graph
+from lazyflow.request import Request
 
 import time
 import re
+from functools import partial
 
 
 # just a container class, nothing fancy here
@@ -37,6 +41,7 @@ class FeatureSelectionResult(object):
         selection_method,
         oob_err=None,
         feature_calc_time=None,
+        throughput=None,
     ):
         self.feature_matrix = feature_matrix
         self.segmentation = segmentation
@@ -44,6 +49,7 @@ class FeatureSelectionResult(object):
         self.selection_method = selection_method
         self.oob_err = oob_err
         self.feature_calc_time = feature_calc_time
+        self.throughput = throughput
         self.feature_ids = feature_ids
 
         self.name = self._create_name()
@@ -61,6 +67,8 @@ class FeatureSelectionResult(object):
                 name = "%d features, %s selection" % (self.parameters["num_of_feat"], self.selection_method)
         elif self.selection_method == "wrapper":
             name = "%d features, wrapper method" % numpy.sum(self.feature_matrix)
+        elif self.selection_method == "cost":
+            name = "%d features, cost-aware selection" % numpy.sum(self.feature_matrix)
         else:
             name = self.selection_method
         return name
@@ -78,12 +86,19 @@ class FeatureSelectionResult(object):
                 name = "%d features, %s selection" % (self.parameters["num_of_feat"], self.selection_method)
         elif self.selection_method == "wrapper":
             name = "%i features, wrapper selection, c=%1.02f" % (numpy.sum(self.feature_matrix), self.parameters["c"])
+        elif self.selection_method == "cost":
+            name = "%i features, cost-aware selection, max. loss=%1.02f" % (
+                numpy.sum(self.feature_matrix),
+                self.parameters["max_loss"],
+            )
         else:
             name = self.selection_method
         if self.oob_err is not None:
             name += ", oob_error=%1.3f" % self.oob_err
         if self.feature_calc_time is not None:
             name += ", computation time=%1.3f" % self.feature_calc_time
+        if self.throughput is not None:
+            name += ", projected throughput=%1.1f Mvox/s" % self.throughput
         return name
 
     def change_name(self, name):
@@ -146,9 +161,11 @@ class FeatureSelectionDialog(QtWidgets.QDialog):
         self._stack_dim = self.opPixelClassification.InputImages.meta.shape
         self._stack_axistags = self.opPixelClassification.InputImages.meta.axistags
 
-        self.__selection_methods = {0: "gini", 1: "filter", 2: "wrapper"}
+        self.__selection_methods = {0: "gini", 1: "filter", 2: "wrapper", 3: "cost"}
 
-        self._selection_params = {"num_of_feat": 7, "c": 0.1}  # arbitrary number for the default, Ulli thinks it's good
+        # arbitrary number for the default, Ulli thinks it's good
+        self._selection_params = {"num_of_feat": 7, "c": 0.1, "max_loss": 1.0}
+        self._feature_costs = None  # seconds per megavoxel for each (feature, scale), measured on demand
         self._selection_method = "None"
         self._gui_initialized = False  #  is set to true once gui is initialized, prevents multiple initialization
         self._feature_selection_results = []
@@ -162,6 +179,7 @@ class FeatureSelectionDialog(QtWidgets.QDialog):
         # set default parameter values
         self.number_of_feat_box.setValue(self._selection_params["num_of_feat"])
         self.spinbox_c_widget.setValue(self._selection_params["c"])
+        self.spinbox_max_loss.setValue(self._selection_params["max_loss"])
 
         # connect functionality
         self.cancel_button.clicked.connect(self.reject)
@@ -169,6 +187,7 @@ class FeatureSelectionDialog(QtWidgets.QDialog):
         self.select_method_cbox.currentIndexChanged.connect(self._handle_selected_method_changed)
         self.spinbox_c_widget.valueChanged.connect(self._update_parameters)
         self.number_of_feat_box.valueChanged.connect(self._update_parameters)
+        self.spinbox_max_loss.valueChanged.connect(self._update_parameters)
         self.run_button.clicked.connect(self._run_selection)
         self.all_feature_sets_combo_box.currentIndexChanged.connect(self._handle_selected_feature_set_changed)
 
@@ -261,6 +280,7 @@ class FeatureSelectionDialog(QtWidgets.QDialog):
         self._initialized_all_features_segmentation_layer = False
         self._initialized_current_features_segmentation_layer = False
         self._initialized_feature_matrix = False
+        self._feature_costs = None
         # self.all_feature_sets_combo_box.resetInputContext()
         self._selected_feature_set_id = None
 
@@ -291,6 +311,7 @@ class FeatureSelectionDialog(QtWidgets.QDialog):
             self.select_method_cbox.addItem("Gini Importance (quick & dirty)")
             self.select_method_cbox.addItem("Filter Method (recommended)")
             self.select_method_cbox.addItem("Wrapper Method (slow but good)")
+            self.select_method_cbox.addItem("Cost-aware (fastest prediction)")
             self.select_method_cbox.setCurrentIndex(1)
 
             # number of selected features
@@ -323,6 +344,21 @@ class FeatureSelectionDialog(QtWidgets.QDialog):
 
             self.c_widget.setLayout(c_widget_layout)
 
+            # accuracy loss bound for the cost-aware selection
+            # create a widget containing 2 child widgets in a horizontal layout
+            # child widgets: QLabel for text and QDoubleSpinBox for the acceptable increase of the oob error (in %)
+            self.max_loss_widget = QtWidgets.QWidget()
+
+            text_max_loss = QtWidgets.QLabel("Max. Accuracy Loss (%)")
+            self.spinbox_max_loss = QtWidgets.QDoubleSpinBox()
+            self.spinbox_max_loss.setSingleStep(0.5)
+
+            max_loss_layout = QtWidgets.QHBoxLayout()
+            max_loss_layout.addWidget(text_max_loss)
+            max_loss_layout.addWidget(self.spinbox_max_loss)
+
+            self.max_loss_widget.setLayout(max_loss_layout)
+
             # run button
             self.run_button = QtWidgets.QPushButton("Run Feature Selection")
 
@@ -333,7 +369,9 @@ class FeatureSelectionDialog(QtWidgets.QDialog):
                 "<html><b>1) Choose the feature selection method</b><br>"
                 + "- Gini Importance: inaccurate but fast<br>"
                 + "- Filter Method: recommended<br>"
-                + "- Wrapper Method: slow but provides the best results<br><br>"
+                + "- Wrapper Method: slow but provides the best results<br>"
+                + "- Cost-aware: measures the computation time of each feature on your data and selects the cheapest"
+                + " feature set whose oob error is at most <u>Max. Accuracy Loss</u> above that of all features<br><br>"
                 + "<b>2) Choose the parameters</b><br>"
                 + "- choose <u>number of features</u>: more features need more time and RAM, but provide better results."
                 + " To select the number of features <u>automatically</u>, set this number to 0 (selection will take a while).<br><br>"
@@ -348,7 +386,8 @@ class FeatureSelectionDialog(QtWidgets.QDialog):
                 "<br>"
                 + "<b>Explanations:</b><br>"
                 + "<u>oob</u>: out of bag error (in &#37;), lower is better<br>"
-                + "feature <u>computation time</u> is shown in seconds<br><br>"
+                + "feature <u>computation time</u> is shown in seconds<br>"
+                + "<u>projected throughput</u>: headless feature computation speed in megavoxels per second<br><br>"
                 + "If the segmentation (shown in the viewer) differs a lot between the feature sets and the reference (usualls all features), but the oob values are similar then this is an indication that you should place more labels, especially in the regions where there were differences. Return to the feature selection once you added more labels</html>"
             )
 
@@ -357,6 +396,7 @@ class FeatureSelectionDialog(QtWidgets.QDialog):
             left_side_layout.addWidget(self.select_method_cbox)
             left_side_layout.addWidget(self.number_of_features_selection_widget)
             left_side_layout.addWidget(self.c_widget)
+            left_side_layout.addWidget(self.max_loss_widget)
             left_side_layout.addWidget(self.run_button)
             left_side_layout.addWidget(text_box)
             left_side_layout.setStretchFactor(text_box, 1)
@@ -510,6 +550,7 @@ class FeatureSelectionDialog(QtWidgets.QDialog):
     def _update_parameters(self):
         self._selection_params["num_of_feat"] = self.number_of_feat_box.value()
         self._selection_params["c"] = self.spinbox_c_widget.value()
+        self._selection_params["max_loss"] = self.spinbox_max_loss.value()
         self._update_gui()
 
     def _update_gui(self):
@@ -517,14 +558,19 @@ class FeatureSelectionDialog(QtWidgets.QDialog):
         Depending on feature selection method and the number of features in the set some GUI elements are
         enabled/disabled
         """
+        self.max_loss_widget.setEnabled(False)
         if (self.select_method_cbox.currentIndex() == 0) | (self.select_method_cbox.currentIndex() == 1):
             self.c_widget.setEnabled(False)
             self.number_of_features_selection_widget.setEnabled(True)
-        else:
+            if self.number_of_feat_box.value() == 0:
+                self.c_widget.setEnabled(True)
+        elif self.select_method_cbox.currentIndex() == 2:
             self.c_widget.setEnabled(True)
             self.number_of_features_selection_widget.setEnabled(False)
-        if self.number_of_feat_box.value() == 0:
-            self.c_widget.setEnabled(True)
+        else:
+            self.c_widget.setEnabled(False)
+            self.number_of_features_selection_widget.setEnabled(False)
+            self.max_loss_widget.setEnabled(True)
 
     def _add_segmentation_layer(self, data, name=None, visible=False):
         """
@@ -729,42 +775,144 @@ class FeatureSelectionDialog(QtWidgets.QDialog):
 
     def _auto_select_num_features(self, feature_order):
         """
-        Determines the optimal number of features. This is achieved by sequentially adding features from the
-        feature_order to the list and comparing the accuracies achieved with the growing feature sets. These accuracies
-        are penalized by the feature set size ('accuracy - size trade-off' from GUI) to prevent the set size from
-        becoming too large with too little accuracy benefit
+        Determines the optimal number of features. This is achieved by adding features from the feature_order to the
+        list and comparing the accuracies achieved with the growing feature sets. These accuracies are penalized by
+        the feature set size ('accuracy - size trade-off' from GUI) to prevent the set size from becoming too large
+        with too little accuracy benefit. The sizes are evaluated in the background (see FeatureSetSizeEvaluator),
+        while a progress dialog is shown. If the user cancels, the best size found so far is used.
         ToDO: This should actually use the opTrain of Ilastik
 
         :param feature_order: ordered list of feature IDs
         :return: optimal number of selected features
         """
+        evaluator = FeatureSetSizeEvaluator(
+            self.featureLabelMatrix_all_features[:, 1:],
+            self.featureLabelMatrix_all_features[:, 0],
+            complexity_penalty=self._selection_params["c"],
+            max_workers=max(1, Request.global_thread_pool.num_workers),
+        )
+        return self._run_with_progress_dialog(
+            "Determining the number of features...", evaluator, partial(evaluator.run, feature_order)
+        )
+
+    def _run_with_progress_dialog(self, text, evaluator, func):
+        """
+        Runs func in a background request and shows the progress of the evaluator until it is done.
+        The cancel button of the dialog cancels the evaluator.
+        Returns the result of func (or raises its exception).
+        """
+        progress_dialog = QtWidgets.QProgressDialog(text, "Cancel", 0, 100, self)
+        progress_dialog.setWindowModality(QtCore.Qt.WindowModal)
+        progress_dialog.setMinimumDuration(0)
+        progress_dialog.setAutoClose(False)
+        progress_dialog.setAutoReset(False)
+        progress_dialog.canceled.connect(evaluator.cancel)
+
+        timer = QtCore.QTimer(progress_dialog)
+        timer.timeout.connect(lambda: progress_dialog.setValue(int(100 * evaluator.progress)))
+        timer.start(100)
+
+        def close_progress_dialog(*args):
+            QtWidgets.QApplication.postEvent(progress_dialog, QCloseEvent())
+
+        req = Request(func)
+        req.notify_finished(close_progress_dialog)
+        req.notify_failed(close_progress_dialog)
+        req.submit()
+
+        # the wait cursor would hide that the dialog can be cancelled
+        QtWidgets.QApplication.instance().restoreOverrideCursor()
+        progress_dialog.exec_()
+        timer.stop()
+        QtWidgets.QApplication.instance().setOverrideCursor(QCursor(QtCore.Qt.WaitCursor))
+        return req.wait()
+
+    def _measure_feature_costs(self, feature_matrix):
+        """
+        Measures the computation time of the features in feature_matrix (seconds per megavoxel) on the data around the
+        currently displayed slice. For 3D data, a slab of slices is used, so that the cost of the 3D filters is
+        measured. The costs are measured only once each time the FeatureSelectionDialog is opened.
+
+        :param feature_matrix: boolean feature matrix as in opFeatureSelection.SelectionMatrix
+        :return: cost matrix with the shape of the feature matrix
+        """
+        if self._feature_costs is None:
+            axistags = self.opFeatureSelection.InputImage.meta.axistags
+            shape = self.opFeatureSelection.InputImage.meta.shape
+
+            # a small piece around the center of the displayed region is enough
+            bbox = dict(self._bbox)
+            bbox["c"] = [0, 1]
+            for key, half_size in (("x", 128), ("y", 128), ("z", 8)):
+                if key not in axistags:
+                    continue
+                center = (bbox[key][0] + bbox[key][1]) // 2 if key != "z" else self._xysliceID
+                size = shape[axistags.index(key)]
+                bbox[key] = [max(0, center - half_size), min(size, center + half_size)]
+
+            slicing = [slice(bbox[ai.key][0], bbox[ai.key][1]) for ai in axistags]
+            data = self.opPixelClassification.InputImages[slicing].wait()
+            spatial_shape = [data.shape[i] for i, ai in enumerate(axistags) if ai.key in "zyx" and data.shape[i] > 1]
+            num_channels = shape[axistags.index("c")] if "c" in axistags else 1
+
+            self._feature_costs = featureCost.measure_feature_costs(
+                data.reshape(spatial_shape),
+                self.opFeatureSelection.FeatureIds.value,
+                self.opFeatureSelection.Scales.value,
+                num_channels,
+                mask=feature_matrix,
+            )
+        return self._feature_costs
+
+    def _cost_aware_selection(self, feature_matrix):
+        """
+        Selects the feature set that is cheapest to compute, among the sets whose out of bag error is at most
+        'Max. Accuracy Loss' percentage points above the out of bag error achieved with all features.
+        Candidate sets are the best features ranked by their gini importance, and by their importance per cost.
+
+        :param feature_matrix: boolean feature matrix of all features the selection can choose from
+        :return: selected feature ids, projected headless throughput of the feature computation (in Mvox/s)
+        """
         from sklearn.ensemble import RandomForestClassifier
-        from ilastik_feature_selection.wrapper_feature_selection import EvaluationFunction
 
-        feature_order = numpy.array(feature_order)
+        entry_costs = self._measure_feature_costs(feature_matrix).ravel()
+        channel_entries = numpy.array(
+            [
+                numpy.flatnonzero(self._convert_featureIDs_to_featureMatrix([feature_id]))[0]
+                for feature_id in range(self.n_features)
+            ]
+        )
 
-        rf = RandomForestClassifier(n_jobs=-1, n_estimators=255)
-        ev_func = EvaluationFunction(rf, complexity_penalty=self._selection_params["c"])
-        n_select = 1
-        overshoot = 0
-        score = 0.0
         X = self.featureLabelMatrix_all_features[:, 1:]
         Y = self.featureLabelMatrix_all_features[:, 0]
-        n_select_opt = n_select
-
-        while (overshoot < 3) & (n_select < self.n_features):
-            score_old = score
-            score = ev_func.evaluate_feature_set_size_penalty(X, Y, None, feature_order[:n_select])
-
-            if score > score_old:
-                n_select_opt = n_select
-                overshoot = 0
-            else:
-                overshoot += 1
 
-            n_select += 1
+        def oob_error(feature_ids):
+            rf = RandomForestClassifier(n_jobs=-1, n_estimators=100, oob_score=True)
+            rf.fit(X[:, feature_ids], Y)
+            return 100.0 * (1.0 - rf.oob_score_)
+
+        rf = RandomForestClassifier(n_jobs=-1, n_estimators=100, oob_score=True)
+        rf.fit(X, Y)
+        reference_error = 100.0 * (1.0 - rf.oob_score_)
+        importance = rf.feature_importances_
+
+        # vector-valued features (e.g. Hessian eigenvalues) share their cost among their channels
+        channels_per_entry = numpy.bincount(channel_entries, minlength=entry_costs.size)
+        channel_costs = entry_costs[channel_entries] / channels_per_entry[channel_entries]
+        candidate_orders = [
+            numpy.argsort(-importance),
+            numpy.argsort(-importance / numpy.maximum(channel_costs, 1e-9)),
+        ]
 
-        return n_select_opt
+        selection = featureCost.select_cheapest_feature_set(
+            candidate_orders,
+            channel_entries,
+            entry_costs,
+            oob_error,
+            reference_error + self._selection_params["max_loss"],
+        )
+        throughput = featureCost.projected_throughput(selection.cost, Request.global_thread_pool.num_workers)
+        return selection.feature_ids, throughput
 
     def _run_selection(self):
         QtWidgets.QApplication.instance().setOverrideCursor(QCursor(QtCore.Qt.WaitCursor))
@@ -834,6 +982,7 @@ class FeatureSelectionDialog(QtWidgets.QDialog):
             self._initialized_all_features_segmentation_layer = True
 
         # run feature selection using the chosen parameters
+        throughput = None
         if self._selection_method == "gini":
             if self._selection_params["num_of_feat"] == 0:
                 self.opGiniFeatureSelection.NumberOfSelectedFeatures.setValue(self.n_features)
@@ -864,9 +1013,11 @@ class FeatureSelectionDialog(QtWidgets.QDialog):
                     numpy.min([self._selection_params["num_of_feat"], self.n_features])
                 )
                 selected_feature_ids = self.opFilterFeatureSelection.SelectedFeatureIDs.value
-        else:
+        elif self._selection_method == "wrapper":
             self.opWrapperFeatureSelection.ComplexityPenalty.setValue(self._selection_params["c"])
             selected_feature_ids = self.opWrapperFeatureSelection.SelectedFeatureIDs.value
+        else:
+            selected_feature_ids, throughput = self._cost_aware_selection(all_features_active_matrix)
 
         # create a new layer for display in the volumina viewer
         # make sure to save the feature matrix used to obtain it
@@ -881,6 +1032,7 @@ class FeatureSelectionDialog(QtWidgets.QDialog):
             self._selection_method,
             oob_err=new_oob,
             feature_calc_time=new_time,
+            throughput=throughput,
         )
         self._add_feature_set_to_results(new_feature_selection_result)
 
@@ -0,0 +1,141 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2020, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+"""
+Helpers for the cost-aware mode of the FeatureSelectionDialog: measure how long each pixel feature takes to
+compute on the user's data, and find the cheapest feature set whose accuracy stays within a given bound.
+"""
+import collections
+import logging
+import time
+
+import numpy
+import vigra
+
+from ilastik.utility.simple_predict import FilterSpec, compute_features
+
+logger = logging.getLogger(__name__)
+
+CostAwareSelection = collections.namedtuple("CostAwareSelection", "feature_ids cost error")
+
+
+def measure_feature_costs(sample, feature_ids, scales, num_channels=1, mask=None):
+    """
+    Measures the computation time of every (feature, scale) combination on a sample of the data.
+
+    :param sample: spatial numpy array (2D or 3D, without channel axis), a representative piece of the input data
+    :param feature_ids: feature names as in opFeatureSelection.FeatureIds (rows of the selection matrix)
+    :param scales: scales as in opFeatureSelection.Scales (columns of the selection matrix)
+    :param num_channels: number of channels of the input data, features are computed for each of them
+    :param mask: optional boolean array like the selection matrix, only the costs of the True entries are measured
+    :return: array of shape (len(feature_ids), len(scales)) with the computation time in seconds per megavoxel
+    """
+    sample = numpy.asarray(sample, dtype=numpy.float32)
+    axes = "zyx"[-sample.ndim :]
+    num_megavoxels = sample.size / 1e6
+
+    if mask is not None:
+        mask = numpy.asarray(mask, dtype=bool)
+
+    costs = numpy.zeros((len(feature_ids), len(scales)), dtype=numpy.float64)
+    for col, scale in enumerate(scales):
+        if mask is not None and not mask[:, col].any():
+            continue
+
+        # Pad the sample, so that the filter kernels fit, and only compute the features for the original region
+        halo = int(numpy.ceil(4.5 * scale)) + 1
+        padded = numpy.pad(sample, halo, mode="symmetric")
+        padded = vigra.taggedView(padded, axes)
+        roi = ((halo,) * sample.ndim, tuple(halo + s for s in sample.shape))
+
+        for row, feature_id in enumerate(feature_ids):
+            if mask is not None and not mask[row, col]:
+                continue
+            start = time.perf_counter()
+            compute_features(padded, [FilterSpec(feature_id, scale)], roi=roi)
+            costs[row, col] = (time.perf_counter() - start) * num_channels / num_megavoxels
+            logger.debug(f"{feature_id} (scale {scale}): {costs[row, col]:.3f} s/Mvox")
+    return costs
+
+
+def feature_set_cost(feature_ids, channel_entries, entry_costs):
+    """
+    Computation cost of a set of feature channels.
+
+    Vector-valued features (e.g. Hessian eigenvalues) provide several channels, but have to be computed only once.
+
+    :param feature_ids: selected feature channel ids
+    :param channel_entries: for every feature channel, the flat index of its (feature, scale) entry in entry_costs
+    :param entry_costs: flat array with the cost of every (feature, scale) combination
+    """
+    entries = numpy.unique(numpy.asarray(channel_entries)[numpy.asarray(feature_ids, dtype=int)])
+    return float(numpy.sum(numpy.asarray(entry_costs)[entries]))
+
+
+def select_cheapest_feature_set(candidate_orders, channel_entries, entry_costs, evaluate, max_error):
+    """
+    Finds the cheapest feature set whose error is at most max_error.
+
+    For every ranking of the features in candidate_orders, the shortest prefix that reaches max_error is a
+    candidate, and the cheapest of these candidates is returned. Prefixes that are already more expensive than the
+    best candidate found so far are not evaluated.
+
+    :param candidate_orders: list of feature channel id rankings, e.g. by importance and by importance per cost
+    :param evaluate: function that returns the error for a list of feature channel ids
+    :param max_error: largest acceptable error
+    :return: CostAwareSelection; all features of the first ranking if no prefix is accurate enough
+    """
+    errors = {}
+
+    def cached_evaluate(feature_ids):
+        key = tuple(sorted(feature_ids))
+        if key not in errors:
+            errors[key] = evaluate(list(feature_ids))
+        return errors[key]
+
+    best = None
+    for order in candidate_orders:
+        order = list(order)
+        for n_select in range(1, len(order) + 1):
+            feature_ids = order[:n_select]
+            cost = feature_set_cost(feature_ids, channel_entries, entry_costs)
+            if best is not None and cost >= best.cost:
+                break
+            error = cached_evaluate(feature_ids)
+            if error <= max_error:
+                best = CostAwareSelection(feature_ids, cost, error)
+                break
+
+    if best is None:
+        feature_ids = list(candidate_orders[0])
+        best = CostAwareSelection(
+            feature_ids, feature_set_cost(feature_ids, channel_entries, entry_costs), cached_evaluate(feature_ids)
+        )
+    return best
+
+
+def projected_throughput(cost_per_megavoxel, num_workers=1):
+    """
+    Projected feature computation throughput in megavoxels per second, for a feature set with the given cost,
+    when blocks are processed by num_workers threads in parallel.
+    """
+    if cost_per_megavoxel <= 0:
+        return float("inf")
+    return max(1, num_workers) / cost_per_megavoxel
@@ -0,0 +1,157 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2020, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+"""
+Evaluation engine for the automatic feature set sizing of the FeatureSelectionDialog.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+logger = logging.getLogger(__name__)
+
+
+def stratified_subsample(labels, max_samples, random_state=None):
+    """
+    Chooses at most max_samples indices into labels, keeping the class proportions.
+    Rare classes keep at least min(class size, 50) samples, so that they do not vanish from the subsample.
+
+    :return: sorted index array (all indices if there are no more than max_samples labels)
+    """
+    labels = numpy.asarray(labels)
+    if len(labels) <= max_samples:
+        return numpy.arange(len(labels))
+
+    rng = numpy.random.RandomState(random_state)
+    classes, class_counts = numpy.unique(labels, return_counts=True)
+    selected = []
+    for label_class, count in zip(classes, class_counts):
+        n_samples = max(min(count, 50), int(round(max_samples * count / len(labels))))
+        class_indices = numpy.flatnonzero(labels == label_class)
+        selected.append(rng.choice(class_indices, size=min(count, n_samples), replace=False))
+    return numpy.sort(numpy.concatenate(selected))
+
+
+class FeatureSetSizeEvaluator(object):
+    """
+    Determines the best number of features for a ranked feature order, i.e. the prefix length with the best out of
+    bag accuracy, penalized by the feature set size (accuracy - complexity_penalty * n_selected / n_features).
+
+    - the labels are subsampled (stratified by class) to at most max_samples
+    - candidate sizes are evaluated concurrently by at most max_workers random forests
+    - every forest grows in stages (see TREE_STAGES) and stops growing as soon as its out of bag estimate changes
+      by less than oob_tolerance, i.e. the estimate of the smaller forest is reused if it is stable
+    - the search stops early if the best score has not improved for `patience` consecutive sizes
+    - cancel() (e.g. from another thread) stops the search, run() then returns the best size found so far
+    """
+
+    TREE_STAGES = (32, 64, 128, 255)
+
+    def __init__(
+        self,
+        X,
+        Y,
+        complexity_penalty,
+        max_samples=50000,
+        max_workers=None,
+        patience=3,
+        oob_tolerance=0.005,
+        random_state=0,
+    ):
+        indices = stratified_subsample(Y, max_samples, random_state)
+        self._X = numpy.ascontiguousarray(X[indices])
+        self._Y = numpy.asarray(Y)[indices]
+        self._n_features = X.shape[1]
+        self._complexity_penalty = complexity_penalty
+        self._max_workers = max_workers or os.cpu_count() or 1
+        self._patience = patience
+        self._oob_tolerance = oob_tolerance
+        self._random_state = random_state
+        self._cancel_event = threading.Event()
+        self.progress = 0.0
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def evaluate(self, feature_ids):
+        """
+        :return: penalized out of bag accuracy of the given feature set, None if the evaluation was cancelled
+        """
+        from sklearn.ensemble import RandomForestClassifier
+
+        X = self._X[:, numpy.asarray(feature_ids)]
+        rf = RandomForestClassifier(warm_start=True, oob_score=True, n_jobs=1, random_state=self._random_state)
+        accuracy = None
+        for n_trees in self.TREE_STAGES:
+            if self.cancelled:
+                return None
+            previous_accuracy = accuracy
+            rf.set_params(n_estimators=n_trees)
+            rf.fit(X, self._Y)
+            accuracy = rf.oob_score_
+            if previous_accuracy is not None and abs(accuracy - previous_accuracy) < self._oob_tolerance:
+                break
+
+        logger.debug(f"{len(feature_ids)} features: oob accuracy {accuracy:.4f} with {rf.n_estimators} trees")
+        return accuracy - self._complexity_penalty * len(feature_ids) / self._n_features
+
+    def run(self, feature_order, progress_callback=None):
+        """
+        :param feature_order: ordered list of feature IDs
+        :param progress_callback: optional function that is called with the progress (0.0 to 1.0)
+        :return: optimal number of selected features
+        """
+        feature_order = numpy.asarray(feature_order)
+        sizes = list(range(1, len(feature_order)))
+        best_size, best_score = 1, -numpy.inf
+        overshoot = 0
+        self.progress = 0.0
+
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            for wave_start in range(0, len(sizes), self._max_workers):
+                wave = sizes[wave_start : wave_start + self._max_workers]
+                scores = list(executor.map(lambda n_select: self.evaluate(feature_order[:n_select]), wave))
+
+                for n_select, score in zip(wave, scores):
+                    if score is None:
+                        break
+                    if score > best_score:
+                        best_size, best_score = n_select, score
+                        overshoot = 0
+                    else:
+                        overshoot += 1
+                    if overshoot >= self._patience:
+                        break
+
+                self.progress = (wave_start + len(wave)) / len(sizes)
+                if progress_callback is not None:
+                    progress_callback(self.progress)
+                if self.cancelled or overshoot >= self._patience:
+                    break
+
+        self.progress = 1.0
+        return best_size
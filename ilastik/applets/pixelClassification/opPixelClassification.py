@@ -52,6 +52,7 @@ from lazyflow.classifiers import ParallelVigraRfLazyflowClassifierFactory
 from ilastik.applets.base.applet import DatasetConstraintError
 from ilastik.utility.operatorSubView import OperatorSubView
 from ilastik.utility import OpMultiLaneWrapper
+from ilastik.utility.opSharedResultBuffer import OpSharedResultBuffer
 from ilastik.utility.slottools import DtypeConvertFunction
 
 # from PyQt5.QtCore import pyqtRemoveInputHook, pyqtRestoreInputHook
@@ -78,6 +79,7 @@ class OpPixelClassification(Operator):
     CachedFeatureImages = InputSlot(level=1)  # Cached feature data.
 
     FreezePredictions = InputSlot(stype="bool")
+    SharedResultCapacity = InputSlot(value=0)  # See OpPredictionPipelineNoCache.SharedResultCapacity
     ClassifierFactory = InputSlot(value=ParallelVigraRfLazyflowClassifierFactory(100))
 
     PredictionsFromDisk = InputSlot(optional=True, level=1)
@@ -175,6 +177,7 @@ class OpPixelClassification(Operator):
         self.opPredictionPipeline.CachedFeatureImages.connect(self.CachedFeatureImages)
         self.opPredictionPipeline.Classifier.connect(self.classifier_cache.Output)
         self.opPredictionPipeline.FreezePredictions.connect(self.FreezePredictions)
+        self.opPredictionPipeline.SharedResultCapacity.connect(self.SharedResultCapacity)
         self.opPredictionPipeline.PredictionsFromDisk.connect(self.PredictionsFromDisk)
         self.opPredictionPipeline.PredictionMask.connect(self.PredictionMasks)
 
@@ -461,6 +464,8 @@ class OpPredictionPipelineNoCache(Operator):
     Classifier = InputSlot()
     PredictionsFromDisk = InputSlot(optional=True)
     NumClasses = InputSlot()
+    # Number of recent prediction blocks that are shared between the headless outputs (see OpSharedResultBuffer)
+    SharedResultCapacity = InputSlot(value=0)
 
     HeadlessPredictionProbabilities = OutputSlot()  # drange is 0.0 to 1.0
     HeadlessUint8PredictionProbabilities = OutputSlot()  # drange 0 to 255
@@ -479,22 +484,28 @@ class OpPredictionPipelineNoCache(Operator):
         self.cacheless_predict.Image.connect(self.FeatureImages)  # <--- Not from cache
         self.cacheless_predict.LabelsCount.connect(self.NumClasses)
         self.cacheless_predict.PredictionMask.connect(self.PredictionMask)
-        self.HeadlessPredictionProbabilities.connect(self.cacheless_predict.PMaps)
+
+        # When several headless outputs are exported in one pass, they all request the same
+        #  prediction blocks. The buffer makes sure each block is predicted only once.
+        self.opSharedPMaps = OpSharedResultBuffer(parent=self)
+        self.opSharedPMaps.Input.connect(self.cacheless_predict.PMaps)
+        self.opSharedPMaps.Capacity.connect(self.SharedResultCapacity)
+        self.HeadlessPredictionProbabilities.connect(self.opSharedPMaps.Output)
 
         # Alternate headless output: uint8 instead of float.
         # Note that drange is automatically updated.
         self.opConvertToUint8 = OpPixelOperator(parent=self)
-        self.opConvertToUint8.Input.connect(self.cacheless_predict.PMaps)
+        self.opConvertToUint8.Input.connect(self.opSharedPMaps.Output)
         self.opConvertToUint8.Function.setValue(lambda a: (255 * a).astype(numpy.uint8))
         self.HeadlessUint8PredictionProbabilities.connect(self.opConvertToUint8.Output)
 
         self.opArgmaxChannel = OpArgmaxChannel(parent=self)
-        self.opArgmaxChannel.Input.connect(self.cacheless_predict.PMaps)
+        self.opArgmaxChannel.Input.connect(self.opSharedPMaps.Output)
         self.SimpleSegmentation.connect(self.opArgmaxChannel.Output)
 
         # Create a layer for uncertainty estimate
         self.opUncertaintyEstimator = OpEnsembleMargin(parent=self)
-        self.opUncertaintyEstimator.Input.connect(self.cacheless_predict.PMaps)
+        self.opUncertaintyEstimator.Input.connect(self.opSharedPMaps.Output)
         self.HeadlessUncertaintyEstimate.connect(self.opUncertaintyEstimator.Output)
 
     def setupOutputs(self):
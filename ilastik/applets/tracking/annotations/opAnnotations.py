@@ -20,13 +20,13 @@
 ###############################################################################
 from builtins import range
 from ilastik.applets.base.applet import DatasetConstraintError
+from ilastik.applets.tracking.base.trackLabelLookup import TrackLabelLookup
 
 from lazyflow.graph import Operator, InputSlot, OutputSlot
 from lazyflow.rtype import List, SubRegion
 from lazyflow.stype import Opaque
 
 import numpy as np
-import vigra
 
 import logging
 
@@ -76,6 +76,11 @@ class OpAnnotations(Operator):
         self.appearances = {}
         self.disappearances = {}
 
+        self._trackLookup = TrackLabelLookup()
+        self.TrackImage.notifyDirty(self._onAnnotationsDirty)
+        self.UntrackedImage.notifyDirty(self._onAnnotationsDirty)
+        self.Labels.notifyDirty(self._onAnnotationsDirty)
+
         self.Annotations.setValue(dict())
         self.Labels.setValue({})
         self.Divisions.setValue({})
@@ -168,22 +173,16 @@ class OpAnnotations(Operator):
             for t in list(self.labels.keys()):
                 result[t] = self.labels[t]
 
-        elif slot is self.TrackImage:
-            for t in range(roi.start[0], roi.stop[0]):
-                if t not in list(self.labels.keys()):
-                    result[t - roi.start[0], ...][:] = 0
-                    return result
-
-                result[t - roi.start[0], ...] = self.LabelImage.get(roi).wait()[t - roi.start[0], ...]
-                result[t - roi.start[0], ..., 0] = self._relabel(result[t - roi.start[0], ..., 0], self.labels[t])
-
-        elif slot is self.UntrackedImage:
+        elif slot is self.TrackImage or slot is self.UntrackedImage:
+            if slot is self.TrackImage:
+                relabel = self._trackLookup.track_image
+            else:
+                relabel = self._trackLookup.untracked_image
+            labelImage = self.LabelImage.get(roi).wait()
             for t in range(roi.start[0], roi.stop[0]):
-                result[t - roi.start[0], ...] = self.LabelImage.get(roi).wait()[t - roi.start[0], ...]
-                labels_at = {}
-                if t in list(self.labels.keys()):
-                    labels_at = self.labels[t]
-                result[t - roi.start[0], ..., 0] = self._relabelUntracked(result[t - roi.start[0], ..., 0], labels_at)
+                frame = labelImage[t - roi.start[0], ...]
+                result[t - roi.start[0], ...] = frame
+                result[t - roi.start[0], ..., 0] = relabel(t, self.labels.get(t, {}), frame[..., 0])
 
         if slot.name == "Annotations":
             annotations = self.Annotations[key].wait()
@@ -199,6 +198,7 @@ class OpAnnotations(Operator):
 
     def propagateDirty(self, slot, subindex, roi):
         if slot == self.LabelImage:
+            self._trackLookup.invalidate()
             self.labels = {}
             self.divisions = {}
             self.appearances = {}
@@ -218,31 +218,15 @@ class OpAnnotations(Operator):
         #     self.Divisions.setDirty( slice(None) )
         #     self.Annotations.setDirty( slice(None) )
 
-    def _relabel(self, volume, replace):
-        mp = np.arange(0, np.amax(volume) + 1, dtype=volume.dtype)
-        mp[1:] = 0
-        labels = np.sort(vigra.analysis.unique(volume)).tolist()
-        if 0 in labels:
-            labels.remove(0)
-        for label in labels:
-            if label in replace and len(replace[label]) > 0:
-                l = list(replace[label])[-1]
-                if l == -1:
-                    mp[label] = 2 ** 16 - 1
-                else:
-                    mp[label] = l
-        return mp[volume]
-
-    def _relabelUntracked(self, volume, tracked_at):
-        mp = np.arange(0, np.amax(volume) + 1, dtype=volume.dtype)
-        mp[1:] = 1
-        labels = np.sort(vigra.analysis.unique(volume)).tolist()
-        if 0 in labels:
-            labels.remove(0)
-        for label in labels:
-            if (label in list(tracked_at.keys())) and (len(tracked_at[label]) > 0):
-                mp[label] = 0
-        return mp[volume]
+    def _onAnnotationsDirty(self, slot, roi):
+        """
+        The annotation views are dirtied whenever the annotations of some frames change,
+        so the lookup tables of these frames have to be rebuilt.
+        """
+        if slot is self.Labels:
+            self._trackLookup.invalidate()
+        else:
+            self._trackLookup.invalidate(list(range(roi.start[0], roi.stop[0])))
 
     def _getObjects(self, trange, misdet_idx):
         filtered_labels = {}
@@ -0,0 +1,89 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2020, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+import threading
+
+import numpy as np
+
+
+class TrackLabelLookup(object):
+    """
+    Per-frame lookup tables that map object labels to what the annotation views display:
+    the (last) track id of an object for the track image, and 1 for objects without a track for the
+    untracked image.
+
+    The tables are built from the operator's ``labels[t]`` dict ({oid: set of track ids}) the first time a frame
+    is displayed, so rendering a tile is a single fancy-index over the label data. They must be invalidated
+    whenever the annotations of a frame change; the operators do that whenever their image outputs are dirtied.
+    A frame is also rebuilt if its annotation dict was replaced by a new object.
+    """
+
+    #: Displayed for objects marked as misdetections (track id -1)
+    MISDETECTION_VALUE = 2 ** 16 - 1
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tables = {}  # t -> (annotations dict the tables were built from, track table, untracked table)
+
+    def invalidate(self, timesteps=None):
+        with self._lock:
+            if timesteps is None:
+                self._tables.clear()
+            else:
+                for t in timesteps:
+                    self._tables.pop(t, None)
+
+    def _get_tables(self, t, labels_at, max_label):
+        with self._lock:
+            entry = self._tables.get(t)
+            if entry is None or entry[0] is not labels_at or len(entry[1]) <= max_label:
+                entry = (labels_at,) + self._build_tables(labels_at, max_label)
+                self._tables[t] = entry
+            return entry[1], entry[2]
+
+    def _build_tables(self, labels_at, max_label):
+        size = max([max_label] + [oid for oid in labels_at.keys()]) + 1
+        track_table = np.zeros(size, dtype=np.int64)
+        untracked_table = np.ones(size, dtype=np.int64)
+        untracked_table[0] = 0
+        for oid, tracks in labels_at.items():
+            if len(tracks) > 0:
+                track = list(tracks)[-1]
+                track_table[oid] = self.MISDETECTION_VALUE if track == -1 else track
+                untracked_table[oid] = 0
+        return track_table, untracked_table
+
+    def track_image(self, t, labels_at, volume):
+        """
+        Relabel objects in ``volume`` (labels of frame t) with their track id, 0 for objects without track.
+        """
+        if not labels_at:
+            return np.zeros_like(volume)
+        track_table, _ = self._get_tables(t, labels_at, int(volume.max()) if volume.size else 0)
+        return track_table[volume].astype(volume.dtype, copy=False)
+
+    def untracked_image(self, t, labels_at, volume):
+        """
+        Mark objects in ``volume`` (labels of frame t) that don't belong to a track with 1, everything else with 0.
+        """
+        if not labels_at:
+            return (volume != 0).astype(volume.dtype)
+        _, untracked_table = self._get_tables(t, labels_at, int(volume.max()) if volume.size else 0)
+        return untracked_table[volume].astype(volume.dtype, copy=False)
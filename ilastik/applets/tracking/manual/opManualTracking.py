@@ -20,6 +20,7 @@
 ###############################################################################
 from builtins import range
 from ilastik.applets.base.applet import DatasetConstraintError
+from ilastik.applets.tracking.base.trackLabelLookup import TrackLabelLookup
 from ilastik.utility.exportingOperator import ExportingOperator
 from ilastik.utility.exportFile import objects_per_frame, ExportFile, ilastik_ids, Mode, Default
 from operator import itemgetter
@@ -31,7 +32,6 @@ from lazyflow.rtype import List, SubRegion
 from lazyflow.stype import Opaque
 
 import numpy as np
-import vigra
 
 import os
 import logging
@@ -73,6 +73,11 @@ class OpManualTracking(Operator, ExportingOperator):
         self.labels = {}
         self.divisions = {}
 
+        self._trackLookup = TrackLabelLookup()
+        self.TrackImage.notifyDirty(self._onAnnotationsDirty)
+        self.UntrackedImage.notifyDirty(self._onAnnotationsDirty)
+        self.Labels.notifyDirty(self._onAnnotationsDirty)
+
         # As soon as input data is available, check its constraints
         self.RawImage.notifyReady(self._checkConstraints)
         self.BinaryImage.notifyReady(self._checkConstraints)
@@ -132,55 +137,34 @@ class OpManualTracking(Operator, ExportingOperator):
             for t in list(self.labels.keys()):
                 result[t] = self.labels[t]
 
-        elif slot is self.TrackImage:
-            for t in range(roi.start[0], roi.stop[0]):
-                if t not in list(self.labels.keys()):
-                    result[t - roi.start[0], ...][:] = 0
-                    return result
-
-                result[t - roi.start[0], ...] = self.LabelImage.get(roi).wait()[t - roi.start[0], ...]
-                result[t - roi.start[0], ..., 0] = self._relabel(result[t - roi.start[0], ..., 0], self.labels[t])
-
-        elif slot is self.UntrackedImage:
+        elif slot is self.TrackImage or slot is self.UntrackedImage:
+            if slot is self.TrackImage:
+                relabel = self._trackLookup.track_image
+            else:
+                relabel = self._trackLookup.untracked_image
+            labelImage = self.LabelImage.get(roi).wait()
             for t in range(roi.start[0], roi.stop[0]):
-                result[t - roi.start[0], ...] = self.LabelImage.get(roi).wait()[t - roi.start[0], ...]
-                labels_at = {}
-                if t in list(self.labels.keys()):
-                    labels_at = self.labels[t]
-                result[t - roi.start[0], ..., 0] = self._relabelUntracked(result[t - roi.start[0], ..., 0], labels_at)
+                frame = labelImage[t - roi.start[0], ...]
+                result[t - roi.start[0], ...] = frame
+                result[t - roi.start[0], ..., 0] = relabel(t, self.labels.get(t, {}), frame[..., 0])
 
         return result
 
     def propagateDirty(self, inputSlot, subindex, roi):
         if inputSlot == self.LabelImage:
+            self._trackLookup.invalidate()
             self.labels = {}
             self.divisions = {}
 
-    def _relabel(self, volume, replace):
-        mp = np.arange(0, np.amax(volume) + 1, dtype=volume.dtype)
-        mp[1:] = 0
-        labels = np.sort(vigra.analysis.unique(volume)).tolist()
-        if 0 in labels:
-            labels.remove(0)
-        for label in labels:
-            if label in replace and len(replace[label]) > 0:
-                l = list(replace[label])[-1]
-                if l == -1:
-                    mp[label] = 2 ** 16 - 1
-                else:
-                    mp[label] = l
-        return mp[volume]
-
-    def _relabelUntracked(self, volume, tracked_at):
-        mp = np.arange(0, np.amax(volume) + 1, dtype=volume.dtype)
-        mp[1:] = 1
-        labels = np.sort(vigra.analysis.unique(volume)).tolist()
-        if 0 in labels:
-            labels.remove(0)
-        for label in labels:
-            if (label in list(tracked_at.keys())) and (len(tracked_at[label]) > 0):
-                mp[label] = 0
-        return mp[volume]
+    def _onAnnotationsDirty(self, slot, roi):
+        """
+        The annotation views are dirtied whenever the annotations of some frames change,
+        so the lookup tables of these frames have to be rebuilt.
+        """
+        if slot is self.Labels:
+            self._trackLookup.invalidate()
+        else:
+            self._trackLookup.invalidate(list(range(roi.start[0], roi.stop[0])))
 
     def _getObjects(self, trange, misdet_idx):
         filtered_labels = {}
@@ -0,0 +1,112 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2020, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+
+class AnnotationIndex(object):
+    """
+    Index over the tracking annotation labels {time: {label: set(tracks)}}, for lookups that do not have to scan
+    all frames:
+
+    - track -> list of (time, label) of all objects annotated with this track, sorted by time
+    - (time, label) -> set of tracks annotated on this object
+
+    Building the index takes linear time in the number of annotations. Edits can be applied with add() and remove().
+    """
+
+    def __init__(self, labels=None):
+        self.source = labels
+        self._objectsOfTrack = defaultdict(list)
+        self._tracksOfObject = {}
+        if labels:
+            for time in sorted(labels.keys()):
+                for label, tracks in labels[time].items():
+                    for track in tracks:
+                        self.add(time, label, track)
+
+    def add(self, time, label, track):
+        tracks = self._tracksOfObject.setdefault((time, label), set())
+        if track not in tracks:
+            tracks.add(track)
+            objects = self._objectsOfTrack[track]
+            if not objects or objects[-1] < (time, label):
+                objects.append((time, label))
+            else:
+                insort(objects, (time, label))
+
+    def remove(self, time, label, track):
+        tracks = self._tracksOfObject.get((time, label))
+        if tracks is None or track not in tracks:
+            return
+        tracks.remove(track)
+        if not tracks:
+            del self._tracksOfObject[(time, label)]
+        objects = self._objectsOfTrack[track]
+        objects.remove((time, label))
+        if not objects:
+            del self._objectsOfTrack[track]
+
+    def tracks(self, time, label):
+        """
+        Returns the set of tracks annotated on object label in frame time.
+        """
+        return frozenset(self._tracksOfObject.get((time, label), ()))
+
+    def objects(self, track):
+        """
+        Returns the (time, label) of all objects annotated with track, sorted by time.
+        """
+        return list(self._objectsOfTrack.get(track, ()))
+
+    def labels(self, time, track):
+        """
+        Returns the labels of the objects in frame time that are annotated with track.
+        """
+        objects = self._objectsOfTrack.get(track, ())
+        start = bisect_left(objects, (time,))
+        stop = bisect_left(objects, (time + 1,))
+        return [label for _, label in objects[start:stop]]
+
+    def label(self, time, track, default=None):
+        """
+        Returns the label of the object in frame time that is annotated with track only (not a merger).
+        """
+        for label in self.labels(time, track):
+            if self._tracksOfObject[(time, label)] == {track}:
+                return label
+        return default
+
+    def previous(self, track, time):
+        """
+        Returns (time, label) of the last object annotated with track before the given frame, or None.
+        """
+        objects = self._objectsOfTrack.get(track, ())
+        position = bisect_left(objects, (time,))
+        return objects[position - 1] if position > 0 else None
+
+    def next(self, track, time):
+        """
+        Returns (time, label) of the first object annotated with track after the given frame, or None.
+        """
+        objects = self._objectsOfTrack.get(track, ())
+        position = bisect_left(objects, (time + 1,))
+        return objects[position] if position < len(objects) else None
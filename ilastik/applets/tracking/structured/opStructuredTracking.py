@@ -11,6 +11,7 @@ from ilastik.utility import bind
 from ilastik.applets.tracking.conservation.opConservationTracking import OpConservationTracking
 from ilastik.applets.base.applet import DatasetConstraintError
 from ilastik.applets.objectExtraction.opObjectExtraction import default_features_key
+from ilastik.applets.tracking.structured.annotationIndex import AnnotationIndex
 
 from ilastik.utility.progress import DefaultProgressVisitor, CommandLineProgressVisitor
 
@@ -65,6 +66,8 @@ class OpStructuredTracking(OpConservationTracking):
         self.divisions = {}
         self.appearances = {}
         self.disappearances = {}
+        self._annotationIndex = None
+        self.Annotations.notifyDirty(bind(self._invalidateAnnotationIndex))
         self.Annotations.setValue({})
         self.Appearances.setValue({})
         self.Disappearances.setValue({})
@@ -94,6 +97,19 @@ class OpStructuredTracking(OpConservationTracking):
 
         self._solver = self.parent.parent._solver
 
+    def _invalidateAnnotationIndex(self):
+        self._annotationIndex = None
+
+    def annotationIndex(self):
+        """
+        Returns the AnnotationIndex of the current annotation labels. The index is rebuilt (in linear time) after the
+        annotations have changed, i.e. when the Annotations slot was set dirty or received a new value.
+        """
+        labels = self.Annotations.value.get("labels", {})
+        if self._annotationIndex is None or self._annotationIndex.source is not labels:
+            self._annotationIndex = AnnotationIndex(labels)
+        return self._annotationIndex
+
     def _updateLabelsFromOperator(self):
         self.labels = self.Labels.value
 
@@ -633,11 +649,7 @@ class OpStructuredTracking(OpConservationTracking):
         ]
 
     def getLabelTT(self, time, track):
-        labels = self.Annotations.value["labels"][time]
-        for label in list(labels.keys()):
-            if self.Annotations.value["labels"][time][label] == set([track]):
-                return label
-        return -1
+        return self.annotationIndex().label(time, track, default=-1)
 
     def _type(self, time, track):
         # returns [type, previous_label] (if type=="LAST" or "INTERMEDIATE" else [type])
@@ -647,17 +659,10 @@ class OpStructuredTracking(OpConservationTracking):
         elif time == 0:
             type = "FIRST"
 
-        labels = self.Annotations.value["labels"]
-        lastTime = -1
-        lastLabel = -1
+        index = self.annotationIndex()
         maxTime = self.LabelImage.meta.shape[0]
-        for t in range(0, time):
-            if t in list(labels.keys()):
-                for label in labels[t]:
-                    if track in labels[t][label]:
-                        lastTime = t
-                        lastLabel = label
 
+        lastTime, lastLabel = index.previous(track, time) or (-1, -1)
         if lastTime == -1:
             type = "FIRST"
         elif lastTime < time - 1:
@@ -666,11 +671,9 @@ class OpStructuredTracking(OpConservationTracking):
             type = "INTERMEDIATE"
 
         firstTime = -1
-        for t in range(maxTime, time, -1):
-            if t in list(labels.keys()):
-                for label in labels[t]:
-                    if track in labels[t][label]:
-                        firstTime = t
+        following = index.next(track, time)
+        if following is not None and following[0] <= maxTime:
+            firstTime = following[0]
         if firstTime == -1:
             if type == "FIRST":
                 return ["SINGLETON(FIRST_LAST)"]
@@ -720,6 +723,7 @@ class OpStructuredTracking(OpConservationTracking):
 
         labels = annotations["labels"]
         divisions = annotations["divisions"]
+        index = AnnotationIndex(labels)
 
         for t in labels.keys():
             for obj in labels[t]:
@@ -735,8 +739,12 @@ class OpStructuredTracking(OpConservationTracking):
                 if (misdetectionLabel in labels[t][source_object_id]) or (t + 1 not in labels.keys()):
                     continue
 
-                # check object ids in the following frame
-                for destination_object_id in labels[t + 1].keys():
+                # check the objects in the following frame that share a track with the source object
+                destination_object_ids = set()
+                for track in labels[t][source_object_id]:
+                    destination_object_ids.update(index.labels(t + 1, track))
+
+                for destination_object_id in destination_object_ids:
                     # skip if misdetection inside
                     if misdetectionLabel in labels[t + 1][destination_object_id]:
                         continue
@@ -758,9 +766,9 @@ class OpStructuredTracking(OpConservationTracking):
         for parentTrack in list(divisions.keys()):
             t = divisions[parentTrack][1]
             childrenTracks = divisions[parentTrack][0]
-            parent = cls.getLabelT(parentTrack, labels[t])
+            parent = index.label(t, parentTrack, default=False)
             for childTrack in childrenTracks:
-                child = cls.getLabelT(childTrack, labels[t + 1])
+                child = index.label(t + 1, childTrack, default=False)
                 traxelgraph._graph.edges[((t, parent), (t + 1, child))]["value"] = 1
                 traxelgraph._graph.edges[((t, parent), (t + 1, child))]["gap"] = 1
             traxelgraph._graph.node[(t, parent)]["divisionValue"] = True
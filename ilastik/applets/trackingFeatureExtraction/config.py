@@ -61,7 +61,7 @@ size_name = "Count"
 # deliminator for division feature concatenation
 delim = "_"
 
-# size of search window for successor candidates in t+1
+# size of search window for successor candidates in t+1 (candidates have their center inside the window)
 template_size = 50
 
 # do not consider objects with size < size_filter as children candidates
@@ -20,35 +20,25 @@
 ###############################################################################
 from __future__ import division
 from builtins import range
+import itertools
 import numpy as np
-import math
-import vigra
-
-
-def dotproduct(v1, v2):
-    return sum((a * b) for a, b in zip(v1, v2))
-
-
-def length(v):
-    return math.sqrt(dotproduct(v, v))
-
-
-def angle(v1, v2):
-    try:
-        if length(v1) * length(v2) == 0:
-            radians = 0
-        else:
-            radians = math.acos(dotproduct(v1, v2) / (length(v1) * length(v2)))
-    except Exception as e:
-        # print str(e), ': math.acos(', dotproduct(v1, v2) / (length(v1) * length(v2)), '), v1 =', v1, ', v2 =', v2
-        radians = 0
-    return (radians * 180) / math.pi
 
 
 ##### Feature base class #######
 
 
 class Feature(object):
+    """
+    A division feature of the objects of one frame.
+
+    compute() is vectorized over all objects of the frame:
+        feats_cur: (n_objects, feat_dim) feature values of the objects at time t
+        feats_next: (n_objects, n_best, feat_dim) feature values of the nearest objects at time t+1,
+                    ordered by distance. Only the first num_next[i] entries of row i are valid.
+        num_next: (n_objects,) number of candidates found for each object
+    and returns an (n_objects, dim()) array.
+    """
+
     name = "Feature"
     plugin = "Tracking Features"
     default_value = 0
@@ -63,7 +53,7 @@ class Feature(object):
         self.ndim = ndim
         self.feat_dim = feat_dim
 
-    def compute(self, feats_cur, feats_next, **kwargs):
+    def compute(self, feats_cur, feats_next, num_next):
         raise NotImplementedError("Feature not fully implemented yet.")
 
     def getName(self):
@@ -75,18 +65,21 @@ class Feature(object):
     def dim(self):
         return self.dimensionality
 
+    def _defaults(self, n_objects):
+        return np.full((n_objects, self.dim()), self.default_value, dtype=np.float64)
+
 
 class ParentChildrenRatio(Feature):
     name = "ParentChildrenRatio"
     dimensionality = 1
 
-    def compute(self, feats_cur, feats_next, **kwargs):
-        if len(feats_next) < 2:
-            return np.array(len(feats_cur) * [self.default_value])
-        result = np.array(feats_cur) / np.array(feats_next[0] + feats_next[1])
-        for i in range(len(result)):
-            if math.isnan(result[i]):
-                result[i] = self.default_value
+    def compute(self, feats_cur, feats_next, num_next):
+        result = self._defaults(feats_cur.shape[0])
+        has_children = num_next >= 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = feats_cur[has_children] / (feats_next[has_children, 0] + feats_next[has_children, 1])
+        ratio[np.isnan(ratio)] = self.default_value
+        result[has_children] = ratio
         return result
 
     def dim(self):
@@ -97,16 +90,15 @@ class ChildrenRatio(Feature):
     name = "ChildrenRatio"
     dimensionality = 1
 
-    def compute(self, feats_cur, feats_next, **kwargs):
-        if len(feats_next) < 2:
-            return np.array(len(feats_cur) * [self.default_value])
-        ratio = np.array(feats_next[0]) / np.array(feats_next[1])
-        for i in range(len(ratio)):
-            if math.isnan(ratio[i]):
-                ratio[i] = self.default_value
-            if ratio[i] > 1 and ratio[i] != 0:
-                ratio[i] = 1.0 / ratio[i]
-        return ratio
+    def compute(self, feats_cur, feats_next, num_next):
+        result = self._defaults(feats_cur.shape[0])
+        has_children = num_next >= 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = feats_next[has_children, 0] / feats_next[has_children, 1]
+            ratio[np.isnan(ratio)] = self.default_value
+            ratio = np.where(ratio > 1, 1.0 / ratio, ratio)
+        result[has_children] = ratio
+        return result
 
     def dim(self):
         return self.dimensionality * self.feat_dim
@@ -115,7 +107,7 @@ class ChildrenRatio(Feature):
 class SquaredDistances(Feature):
     name = "SquaredDistances"
 
-    def compute(self, feats_cur, feats_next, **kwargs):
+    def compute(self, feats_cur, feats_next, num_next):
         return feats_cur
 
     def dim(self):
@@ -126,31 +118,114 @@ class ParentChildrenAngle(Feature):
     name = "ParentChildrenAngle"
     dimensionality = 1
 
-    def compute(self, feats_cur, feats_next, **kwargs):
-        angles = []
-        for idx, com1 in enumerate(feats_next):
-            v1 = (com1 - feats_cur) * self.scales[0 : com1.shape[0]]
-            for com2 in feats_next[idx + 1 :]:
-                v2 = (com2 - feats_cur) * self.scales[0 : com2.shape[0]]
-                ang = angle(v1, v2)
-                if ang > 180:
-                    assert ang <= 360.01, "the angle must be smaller than 360 degrees"
-                    ang = 360 - ang
-                angles.append(ang)
-
-        if len(angles) == 0:
-            angles = [self.default_value]
-
-        return max(angles)
+    def compute(self, feats_cur, feats_next, num_next):
+        """
+        The largest angle (in degrees) between the vectors from the parent to any two of its candidate children.
+        """
+        result = self._defaults(feats_cur.shape[0])
+        scales = np.asarray(self.scales[0 : feats_cur.shape[1]])
+        vectors = (feats_next - feats_cur[:, np.newaxis, :]) * scales
+        lengths = np.linalg.norm(vectors, axis=2)
+
+        max_angle = np.full(feats_cur.shape[0], -np.inf)
+        for i, j in itertools.combinations(range(feats_next.shape[1]), 2):
+            valid = num_next > j
+            norm = lengths[:, i] * lengths[:, j]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                cosine = np.sum(vectors[:, i] * vectors[:, j], axis=1) / norm
+            # Degenerate vectors and rounding errors outside of acos' domain count as 0 degrees
+            defined = (norm != 0) & (np.abs(cosine) <= 1)
+            angles = np.degrees(np.arccos(np.where(defined, cosine, 1.0)))
+            max_angle = np.where(valid, np.maximum(max_angle, angles), max_angle)
+
+        has_children = num_next >= 2
+        result[has_children, 0] = max_angle[has_children]
+        return result
 
 
 class ParentIdentity(Feature):
     name = ""
 
-    def compute(self, feats_cur, feats_next, **kwargs):
+    def compute(self, feats_cur, feats_next, num_next):
         return feats_cur
 
 
+class CenterGrid(object):
+    """
+    Grid index over object centers that answers box queries, i.e. "which objects have their (rounded) center
+    inside the box [start, stop)", for many boxes at once.
+
+    The centers are bucketed into cubic cells of ``cell_size`` pixels. A query only looks at the cells that
+    overlap its box, so the cost per frame is linear in the number of objects for boxes of about the cell size.
+    """
+
+    def __init__(self, labels, centers, cell_size):
+        self.cell_size = max(1, int(cell_size))
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.centers = np.asarray(centers, dtype=np.float64).reshape(len(self.labels), -1)
+        self.positions = np.round(self.centers).astype(np.int64)
+
+        ndim = self.centers.shape[1]
+        if len(self.labels) == 0:
+            self.cell_offset = np.zeros(ndim, dtype=np.int64)
+            self.grid_shape = (1,) * ndim
+            self.cell_ids = np.zeros(0, dtype=np.int64)
+            return
+
+        cells = self.positions // self.cell_size
+        self.cell_offset = cells.min(axis=0)
+        self.grid_shape = tuple(cells.max(axis=0) - self.cell_offset + 1)
+        cell_ids = np.ravel_multi_index(tuple((cells - self.cell_offset).T), self.grid_shape)
+
+        order = np.argsort(cell_ids, kind="stable")
+        self.cell_ids = cell_ids[order]
+        self.labels = self.labels[order]
+        self.centers = self.centers[order]
+        self.positions = self.positions[order]
+
+    def query_boxes(self, starts, stops):
+        """
+        starts, stops: (n_queries, ndim) integer box bounds.
+        Returns (query_index, object_index) arrays of all objects whose rounded center lies in the query's box.
+        Object indices refer to the (sorted) ``labels`` and ``centers`` attributes of the grid.
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        stops = np.asarray(stops, dtype=np.int64)
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        if len(self.cell_ids) == 0 or len(starts) == 0:
+            return empty
+
+        grid_shape = np.array(self.grid_shape)
+        first_cells = starts // self.cell_size - self.cell_offset
+        last_cells = (np.maximum(stops, starts + 1) - 1) // self.cell_size - self.cell_offset
+        span = int((last_cells - first_cells).max()) + 1
+
+        query_indices, object_indices = [], []
+        for offset in itertools.product(range(span), repeat=starts.shape[1]):
+            cells = first_cells + np.array(offset)
+            inside = np.all((cells <= last_cells) & (cells >= 0) & (cells < grid_shape), axis=1)
+            queries = np.flatnonzero(inside)
+            if len(queries) == 0:
+                continue
+            cell_ids = np.ravel_multi_index(tuple(cells[queries].T), self.grid_shape)
+            begin = np.searchsorted(self.cell_ids, cell_ids, side="left")
+            end = np.searchsorted(self.cell_ids, cell_ids, side="right")
+            counts = end - begin
+            # Expand the [begin, end) ranges into one entry per (query, object) pair
+            total = counts.sum()
+            query_indices.append(np.repeat(queries, counts))
+            object_indices.append(np.arange(total) - np.repeat(np.cumsum(counts) - counts - begin, counts))
+
+        if not query_indices:
+            return empty
+        query_indices = np.concatenate(query_indices)
+        object_indices = np.concatenate(object_indices)
+
+        positions = self.positions[object_indices]
+        in_box = np.all((positions >= starts[query_indices]) & (positions < stops[query_indices]), axis=1)
+        return query_indices[in_box], object_indices[in_box]
+
+
 class FeatureManager(object):
 
     feature_mappings = {
@@ -185,38 +260,60 @@ class FeatureManager(object):
         self.size_filter = size_filter
         self.squared_distance_default = squared_distance_default
 
-    def _getBestSquaredDistances(self, com_cur, coms_next, size_filter=None, sizes_next=[], default_value=9999):
-        """ returns the squared distances to the objects in the neighborhood of com_curr, optionally with size filter """
-        squaredDistances = []
-
-        for label_next in list(coms_next.keys()):
-            assert label_next in list(sizes_next.keys())
-            if size_filter != None and sizes_next[label_next] >= size_filter:
-                dist = np.linalg.norm(coms_next[label_next] - com_cur * self.scales)
-                squaredDistances.append([label_next, dist])
-
-        squaredDistances = np.array(squaredDistances)
-        # sort the array in the second column in ascending order
-        squaredDistances = np.array(sorted(squaredDistances, key=lambda a_entry: a_entry[1]))
-
-        # initialize with label -1 and default value
-        result = np.array([[-1, default_value] for x in range(self.n_best)], dtype=np.float32)
-        if squaredDistances.shape[0] != 0:
-            result[0 : min(squaredDistances.shape[0], result.shape[0]), :] = squaredDistances[
-                0 : min(squaredDistances.shape[0], result.shape[0]), :
-            ]
-
-        return result
+    def _getBestSquaredDistances(self, coms_cur, coms_next, sizes_next, image_shape):
+        """
+        Finds the n_best nearest candidate children at t+1 for all objects at t.
+
+        Candidates are the objects at t+1 (of at least size_filter pixels) whose center lies in the search window
+        of template_size pixels around the center of the object at t.
+        Returns (labels, distances), both of shape (n_objects, n_best), sorted by distance.
+        Missing candidates have label -1 and the default distance.
+        """
+        n_objects = coms_cur.shape[0]
+        best_labels = np.full((n_objects, self.n_best), -1, dtype=np.int64)
+        best_distances = np.full((n_objects, self.n_best), self.squared_distance_default, dtype=np.float32)
+        if coms_next is None:
+            return best_labels, best_distances
+
+        candidates = np.arange(coms_next.shape[0]) != 0  # background
+        candidates &= sizes_next > 0
+        if self.size_filter is not None:
+            candidates &= sizes_next >= self.size_filter
+        candidates &= np.all(np.isfinite(coms_next), axis=1)
+        labels_next = np.flatnonzero(candidates)
+        grid = CenterGrid(labels_next, coms_next[labels_next], self.template_size // 2)
+
+        # Search windows around the objects at t (not for the background)
+        queries = np.flatnonzero(np.all(np.isfinite(coms_cur), axis=1))
+        queries = queries[queries != 0]
+        centers = np.round(coms_cur[queries]).astype(np.int64)
+        starts = np.maximum(centers - self.template_size // 2, 0)
+        stops = np.minimum(centers + self.template_size // 2, np.asarray(image_shape[: coms_cur.shape[1]]))
+
+        query_indices, object_indices = grid.query_boxes(starts, stops)
+        objects = queries[query_indices]
+        labels = grid.labels[object_indices]
+        distances = np.linalg.norm(grid.centers[object_indices] - coms_cur[objects] * self.scales, axis=1)
+
+        # Rank the candidates of each object by distance (ties by label) and keep the n_best closest
+        order = np.lexsort((labels, distances, objects))
+        objects, labels, distances = objects[order], labels[order], distances[order]
+        group_start = np.searchsorted(objects, objects, side="left")
+        rank = np.arange(len(objects)) - group_start
+        keep = rank < self.n_best
+        best_labels[objects[keep], rank[keep]] = labels[keep]
+        best_distances[objects[keep], rank[keep]] = distances[keep]
+        return best_labels, best_distances
 
     def computeFeatures_at(self, feats_cur, feats_next, img_next, feat_names):
-
-        #         n_labels = feats_cur.values()[0].shape[0]
         result = {}
+        n_labels = list(feats_cur.values())[0].shape[0]
 
-        vigra_feat_names = set([self.com_name_cur, self.com_name_next, self.size_name])
+        def as_rows(values):
+            values = np.asarray(values, dtype=np.float64)
+            return values.reshape(values.shape[0], -1)
 
         feat_classes = {}
-
         for name in feat_names:
             name_split = name.split(self.delim)
             if "SquaredDistances" in name_split:
@@ -231,94 +328,35 @@ class FeatureManager(object):
                 name_split[1], delim=self.delim, ndim=self.ndim, feat_dim=feat_dim
             )
 
-            shape = (list(feats_cur.values())[0].shape[0], feat_classes[name].dim())
+            shape = (n_labels, feat_classes[name].dim())
             result[name] = np.ones(shape) * feat_classes[name].default_value
 
-            vigra_feat_names.add(name_split[1])
+        coms_cur = as_rows(feats_cur[self.com_name_cur])
+        if feats_next is not None and img_next is not None:
+            best_labels, best_distances = self._getBestSquaredDistances(
+                coms_cur,
+                as_rows(feats_next[self.com_name_next]),
+                as_rows(feats_next[self.size_name])[:, 0],
+                img_next.shape,
+            )
+        else:
+            best_labels, best_distances = self._getBestSquaredDistances(coms_cur, None, None, None)
 
+        # first add squared distances
         for idx in range(self.n_best):
             name = "SquaredDistances_" + str(idx)
-            result[name] = np.ones((list(feats_cur.values())[0].shape[0], 1)) * self.squared_distance_default
-
-        for label_cur, com_cur in enumerate(feats_cur[self.com_name_cur]):
-            if label_cur == 0:
-                continue
-
-            feats_next_subset = {}
-            for k in vigra_feat_names:
-                feats_next_subset[k] = {}
-
-            if feats_next is not None and img_next is not None:
-                idx_cur = [round(x) for x in com_cur]
-
-                roi = []
-                for idx, coord in enumerate(idx_cur):
-                    start = max(coord - self.template_size // 2, 0)
-                    stop = min(coord + self.template_size // 2, img_next.shape[idx])
-                    roi.append(slice(int(start), int(stop)))
-
-                # find all coms in the neighborhood of com_cur
-                subimg_next = img_next[roi]
-                labels_next = np.sort(vigra.analysis.unique(subimg_next)).tolist()
-
-                for l in labels_next:
-                    if l != 0:
-                        for n in vigra_feat_names:
-                            feats_next_subset[n][l] = np.array([feats_next[n][l]]).flatten()
-
-            sq_dist_label = self._getBestSquaredDistances(
-                com_cur,
-                feats_next_subset[self.com_name_next],
-                self.size_filter,
-                feats_next_subset[self.size_name],
-                default_value=self.squared_distance_default,
-            )
-
-            feats_next_subset_best = {}
-            for n in vigra_feat_names:
-                feats_next_subset_best[n] = []
-                for idx, row in enumerate(sq_dist_label):
-                    l = row[0]
-                    if l != -1:
-                        feats_next_subset_best[n].append(feats_next_subset[n][l])
-
-            # first add squared distances
-            for idx in range(self.n_best):
-                name = "SquaredDistances_" + str(idx)
-                result[name][label_cur] = sq_dist_label[idx][1]
-
-            # add all other features
-            for name, feat_class in list(feat_classes.items()):
-                if feat_class.feats_name == "SquaredDistances":
-                    f_next = sq_dist_label[0:2, 1]
-                    f_cur = None
-                else:
-                    f_cur = np.array([feats_cur[feat_class.feats_name][label_cur]]).flatten()
-                    f_next = np.array([feats_next_subset_best[feat_class.feats_name]]).reshape((-1, f_cur.shape[0]))
-                result[name][label_cur] = feat_class.compute(f_cur, f_next)
+            result[name] = np.ones((n_labels, 1)) * self.squared_distance_default
+            result[name][1:, 0] = best_distances[1:, idx]
+
+        # add all other features, for all objects (except the background) at once
+        num_next = np.sum(best_labels != -1, axis=1)[1:]
+        for name, feat_class in list(feat_classes.items()):
+            f_cur = as_rows(feats_cur[feat_class.feats_name])[1:]
+            if feats_next is not None:
+                values_next = as_rows(feats_next[feat_class.feats_name])
+                f_next = values_next[np.maximum(best_labels[1:], 0)]
+            else:
+                f_next = np.zeros((n_labels - 1, self.n_best, f_cur.shape[1]))
+            result[name][1:] = feat_class.compute(f_cur, f_next, num_next)
 
         return result
-
-
-if __name__ == "__main__":
-    import vigra
-    import numpy as np
-
-    img_cur = vigra.readImage("/home/mschiegg/tmp/segmentImage.tif")
-    img_next = img_cur
-
-    labels_cur = vigra.analysis.labelImage(img_cur)
-    feats_cur = vigra.analysis.extractRegionFeatures(
-        labels_cur.astype(np.float32), labels_cur.astype(np.uint32), features="all", ignoreLabel=0
-    )
-
-    feat_names = [
-        "ParentChildrenRatio_Count",
-        "ParentChildrenRatio_Mean",
-        "ChildrenRatio_Count",
-        "ChildrenRatio_Mean",
-        "ParentChildrenAngle_RegionCenter",
-        "ChildrenRatio_SquaredDistances",
-    ]
-    fm = FeatureManager()
-    res = fm.computeFeatures_at(feats_cur, feats_cur, img_cur, feat_names)
@@ -43,6 +43,7 @@ plugin_directories: ~/.ilastik/plugins,
 [lazyflow]
 threads: -1
 total_ram_mb: 0
+auto_resources: true
 
 [ipc raw tcp]
 autostart: false
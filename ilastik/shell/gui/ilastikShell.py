@@ -91,7 +91,8 @@ from ilastik.widgets.filePathButton import FilePathButton
 
 from ilastik.shell.gui.ipcManager import IPCFacade, TCPServer, TCPClient, ZMQPublisher, ZMQSubscriber, ZMQBase
 
-# Import all known workflows now to make sure they are all registered with getWorkflowFromName()
+# Workflows are registered in ilastik.workflows, their modules are imported on demand by
+# getAvailableWorkflows() (start screen) and getWorkflowFromName()
 import ilastik.workflows
 
 try:
@@ -0,0 +1,487 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2020, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+"""
+A long-running headless prediction server.
+
+The server keeps a project (workflow, classifier, caches) loaded and runs predictions for clients on the same
+machine, so the cost of starting ilastik and loading the project is paid only once. Requests are queued and
+processed in batches by the workflow's batch processing applet: each request of a batch gets its own lane, and
+the lanes are exported concurrently on the lazyflow request thread pool.
+
+The server has no authentication and clients choose the files that are read and written, so it only listens on
+loopback addresses.
+
+Messages are length-prefixed: a 4-byte big-endian header length, a JSON header and an optional binary payload
+whose size is given by the header's ``nbytes`` field. Supported commands:
+
+    {"command": "predict", "path": "/some/image.h5/data"}
+        -> {"status": "ok", "path": "/some/image_Probabilities.h5/exported_data"}
+    {"command": "predict", "array": {"shape": [...], "dtype": "uint8", "axes": "yxc", "shm": <name or null>}}
+        -> {"status": "ok", "array": {"shape": [...], "dtype": "float32", "axes": "yxc", "shm": <name or null>}}
+    {"command": "info"}
+    {"command": "shutdown"}
+
+Arrays are passed through shared memory (``multiprocessing.shared_memory``) if the client provides a segment
+name, otherwise inline as payload. The input segment is owned by the client; the server maps it without copying.
+Result segments are created by the server and handed over to the client, which unlinks them.
+
+Usage:
+    python ilastik.py --headless --project=MyProject.ilp --serve=127.0.0.1:5555
+
+    from ilastik.shell.headless.predictionServer import PredictionClient
+    with PredictionClient(("127.0.0.1", 5555)) as client:
+        probabilities = client.predict_array(image, axes="yxc")
+"""
+import ipaddress
+import json
+import logging
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import numpy
+import vigra
+
+from ilastik.applets.dataSelection.opDataSelection import PreloadedArrayDatasetInfo
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+logger = logging.getLogger(__name__)
+
+HEADER_LENGTH = struct.Struct(">I")
+
+#: Arrays smaller than this are sent inline, even if shared memory is available
+SHARED_MEMORY_THRESHOLD = 1 << 20
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host.strip("[]")).is_loopback
+    except ValueError:
+        return False
+
+
+def is_ipv6(host: str) -> bool:
+    try:
+        return ipaddress.ip_address(host.strip("[]")).version == 6
+    except ValueError:
+        return False
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """
+    Parse "host:port" or "port" (listening on localhost). Only loopback hosts are accepted.
+    """
+    host, _, port = address.rpartition(":")
+    try:
+        host, port = host or "127.0.0.1", int(port)
+    except ValueError:
+        raise ValueError(f"Invalid server address {address!r}, expected host:port")
+    if not is_loopback(host):
+        raise ValueError(f"The prediction server only listens on loopback addresses, got {host!r}")
+    return host.strip("[]"), port
+
+
+class PredictionServerError(Exception):
+    """
+    Raised by the client if the server could not process a request.
+    """
+
+
+def send_message(sock: socket.socket, header: dict, payload: Optional[memoryview] = None):
+    header = dict(header, nbytes=0 if payload is None else payload.nbytes)
+    encoded = json.dumps(header).encode("utf-8")
+    sock.sendall(HEADER_LENGTH.pack(len(encoded)) + encoded)
+    if payload is not None and payload.nbytes:
+        sock.sendall(payload)
+
+
+def _receive_exactly(sock: socket.socket, nbytes: int) -> bytearray:
+    buffer = bytearray(nbytes)
+    view = memoryview(buffer)
+    received = 0
+    while received < nbytes:
+        count = sock.recv_into(view[received:], nbytes - received)
+        if count == 0:
+            raise ConnectionError("Connection closed while receiving a message")
+        received += count
+    return buffer
+
+
+def receive_message(sock: socket.socket) -> Tuple[Optional[dict], Optional[bytearray]]:
+    """
+    Returns (header, payload). The header is None if the peer closed the connection.
+    """
+    try:
+        (length,) = HEADER_LENGTH.unpack(_receive_exactly(sock, HEADER_LENGTH.size))
+    except ConnectionError:
+        return None, None
+    header = json.loads(_receive_exactly(sock, length).decode("utf-8"))
+    payload = _receive_exactly(sock, header["nbytes"]) if header.get("nbytes") else None
+    return header, payload
+
+
+def _untrack(segment):
+    """
+    Hand the lifetime of a shared memory segment to the other process.
+    Otherwise the resource tracker of this process unlinks it when the process exits.
+    """
+    try:
+        from multiprocessing import resource_tracker
+
+        resource_tracker.unregister(segment._name, "shared_memory")
+    except Exception:
+        pass
+
+
+class _SharedArray(numpy.ndarray):
+    """
+    ndarray view of a shared memory segment. Keeps the segment mapped as long as the array is alive.
+    """
+
+    def __array_finalize__(self, obj):
+        self.segment = getattr(obj, "segment", None)
+
+
+def _array_from_description(description: dict, payload) -> numpy.ndarray:
+    shape = tuple(description["shape"])
+    dtype = numpy.dtype(description["dtype"])
+    if description.get("shm"):
+        segment = shared_memory.SharedMemory(name=description["shm"])
+        array = numpy.ndarray(shape, dtype=dtype, buffer=segment.buf).view(_SharedArray)
+        array.segment = segment
+        return array
+    return numpy.frombuffer(payload, dtype=dtype).reshape(shape)
+
+
+def _describe_array(array: numpy.ndarray, axes: str, use_shared_memory: bool):
+    """
+    Returns (description, payload) for sending an array, copying it into a new shared memory segment if requested.
+    """
+    array = numpy.ascontiguousarray(array)
+    description = {"shape": list(array.shape), "dtype": array.dtype.str, "axes": axes, "shm": None}
+    if use_shared_memory and shared_memory is not None and array.nbytes > 0:
+        segment = shared_memory.SharedMemory(create=True, size=array.nbytes)
+        numpy.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+        description["shm"] = segment.name
+        return description, segment
+    return description, memoryview(array).cast("B")
+
+
+class _PendingPrediction(object):
+    def __init__(self, kind: str, data, axes: Optional[str] = None):
+        self.kind = kind  # "path" or "array"
+        self.data = data
+        self.axes = axes
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class _PredictionRequestHandler(socketserver.BaseRequestHandler):
+    """
+    Serves all messages of one client connection.
+    """
+
+    def handle(self):
+        server = self.server.prediction_server
+        while True:
+            try:
+                header, payload = receive_message(self.request)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Dropping connection to {self.client_address}: {e}")
+                return
+            if header is None:
+                return
+            try:
+                reply, reply_payload = server.handle_message(header, payload)
+            except Exception as e:
+                logger.exception(f"Request from {self.client_address} failed")
+                reply, reply_payload = {"status": "error", "message": f"{type(e).__name__}: {e}"}, None
+            try:
+                send_message(self.request, reply, reply_payload)
+            except OSError as e:
+                logger.warning(f"Could not reply to {self.client_address}: {e}")
+                return
+            if header.get("command") == "shutdown":
+                return
+
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, request_handler_class):
+        if is_ipv6(server_address[0]):
+            self.address_family = socket.AF_INET6
+        super().__init__(server_address, request_handler_class)
+
+
+class PredictionServer(object):
+    """
+    Serves predictions of the project that is loaded in the given (headless) shell.
+
+    All workflow access happens on the thread that calls :meth:`serve_forever`: the connection threads only
+    queue requests. Up to ``max_batch_size`` queued requests of the same kind are exported together with one
+    call to ``BatchProcessingApplet.run_export_concurrently``, which exports their lanes in parallel; requests
+    that arrive within ``batch_window`` seconds of the first one are added to its batch.
+    """
+
+    def __init__(self, shell, address=("127.0.0.1", 0), max_batch_size=8, batch_window=0.005):
+        self._shell = shell
+        self._batch_applet = getattr(shell.workflow, "batchProcessingApplet", None)
+        if self._batch_applet is None:
+            raise ValueError(f"Workflow {type(shell.workflow).__name__} does not support batch processing")
+        if not is_loopback(address[0]):
+            raise ValueError(f"The prediction server only listens on loopback addresses, got {address[0]!r}")
+        self._max_batch_size = max(1, max_batch_size)
+        self._batch_window = batch_window
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._served = 0
+
+        self._tcp_server = _ThreadingTCPServer((address[0].strip("[]"), address[1]), _PredictionRequestHandler)
+        self._tcp_server.prediction_server = self
+        self._tcp_thread = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._tcp_server.server_address[:2]
+
+    def serve_forever(self):
+        """
+        Accept connections in the background and process queued predictions until shut down.
+        """
+        self._tcp_thread = threading.Thread(target=self._tcp_server.serve_forever, name="PredictionServer Thread")
+        self._tcp_thread.daemon = True
+        self._tcp_thread.start()
+        logger.info("Prediction server listening on {}:{}".format(*self.address))
+        try:
+            while not self._stopped.is_set():
+                batch = self._next_batch()
+                if batch:
+                    self._process_batch(batch)
+        finally:
+            self._tcp_server.shutdown()
+            self._tcp_server.server_close()
+            self._fail_pending("Server shut down")
+            logger.info(f"Prediction server stopped after {self._served} predictions")
+
+    def shutdown(self):
+        self._stopped.set()
+        self._queue.put(None)  # Wake up the worker
+
+    def handle_message(self, header: dict, payload):
+        """
+        Called from the connection threads. Returns (reply header, reply payload).
+        """
+        command = header.get("command")
+        if command == "info":
+            workflow = self._shell.workflow
+            return (
+                {
+                    "status": "ok",
+                    "workflow": type(workflow).__name__,
+                    "project": self._shell.projectManager.currentProjectPath,
+                    "roles": self._batch_applet.role_names,
+                    "shared_memory": shared_memory is not None,
+                },
+                None,
+            )
+        if command == "shutdown":
+            self.shutdown()
+            return {"status": "ok"}, None
+        if command != "predict":
+            raise ValueError(f"Unknown command: {command!r}")
+
+        if "path" in header:
+            pending = _PendingPrediction("path", header["path"])
+        elif "array" in header:
+            description = header["array"]
+            array = _array_from_description(description, payload)
+            if isinstance(array, _SharedArray):
+                # The client owns the input segment
+                _untrack(array.segment)
+            pending = _PendingPrediction("array", array, description["axes"])
+        else:
+            raise ValueError("predict needs either a 'path' or an 'array'")
+
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        if pending.kind == "path":
+            return {"status": "ok", "path": pending.result}, None
+
+        use_shared_memory = bool(header["array"].get("shm"))
+        description, result_payload = _describe_array(pending.result, pending.axes, use_shared_memory)
+        if description["shm"]:
+            _untrack(result_payload)
+            result_payload.close()
+            result_payload = None
+        return {"status": "ok", "array": description}, result_payload
+
+    def _next_batch(self) -> List[_PendingPrediction]:
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.perf_counter() + self._batch_window
+        while len(batch) < self._max_batch_size:
+            try:
+                pending = self._queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if pending is None:
+                self._stopped.set()
+                break
+            batch.append(pending)
+        return batch
+
+    def _process_batch(self, batch: List[_PendingPrediction]):
+        for kind in ("path", "array"):
+            group = [pending for pending in batch if pending.kind == kind]
+            if not group:
+                continue
+            try:
+                results = self._run_export(group)
+            except Exception as e:
+                if len(group) > 1:
+                    # Retry one by one, so a single bad input does not fail the whole batch
+                    logger.warning(f"Batch of {len(group)} predictions failed ({e}), retrying one by one")
+                    self._process_batch_one_by_one(group)
+                else:
+                    logger.exception("Prediction failed")
+                    group[0].error = e
+                    group[0].done.set()
+            else:
+                for pending, result in zip(group, results):
+                    pending.result = result
+                    pending.done.set()
+            self._served += len(group)
+
+    def _process_batch_one_by_one(self, group: List[_PendingPrediction]):
+        for pending in group:
+            try:
+                pending.result = self._run_export([pending])[0]
+            except Exception as e:
+                logger.exception("Prediction failed")
+                pending.error = e
+            pending.done.set()
+
+    def _run_export(self, group: List[_PendingPrediction]):
+        start_time = time.perf_counter()
+        if group[0].kind == "path":
+            inputs = [pending.data for pending in group]
+        else:
+            inputs = [
+                PreloadedArrayDatasetInfo(preloaded_array=pending.data, axistags=vigra.defaultAxistags(pending.axes))
+                for pending in group
+            ]
+        # Only the first role (the raw data) is provided by clients
+        role_data_dict = {self._batch_applet.role_names[0]: inputs}
+        results = self._batch_applet.run_export_concurrently(role_data_dict, export_to_array=group[0].kind == "array")
+        if group[0].kind == "array":
+            results = [numpy.asarray(result) for result in results]
+        logger.info(f"Predicted batch of {len(group)} {group[0].kind}s in {time.perf_counter() - start_time:.3f}s")
+        return results
+
+    def _fail_pending(self, message):
+        while True:
+            try:
+                pending = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if pending is not None:
+                pending.error = RuntimeError(message)
+                pending.done.set()
+
+
+class PredictionClient(object):
+    """
+    Client for :class:`PredictionServer`. One client holds one connection; requests are processed in order.
+    """
+
+    def __init__(self, address: Tuple[str, int], timeout: Optional[float] = None):
+        self._socket = socket.create_connection(tuple(address), timeout=timeout)
+
+    def close(self):
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _request(self, header: dict, payload=None):
+        send_message(self._socket, header, payload)
+        reply, reply_payload = receive_message(self._socket)
+        if reply is None:
+            raise PredictionServerError("Server closed the connection")
+        if reply.get("status") != "ok":
+            raise PredictionServerError(reply.get("message", "unknown error"))
+        return reply, reply_payload
+
+    def info(self) -> dict:
+        return self._request({"command": "info"})[0]
+
+    def shutdown(self):
+        self._request({"command": "shutdown"})
+
+    def predict_file(self, path: str) -> str:
+        """
+        Export the prediction of the given image with the project's export settings, returns the export path.
+        """
+        return self._request({"command": "predict", "path": str(path)})[0]["path"]
+
+    def predict_array(self, array: numpy.ndarray, axes: str, use_shared_memory: Optional[bool] = None):
+        """
+        Predict an in-memory image. With shared memory, the result is a view of a segment created by the server;
+        it is unlinked right away and freed once the returned array is garbage collected.
+        """
+        if use_shared_memory is None:
+            use_shared_memory = shared_memory is not None and array.nbytes >= SHARED_MEMORY_THRESHOLD
+        description, payload = _describe_array(array, axes, use_shared_memory)
+        input_segment = None
+        if description["shm"]:
+            input_segment, payload = payload, None
+        try:
+            reply, reply_payload = self._request({"command": "predict", "array": description}, payload)
+        finally:
+            if input_segment is not None:
+                input_segment.close()
+                input_segment.unlink()
+
+        result = _array_from_description(reply["array"], reply_payload)
+        if isinstance(result, _SharedArray):
+            # The mapping stays valid after unlinking, the memory is released with the last view
+            result.segment.unlink()
+        return result
@@ -0,0 +1,140 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2020, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+"""
+Columnar storage of per-edge values of a region adjacency graph.
+
+The edge-training and multicut applets used to pass per-edge results around as dicts of ``(u, v) -> value``.
+With millions of edges, building and iterating over these dicts takes seconds and a lot of memory.
+An :class:`EdgeTable` keeps the edge ids and the values in two parallel arrays instead, and answers
+lookups of many edges at once with a binary search.
+"""
+import numpy as np
+
+
+class EdgeTable(object):
+    """
+    Parallel arrays of edge ids (shape (N, 2)) and values (shape (N,)).
+
+    Supports the read-only part of the dict interface (``table[(u, v)]``, ``in``, ``len``, ``keys``, ``items``)
+    for code that handles a few edges at a time. Bulk operations should use :meth:`indices` instead.
+    """
+
+    def __init__(self, edge_ids, values):
+        edge_ids = np.asarray(edge_ids)
+        values = np.asarray(values)
+        if len(edge_ids) == 0:
+            edge_ids = edge_ids.reshape((0, 2))
+        assert edge_ids.ndim == 2 and edge_ids.shape[1] == 2, "edge_ids must have shape (N, 2)"
+        assert values.shape == (len(edge_ids),), "Expected {} values, got shape {}".format(len(edge_ids), values.shape)
+        self.edge_ids = edge_ids
+        self.values = values
+        self._sorted_keys = None
+        self._order = None
+
+    @classmethod
+    def from_dict(cls, edge_dict, dtype=None):
+        """
+        Converts a dict of ``(u, v) -> value`` into an EdgeTable.
+        """
+        edge_ids = np.array(list(edge_dict.keys()), dtype=np.uint32).reshape((-1, 2))
+        values = np.fromiter(edge_dict.values(), dtype=dtype or np.float64, count=len(edge_dict))
+        return cls(edge_ids, values)
+
+    @staticmethod
+    def _keys(edge_ids):
+        edge_ids = np.asarray(edge_ids, dtype=np.uint64).reshape((-1, 2))
+        return (edge_ids[:, 0] << np.uint64(32)) | edge_ids[:, 1]
+
+    def _search_index(self):
+        if self._sorted_keys is None:
+            keys = self._keys(self.edge_ids)
+            if len(keys) > 1 and not (keys[1:] > keys[:-1]).all():
+                # The edges of a Rag are already sorted; anything else needs a permutation
+                self._order = np.argsort(keys, kind="stable")
+                keys = keys[self._order]
+            self._sorted_keys = keys
+        return self._sorted_keys, self._order
+
+    def indices(self, edge_ids):
+        """
+        Returns the row of each of the given edges (shape (M, 2)) in this table, or -1 for unknown edges.
+        """
+        sorted_keys, order = self._search_index()
+        keys = self._keys(edge_ids)
+        if len(sorted_keys) == 0:
+            return np.full(len(keys), -1, dtype=np.intp)
+        positions = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+        found = sorted_keys[positions] == keys
+        rows = positions if order is None else order[positions]
+        return np.where(found, rows, -1).astype(np.intp)
+
+    def lookup(self, edge_ids, default=0):
+        """
+        Returns the values of the given edges, with ``default`` for edges that are not in the table.
+        """
+        rows = self.indices(edge_ids)
+        result = np.full(len(rows), default, dtype=np.result_type(self.values, np.min_scalar_type(default)))
+        known = rows >= 0
+        result[known] = self.values[rows[known]]
+        return result
+
+    def select(self, mask):
+        """
+        Returns a new table with the rows for which mask (boolean array or row indices) is set.
+        """
+        return EdgeTable(self.edge_ids[mask], self.values[mask])
+
+    def to_dict(self, values=None):
+        """
+        Returns a dict of ``(u, v) -> value``, for APIs that need one.
+        ``values`` optionally replaces the values of the table (e.g. with one pen per edge).
+        """
+        if values is None:
+            values = self.values
+        return dict(zip(self.keys(), values.tolist() if isinstance(values, np.ndarray) else values))
+
+    def keys(self):
+        return [tuple(edge_id) for edge_id in self.edge_ids.tolist()]
+
+    def items(self):
+        return list(zip(self.keys(), self.values.tolist()))
+
+    def __len__(self):
+        return len(self.edge_ids)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __contains__(self, edge_id):
+        return self.indices([edge_id])[0] >= 0
+
+    def __getitem__(self, edge_id):
+        row = self.indices([edge_id])[0]
+        if row < 0:
+            raise KeyError(edge_id)
+        return self.values[row]
+
+    def get(self, edge_id, default=None):
+        row = self.indices([edge_id])[0]
+        return default if row < 0 else self.values[row]
+
+    def __repr__(self):
+        return "EdgeTable({} edges, dtype={})".format(len(self), self.values.dtype)
@@ -0,0 +1,115 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2020, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+import logging
+from collections import OrderedDict
+
+import numpy
+
+from lazyflow.graph import Operator, InputSlot, OutputSlot
+from lazyflow.request import RequestLock
+from lazyflow.roi import roiToSlice
+
+logger = logging.getLogger(__name__)
+
+
+class OpSharedResultBuffer(Operator):
+    """
+    Lets several downstream consumers share the computation of the same roi.
+
+    Requests for a roi that is already being computed (or was computed recently) wait for the pending
+    upstream request instead of starting a new one. This is used during export, when several results
+    (e.g. probabilities, segmentation and uncertainty) are derived from the same expensive prediction
+    and their blocks are requested at the same time.
+
+    Unlike a block cache, the buffer only keeps the most recent ``Capacity`` results and is meant to be
+    switched on for the duration of a single pass over the data. With ``Capacity`` 0 (the default) it is a
+    plain pass-through. Changing ``Capacity`` or any input clears the buffer.
+    """
+
+    Input = InputSlot()
+    Capacity = InputSlot(value=0)  # Number of results that are kept, 0 disables sharing
+
+    Output = OutputSlot()
+
+    def __init__(self, *args, **kwargs):
+        super(OpSharedResultBuffer, self).__init__(*args, **kwargs)
+        self._lock = RequestLock()
+        self._requests = OrderedDict()  # (start, stop) -> pending or finished upstream request
+        self.hits = 0
+        self.misses = 0
+
+    def setupOutputs(self):
+        self.Output.meta.assignFrom(self.Input.meta)
+        self._clear()
+
+    def _clear(self):
+        with self._lock:
+            self._requests.clear()
+
+    def _find(self, start, stop):
+        """
+        Returns the key of a buffered roi that contains the given roi, or None.
+        """
+        for key in reversed(self._requests):
+            buffered_start, buffered_stop = key
+            if all(b <= s for b, s in zip(buffered_start, start)) and all(
+                s <= b for s, b in zip(stop, buffered_stop)
+            ):
+                return key
+        return None
+
+    def execute(self, slot, subindex, roi, result):
+        capacity = self.Capacity.value
+        if capacity <= 0:
+            self.Input(roi.start, roi.stop).writeInto(result).wait()
+            return result
+
+        start = tuple(int(s) for s in roi.start)
+        stop = tuple(int(s) for s in roi.stop)
+        with self._lock:
+            key = self._find(start, stop)
+            if key is None:
+                key = (start, stop)
+                self._requests[key] = self.Input(start, stop)
+                self.misses += 1
+                while len(self._requests) > capacity:
+                    self._requests.popitem(last=False)
+            else:
+                self._requests.move_to_end(key)
+                self.hits += 1
+            request = self._requests[key]
+
+        try:
+            data = request.wait()
+        except BaseException:
+            with self._lock:
+                if self._requests.get(key) is request:
+                    del self._requests[key]
+            raise
+
+        offset = numpy.array(start) - numpy.array(key[0])
+        result[...] = data[roiToSlice(offset, offset + numpy.array(stop) - numpy.array(start))]
+        return result
+
+    def propagateDirty(self, slot, subindex, roi):
+        self._clear()
+        if slot is self.Input:
+            self.Output.setDirty(roi.start, roi.stop)
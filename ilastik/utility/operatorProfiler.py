@@ -0,0 +1,285 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2020, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+"""
+A profiler for lazyflow operators.
+
+While installed, it records for every operator class and output slot: the number of execute() calls, the time spent
+in them, the number of bytes produced, the time the requests waited in the request queue before they started and,
+for caches, how many requests were served from the cache (hits) and how many had to execute operators outside of the
+cache (misses). At the end, it writes a Chrome trace (open in chrome://tracing or https://ui.perfetto.dev) containing
+every execute() call and the summary table.
+
+Usage:
+    profiler = OperatorProfiler()
+    profiler.install()
+    ...
+    profiler.write("trace.json")
+
+Headless ilastik runs enable it with --profile=trace.json.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+# The execute() call (_ExecuteRecord) that is currently running, and the queue wait time of the current request
+_current_record = contextvars.ContextVar("current_execute_record", default=None)
+_queue_wait = contextvars.ContextVar("request_queue_wait", default=0.0)
+
+
+class _ExecuteRecord(object):
+    __slots__ = ("operator", "key", "is_cache", "parent", "upstream")
+
+    def __init__(self, operator, key, is_cache, parent):
+        self.operator = operator
+        self.key = key
+        self.is_cache = is_cache
+        self.parent = parent
+        self.upstream = False  # Only for caches: whether an operator outside of the cache had to be executed
+
+    def mark_upstream_of(self, operator):
+        """
+        Marks all caches that (directly or indirectly) caused the execution of the given operator as misses,
+        unless the operator is part of the cache itself.
+        """
+        owners = set()
+        while operator is not None:
+            owners.add(id(operator))
+            operator = getattr(operator, "parent", None)
+
+        record = self
+        while record is not None:
+            if record.is_cache and id(record.operator) not in owners:
+                record.upstream = True
+            record = record.parent
+
+
+class _SlotStats(object):
+    __slots__ = ("calls", "total_time", "max_time", "bytes", "queue_wait", "cache_hits", "cache_misses")
+
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.bytes = 0
+        self.queue_wait = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+class OperatorProfiler(object):
+    """
+    Records the execution of all lazyflow operators, see the module docstring.
+    At most max_trace_events execute() calls are kept for the trace; the summary always covers all calls.
+    """
+
+    def __init__(self, max_trace_events=1000000):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._events = []
+        self._max_trace_events = max_trace_events
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+        self._patches = []
+        self._cache_base = None
+
+    def install(self):
+        from lazyflow.graph import Operator
+        from lazyflow.request import Request
+
+        try:
+            from lazyflow.operators.opCache import Cache
+
+            self._cache_base = Cache
+        except ImportError:
+            logger.warning("lazyflow caches not found, cache hits are not recorded.")
+            self._cache_base = None
+
+        self._patch(Operator, "call_execute", self._wrap_call_execute)
+        if hasattr(Request, "submit") and hasattr(Request, "_execute"):
+            self._patch(Request, "__init__", self._wrap_request_init)
+            self._patch(Request, "submit", self._wrap_request_submit)
+            self._patch(Request, "_execute", self._wrap_request_execute)
+        else:
+            logger.warning("Unknown lazyflow request implementation, request queue wait times are not recorded.")
+        logger.info("Operator profiling enabled")
+
+    def uninstall(self):
+        for cls, name, original in reversed(self._patches):
+            setattr(cls, name, original)
+        self._patches = []
+
+    def _patch(self, cls, name, wrapper_factory):
+        original = cls.__dict__[name]
+        self._patches.append((cls, name, original))
+        setattr(cls, name, wraps(original)(wrapper_factory(original)))
+
+    def _is_cache(self, op):
+        return self._cache_base is not None and isinstance(op, self._cache_base)
+
+    def _wrap_call_execute(self, original):
+        profiler = self
+
+        def call_execute(op, slot, subindex, roi, result, **kwargs):
+            parent = _current_record.get()
+            if parent is not None:
+                parent.mark_upstream_of(op)
+
+            record = _ExecuteRecord(op, (type(op).__name__, slot.name), profiler._is_cache(op), parent)
+            token = _current_record.set(record)
+            queue_wait = _queue_wait.get()
+            if queue_wait:
+                _queue_wait.set(0.0)
+
+            start = time.perf_counter()
+            try:
+                return original(op, slot, subindex, roi, result, **kwargs)
+            finally:
+                stop = time.perf_counter()
+                _current_record.reset(token)
+                profiler._record(record, start, stop, getattr(result, "nbytes", 0), queue_wait, roi)
+
+        return call_execute
+
+    def _wrap_request_init(self, original):
+        def __init__(request, *args, **kwargs):
+            original(request, *args, **kwargs)
+            request._profiler_parent = _current_record.get()
+
+        return __init__
+
+    def _wrap_request_submit(self, original):
+        def submit(request, *args, **kwargs):
+            request._profiler_submitted = time.perf_counter()
+            return original(request, *args, **kwargs)
+
+        return submit
+
+    def _wrap_request_execute(self, original):
+        def _execute(request, *args, **kwargs):
+            # Requests run in other threads / greenlets: continue the context of the code that created them
+            submitted = getattr(request, "_profiler_submitted", None)
+            record_token = _current_record.set(getattr(request, "_profiler_parent", None))
+            wait_token = _queue_wait.set(0.0 if submitted is None else time.perf_counter() - submitted)
+            try:
+                return original(request, *args, **kwargs)
+            finally:
+                _queue_wait.reset(wait_token)
+                _current_record.reset(record_token)
+
+        return _execute
+
+    def _record(self, record, start, stop, nbytes, queue_wait, roi):
+        duration = stop - start
+        with self._lock:
+            stats = self._stats.get(record.key)
+            if stats is None:
+                stats = self._stats[record.key] = _SlotStats()
+            stats.calls += 1
+            stats.total_time += duration
+            stats.max_time = max(stats.max_time, duration)
+            stats.bytes += nbytes
+            stats.queue_wait += queue_wait
+            if record.is_cache:
+                if record.upstream:
+                    stats.cache_misses += 1
+                else:
+                    stats.cache_hits += 1
+
+            if len(self._events) < self._max_trace_events:
+                self._events.append(
+                    {
+                        "name": "{}.{}".format(*record.key),
+                        "cat": "cache" if record.is_cache else "execute",
+                        "ph": "X",
+                        "ts": (start - self._origin) * 1e6,
+                        "dur": duration * 1e6,
+                        "pid": self._pid,
+                        "tid": threading.get_ident(),
+                        "args": {"bytes": nbytes, "queue_wait_ms": queue_wait * 1e3, "roi": str(roi)},
+                    }
+                )
+
+    def summary(self):
+        """
+        Returns one dict per (operator, slot), sorted by the total execute time (descending).
+        """
+        with self._lock:
+            items = list(self._stats.items())
+
+        rows = []
+        for (operator, slot), stats in items:
+            row = {
+                "operator": operator,
+                "slot": slot,
+                "calls": stats.calls,
+                "total_s": stats.total_time,
+                "mean_ms": 1e3 * stats.total_time / stats.calls,
+                "max_ms": 1e3 * stats.max_time,
+                "mbytes": stats.bytes / 1024 ** 2,
+                "queue_wait_s": stats.queue_wait,
+                "cache_hit_ratio": None,
+            }
+            if stats.cache_hits + stats.cache_misses:
+                row["cache_hit_ratio"] = stats.cache_hits / (stats.cache_hits + stats.cache_misses)
+            rows.append(row)
+        return sorted(rows, key=lambda row: row["total_s"], reverse=True)
+
+    def format_summary(self, max_rows=40):
+        lines = [
+            "{:<60} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>6}".format(
+                "operator.slot", "calls", "total [s]", "mean [ms]", "max [ms]", "MB", "queue [s]", "hits"
+            )
+        ]
+        for row in self.summary()[:max_rows]:
+            hits = "-" if row["cache_hit_ratio"] is None else "{:.0%}".format(row["cache_hit_ratio"])
+            lines.append(
+                "{:<60} {:>8} {:>10.3f} {:>10.2f} {:>10.2f} {:>10.1f} {:>10.3f} {:>6}".format(
+                    "{}.{}".format(row["operator"], row["slot"])[:60],
+                    row["calls"],
+                    row["total_s"],
+                    row["mean_ms"],
+                    row["max_ms"],
+                    row["mbytes"],
+                    row["queue_wait_s"],
+                    hits,
+                )
+            )
+        return "\n".join(lines)
+
+    def write(self, path):
+        """
+        Writes the Chrome trace (with the summary in "otherData") to path and logs the summary table.
+        """
+        with self._lock:
+            events = list(self._events)
+        if len(events) == self._max_trace_events:
+            logger.warning(f"The trace only contains the first {len(events)} execute calls.")
+
+        trace = {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"summary": self.summary()}}
+        with open(path, "w") as f:
+            json.dump(trace, f)
+        logger.info("Operator profile written to {}:\n{}".format(path, self.format_summary()))
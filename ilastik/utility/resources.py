@@ -0,0 +1,270 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2020, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+"""
+Detection of the CPU and memory limits of the current process (cgroup v1/v2 quotas, cpusets and Slurm allocations),
+so that the lazyflow thread pool and cache budget fit into containers and cluster jobs instead of the whole host.
+"""
+import logging
+import math
+import os
+import threading
+from typing import Callable, Dict, Iterator, Mapping, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+PROC_SELF_CGROUP = "/proc/self/cgroup"
+
+# cgroup v1 reports "no limit" as a huge number (close to 2**63, rounded to the page size)
+_UNLIMITED_MEMORY = 2 ** 60
+
+
+class ResourceLimits(NamedTuple):
+    cpus: Optional[float] = None  # number of CPUs the process may use (may be fractional for CPU quotas)
+    memory_bytes: Optional[int] = None  # memory limit of the process
+
+    def thread_count(self) -> Optional[int]:
+        """Size of the lazyflow thread pool for these limits (None if unknown)."""
+        if self.cpus is None:
+            return None
+        return max(1, int(math.floor(self.cpus)))
+
+    def total_ram_mb(self) -> Optional[int]:
+        """RAM budget for lazyflow for these limits, in MB (None if unknown)."""
+        if self.memory_bytes is None:
+            return None
+        return int(self.memory_bytes // 1024 ** 2)
+
+
+def _read_text(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (OSError, ValueError):
+        return None
+
+
+def _min_or_none(*values):
+    values = [v for v in values if v is not None]
+    return min(values) if values else None
+
+
+def parse_cpu_list(cpu_list: str) -> int:
+    """Number of CPUs in a cpuset list, e.g. "0-3,8,10-11" -> 7"""
+    count = 0
+    for part in cpu_list.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            count += int(last) - int(first) + 1
+        else:
+            count += 1
+    return count
+
+
+def cgroup_paths(proc_cgroup: str = PROC_SELF_CGROUP) -> Dict[str, str]:
+    """
+    The cgroups of the process, from /proc/self/cgroup: the path in the hierarchy of each cgroup v1 controller
+    (e.g. "cpu", "memory") and the path in the cgroup v2 unified hierarchy (key "").
+    """
+    paths = {}
+    for line in (_read_text(proc_cgroup) or "").splitlines():
+        fields = line.split(":", 2)  # "<hierarchy id>:<controllers>:<path>", controllers are empty for v2
+        if len(fields) != 3:
+            continue
+        for controller in fields[1].split(","):
+            paths[controller] = fields[2]
+    return paths
+
+
+def _cgroup_dirs(root: str, mount: str, cgroup_path: Optional[str]) -> Iterator[str]:
+    """
+    The directories of a cgroup and all of its ancestors (whose limits apply, too) in the hierarchy mounted at
+    root/mount. If the cgroup is not visible there (e.g. in a container that mounts its own cgroup as the root),
+    only the mount point is used.
+    """
+    mount_dir = os.path.join(root, mount) if mount else root
+    parts = [part for part in (cgroup_path or "").split("/") if part]
+    if not os.path.isdir(os.path.join(mount_dir, *parts)):
+        parts = []
+    for depth in range(len(parts), -1, -1):
+        yield os.path.join(mount_dir, *parts[:depth])
+
+
+def cgroup_cpu_limit(root: str = CGROUP_ROOT, proc_cgroup: str = PROC_SELF_CGROUP) -> Optional[float]:
+    """
+    CPU quota (quota / period) of the cgroup of the process for cgroup v2 or v1, None if there is no quota.
+    The tightest quota of the cgroup and its ancestors is used.
+    """
+    paths = cgroup_paths(proc_cgroup)
+
+    quotas = []
+    found = False
+    for cgroup_dir in _cgroup_dirs(root, "", paths.get("")):
+        cpu_max = _read_text(os.path.join(cgroup_dir, "cpu.max"))  # v2: "<quota> <period>" or "max <period>"
+        if cpu_max is None:
+            continue
+        found = True
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max" and period:
+            quotas.append(int(quota) / int(period))
+    if found:
+        return _min_or_none(*quotas)
+
+    for controller in ("cpu", "cpu,cpuacct"):
+        for cgroup_dir in _cgroup_dirs(root, controller, paths.get("cpu")):
+            quota = _read_text(os.path.join(cgroup_dir, "cpu.cfs_quota_us"))
+            period = _read_text(os.path.join(cgroup_dir, "cpu.cfs_period_us"))
+            if quota is None or period is None:
+                continue
+            found = True
+            if int(quota) > 0 and int(period) > 0:
+                quotas.append(int(quota) / int(period))
+        if found:
+            return _min_or_none(*quotas)
+    return None
+
+
+def cpuset_cpu_count(root: str = CGROUP_ROOT) -> Optional[int]:
+    """Number of CPUs the process is allowed to run on (affinity mask, or the cgroup cpuset)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    for path in ("cpuset.cpus.effective", os.path.join("cpuset", "cpuset.effective_cpus"), "cpuset/cpuset.cpus"):
+        cpus = _read_text(os.path.join(root, path))
+        if cpus:
+            return parse_cpu_list(cpus)
+    return None
+
+
+def cgroup_memory_limit(root: str = CGROUP_ROOT, proc_cgroup: str = PROC_SELF_CGROUP) -> Optional[int]:
+    """
+    Memory limit of the cgroup of the process in bytes for cgroup v2 or v1, None if there is no limit.
+    The tightest limit of the cgroup and its ancestors is used.
+    """
+    paths = cgroup_paths(proc_cgroup)
+    for mount, controller, filename in (("", "", "memory.max"), ("memory", "memory", "memory.limit_in_bytes")):
+        limits = []
+        found = False
+        for cgroup_dir in _cgroup_dirs(root, mount, paths.get(controller)):
+            limit = _read_text(os.path.join(cgroup_dir, filename))
+            if limit is None:
+                continue
+            found = True
+            if limit != "max" and int(limit) < _UNLIMITED_MEMORY:
+                limits.append(int(limit))
+        if found:
+            return _min_or_none(*limits)
+    return None
+
+
+def slurm_limits(environ: Mapping[str, str] = os.environ) -> ResourceLimits:
+    """CPUs and memory of the Slurm allocation of this task (from the job environment)."""
+    cpus = environ.get("SLURM_CPUS_PER_TASK") or environ.get("SLURM_CPUS_ON_NODE")
+    cpus = int(cpus) if cpus else None
+
+    memory_bytes = None
+    if environ.get("SLURM_MEM_PER_NODE"):
+        memory_bytes = int(environ["SLURM_MEM_PER_NODE"]) * 1024 ** 2
+    elif environ.get("SLURM_MEM_PER_CPU") and cpus:
+        memory_bytes = int(environ["SLURM_MEM_PER_CPU"]) * cpus * 1024 ** 2
+    return ResourceLimits(cpus, memory_bytes)
+
+
+def probe_resource_limits(
+    root: str = CGROUP_ROOT, environ: Mapping[str, str] = os.environ, proc_cgroup: str = PROC_SELF_CGROUP
+) -> ResourceLimits:
+    """
+    The tightest CPU and memory limits of the cgroup (CPU quota, cpuset, memory limit) and the Slurm allocation.
+    Limits that cannot be determined are None.
+    """
+    slurm = slurm_limits(environ)
+    cpus = _min_or_none(cgroup_cpu_limit(root, proc_cgroup), cpuset_cpu_count(root), slurm.cpus)
+    memory_bytes = _min_or_none(cgroup_memory_limit(root, proc_cgroup), slurm.memory_bytes)
+    return ResourceLimits(cpus, memory_bytes)
+
+
+class MemoryPressureMonitor(object):
+    """
+    Shrinks the cache budget when the resident memory of the process gets close to the memory limit, and restores
+    it step by step when there is room again.
+
+    get_rss, get_cache_budget and set_cache_budget are callables (in bytes), e.g. psutil and
+    lazyflow.utility.Memory.get/setAvailableRamCaches. Call check() periodically, or start() a daemon thread.
+    """
+
+    def __init__(
+        self,
+        memory_limit: int,
+        get_rss: Callable[[], int],
+        get_cache_budget: Callable[[], int],
+        set_cache_budget: Callable[[int], None],
+        high_watermark: float = 0.9,
+        low_watermark: float = 0.75,
+        min_budget_fraction: float = 0.1,
+    ):
+        self.memory_limit = memory_limit
+        self._get_rss = get_rss
+        self._set_cache_budget = set_cache_budget
+        self._base_budget = get_cache_budget()
+        self._budget = self._base_budget
+        self._high = high_watermark * memory_limit
+        self._low = low_watermark * memory_limit
+        self._min_budget = int(min_budget_fraction * self._base_budget)
+        self._stop_event = threading.Event()
+
+    @property
+    def budget(self) -> int:
+        return self._budget
+
+    def check(self) -> int:
+        """Adapts the cache budget to the current memory usage and returns it."""
+        rss = self._get_rss()
+        budget = self._budget
+        if rss > self._high:
+            # Free at least the excess over the high watermark
+            budget = max(self._min_budget, min(int(budget * 0.75), int(budget - (rss - self._high))))
+        elif rss < self._low and budget < self._base_budget:
+            budget = min(self._base_budget, int(budget * 1.25) + 1)
+
+        if budget != self._budget:
+            logger.info(
+                f"Memory usage {rss / 1024 ** 2:.0f} MB of {self.memory_limit / 1024 ** 2:.0f} MB: "
+                f"setting cache budget to {budget / 1024 ** 2:.0f} MB"
+            )
+            self._budget = budget
+            self._set_cache_budget(budget)
+        return budget
+
+    def start(self, interval_secs: float = 5.0) -> threading.Thread:
+        def run():
+            while not self._stop_event.wait(interval_secs):
+                try:
+                    self.check()
+                except Exception:
+                    logger.exception("Memory pressure check failed")
+
+        thread = threading.Thread(target=run, name="MemoryPressureMonitor", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop_event.set()
@@ -25,7 +25,17 @@ from functools import partial
 
 from PyQt5 import uic
 from PyQt5.QtCore import Qt, QEvent
-from PyQt5.QtWidgets import QDialogButtonBox, QComboBox, QDialog, QFileDialog, QLabel, QMessageBox, QVBoxLayout
+from PyQt5.QtWidgets import (
+    QCheckBox,
+    QDialogButtonBox,
+    QComboBox,
+    QDialog,
+    QFileDialog,
+    QHBoxLayout,
+    QLabel,
+    QMessageBox,
+    QVBoxLayout,
+)
 
 import vigra
 
@@ -84,6 +94,26 @@ class StackFileSelectionWidget(QDialog):
 
         self.stackAcrossTButton.setChecked(True)
 
+        # Options for copying the stack into the project file
+        importOptionsLayout = QHBoxLayout()
+        importOptionsLayout.addWidget(QLabel("Chunking in project file:"))
+        self.chunkLayoutComboBox = QComboBox(self)
+        for layout, text in (("auto", "Automatic"), ("2d", "Slice-wise (2D)"), ("3d", "Block-wise (3D)")):
+            self.chunkLayoutComboBox.addItem(text, layout)
+        self.chunkLayoutComboBox.setToolTip(
+            "Slice-wise chunks are fastest for viewing single slices,\n"
+            "block-wise chunks are fastest for 3D feature computation."
+        )
+        importOptionsLayout.addWidget(self.chunkLayoutComboBox)
+        self.compressCheckBox = QCheckBox("Compress", self)
+        self.compressCheckBox.setChecked(True)
+        self.compressCheckBox.setToolTip(
+            "Compress the stack in the project file\n(smaller file, slightly slower access)."
+        )
+        importOptionsLayout.addWidget(self.compressCheckBox)
+        importOptionsLayout.addStretch()
+        self.verticalLayout_2.insertLayout(self.verticalLayout_2.count() - 1, importOptionsLayout)
+
     def accept(self):
         self.patternEdit.removeEventFilter(self)
         super(StackFileSelectionWidget, self).accept()
@@ -100,6 +130,14 @@ class StackFileSelectionWidget(QDialog):
             return "z"
         return "c"
 
+    @property
+    def chunk_layout(self):
+        return self.chunkLayoutComboBox.currentData()
+
+    @property
+    def compression(self):
+        return "gzip" if self.compressCheckBox.isChecked() else "none"
+
     def _configureGui(self, mode):
         """
         Configure the gui to select files via one of our three selection modes.
@@ -253,14 +253,17 @@ def all_subclasses(cls):
 def getAvailableWorkflows():
     """
     This function used to iterate over all workflows that have been imported so far,
-    but now we rely on the explicit list in workflows/__init__.py,
+    but now we rely on the explicit registry in workflows/__init__.py,
     and add any extra auto-discovered workflows at the end.
+
+    Note: This imports all available workflows. Use :py:func:`getWorkflowFromName`
+    if only a single workflow is needed.
     """
     alreadyListed = set()
 
     from . import workflows
 
-    for W in workflows.WORKFLOW_CLASSES + all_subclasses(Workflow):
+    for W in workflows.load_all_workflows() + all_subclasses(Workflow):
         if W.__name__ in alreadyListed:
             continue
         alreadyListed.add(W.__name__)
@@ -294,7 +297,21 @@ def getAvailableWorkflows():
 
 
 def getWorkflowFromName(Name):
-    """return workflow by naming its workflowName variable"""
+    """return workflow by naming its workflowName variable
+
+    Registered workflows are resolved without importing any other workflow module.
+    """
+    from . import workflows
+
+    entry = workflows.find_workflow_entry(Name)
+    if entry is not None:
+        try:
+            return entry.load()
+        except (ImportError, AttributeError) as e:
+            logger.warning("Failed to import workflow {}; check dependencies: {}".format(entry.class_name, e))
+            return None
+
+    # Not registered: look through all workflows, including auto-discovered subclasses (e.g. from plugins)
     for w, _name, _displayName in getAvailableWorkflows():
         if _name == Name or w.__name__ == Name or _displayName == Name:
             return w
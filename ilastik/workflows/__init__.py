@@ -20,148 +20,254 @@ from __future__ import absolute_import
 # on the ilastik web site at:
 # 		   http://ilastik.org/license.html
 ###############################################################################
+import importlib
+import importlib.util
 import logging
 
 logger = logging.getLogger(__name__)
 
-WORKFLOW_CLASSES = []
-
 import ilastik.config
 
-# VIB classifier using deep learning
-can_dl = True
-try:
-    import neuralnets
-except ImportError as e:
-    can_dl = False
-    logger.warning("Cannot load the VIB Deep Learning workflow because the 'neuralnets' library is missing. Either install it via pip or add its location to PYTHONPATH.")
-
-if can_dl:
-    from .dlClassification import DLClassificationWorkflow
-
-    WORKFLOW_CLASSES += [DLClassificationWorkflow]
-
-from .pixelClassification import PixelClassificationWorkflow
-
-WORKFLOW_CLASSES += [PixelClassificationWorkflow]
-
-from .newAutocontext.newAutocontextWorkflow import AutocontextTwoStage
-
-WORKFLOW_CLASSES += [AutocontextTwoStage]
-if ilastik.config.cfg.getboolean("ilastik", "debug"):
-    from .newAutocontext.newAutocontextWorkflow import AutocontextThreeStage, AutocontextFourStage
-
-    WORKFLOW_CLASSES += [AutocontextThreeStage, AutocontextFourStage]
-
-
-try:
-    from .objectClassification.objectClassificationWorkflow import (
-        ObjectClassificationWorkflowPixel,
-        ObjectClassificationWorkflowPrediction,
-        ObjectClassificationWorkflowBinary,
-    )
-
-    WORKFLOW_CLASSES += [
-        ObjectClassificationWorkflowPixel,
-        ObjectClassificationWorkflowPrediction,
-        ObjectClassificationWorkflowBinary,
-    ]
-except ImportError as e:
-    logger.warning("Failed to import object workflow; check dependencies: " + str(e))
-
-try:
-    from .tracking.manual.manualTrackingWorkflow import ManualTrackingWorkflow
-
-    WORKFLOW_CLASSES += [ManualTrackingWorkflow]
-except (ImportError, AttributeError) as e:
-    logger.warning("Failed to import tracking workflow; check pgmlink dependency: " + str(e))
-
-try:
-    from .tracking.conservation.conservationTrackingWorkflow import (
-        ConservationTrackingWorkflowFromBinary,
-        ConservationTrackingWorkflowFromPrediction,
-    )
-    from .tracking.conservation.animalConservationTrackingWorkflow import (
-        AnimalConservationTrackingWorkflowFromBinary,
-        AnimalConservationTrackingWorkflowFromPrediction,
-    )
-
-    WORKFLOW_CLASSES += [
-        ConservationTrackingWorkflowFromBinary,
-        ConservationTrackingWorkflowFromPrediction,
-        AnimalConservationTrackingWorkflowFromBinary,
-        AnimalConservationTrackingWorkflowFromPrediction,
-    ]
-except ImportError as e:
-    logger.warning(
-        "Failed to import automatic tracking workflow (conservation tracking). For this workflow, see the installation"
-        "instructions on our website ilastik.org; check dependencies: " + str(e)
-    )
-
-try:
-    from .tracking.structured.structuredTrackingWorkflow import (
-        StructuredTrackingWorkflowFromBinary,
-        StructuredTrackingWorkflowFromPrediction,
-    )
-
-    WORKFLOW_CLASSES += [StructuredTrackingWorkflowFromBinary, StructuredTrackingWorkflowFromPrediction]
-except ImportError as e:
-    logger.warning(
-        "Failed to import structured learning tracking workflow. For this workflow, see the installation"
-        "instructions on our website ilastik.org; check dependencies: " + str(e)
-    )
-try:
-    from .carving.carvingWorkflow import CarvingWorkflow
-
-    WORKFLOW_CLASSES += [CarvingWorkflow]
-except ImportError as e:
-    logger.warning("Failed to import carving workflow; check vigra dependency: " + str(e))
-
-# try:
-#     import multicut
-# except ImportError as e:
-#     logger.warning("Failed to import multicut workflow; check dependencies: " + str(e))
-
-# try:
-#     from .edgeTrainingWithMulticut import EdgeTrainingWithMulticutWorkflow
-#
-#     WORKFLOW_CLASSES += [EdgeTrainingWithMulticutWorkflow]
-# except ImportError as e:
-#     logger.warning("Failed to import 'Edge Training With Multicut' workflow; check dependencies: " + str(e))
-
-try:
-    from .counting import CountingWorkflow
-
-    WORKFLOW_CLASSES += [CountingWorkflow]
-except ImportError as e:
-    logger.warning("Failed to import counting workflow; check dependencies: " + str(e))
-
-from .examples.dataConversion.dataConversionWorkflow import DataConversionWorkflow
-
-WORKFLOW_CLASSES += [DataConversionWorkflow]
-
-# network classification, check whether required modules are available:
-can_nn = True
-try:
-    import torch
-    import inferno
-    import tiktorch
-except ImportError as e:
-    can_nn = False
-    logger.debug(f"NNClassificationWorkflow: could not import required modules: {e}")
-
-if can_nn:
-    if ilastik.config.cfg.getboolean("ilastik", "hbp", fallback=False):
-        from .nnClassification import NNClassificationWorkflow
-
-        WORKFLOW_CLASSES += [NNClassificationWorkflow]
-
-
-# Examples
-if ilastik.config.cfg.getboolean("ilastik", "debug"):
-    from . import wsdt
-    from .examples import layerViewer
-    from .examples import thresholdMasking
-    from .examples import deviationFromMean
-    from .examples import labeling
-    from .examples import connectedComponents
+
+class WorkflowRegistryEntry(object):
+    """
+    Describes a workflow class without importing its module.
+
+    The module is only imported by :py:meth:`load`, i.e. when the workflow is actually needed
+    (e.g. by ``getWorkflowFromName()`` while opening a project, or to populate the GUI start screen).
+    Headless processes therefore only pay the import cost of the workflow they run.
+
+    :param module: module that defines the workflow, relative to this package
+    :param class_name: name of the workflow class in that module
+    :param name: the ``workflowName`` of the class (the name stored in project files)
+    :param display_name: the ``workflowDisplayName`` of the class, defaults to ``name``
+    :param requires: top-level modules the workflow depends on; the workflow is not offered if one is missing
+    :param config_flag: only offer the workflow if this boolean option of the [ilastik] config section is set
+    :param missing_message: logged as a warning if a required module is missing
+    """
+
+    def __init__(
+        self, module, class_name, name, display_name=None, requires=(), config_flag=None, missing_message=None
+    ):
+        self.module = module
+        self.class_name = class_name
+        self.name = name
+        self.display_name = display_name or name
+        self.requires = tuple(requires)
+        self.config_flag = config_flag
+        self.missing_message = missing_message
+
+    def matches(self, name):
+        return name in (self.name, self.class_name, self.display_name)
+
+    @property
+    def enabled(self):
+        return self.config_flag is None or ilastik.config.cfg.getboolean("ilastik", self.config_flag, fallback=False)
+
+    def missing_requirements(self):
+        """
+        Return the required modules that cannot be found (without importing them).
+        """
+        return [req for req in self.requires if importlib.util.find_spec(req) is None]
+
+    def load(self):
+        """
+        Import the workflow module and return the workflow class.
+        Raises ImportError if the workflow or one of its dependencies cannot be imported.
+        """
+        missing = self.missing_requirements()
+        if missing:
+            raise ImportError("Missing modules for {}: {}".format(self.class_name, ", ".join(missing)))
+        module = importlib.import_module(self.module, __name__)
+        return getattr(module, self.class_name)
+
+    def __repr__(self):
+        return "WorkflowRegistryEntry({}.{})".format(self.module, self.class_name)
+
+
+# The order of this list is the order of the workflows on the GUI start screen.
+WORKFLOW_REGISTRY = [
+    WorkflowRegistryEntry(
+        ".dlClassification.dlClassificationWorkflow",
+        "DLClassificationWorkflow",
+        "VIB Deep Learning Classification",
+        requires=["neuralnets"],
+        missing_message="Cannot load the VIB Deep Learning workflow because the 'neuralnets' library is missing. "
+        "Either install it via pip or add its location to PYTHONPATH.",
+    ),
+    WorkflowRegistryEntry(
+        ".pixelClassification.pixelClassificationWorkflow", "PixelClassificationWorkflow", "Pixel Classification"
+    ),
+    WorkflowRegistryEntry(
+        ".newAutocontext.newAutocontextWorkflow", "AutocontextTwoStage", "AutocontextTwoStage", "Autocontext (2-stage)"
+    ),
+    WorkflowRegistryEntry(
+        ".newAutocontext.newAutocontextWorkflow",
+        "AutocontextThreeStage",
+        "AutocontextThreeStage",
+        "Autocontext (3-stage)",
+        config_flag="debug",
+    ),
+    WorkflowRegistryEntry(
+        ".newAutocontext.newAutocontextWorkflow",
+        "AutocontextFourStage",
+        "AutocontextFourStage",
+        "Autocontext (4-stage)",
+        config_flag="debug",
+    ),
+    WorkflowRegistryEntry(
+        ".objectClassification.objectClassificationWorkflow",
+        "ObjectClassificationWorkflowPixel",
+        "Object Classification (from pixel classification)",
+        "Pixel Classification + Object Classification",
+    ),
+    WorkflowRegistryEntry(
+        ".objectClassification.objectClassificationWorkflow",
+        "ObjectClassificationWorkflowPrediction",
+        "Object Classification (from prediction image)",
+        "Object Classification [Inputs: Raw Data, Pixel Prediction Map]",
+    ),
+    WorkflowRegistryEntry(
+        ".objectClassification.objectClassificationWorkflow",
+        "ObjectClassificationWorkflowBinary",
+        "Object Classification (from binary image)",
+        "Object Classification [Inputs: Raw Data, Segmentation]",
+    ),
+    WorkflowRegistryEntry(
+        ".tracking.manual.manualTrackingWorkflow",
+        "ManualTrackingWorkflow",
+        "Manual Tracking Workflow",
+        "Manual Tracking Workflow [Inputs: Raw Data, Pixel Prediction Map]",
+    ),
+    WorkflowRegistryEntry(
+        ".tracking.conservation.conservationTrackingWorkflow",
+        "ConservationTrackingWorkflowFromBinary",
+        "Automatic Tracking Workflow (Conservation Tracking) from binary image",
+        "Tracking [Inputs: Raw Data, Binary Image]",
+    ),
+    WorkflowRegistryEntry(
+        ".tracking.conservation.conservationTrackingWorkflow",
+        "ConservationTrackingWorkflowFromPrediction",
+        "Automatic Tracking Workflow (Conservation Tracking) from prediction image",
+        "Tracking [Inputs: Raw Data, Pixel Prediction Map]",
+    ),
+    WorkflowRegistryEntry(
+        ".tracking.conservation.animalConservationTrackingWorkflow",
+        "AnimalConservationTrackingWorkflowFromBinary",
+        "Animal Conservation Tracking Workflow from Binary Image",
+        "Animal Tracking [Inputs: Raw Data, Binary Image]",
+    ),
+    WorkflowRegistryEntry(
+        ".tracking.conservation.animalConservationTrackingWorkflow",
+        "AnimalConservationTrackingWorkflowFromPrediction",
+        "Animal Conservation Tracking Workflow from Prediction Image",
+        "Animal Tracking [Inputs: Raw Data, Pixel Prediction Map]",
+    ),
+    WorkflowRegistryEntry(
+        ".tracking.structured.structuredTrackingWorkflow",
+        "StructuredTrackingWorkflowFromBinary",
+        "Structured Learning Tracking Workflow from binary image",
+        "Tracking with Learning [Inputs: Raw Data, Binary Image]",
+    ),
+    WorkflowRegistryEntry(
+        ".tracking.structured.structuredTrackingWorkflow",
+        "StructuredTrackingWorkflowFromPrediction",
+        "Structured Learning Tracking Workflow from prediction image",
+        "Tracking with Learning [Inputs: Raw Data, Pixel Prediction Map]",
+    ),
+    WorkflowRegistryEntry(".carving.carvingWorkflow", "CarvingWorkflow", "Carving"),
+    WorkflowRegistryEntry(".counting.countingWorkflow", "CountingWorkflow", "Cell Density Counting"),
+    WorkflowRegistryEntry(
+        ".examples.dataConversion.dataConversionWorkflow", "DataConversionWorkflow", "Data Conversion"
+    ),
+    WorkflowRegistryEntry(
+        ".nnClassification.nnClassificationWorkflow",
+        "NNClassificationWorkflow",
+        "Neural Network Classification",
+        requires=["torch", "inferno", "tiktorch"],
+        config_flag="hbp",
+    ),
+]
+
+# Example workflows, only registered (by importing them) in debug mode
+DEBUG_WORKFLOW_MODULES = [
+    ".wsdt",
+    ".examples.layerViewer",
+    ".examples.thresholdMasking",
+    ".examples.deviationFromMean",
+    ".examples.labeling",
+    ".examples.connectedComponents",
+]
+
+
+def available_workflow_entries():
+    """
+    Registry entries of all workflows that are enabled and whose dependencies can be found.
+    Nothing is imported.
+    """
+    for entry in WORKFLOW_REGISTRY:
+        if not entry.enabled:
+            continue
+        missing = entry.missing_requirements()
+        if missing:
+            if entry.missing_message:
+                logger.warning(entry.missing_message)
+            else:
+                logger.debug(f"{entry.class_name}: could not find required modules: {missing}")
+            continue
+        yield entry
+
+
+def find_workflow_entry(name):
+    """
+    Return the registry entry whose workflow name, class name or display name is ``name``, or None.
+    Like the workflow list, entries whose config flag is not set are not offered.
+    """
+    for entry in WORKFLOW_REGISTRY:
+        if entry.enabled and entry.matches(name):
+            return entry
+    return None
+
+
+_loaded_workflow_classes = None
+
+
+def load_all_workflows():
+    """
+    Import all available workflows and return their classes (in registry order).
+    Workflows that fail to import are skipped with a warning.
+    """
+    global _loaded_workflow_classes
+    if _loaded_workflow_classes is not None:
+        return list(_loaded_workflow_classes)
+
+    workflow_classes = []
+    for entry in available_workflow_entries():
+        try:
+            workflow_classes.append(entry.load())
+        except (ImportError, AttributeError) as e:
+            logger.warning("Failed to import workflow {}; check dependencies: {}".format(entry.class_name, e))
+
+    if ilastik.config.cfg.getboolean("ilastik", "debug"):
+        for module in DEBUG_WORKFLOW_MODULES:
+            importlib.import_module(module, __name__)
+
+    _loaded_workflow_classes = workflow_classes
+    return list(workflow_classes)
+
+
+def __getattr__(name):
+    """
+    Lazy access to ``WORKFLOW_CLASSES``, to registered workflow classes (``ilastik.workflows.CarvingWorkflow``)
+    and to workflow subpackages (``ilastik.workflows.pixelClassification``).
+    """
+    if name.startswith("__"):
+        raise AttributeError(name)
+    if name == "WORKFLOW_CLASSES":
+        return load_all_workflows()
+    for entry in WORKFLOW_REGISTRY:
+        if entry.class_name == name:
+            return entry.load()
+    if importlib.util.find_spec("." + name, __name__) is not None:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
@@ -535,7 +535,7 @@ class CarvingGui(LabelingGui):
             object_supervoxels = mst.object_lut[object_name]
             object_lut = numpy.zeros(mst.nodeNum + 1, dtype=numpy.int32)
             object_lut[object_supervoxels] = 1
-            supervoxel_volume = mst.supervoxelUint32
+            supervoxel_volume = mst.supervoxelUint32[...]
             object_volume = object_lut[supervoxel_volume]
             return object_volume
 
@@ -630,7 +630,7 @@ class CarvingGui(LabelingGui):
             label_name_map[CURRENT_SEGMENTATION_NAME] = self._segmentation_3d_label
             lut[:] = numpy.where(op.MST.value.getSuperVoxelSeg() == 2, self._segmentation_3d_label, lut)
 
-        self._renderMgr.volume = lut[op.MST.value.supervoxelUint32], label_name_map  # (Advanced indexing)
+        self._renderMgr.volume = lut[op.MST.value.supervoxelUint32[...]], label_name_map  # (Advanced indexing)
         self._update_colors()
         self._renderMgr.update()
 
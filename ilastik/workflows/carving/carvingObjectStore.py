@@ -0,0 +1,101 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2020, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+"""
+Columnar storage of saved carving objects in the project file.
+
+All objects of a lane are stored in a handful of datasets: one row per object for the scalar properties, and the
+seed coordinates and supervoxels of all objects concatenated into one dataset each, with an offset table
+(object i owns rows offsets[i]:offsets[i + 1]). Reading and writing thousands of objects therefore touches
+a few compressed datasets instead of thousands of tiny ones.
+
+This layout was introduced with version 0.2 of the CarvingSerializer. Projects saved in it cannot be loaded by
+ilastik versions that only read the older one-group-per-object layout.
+"""
+import numpy
+
+
+def _concatenate(arrays, offsets_name, values_name, group, columns=None):
+    lengths = [len(a) for a in arrays]
+    offsets = numpy.zeros(len(arrays) + 1, dtype=numpy.int64)
+    numpy.cumsum(lengths, out=offsets[1:])
+
+    shape = (0,) if columns is None else (0, columns)
+    values = numpy.concatenate(arrays) if arrays else numpy.zeros(shape, dtype=numpy.int64)
+    group.create_dataset(offsets_name, data=offsets)
+    if len(values) > 0:
+        group.create_dataset(values_name, data=values, compression="gzip", compression_opts=1, shuffle=True)
+    else:
+        group.create_dataset(values_name, data=values)
+
+
+def _split(group, offsets_name, values_name):
+    offsets = group[offsets_name][:]
+    values = group[values_name][:]
+    return [values[offsets[i] : offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def _voxels_to_rows(voxels):
+    # seeds are kept as three coordinate arrays (the result of numpy.where)
+    return numpy.asarray(voxels, dtype=numpy.uint32).reshape(3, -1).transpose()
+
+
+def write_object_store(group, mst):
+    """
+    Stores the saved objects of a WatershedSegmentor into the (empty) hdf5 group.
+    """
+    names = list(mst.object_names.keys())
+    group.create_dataset("names", data=numpy.array([name.encode("utf-8") for name in names], dtype=bytes))
+    group.create_dataset("numbers", data=numpy.array([mst.object_names[n] for n in names], dtype=numpy.int32))
+    group.create_dataset("bg_prio", data=numpy.array([mst.bg_priority[n] for n in names], dtype=numpy.float32))
+    group.create_dataset(
+        "no_bias_below", data=numpy.array([mst.no_bias_below[n] for n in names], dtype=numpy.int32)
+    )
+
+    fg_voxels = [_voxels_to_rows(mst.object_seeds_fg_voxels[n]) for n in names]
+    bg_voxels = [_voxels_to_rows(mst.object_seeds_bg_voxels[n]) for n in names]
+    supervoxels = [numpy.asarray(mst.object_lut[n], dtype=numpy.int64).reshape(-1) for n in names]
+    _concatenate(fg_voxels, "fg_offsets", "fg_voxels", group, columns=3)
+    _concatenate(bg_voxels, "bg_offsets", "bg_voxels", group, columns=3)
+    _concatenate(supervoxels, "sv_offsets", "sv", group)
+
+
+def read_object_store(group, mst):
+    """
+    Adds the objects stored in the hdf5 group to the object dicts of a WatershedSegmentor.
+    Returns the names of the loaded objects.
+    """
+    names = [name.decode("utf-8") for name in group["names"][:]]
+    numbers = group["numbers"][:].tolist()
+    bg_prio = group["bg_prio"][:].tolist()
+    no_bias_below = group["no_bias_below"][:].tolist()
+    fg_voxels = _split(group, "fg_offsets", "fg_voxels")
+    bg_voxels = _split(group, "bg_offsets", "bg_voxels")
+    supervoxels = _split(group, "sv_offsets", "sv")
+
+    for i, name in enumerate(names):
+        mst.object_names[name] = numbers[i]
+        mst.object_seeds_fg_voxels[name] = [fg_voxels[i][:, k].astype(numpy.int64) for k in range(3)]
+        mst.object_seeds_bg_voxels[name] = [bg_voxels[i][:, k].astype(numpy.int64) for k in range(3)]
+        # same layout as numpy.where(...) results: object_lut[name][0] are the supervoxels
+        mst.object_lut[name] = supervoxels[i][numpy.newaxis]
+        mst.bg_priority[name] = bg_prio[i]
+        mst.no_bias_below[name] = no_bias_below[i]
+    return names
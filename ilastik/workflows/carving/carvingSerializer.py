@@ -21,10 +21,13 @@
 from typing import TYPE_CHECKING
 
 from builtins import range
-from ilastik.applets.base.appletSerializer import AppletSerializer, getOrCreateGroup, deleteIfPresent, SerialSlot
+from ilastik.applets.base.appletSerializer import AppletSerializer, deleteIfPresent, SerialSlot
 import numpy
 
-from lazyflow.roi import roiFromShape, roiToSlice
+from lazyflow.utility.timer import Timer
+
+from .carvingObjectStore import read_object_store, write_object_store
+from .objectIndex import SupervoxelObjectIndex
 
 import logging
 
@@ -34,65 +37,49 @@ if TYPE_CHECKING:
     from .opCarving import OpCarving
 
 
+def _stores_columnar_objects(groupVersion):
+    """
+    Whether a project saved with the given StorageVersion keeps its objects in the "object_store" group.
+    """
+    if isinstance(groupVersion, bytes):
+        groupVersion = groupVersion.decode()
+    return groupVersion is not None and float(groupVersion) >= 0.2
+
+
 class CarvingSerializer(AppletSerializer):
+    # 0.1: one group per object under "objects"
+    # 0.2: all objects in the columnar "object_store" group (see carvingObjectStore).
+    #      ilastik versions that only know 0.1 cannot load these objects.
+    version = "0.2"
+
     def __init__(self, operator: "OpCarving", groupName):
         super().__init__(groupName, slots=[SerialSlot(operator.ObjectPrefix)])
         self._o = operator
 
     def _serializeToHdf5(self, topGroup, hdf5File, projectFilePath):
-        obj = getOrCreateGroup(topGroup, "objects")
         for imageIndex, opCarving in enumerate(self._o.innerOperators):
             mst = opCarving._mst
 
             if mst is None:
                 # Nothing to save
                 return
-            # Populate a list of objects to save:
-            objects_to_save = set(list(mst.object_names.keys()))
-            objects_already_saved = set(list(topGroup["objects"]))
-            # 1.) all objects that are in mst.object_names that are not in saved
-            objects_to_save = objects_to_save.difference(objects_already_saved)
-
-            # 2.) add opCarving._dirtyObjects:
-            objects_to_save = objects_to_save.union(opCarving._dirtyObjects)
-
-            for name in objects_to_save:
-                logger.info("[CarvingSerializer] serializing %s" % name)
-
-                if name in obj and name in mst.object_seeds_fg_voxels:
-                    # group already exists
-                    logger.info("  -> changed")
-                elif name not in mst.object_seeds_fg_voxels:
-                    logger.info("  -> deleted")
-                else:
-                    logger.info("  -> added")
-
-                if name not in mst.object_seeds_fg_voxels:
-                    # this object was deleted
-                    deleteIfPresent(obj, name)
-                    continue
-
-                g = getOrCreateGroup(obj, name)
-                deleteIfPresent(g, "fg_voxels")
-                deleteIfPresent(g, "bg_voxels")
-                deleteIfPresent(g, "sv")
-                deleteIfPresent(g, "bg_prio")
-                deleteIfPresent(g, "no_bias_below")
-
-                v = mst.object_seeds_fg_voxels[name]
-                v = [v[i][:, numpy.newaxis] for i in range(3)]
-                v = numpy.concatenate(v, axis=1)
-                g.create_dataset("fg_voxels", data=v)
-                v = mst.object_seeds_bg_voxels[name]
-                v = [v[i][:, numpy.newaxis] for i in range(3)]
-                v = numpy.concatenate(v, axis=1)
-                g.create_dataset("bg_voxels", data=v)
-                g.create_dataset("sv", data=mst.object_lut[name])
 
-                d1 = numpy.asarray(mst.bg_priority[name], dtype=numpy.float32)
-                d2 = numpy.asarray(mst.no_bias_below[name], dtype=numpy.int32)
-                g.create_dataset("bg_prio", data=d1)
-                g.create_dataset("no_bias_below", data=d2)
+            # projects with the 0.1 layout are converted on save
+            if opCarving._dirtyObjects or "object_store" not in topGroup or "objects" in topGroup:
+                with Timer() as timer:
+                    # objects of older projects were stored in one group per object
+                    deleteIfPresent(topGroup, "objects")
+                    deleteIfPresent(topGroup, "object_store")
+                    write_object_store(topGroup.create_group("object_store"), mst)
+
+                    # save the supervoxel -> object index, so that it doesn't need to be rebuilt when loading
+                    deleteIfPresent(topGroup, "object_index")
+                    index_group = topGroup.create_group("object_index")
+                    index_group.attrs["numNodes"] = mst.numNodes
+                    opCarving._objectIndex().serialize(index_group)
+                logger.info(
+                    "[CarvingSerializer] saved {} objects in {} seconds".format(len(mst.object_names), timer.seconds())
+                )
 
             opCarving._dirtyObjects = set()
 
@@ -116,85 +103,61 @@ class CarvingSerializer(AppletSerializer):
 
             logger.info("saved seeds")
 
+    def _deserializeLegacyObjects(self, obj, mst):
+        """
+        Loads objects from projects that stored one group per object.
+        """
+        for i, name in enumerate(obj):
+            logger.info(" loading object with name='%s'" % name)
+            try:
+                g = obj[name]
+                fg_voxels = g["fg_voxels"]
+                bg_voxels = g["bg_voxels"]
+                fg_voxels = [fg_voxels[:, k] for k in range(3)]
+                bg_voxels = [bg_voxels[:, k] for k in range(3)]
+
+                sv = g["sv"].value
+
+                mst.object_names[name] = i + 1
+                mst.object_seeds_fg_voxels[name] = fg_voxels
+                mst.object_seeds_bg_voxels[name] = bg_voxels
+                mst.object_lut[name] = sv
+                mst.bg_priority[name] = g["bg_prio"].value
+                mst.no_bias_below[name] = g["no_bias_below"].value
+            except Exception as e:
+                logger.info("object %s could not be loaded due to exception: %s" % (name, e))
+
     def _deserializeFromHdf5(self, topGroup, groupVersion, hdf5File, projectFilePath, headless=False):
-        obj = topGroup["objects"]
         for imageIndex, opCarving in enumerate(self._o.innerOperators):
             mst = opCarving._mst
 
-            for i, name in enumerate(obj):
-                logger.info(" loading object with name='%s'" % name)
-                try:
-                    g = obj[name]
-                    fg_voxels = g["fg_voxels"]
-                    bg_voxels = g["bg_voxels"]
-                    fg_voxels = [fg_voxels[:, k] for k in range(3)]
-                    bg_voxels = [bg_voxels[:, k] for k in range(3)]
-
-                    sv = g["sv"].value
-
-                    mst.object_names[name] = i + 1
-                    mst.object_seeds_fg_voxels[name] = fg_voxels
-                    mst.object_seeds_bg_voxels[name] = bg_voxels
-                    mst.object_lut[name] = sv
-                    mst.bg_priority[name] = g["bg_prio"].value
-                    mst.no_bias_below[name] = g["no_bias_below"].value
-
-                    logger.info(
-                        "[CarvingSerializer] de-serializing %s, with opCarving=%d, mst=%d"
-                        % (name, id(opCarving), id(mst))
-                    )
-                    logger.info("  %d voxels labeled with green seed" % fg_voxels[0].shape[0])
-                    logger.info("  %d voxels labeled with red seed" % bg_voxels[0].shape[0])
-                    logger.info("  object is made up of %d supervoxels" % sv.size)
-                    logger.info("  bg priority = %f" % mst.bg_priority[name])
-                    logger.info("  no bias below = %d" % mst.no_bias_below[name])
-                except Exception as e:
-                    logger.info("object %s could not be loaded due to exception: %s" % (name, e))
-
-            shape = opCarving.opLabelArray.Output.meta.shape
-            dtype = opCarving.opLabelArray.Output.meta.dtype
-
+            index_group = topGroup.get("object_index")
+            with Timer() as timer:
+                if _stores_columnar_objects(groupVersion) and "object_store" in topGroup:
+                    read_object_store(topGroup["object_store"], mst)
+                else:
+                    self._deserializeLegacyObjects(topGroup.get("objects", {}), mst)
+                    index_group = None
+            logger.info(
+                "[CarvingSerializer] loaded {} objects in {} seconds".format(len(mst.object_names), timer.seconds())
+            )
+
+            if index_group is not None and index_group.attrs.get("numNodes") == mst.numNodes:
+                mst.object_index = SupervoxelObjectIndex.deserialize(index_group)
+            else:
+                # OpCarving._buildDone rebuilds the index from the loaded objects
+                mst.object_index = None
+
+            # restore the current seeds
             fg_voxels = None
-            if "fg_voxels" in list(topGroup.keys()):
-                fg_voxels = topGroup["fg_voxels"]
-                fg_voxels = [fg_voxels[:, k] for k in range(3)]
+            if "fg_voxels" in topGroup:
+                fg_voxels = topGroup["fg_voxels"][:].transpose()
 
             bg_voxels = None
-            if "bg_voxels" in list(topGroup.keys()):
-                bg_voxels = topGroup["bg_voxels"]
-                bg_voxels = [bg_voxels[:, k] for k in range(3)]
+            if "bg_voxels" in topGroup:
+                bg_voxels = topGroup["bg_voxels"][:].transpose()
 
-            # Determine boundings box of seeds so that we can send the smallest
-            # possible array to the WriteSeeds slot.
-
-            # Start with inverse roi
-            total_roi = roiFromShape(opCarving.opLabelArray.Output.meta.shape)
-            bounding_box_roi = numpy.array([total_roi[1][1:4], total_roi[0][1:4]])
-            if fg_voxels is not None and len(fg_voxels[0]) > 0:
-                fg_bounding_box_start = numpy.array(list(map(numpy.min, fg_voxels)))
-                fg_bounding_box_stop = 1 + numpy.array(list(map(numpy.max, fg_voxels)))
-                bounding_box_roi[0] = numpy.minimum(bounding_box_roi[0], fg_bounding_box_start)
-                bounding_box_roi[1] = numpy.maximum(bounding_box_roi[1], fg_bounding_box_stop)
-
-            if bg_voxels is not None and len(bg_voxels[0]) > 0:
-                bg_bounding_box_start = numpy.array(list(map(numpy.min, bg_voxels)))
-                bg_bounding_box_stop = 1 + numpy.array(list(map(numpy.max, bg_voxels)))
-                bounding_box_roi[0] = numpy.minimum(bounding_box_roi[0], bg_bounding_box_start)
-                bounding_box_roi[1] = numpy.maximum(bounding_box_roi[1], bg_bounding_box_stop)
-
-            if (bounding_box_roi[1] > bounding_box_roi[0]).all():
-                z = numpy.zeros(bounding_box_roi[1] - bounding_box_roi[0], dtype=dtype)
-                if fg_voxels is not None:
-                    fg_voxels = fg_voxels - numpy.array([bounding_box_roi[0]]).transpose()
-                    z[list(fg_voxels)] = 2  # fg_voxels is a 3xn numpy array, break it up into a list with three entries
-                if bg_voxels is not None:
-                    bg_voxels = bg_voxels - numpy.array([bounding_box_roi[0]]).transpose()
-                    z[list(bg_voxels)] = 1
-
-                bounding_box_slicing = roiToSlice(bounding_box_roi[0], bounding_box_roi[1])
-                opCarving.WriteSeeds[(slice(0, 1),) + bounding_box_slicing + (slice(0, 1),)] = z[
-                    numpy.newaxis, :, :, :, numpy.newaxis
-                ]
+            if opCarving.writeSeedVoxels(fg_voxels, bg_voxels):
                 logger.info("restored seeds")
 
             opCarving._buildDone()
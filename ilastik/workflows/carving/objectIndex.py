@@ -0,0 +1,141 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2020, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+import numpy
+
+
+class SupervoxelObjectIndex(object):
+    """
+    Inverted index from supervoxel ids to the numbers of the saved carving objects that contain them.
+
+    Most supervoxels belong to at most one object, so the owning object number is kept in a dense array
+    (0 means no object). Supervoxels that are shared by several objects are marked with SHARED in that array
+    and their owners are kept in a dict. Objects are added and removed incrementally as they are saved or deleted.
+    """
+
+    SHARED = -1
+
+    def __init__(self, num_nodes):
+        self._owners = numpy.zeros(num_nodes + 1, dtype=numpy.int32)
+        self._shared = {}  # supervoxel -> set of object numbers
+
+    @property
+    def num_nodes(self):
+        return len(self._owners) - 1
+
+    @staticmethod
+    def _supervoxel_array(supervoxels):
+        # object_lut entries are the result of numpy.where, i.e. a tuple with one array
+        return numpy.unique(numpy.asarray(supervoxels, dtype=numpy.int64).reshape(-1))
+
+    def add(self, object_number, supervoxels):
+        assert object_number > 0, "object numbers start at 1"
+        supervoxels = self._supervoxel_array(supervoxels)
+        owners = self._owners[supervoxels]
+        free = owners == 0
+        self._owners[supervoxels[free]] = object_number
+
+        taken = ~free & (owners != object_number)
+        for sv, owner in zip(supervoxels[taken].tolist(), owners[taken].tolist()):
+            if owner == self.SHARED:
+                self._shared[sv].add(object_number)
+            else:
+                self._shared[sv] = {owner, object_number}
+                self._owners[sv] = self.SHARED
+
+    def remove(self, object_number, supervoxels):
+        supervoxels = self._supervoxel_array(supervoxels)
+        owners = self._owners[supervoxels]
+        self._owners[supervoxels[owners == object_number]] = 0
+
+        for sv in supervoxels[owners == self.SHARED].tolist():
+            objects = self._shared[sv]
+            objects.discard(object_number)
+            if len(objects) <= 1:
+                del self._shared[sv]
+                self._owners[sv] = objects.pop() if objects else 0
+
+    def objects_at(self, supervoxel):
+        """
+        Returns the (sorted) numbers of all objects containing the given supervoxel.
+        """
+        owner = int(self._owners[supervoxel])
+        if owner == self.SHARED:
+            return sorted(self._shared[int(supervoxel)])
+        if owner == 0:
+            return []
+        return [owner]
+
+    def owner_lut(self, supervoxels=None, exclude=None):
+        """
+        For each supervoxel (all of them by default), the number of one object that contains it, 0 for none.
+        Objects with number ``exclude`` are ignored. Supervoxels shared by several objects map to the highest
+        object number among them.
+        """
+        if supervoxels is None:
+            result = self._owners.copy()
+            supervoxels = numpy.arange(len(self._owners))
+        else:
+            supervoxels = numpy.asarray(supervoxels).reshape(-1)
+            result = self._owners[supervoxels]
+
+        if exclude is not None:
+            result[result == exclude] = 0
+        for position in numpy.nonzero(result == self.SHARED)[0].tolist():
+            candidates = self._shared[int(supervoxels[position])] - {exclude}
+            result[position] = max(candidates) if candidates else 0
+        return result
+
+    def object_numbers(self):
+        numbers = set(numpy.unique(self._owners).tolist()) - {0, self.SHARED}
+        for objects in self._shared.values():
+            numbers.update(objects)
+        return numbers
+
+    def serialize(self, group):
+        """
+        Stores the index into the given (empty) hdf5 group.
+        """
+        group.create_dataset("owners", data=self._owners, compression="gzip", compression_opts=4)
+        shared_supervoxels = []
+        shared_objects = []
+        for sv, objects in self._shared.items():
+            shared_supervoxels.extend([sv] * len(objects))
+            shared_objects.extend(objects)
+        group.create_dataset("shared_supervoxels", data=numpy.array(shared_supervoxels, dtype=numpy.int64))
+        group.create_dataset("shared_objects", data=numpy.array(shared_objects, dtype=numpy.int32))
+
+    @classmethod
+    def deserialize(cls, group):
+        index = cls(0)
+        index._owners = group["owners"][:].astype(numpy.int32, copy=False)
+        for sv, object_number in zip(group["shared_supervoxels"][:].tolist(), group["shared_objects"][:].tolist()):
+            index._shared.setdefault(sv, set()).add(object_number)
+        return index
+
+    @classmethod
+    def from_objects(cls, num_nodes, object_lut, object_names):
+        """
+        Builds the index from scratch, from the object_lut and object_names dicts of a WatershedSegmentor.
+        """
+        index = cls(num_nodes)
+        for name, supervoxels in object_lut.items():
+            index.add(object_names[name], supervoxels)
+        return index
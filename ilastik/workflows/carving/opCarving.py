@@ -35,6 +35,8 @@ from lazyflow.operators.valueProviders import OpValueCache
 # ilastik
 from lazyflow.utility.timer import Timer
 from ilastik.applets.base.applet import DatasetConstraintError
+from .objectIndex import SupervoxelObjectIndex
+from .seedIndex import SparseSeedIndex
 
 
 import logging
@@ -113,11 +115,17 @@ class OpCarving(Operator):
     #: User-defined prefix for autogenerated object names
     ObjectPrefix = OutputSlot(stype="string")
 
+    #: Seeds are restored in blocks of at most this shape (see writeSeedVoxels)
+    SEED_BLOCK_SHAPE = (64, 64, 64)
+
     def __init__(self, graph=None, hintOverlayFile=None, pmapOverlayFile=None, parent=None):
         super(OpCarving, self).__init__(graph=graph, parent=parent)
         self.opLabelArray = OpDenseLabelArray(parent=self)
         # self.opLabelArray.EraserLabelValue.setValue( 100 )
         self.opLabelArray.MetaInput.connect(self.InputData)
+        # coordinates of the seeds in opLabelArray, updated whenever seeds are written (see get_label_voxels)
+        self._seedIndex = None
+        self.opLabelArray.DeleteLabel.notifyDirty(self._invalidateSeedIndex)
 
         self._hintOverlayFile = hintOverlayFile
         self._mst = None
@@ -129,6 +137,8 @@ class OpCarving(Operator):
 
         # supervoxels of finished and saved objects
         self._done_seg_lut = None
+        # the object that was left out of self._done_seg_lut, because it is being edited
+        self._done_excluded_name = None
         self._hints = None
         self._pmap = None
         if hintOverlayFile is not None:
@@ -198,6 +208,9 @@ class OpCarving(Operator):
         self.opLabelArray.DeleteLabel.setValue(2)
         self.opLabelArray.DeleteLabel.setValue(1)
         self.opLabelArray.DeleteLabel.setValue(-1)
+        # no seeds are left, so there is nothing to rebuild
+        if self.opLabelArray.Output.meta.shape is not None:
+            self._seedIndex = SparseSeedIndex(self.opLabelArray.Output.meta.shape[1:4])
         if self._mst is not None:
             self._mst.clearSeeds()
         self.has_seeds = False
@@ -209,26 +222,61 @@ class OpCarving(Operator):
         self._currObjectName = n
         self.CurrentObjectName.setValue(n)
 
+    def _objectIndex(self):
+        """
+        The supervoxel -> object index of the current MST, built from the saved objects if it is missing.
+        """
+        index = getattr(self._mst, "object_index", None)
+        if index is None or index.num_nodes != self._mst.numNodes:
+            index = self._rebuildObjectIndex()
+        return index
+
+    def _rebuildObjectIndex(self):
+        with Timer() as timer:
+            index = SupervoxelObjectIndex.from_objects(
+                self._mst.numNodes, self._mst.object_lut, self._mst.object_names
+            )
+            self._mst.object_index = index
+        logger.info("building the supervoxel -> object index took {} seconds".format(timer.seconds()))
+        return index
+
     def _buildDone(self):
         """
-        Builds the done segmentation anew, for example after saving an object or
-        deleting an object.
+        Builds the done segmentation anew, for example after loading a project.
         """
         if self._mst is None:
             return
         with Timer() as timer:
-            self._done_seg_lut = numpy.zeros(self._mst.numNodes + 1, dtype=numpy.int32)
             logger.info("building 'done' lut")
-            for name, objectSupervoxels in self._mst.object_lut.items():
-                if name == self._currObjectName:
-                    continue
-                assert name in self._mst.object_names, "%s not in self._mst.object_names, keys are %r" % (
-                    name,
-                    list(self._mst.object_names.keys()),
-                )
-                self._done_seg_lut[objectSupervoxels] = self._mst.object_names[name]
+            self._done_excluded_name = self._currObjectName
+            exclude = self._mst.object_names.get(self._currObjectName)
+            self._done_seg_lut = self._objectIndex().owner_lut(exclude=exclude)
         logger.info("building the 'done' luts took {} seconds".format(timer.seconds()))
 
+    def _updateDone(self, *supervoxel_arrays):
+        """
+        Patches the done segmentation for the given supervoxels, for example after saving an object or
+        deleting an object. Supervoxels of the current object and of the object that was current before
+        are updated as well.
+        """
+        if self._mst is None:
+            return
+        if self._done_seg_lut is None or len(self._done_seg_lut) != self._mst.numNodes + 1:
+            self._buildDone()
+            return
+
+        changed = [numpy.zeros((0,), dtype=numpy.int64)]
+        changed += [numpy.asarray(svs, dtype=numpy.int64).reshape(-1) for svs in supervoxel_arrays]
+        if self._done_excluded_name != self._currObjectName:
+            for name in (self._done_excluded_name, self._currObjectName):
+                if name in self._mst.object_lut:
+                    changed.append(numpy.asarray(self._mst.object_lut[name], dtype=numpy.int64).reshape(-1))
+            self._done_excluded_name = self._currObjectName
+
+        changed = numpy.unique(numpy.concatenate(changed))
+        exclude = self._mst.object_names.get(self._currObjectName)
+        self._done_seg_lut[changed] = self._objectIndex().owner_lut(changed, exclude=exclude)
+
     def dataIsStorable(self):
         if self._mst is None:
             return False
@@ -241,6 +289,7 @@ class OpCarving(Operator):
             return True
 
     def setupOutputs(self):
+        self._invalidateSeedIndex()
         self.Segmentation.meta.assignFrom(self.InputData.meta)
         self.Segmentation.meta.dtype = numpy.uint32
 
@@ -308,10 +357,8 @@ class OpCarving(Operator):
 
         # find the supervoxel that was clicked
         sv = self._mst.supervoxelUint32[position3d]
-        names = []
-        for name, objectSupervoxels in self._mst.object_lut.items():
-            if numpy.sum(sv == objectSupervoxels) > 0:
-                names.append(name)
+        object_numbers = set(self._objectIndex().objects_at(sv))
+        names = [name for name, number in self._mst.object_names.items() if number in object_numbers]
         logger.info("click on %r, supervoxel=%d: %r" % (position3d, sv, names))
         return names
 
@@ -378,8 +425,8 @@ class OpCarving(Operator):
         self._setCurrObjectName(name)
         self.HasSegmentation.setValue(True)
 
-        # now that 'name' is no longer part of the set of finished objects, rebuild the done overlay
-        self._buildDone()
+        # now that 'name' is no longer part of the set of finished objects, update the done overlay
+        self._updateDone()
         return (fgVoxelsSeedPos, bgVoxelsSeedPos)
 
     def loadObject(self, name):
@@ -394,38 +441,9 @@ class OpCarving(Operator):
 
         fgVoxels, bgVoxels = self.loadObject_impl(name)
 
-        fg_bounding_box_start = numpy.array(list(map(numpy.min, fgVoxels)))
-        fg_bounding_box_stop = 1 + numpy.array(list(map(numpy.max, fgVoxels)))
-
-        bg_bounding_box_start = numpy.array(list(map(numpy.min, bgVoxels)))
-        bg_bounding_box_stop = 1 + numpy.array(list(map(numpy.max, bgVoxels)))
-
-        bounding_box_start = numpy.minimum(fg_bounding_box_start, bg_bounding_box_start)
-        bounding_box_stop = numpy.maximum(fg_bounding_box_stop, bg_bounding_box_stop)
-
-        bounding_box_slicing = roiToSlice(bounding_box_start, bounding_box_stop)
-
-        bounding_box_shape = tuple(bounding_box_stop - bounding_box_start)
-        dtype = self.opLabelArray.Output.meta.dtype
-
-        # Convert coordinates to be relative to bounding box
-        fgVoxels = numpy.array(fgVoxels)
-        fgVoxels = fgVoxels - numpy.array([bounding_box_start]).transpose()
-        fgVoxels = list(fgVoxels)
-
-        bgVoxels = numpy.array(bgVoxels)
-        bgVoxels = bgVoxels - numpy.array([bounding_box_start]).transpose()
-        bgVoxels = list(bgVoxels)
-
         with Timer() as timer:
             logger.info("Loading seeds....")
-            z = numpy.zeros(bounding_box_shape, dtype=dtype)
-            logger.info("Allocating seed array took {} seconds".format(timer.seconds()))
-            z[fgVoxels] = 2
-            z[bgVoxels] = 1
-            self.WriteSeeds[(slice(0, 1),) + bounding_box_slicing + (slice(0, 1),)] = z[
-                numpy.newaxis, :, :, :, numpy.newaxis
-            ]
+            self.writeSeedVoxels(fgVoxels, bgVoxels)
         logger.info("Loading seeds took a total of {} seconds".format(timer.seconds()))
 
         # restore the correct parameter values
@@ -458,6 +476,10 @@ class OpCarving(Operator):
         # clean seeds
         # lut_seeds[:] = 0
 
+        objectSupervoxels = self._mst.object_lut[name]
+        if name in self._mst.object_names:
+            self._objectIndex().remove(self._mst.object_names[name], objectSupervoxels)
+
         del self._mst.object_lut[name]
         del self._mst.object_seeds_fg_voxels[name]
         del self._mst.object_seeds_bg_voxels[name]
@@ -471,8 +493,8 @@ class OpCarving(Operator):
 
         self._setCurrObjectName("<not saved yet>")
 
-        # now that 'name' has been deleted, rebuild the done overlay
-        self._buildDone()
+        # now that 'name' has been deleted, update the done overlay
+        self._updateDone(objectSupervoxels)
         # self.updatePreprocessing()
 
     def deleteObject(self, name):
@@ -533,7 +555,11 @@ class OpCarving(Operator):
         self._mst.bg_priority[name] = self.BackgroundPriority.value
         self._mst.no_bias_below[name] = self.NoBiasBelow.value
 
+        index = self._objectIndex()
+        previousSupervoxels = self._mst.object_lut.get(name, ())
+        index.remove(objNr, previousSupervoxels)
         self._mst.object_lut[name] = numpy.where(sVseg == 2)
+        index.add(objNr, self._mst.object_lut[name])
 
         self._setCurrObjectName("<not saved yet>")
         self.HasSegmentation.setValue(False)
@@ -541,9 +567,8 @@ class OpCarving(Operator):
         objects = list(self._mst.object_names.keys())
         self.AllObjectNames.meta.shape = (len(objects),)
 
-        # now that 'name' is no longer part of the set of finished objects, rebuild the done overlay
-
-        self._buildDone()
+        # now that 'name' is no longer part of the set of finished objects, update the done overlay
+        self._updateDone(previousSupervoxels, self._mst.object_lut[name])
         # self._clearLabels()
         # self._mst.clearSegmentation()
         # self.clearCurrentLabeling()
@@ -551,35 +576,78 @@ class OpCarving(Operator):
         # self.Trigger.setDirty(slice(None))
         # self.updatePreprocessing()
 
+    def _invalidateSeedIndex(self, *args):
+        # Deleting a label may also shift the values of other labels, so the index is rebuilt when needed
+        self._seedIndex = None
+
+    def _getSeedIndex(self):
+        """
+        The seed index, built from the nonzero blocks of the label array if it was invalidated.
+        """
+        index = self._seedIndex
+        if index is not None:
+            return index
+
+        with Timer() as timer:
+            index = SparseSeedIndex(self.opLabelArray.Output.meta.shape[1:4])
+            nonzeroSlicings = self.opLabelArray.NonzeroBlocks[:].wait()[0]
+            for sl in nonzeroSlicings:
+                a = self.opLabelArray.Output[sl].wait()
+                index.write([sl[i].start for i in range(1, 4)], a[0, ..., 0])
+        logger.info("building the seed index took {} seconds".format(timer.seconds()))
+        self._seedIndex = index
+        return index
+
     def get_label_voxels(self):
         # the voxel coordinates of fg and bg labels
         if not self.opLabelArray.NonzeroBlocks.ready():
             return (None, None)
 
-        nonzeroSlicings = self.opLabelArray.NonzeroBlocks[:].wait()[0]
-
-        coors1 = [[], [], []]
-        coors2 = [[], [], []]
-        for sl in nonzeroSlicings:
-            a = self.opLabelArray.Output[sl].wait()
-            w1 = numpy.where(a == 1)
-            w2 = numpy.where(a == 2)
-            w1 = [w1[i] + sl[i].start for i in range(1, 4)]
-            w2 = [w2[i] + sl[i].start for i in range(1, 4)]
-            for i in range(3):
-                coors1[i].append(w1[i])
-                coors2[i].append(w2[i])
-
-        for i in range(3):
-            if len(coors1[i]) > 0:
-                coors1[i] = numpy.concatenate(coors1[i], 0)
-            else:
-                coors1[i] = numpy.ndarray((0,), numpy.int32)
-            if len(coors2[i]) > 0:
-                coors2[i] = numpy.concatenate(coors2[i], 0)
-            else:
-                coors2[i] = numpy.ndarray((0,), numpy.int32)
-        return (coors2, coors1)
+        index = self._getSeedIndex()
+        return (index.label_coordinates(2), index.label_coordinates(1))
+
+    def writeSeedVoxels(self, fgVoxels, bgVoxels):
+        """
+        Writes seeds, given as coordinate arrays (z, y, x) like the result of numpy.where, into WriteSeeds.
+        The seeds are grouped by blocks of SEED_BLOCK_SHAPE and written block by block, so that only small
+        arrays around the seeds are allocated, no matter how far apart the seeds are.
+        Returns True if any seeds were written.
+        """
+        dtype = self.opLabelArray.Output.meta.dtype
+        coords = []
+        values = []
+        # background is written last, so it wins where both seeds were placed
+        for voxels, value in ((fgVoxels, 2), (bgVoxels, 1)):
+            if voxels is None or len(voxels[0]) == 0:
+                continue
+            voxels = numpy.asarray(voxels, dtype=numpy.int64).reshape(3, -1)
+            coords.append(voxels)
+            values.append(numpy.full(voxels.shape[1], value, dtype=dtype))
+        if not coords:
+            return False
+
+        coords = numpy.concatenate(coords, axis=1)
+        values = numpy.concatenate(values)
+        block_ids = coords // numpy.array(self.SEED_BLOCK_SHAPE)[:, numpy.newaxis]
+        order = numpy.lexsort(block_ids[::-1])  # stable, keeps background after foreground within a block
+        coords = coords[:, order]
+        values = values[order]
+        block_ids = block_ids[:, order]
+
+        boundaries = numpy.flatnonzero((numpy.diff(block_ids, axis=1) != 0).any(axis=0)) + 1
+        starts = numpy.concatenate([[0], boundaries])
+        stops = numpy.concatenate([boundaries, [len(values)]])
+        for start, stop in zip(starts, stops):
+            block_coords = coords[:, start:stop]
+            box_start = block_coords.min(axis=1)
+            box_stop = block_coords.max(axis=1) + 1
+            seeds = numpy.zeros(tuple(box_stop - box_start), dtype=dtype)
+            seeds[tuple(block_coords - box_start[:, numpy.newaxis])] = values[start:stop]
+            self.WriteSeeds[(slice(0, 1),) + roiToSlice(box_start, box_stop) + (slice(0, 1),)] = seeds[
+                numpy.newaxis, :, :, :, numpy.newaxis
+            ]
+        logger.info("Wrote {} seeds in {} blocks".format(len(values), len(starts)))
+        return True
 
     def saveObjectAs(self, name):
         # first, save the object under "name"
@@ -670,6 +738,13 @@ class OpCarving(Operator):
                 self.opLabelArray.LabelSinkInput[roi.toSlice()] = value
                 logger.info("Writing seeds to label array took {} seconds".format(timer.seconds()))
 
+            # An invalid index is rebuilt from the label array (which already contains these seeds) when needed
+            seedIndex = self._seedIndex
+            if seedIndex is not None:
+                eraser = self.opLabelArray.EraserLabelValue
+                eraser_value = eraser.value if eraser.ready() else None
+                seedIndex.write(roi.start[1:4], value.reshape(value.shape[1:4]), eraser_value)
+
             assert self._mst is not None
 
             # Important: mst.seeds will requires erased values to be 255 (a.k.a -1)
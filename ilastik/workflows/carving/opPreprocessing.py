@@ -427,6 +427,8 @@ class OpPreprocessing(Operator):
             mst.object_seeds_fg_voxels = self._prepData[0].object_seeds_fg_voxels
             mst.bg_priority = self._prepData[0].bg_priority
             mst.no_bias_below = self._prepData[0].no_bias_below
+            # rebuilt from object_lut by OpCarving when needed
+            mst.object_index = None
 
         # Cache result
         self._prepData = result
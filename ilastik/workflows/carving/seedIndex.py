@@ -0,0 +1,87 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2020, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+import threading
+
+import numpy
+
+
+class SparseSeedIndex(object):
+    """
+    Coordinates and values of all labeled voxels of a 3D label volume, kept up to date as labels are written.
+
+    Entries are grouped by blocks of ``block_shape``, so that a write only touches the entries of the blocks it
+    overlaps. Fetching all voxels of one label is a concatenation over the blocks; no label data is scanned.
+    """
+
+    def __init__(self, shape, block_shape=(64, 64, 64)):
+        self.shape = tuple(int(s) for s in shape)
+        self._block_shape = numpy.array(block_shape, dtype=numpy.int64)
+        self._grid_shape = tuple(int(g) for g in -(-numpy.array(self.shape) // self._block_shape))
+        self._blocks = {}  # flat block index -> (flat voxel indices, label values)
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+
+    def write(self, start, labels, eraser_value=None):
+        """
+        Applies a write of the (3D) ``labels`` array at position ``start``, with the semantics of the label arrays:
+        voxels with value 0 remain unchanged, voxels with ``eraser_value`` are unlabeled and all others are set.
+        """
+        nonzero = numpy.nonzero(labels)
+        if len(nonzero[0]) == 0:
+            return
+        values = labels[nonzero]
+        coords = numpy.array(nonzero, dtype=numpy.int64) + numpy.asarray(start, dtype=numpy.int64)[:, numpy.newaxis]
+        flat = numpy.ravel_multi_index(tuple(coords), self.shape)
+        block_keys = numpy.ravel_multi_index(tuple(coords // self._block_shape[:, numpy.newaxis]), self._grid_shape)
+
+        order = numpy.argsort(block_keys, kind="stable")
+        flat, values, block_keys = flat[order], values[order], block_keys[order]
+        boundaries = numpy.flatnonzero(numpy.diff(block_keys)) + 1
+        with self._lock:
+            for begin, end in zip(numpy.concatenate([[0], boundaries]), numpy.concatenate([boundaries, [len(flat)]])):
+                key = int(block_keys[begin])
+                new_flat, new_values = flat[begin:end], values[begin:end]
+                if eraser_value is not None:
+                    keep_new = new_values != eraser_value
+                    written_flat, new_flat, new_values = new_flat, new_flat[keep_new], new_values[keep_new]
+                else:
+                    written_flat = new_flat
+
+                old_flat, old_values = self._blocks.get(key, (new_flat[:0], new_values[:0]))
+                keep_old = ~numpy.isin(old_flat, written_flat)
+                merged_flat = numpy.concatenate([old_flat[keep_old], new_flat])
+                if len(merged_flat) == 0:
+                    self._blocks.pop(key, None)
+                else:
+                    self._blocks[key] = (merged_flat, numpy.concatenate([old_values[keep_old], new_values]))
+
+    def label_coordinates(self, label):
+        """
+        Returns the coordinates of all voxels with the given label, as three arrays (like numpy.where).
+        """
+        with self._lock:
+            flat = [block_flat[block_values == label] for block_flat, block_values in self._blocks.values()]
+        if not flat:
+            return [numpy.zeros((0,), dtype=numpy.int64) for _ in range(3)]
+        return list(numpy.unravel_index(numpy.concatenate(flat), self.shape))
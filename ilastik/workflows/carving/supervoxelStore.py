@@ -0,0 +1,183 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2020, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+"""
+Chunked on-disk storage for the supervoxel volume of the carving MST.
+
+The carving graph itself (ilastiktools.GridSegmentor) has to stay in memory, but the python side only needs
+small regions of the supervoxel volume: the tiles that are displayed and the supervoxel under a click.
+For big volumes, the supervoxels computed by preprocessing are kept in a temporary chunked hdf5 file instead,
+and served through an LRU cache of blocks. Supervoxels loaded from a project file stay in memory.
+"""
+import itertools
+import logging
+import os
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+import h5py
+import numpy
+
+logger = logging.getLogger(__name__)
+
+
+def supervoxel_chunk_shape(shape, target_voxels=64 ** 3):
+    """
+    Roughly isotropic chunk shape with about target_voxels voxels; singleton axes stay singleton.
+    """
+    chunk = numpy.array([max(1, s) for s in shape])
+    while numpy.prod(chunk) > target_voxels:
+        axis = int(numpy.argmax(chunk))
+        chunk[axis] = (chunk[axis] + 1) // 2
+    return tuple(int(c) for c in chunk)
+
+
+def copy_blockwise(source, destination, chunk_shape):
+    """
+    Copies source into destination (same shape) one chunk at a time.
+    """
+    chunk_ranges = [range(0, s, c) for s, c in zip(source.shape, chunk_shape)]
+    for chunk_start in itertools.product(*chunk_ranges):
+        slicing = tuple(slice(b, min(b + c, s)) for b, c, s in zip(chunk_start, chunk_shape, source.shape))
+        destination[slicing] = source[slicing]
+
+
+def _remove_file(h5_file, path):
+    try:
+        h5_file.close()
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class ChunkedSupervoxels(object):
+    """
+    Read-only supervoxel volume, stored chunked (and compressed) in a temporary hdf5 file.
+
+    Supports the indexing used by OpCarving: a tuple of slices (returns an array) or of integers (returns a
+    scalar). Decoded chunks are kept in an LRU cache of ``cache_chunks`` entries. ``volume[...]`` loads everything.
+    The temporary file is removed when the object is garbage collected.
+    """
+
+    def __init__(self, dataset, cache_chunks=256):
+        self._dataset = dataset
+        self.shape = tuple(dataset.shape)
+        self.dtype = dataset.dtype
+        self.ndim = len(self.shape)
+        self.chunk_shape = tuple(dataset.chunks)
+        self._cache_chunks = cache_chunks
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_array(cls, array, directory=None, cache_chunks=256):
+        """
+        Writes array (a numpy array or an hdf5 dataset) into a new temporary file, chunk by chunk.
+        """
+        fd, path = tempfile.mkstemp(prefix="ilastik-supervoxels-", suffix=".h5", dir=directory)
+        os.close(fd)
+        h5_file = h5py.File(path, "w")
+        chunk_shape = supervoxel_chunk_shape(array.shape)
+        dataset = h5_file.create_dataset(
+            "supervoxels", shape=array.shape, dtype=array.dtype, chunks=chunk_shape, compression="lzf"
+        )
+        copy_blockwise(array, dataset, chunk_shape)
+        h5_file.flush()
+        logger.debug(f"stored supervoxels of shape {array.shape} in {path} with chunks {chunk_shape}")
+
+        volume = cls(dataset, cache_chunks=cache_chunks)
+        weakref.finalize(volume, _remove_file, h5_file, path)
+        return volume
+
+    def _get_chunk(self, chunk_index):
+        with self._lock:
+            chunk = self._cache.get(chunk_index)
+            if chunk is not None:
+                self._cache.move_to_end(chunk_index)
+                return chunk
+
+        slicing = tuple(
+            slice(i * c, min((i + 1) * c, s)) for i, c, s in zip(chunk_index, self.chunk_shape, self.shape)
+        )
+        chunk = self._dataset[slicing]
+        with self._lock:
+            self._cache[chunk_index] = chunk
+            while len(self._cache) > self._cache_chunks:
+                self._cache.popitem(last=False)
+        return chunk
+
+    def _normalize_key(self, key):
+        if key is Ellipsis:
+            key = ()
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > self.ndim:
+            raise IndexError(f"too many indices for supervoxel volume of shape {self.shape}")
+
+        starts, stops, scalar_axes = [], [], []
+        for axis, size in enumerate(self.shape):
+            k = key[axis] if axis < len(key) else slice(None)
+            if isinstance(k, slice):
+                if k.step not in (None, 1):
+                    raise IndexError("strided access is not supported")
+                start, stop, _ = k.indices(size)
+                starts.append(start)
+                stops.append(max(start, stop))
+            elif isinstance(k, (int, numpy.integer)):
+                k = int(k) + size if k < 0 else int(k)
+                if not 0 <= k < size:
+                    raise IndexError(f"index {k} is out of bounds for axis {axis} with size {size}")
+                starts.append(k)
+                stops.append(k + 1)
+                scalar_axes.append(axis)
+            else:
+                raise IndexError(f"unsupported index {k!r} for supervoxel volume")
+        return starts, stops, scalar_axes
+
+    def __getitem__(self, key):
+        starts, stops, scalar_axes = self._normalize_key(key)
+        result = numpy.zeros([stop - start for start, stop in zip(starts, stops)], dtype=self.dtype)
+
+        if result.size > 0:
+            chunk_ranges = [
+                range(start // c, (stop - 1) // c + 1) for start, stop, c in zip(starts, stops, self.chunk_shape)
+            ]
+            for chunk_index in itertools.product(*chunk_ranges):
+                chunk = self._get_chunk(chunk_index)
+                chunk_start = [i * c for i, c in zip(chunk_index, self.chunk_shape)]
+                overlap_start = [max(a, b) for a, b in zip(starts, chunk_start)]
+                overlap_stop = [min(a, b + n) for a, b, n in zip(stops, chunk_start, chunk.shape)]
+                result_slicing = tuple(slice(b - o, e - o) for b, e, o in zip(overlap_start, overlap_stop, starts))
+                chunk_slicing = tuple(slice(b - o, e - o) for b, e, o in zip(overlap_start, overlap_stop, chunk_start))
+                result[result_slicing] = chunk[chunk_slicing]
+
+        if scalar_axes:
+            result = result.reshape([n for axis, n in enumerate(result.shape) if axis not in scalar_axes])
+            if result.ndim == 0:
+                return result[()]
+        return result
+
+    def __array__(self, dtype=None):
+        return numpy.asarray(self[...], dtype=dtype)
+
+    def squeeze(self):
+        return self[...].squeeze()
@@ -2,6 +2,12 @@ import ilastiktools
 import h5py
 import numpy
 
+from .objectIndex import SupervoxelObjectIndex
+from .supervoxelStore import ChunkedSupervoxels, copy_blockwise, supervoxel_chunk_shape
+
+#: Preprocessed supervoxel volumes with at least this many voxels are kept on disk (see ChunkedSupervoxels)
+SUPERVOXELS_ON_DISK_MIN_VOXELS = 256 ** 3
+
 
 class WatershedSegmentor(object):
     def __init__(self, labels=None, volume_feat=None, edgeWeightFunctor=None, progressCallback=None, h5file=None):
@@ -35,6 +41,7 @@ class WatershedSegmentor(object):
             self.numNodes = self.nodeNum
 
             self.hasSeg = False
+            self._moveSupervoxelsToDisk()
         else:
             self.numNodes = h5file.attrs["numNodes"]
             self.nodeNum = self.numNodes
@@ -65,8 +72,23 @@ class WatershedSegmentor(object):
                     resultSegmentation=resultSegmentation,
                 )
 
+            # The labels were read from the project file anyway; copying them into a temporary file on every
+            # load would cost a full write without lowering the peak memory, so they stay in memory here.
             self.hasSeg = resultSegmentation.max() > 0
 
+        # supervoxel -> saved objects, maintained by OpCarving
+        self.object_index = SupervoxelObjectIndex(self.numNodes)
+
+    def _moveSupervoxelsToDisk(self):
+        """
+        After preprocessing, the supervoxels used for display and picking are a private copy next to the one
+        inside the grid segmentor. For big volumes, that copy is moved to a chunked temporary file once the
+        grid has been built. This does not lower the peak memory of preprocessing, only what stays resident.
+        """
+        supervoxels = self.supervoxelUint32
+        if isinstance(supervoxels, numpy.ndarray) and supervoxels.size >= SUPERVOXELS_ON_DISK_MIN_VOXELS:
+            self.supervoxelUint32 = ChunkedSupervoxels.from_array(self.supervoxelUint32)
+
     def run(self, unaries, prios=None, uncertainty="exchangeCount", moving_average=False, noBiasBelow=0, **kwargs):
         self.gridSegmentor.run(float(prios[1]), float(noBiasBelow))
         self.hasSeg = True
@@ -125,7 +147,17 @@ class WatershedSegmentor(object):
         g = h5g
 
         g.attrs["numNodes"] = self.numNodes
-        g.create_dataset("labels", data=self.supervoxelUint32, compression="gzip", compression_opts=4)
+        # chunked, so that the supervoxels can be read blockwise when loading
+        chunks = supervoxel_chunk_shape(self.supervoxelUint32.shape)
+        labels = g.create_dataset(
+            "labels",
+            shape=self.supervoxelUint32.shape,
+            dtype=self.supervoxelUint32.dtype,
+            chunks=chunks,
+            compression="gzip",
+            compression_opts=4,
+        )
+        copy_blockwise(self.supervoxelUint32, labels, chunks)
 
         gridSeg = self.gridSegmentor
         g.create_dataset("graph", data=gridSeg.serializeGraph())
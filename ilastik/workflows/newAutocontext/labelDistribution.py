@@ -0,0 +1,152 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2020, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+"""
+Copying or partitioning the labels of one autocontext stage into other stages.
+
+Labels are only read from the nonzero blocks of the source label array. Every block is processed by its own request,
+and each destination stage receives a single write per block: there is no need to clear label values one by one,
+because the labels that move away from the source stage are overwritten with the eraser value.
+"""
+import logging
+import threading
+
+import numpy as np
+
+from lazyflow.request import Request, RequestPool
+
+logger = logging.getLogger(__name__)
+
+
+def partition_block(block_labels, destinations, random_state, eraser_value=None, source=None):
+    """
+    Randomly assign every labeled pixel of a block to exactly one of the destinations.
+
+    :param block_labels: label block (0 means unlabeled)
+    :param destinations: destination keys, e.g. stage indexes
+    :param random_state: numpy.random.RandomState used for the assignment
+    :param eraser_value: if given, the block for ``source`` gets this value at labeled pixels that were assigned to
+                         another destination, so that writing it removes them from the source label array
+    :param source: key of the destination the labels are read from (only used with ``eraser_value``)
+    :returns: dict destination -> block to write into that destination
+    """
+    labeled = block_labels != 0
+    assignment = random_state.randint(len(destinations), size=block_labels.shape)
+    blocks = {}
+    for index, destination in enumerate(destinations):
+        selected = assignment == index
+        if eraser_value is not None and destination == source:
+            this_block = np.where(labeled, eraser_value, 0).astype(block_labels.dtype)
+            this_block[selected] = block_labels[selected]
+        else:
+            this_block = np.where(selected, block_labels, 0).astype(block_labels.dtype, copy=False)
+        blocks[destination] = this_block
+    return blocks
+
+
+class LabelDistributor(object):
+    """
+    Distributes the labels of one OpPixelClassification (the source stage) to several others, lane by lane.
+
+    Usage:
+        distributor = LabelDistributor(source_op, {stage_index: op_pc, ...}, source_stage_index, partition=True)
+        distributor.run()
+
+    With ``partition``, every labeled pixel ends up in exactly one (randomly chosen) destination stage; the source
+    stage itself may be one of the destinations. Otherwise the labels are copied to all destinations.
+    """
+
+    #: Number of label blocks that are processed concurrently
+    BATCH_SIZE = 64
+
+    def __init__(self, source_op, destination_ops, source_stage_index, partition, progress_callback=None, seed=None):
+        self._source_op = source_op
+        self._destination_ops = destination_ops
+        self._source_stage_index = source_stage_index
+        self._partition = partition
+        self._progress_callback = progress_callback or (lambda progress: None)
+        self._random_state = np.random.RandomState(seed)
+        self._write_lock = threading.Lock()
+
+    def run(self):
+        self._progress_callback(0)
+        source_lanes = [
+            self._source_op.getLane(lane_index) for lane_index in range(len(self._source_op.InputImages))
+        ]
+        lane_blocks = [list(opLane.NonzeroLabelBlocks.value) for opLane in source_lanes]
+        num_blocks = sum(map(len, lane_blocks))
+        logger.info(
+            f"{'Partitioning' if self._partition else 'Copying'} {num_blocks} label blocks "
+            f"of stage {self._source_stage_index} into stages {list(self._destination_ops.keys())}"
+        )
+
+        done = 0
+        for lane_index, block_slicings in enumerate(lane_blocks):
+            # Seeds are drawn up front, so the result does not depend on the order in which the blocks are processed
+            seeds = self._random_state.randint(2 ** 31, size=len(block_slicings))
+            destination_lanes = {
+                stage_index: op.getLane(lane_index) for stage_index, op in self._destination_ops.items()
+            }
+            for batch_start in range(0, len(block_slicings), self.BATCH_SIZE):
+                batch = list(zip(block_slicings, seeds))[batch_start : batch_start + self.BATCH_SIZE]
+                pool = RequestPool()
+                for block_slicing, seed in batch:
+                    distribute_block = self._make_block_distributor(
+                        source_lanes[lane_index], destination_lanes, block_slicing, seed
+                    )
+                    pool.add(Request(distribute_block))
+                pool.wait()
+                done += len(batch)
+                self._progress_callback(min(99, 100 * done // max(1, num_blocks)))
+
+        self._progress_callback(100)
+
+    def _make_block_distributor(self, source_lane, destination_lanes, block_slicing, seed):
+        def distribute_block():
+            self._distribute_block(source_lane, destination_lanes, block_slicing, seed)
+
+        return distribute_block
+
+    def _distribute_block(self, source_lane, destination_lanes, block_slicing, seed):
+        block_labels = source_lane.LabelImages[block_slicing].wait()
+        if not block_labels.any():
+            return
+
+        if self._partition:
+            eraser_value = source_lane.opLabelPipeline.opLabelArray.eraser.value
+            blocks = partition_block(
+                block_labels,
+                list(destination_lanes.keys()),
+                np.random.RandomState(seed),
+                eraser_value=eraser_value,
+                source=self._source_stage_index,
+            )
+        else:
+            # Copying the labels onto themselves would not change anything
+            blocks = {
+                stage_index: block_labels
+                for stage_index in destination_lanes.keys()
+                if stage_index != self._source_stage_index
+            }
+
+        with self._write_lock:
+            for stage_index, this_stage_block_labels in blocks.items():
+                if this_stage_block_labels.any():
+                    destination_lanes[stage_index].LabelInputs[block_slicing] = this_stage_block_labels
@@ -34,15 +34,18 @@ logger = logging.getLogger(__name__)
 import numpy as np
 
 from ilastik.config import cfg as ilastik_config
+from ilastik.utility import log_exception
 from ilastik.workflow import Workflow
 from ilastik.applets.base.applet import DatasetConstraintError
 from ilastik.applets.dataSelection import DataSelectionApplet
 from ilastik.applets.featureSelection import FeatureSelectionApplet
 from ilastik.applets.pixelClassification import PixelClassificationApplet, PixelClassificationDataExportApplet
 from ilastik.applets.batchProcessing import BatchProcessingApplet
+from ilastik.workflows.newAutocontext.labelDistribution import LabelDistributor
 
 from lazyflow.graph import Graph
-from lazyflow.roi import TinyVector, sliceToRoi, roiToSlice
+from lazyflow.roi import TinyVector
+from lazyflow.request import Request
 from lazyflow.operators.generic import OpMultiArrayStacker
 from lazyflow.operators.valueProviders import OpMetadataInjector
 
@@ -526,10 +529,13 @@ class NewAutocontextWorkflowBase(Workflow):
         Overridden from Workflow base class
         """
         from PyQt5.QtWidgets import QMenu
+        from ilastik.utility.gui import ThreadRouter
 
         autocontext_menu = QMenu("Autocontext Utilities")
-        distribute_action = autocontext_menu.addAction("Distribute Labels...")
-        distribute_action.triggered.connect(self.distribute_labels_from_current_stage)
+        self._distribute_action = autocontext_menu.addAction("Distribute Labels...")
+        self._distribute_action.triggered.connect(self.distribute_labels_from_current_stage)
+        # The label distribution finishes in a background request; its handlers are routed back to the GUI thread
+        self._threadRouter = ThreadRouter(autocontext_menu)
 
         self._autocontext_menu = (
             autocontext_menu
@@ -543,6 +549,10 @@ class NewAutocontextWorkflowBase(Workflow):
         # Late import.
         # (Don't import PyQt in headless mode.)
         from PyQt5.QtWidgets import QMessageBox
+        from ilastik.utility.gui import threadRoutedWithRouter
+
+        if not self._distribute_action.isEnabled():
+            return  # A distribution is still running
 
         current_applet = self._applets[self.shell.currentAppletIndex]
         if current_applet not in self.pcApplets:
@@ -583,51 +593,41 @@ class NewAutocontextWorkflowBase(Workflow):
             new_label_names[:num_current_stage_classes] = current_stage_label_names[:num_current_stage_classes]
             opPc.LabelNames.setValue(new_label_names)
 
-        # For each lane, copy over the labels from the source stage to the destination stages
-        for lane_index in range(len(opCurrentPixelClassification.InputImages)):
-            opPcLane = opCurrentPixelClassification.getLane(lane_index)
-
-            # Gather all the labels for this lane
-            blockwise_labels = {}
-            nonzero_slicings = opPcLane.NonzeroLabelBlocks.value
-            for block_slicing in nonzero_slicings:
-                # Convert from slicing to roi-tuple so we can hash it in a dict key
-                block_roi = sliceToRoi(block_slicing, opPcLane.InputImages.meta.shape)
-                block_roi = tuple(map(tuple, block_roi))
-                blockwise_labels[block_roi] = opPcLane.LabelImages[block_slicing].wait()
-
-            if partition and current_stage_index in destination_stage_indexes:
-                # Clear all labels in the current lane, since we'll be overwriting it with a subset of labels
-                # FIXME: We could implement a fast function for this in OpCompressedUserLabelArray...
-                for label_value in range(1, num_current_stage_classes + 1):
-                    opPcLane.opLabelPipeline.opLabelArray.clearLabel(label_value)
-
-            # Now redistribute those labels across all lanes
-            for block_roi, block_labels in list(blockwise_labels.items()):
-                nonzero_coords = block_labels.nonzero()
-
-                if partition:
-                    num_labels = len(nonzero_coords[0])
-                    destination_stage_map = np.random.choice(destination_stage_indexes, (num_labels,))
-
-                for stage_index in destination_stage_indexes:
-                    if not partition:
-                        this_stage_block_labels = block_labels
-                    else:
-                        # Divide into disjoint partitions
-                        # Find the coordinates labels destined for this stage
-                        this_stage_coords = np.transpose(nonzero_coords)[destination_stage_map == stage_index]
-                        this_stage_coords = tuple(this_stage_coords.transpose())
-
-                        # Extract only the labels destined for this stage
-                        this_stage_block_labels = np.zeros_like(block_labels)
-                        this_stage_block_labels[this_stage_coords] = block_labels[this_stage_coords]
-
-                    # Get the current lane's view of this stage's OpPixelClassification
-                    opPc = self.pcApplets[stage_index].topLevelOperator.getLane(lane_index)
-
-                    # Inject
-                    opPc.LabelInputs[roiToSlice(*block_roi)] = this_stage_block_labels
+        # Copy over the labels from the source stage to the destination stages, in the background
+        destination_ops = {
+            stage_index: self.pcApplets[stage_index].topLevelOperator for stage_index in destination_stage_indexes
+        }
+        distributor = LabelDistributor(
+            opCurrentPixelClassification,
+            destination_ops,
+            current_stage_index,
+            partition,
+            progress_callback=current_applet.progressSignal,
+        )
+
+        @threadRoutedWithRouter(self._threadRouter)
+        def handle_finished(*args):
+            self._distribute_action.setEnabled(True)
+            current_applet.busy = False
+            current_applet.appletStateUpdateRequested()
+
+        @threadRoutedWithRouter(self._threadRouter)
+        def handle_failure(exc, exc_info):
+            msg = "Failed to distribute labels:\n{}".format(exc)
+            log_exception(logger, msg, exc_info)
+            current_applet.progressSignal(100)
+            handle_finished()
+            QMessageBox.critical(self.shell, "Label Distribution Failed", msg)
+
+        # Don't start a second distribution (or edit the labels) while this one is running
+        self._distribute_action.setEnabled(False)
+        current_applet.busy = True
+        current_applet.appletStateUpdateRequested()
+
+        req = Request(distributor.run)
+        req.notify_finished(handle_finished)
+        req.notify_failed(handle_failure)
+        req.submit()
 
     @staticmethod
     def get_label_distribution_settings(source_stage_index, num_stages):
@@ -40,6 +40,7 @@ from ilastik.applets.batchProcessing import BatchProcessingApplet
 from ilastik.utility import SlotNameEnum
 
 from lazyflow.graph import Graph
+from lazyflow.request import Request
 from lazyflow.roi import TinyVector, fullSlicing
 
 
@@ -390,12 +391,19 @@ class PixelClassificationWorkflow(Workflow):
         self.freeze_status = self.pcApplet.topLevelOperator.FreezePredictions.value
         self.pcApplet.topLevelOperator.FreezePredictions.setValue(False)
 
+        # Exporting several results in one pass: share the predictions of the blocks in flight between them
+        export_targets = self.dataExportApplet.topLevelOperator.ExportTargets
+        if export_targets.ready() and export_targets.value:
+            capacity = 2 * max(1, Request.global_thread_pool.num_workers)
+            self.pcApplet.topLevelOperator.SharedResultCapacity.setValue(capacity)
+
     def post_process_entire_export(self):
         """
         Assigned to DataExportApplet.post_process_entire_export
         (See above.)
         """
         self.pcApplet.topLevelOperator.FreezePredictions.setValue(self.freeze_status)
+        self.pcApplet.topLevelOperator.SharedResultCapacity.setValue(0)
 
     def _force_retrain_classifier(self, projectManager):
         # Cause the classifier to be dirty so it is forced to retrain.
@@ -38,6 +38,18 @@ def _argparser() -> argparse.ArgumentParser:
         "--exit_on_failure", help="Immediately call exit(1) if an unhandled exception occurs.", action="store_true"
     )
     ap.add_argument("--hbp", help="Enable HBP-specific functionality.", action="store_true")
+    ap.add_argument(
+        "--serve",
+        metavar="[HOST:]PORT",
+        help="Keep the project loaded and serve predictions on the given loopback address (headless only). "
+        "See ilastik/shell/headless/predictionServer.py for the protocol.",
+    )
+    ap.add_argument(
+        "--profile",
+        metavar="TRACE_FILE",
+        help="Profile all operators and write a Chrome trace (chrome://tracing) with a summary to this file at exit "
+        "(headless only).",
+    )
     return ap
 
 
@@ -59,6 +71,12 @@ def _ensure_compatible_args(parser: argparse.ArgumentParser, args: argparse.Name
     if args.headless and (args.fullscreen or args.exit_on_failure):
         parser.error("Some of the command-line options you provided are not " "supported in headless mode.")
 
+    if args.serve and not (args.headless and args.project):
+        parser.error("The --serve argument requires --headless and --project.")
+
+    if args.profile and not args.headless:
+        parser.error("The --profile argument requires --headless.")
+
     if args.headless and not args.project and not (args.new_project and args.workflow):
         parser.error(
             "You have to supply at least --project, or --new_project "
@@ -125,6 +143,10 @@ def main(parsed_args, workflow_cmdline_args=[], init_logging=True):
     if lazyflow_config_fn:
         preinit_funcs.append(lazyflow_config_fn)
 
+    profiler_fn = _prepare_profiler(parsed_args)
+    if profiler_fn:
+        preinit_funcs.append(profiler_fn)
+
     # More initialization functions.
     # These will be called AFTER the shell is created.
     # The shell is provided as a parameter to the function.
@@ -163,6 +185,11 @@ def main(parsed_args, workflow_cmdline_args=[], init_logging=True):
         # Run post-init
         for f in postinit_funcs:
             f(shell)
+
+        if parsed_args.serve:
+            from ilastik.shell.headless.predictionServer import PredictionServer, parse_address
+
+            PredictionServer(shell, parse_address(parsed_args.serve)).serve_forever()
         return shell
     # Normal launch
     else:
@@ -286,8 +313,20 @@ def _prepare_lazyflow_config(parsed_args):
             n_threads = None
     total_ram_mb = total_ram_mb or ilastik_config.getint("lazyflow", "total_ram_mb")
 
+    # Settings that are not given are derived from the CPU quota / memory limit of the container or cluster job.
+    memory_limit = None
+    if ilastik_config.getboolean("lazyflow", "auto_resources") and (n_threads is None or not total_ram_mb):
+        from ilastik.utility.resources import probe_resource_limits
+
+        limits = probe_resource_limits()
+        logger.debug(f"Detected resource limits: {limits}")
+        if n_threads is None and limits.cpus is not None and limits.cpus < (os.cpu_count() or 1):
+            n_threads = limits.thread_count()
+        if not total_ram_mb:
+            memory_limit = limits.memory_bytes
+
     # Note that n_threads == 0 is valid and useful for debugging.
-    if (n_threads is not None) or total_ram_mb or status_interval_secs:
+    if (n_threads is not None) or total_ram_mb or memory_limit or status_interval_secs:
 
         def _configure_lazyflow_settings():
             import lazyflow
@@ -303,7 +342,7 @@ def _prepare_lazyflow_config(parsed_args):
             if n_threads is not None:
                 logger.info(f"Resetting lazyflow thread pool with {n_threads} " "threads.")
                 lazyflow.request.Request.reset_thread_pool(n_threads)
-            if total_ram_mb > 0:
+            if total_ram_mb and total_ram_mb > 0:
                 if total_ram_mb < 500:
                     raise Exception(
                         "In your current configuration, RAM is "
@@ -314,11 +353,42 @@ def _prepare_lazyflow_config(parsed_args):
                 fmt = Memory.format(ram)
                 logger.info("Configuring lazyflow RAM limit to {}".format(fmt))
                 Memory.setAvailableRam(ram)
+            elif memory_limit and memory_limit < Memory.getAvailableRam():
+                import psutil
+                from ilastik.utility.resources import MemoryPressureMonitor
+
+                fmt = Memory.format(memory_limit)
+                logger.info("Configuring lazyflow RAM limit to the memory limit of {}".format(fmt))
+                Memory.setAvailableRam(memory_limit)
+
+                # Shrink the caches if the process gets close to the limit anyway
+                process = psutil.Process()
+                MemoryPressureMonitor(
+                    memory_limit,
+                    get_rss=lambda: process.memory_info().rss,
+                    get_cache_budget=Memory.getAvailableRamCaches,
+                    set_cache_budget=Memory.setAvailableRamCaches,
+                ).start()
 
         return _configure_lazyflow_settings
     return None
 
 
+def _prepare_profiler(parsed_args):
+    if not parsed_args.profile:
+        return None
+
+    def start_profiler():
+        import atexit
+        from ilastik.utility.operatorProfiler import OperatorProfiler
+
+        profiler = OperatorProfiler()
+        profiler.install()
+        atexit.register(profiler.write, parsed_args.profile)
+
+    return start_profiler
+
+
 def _prepare_auto_open_project(parsed_args):
     if parsed_args.project is None:
         return None
@@ -113,6 +113,44 @@ class TestOpBlockwiseObjectClassification(unittest.TestCase):
                 "as the non-blockwise prediction operator!"
             )
 
+    def testBoundedPipelinePool(self):
+        # With 27 blocks and only 2 pipelines, the pipelines must be retargeted without affecting the result
+        self.op.BlockShape3dDict.setValue({"x": 40, "y": 40, "z": 40})
+        self.op.HaloPadding3dDict.setValue({"x": 10, "y": 10, "z": 10})
+        self.op.MaxBlockPipelines.setValue(2)
+
+        pred = numpy.zeros_like(self.prediction_volume)
+        for x in range(0, 100, 40):
+            for y in range(0, 100, 40):
+                for z in range(0, 100, 40):
+                    block = numpy.s_[:, x : x + 40, y : y + 40, z : z + 40, :]
+                    pred[block] = self.op.PredictionImage[block].wait()
+                    assert len(self.op._blockPipelines) <= 2
+
+        if not (pred == self.prediction_volume).all():
+            self.logImage(pred, "bounded_pool_prediction_")
+            assert False, (
+                "Blockwise prediction operator did not produce the same prediction image"
+                "as the non-blockwise prediction operator!"
+            )
+
+    def testBlockwiseRegionFeatures(self):
+        self.op.BlockShape3dDict.setValue({"x": 40, "y": 40, "z": 40})
+        self.op.HaloPadding3dDict.setValue({"x": 10, "y": 10, "z": 10})
+        self.op.PredictionImage[:].wait()
+
+        region_features = self.op.BlockwiseRegionFeatures[:].wait()
+        assert region_features.shape == (1, 3, 3, 3, 1)
+        for block_features in region_features.flat:
+            assert "RegionCenter" in block_features["Default features"]
+
+    def testAreInBlock(self):
+        self.op.BlockShape3dDict.setValue({"x": 40, "y": 40, "z": 40})
+        coords = numpy.array([(0, 0, 0, 0, 0), (0, 39, 39, 39, 0), (0, 40, 0, 0, 0), (0, 45, 10, 41, 0)])
+        assert list(self.op.are_in_block((0, 0, 0, 0, 0), coords)) == [True, True, False, False]
+        assert list(self.op.are_in_block((0, 40, 0, 40, 0), coords)) == [False, False, False, True]
+        assert self.op.is_in_block((0, 40, 0, 40, 0), (0, 79, 39, 79, 0))
+
     def testZeroHalo(self):
         # If we shrink the halo down to zero, then we get different predictions...
         # This block shape/halo combination will slice through some of the big blocks, causing mis-classification.
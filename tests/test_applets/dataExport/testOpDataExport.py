@@ -23,16 +23,20 @@ import tempfile
 import shutil
 from pathlib import Path
 
+import h5py
 import numpy
 import pytest
 import vigra
 
-from lazyflow.graph import Graph
+from lazyflow.graph import Graph, Operator, InputSlot, OutputSlot
 from lazyflow.roi import roiToSlice
+from lazyflow.operators import OpPixelOperator
 from lazyflow.operators.ioOperators import OpInputDataReader
 from ilastik.applets.dataSelection.opDataSelection import FilesystemDatasetInfo
 
 from ilastik.applets.dataExport.opDataExport import OpDataExport, DataExportPathFormatter
+from ilastik.applets.dataExport.multiTargetExport import ExportTarget, MultiTargetExporter
+from ilastik.utility.opSharedResultBuffer import OpSharedResultBuffer
 
 
 class TestOpDataExport(object):
@@ -102,6 +106,141 @@ class TestOpDataExport(object):
             opRead.cleanUp()
 
 
+class OpCountPixels(Operator):
+    """
+    Pass-through that counts the number of pixels it computes.
+    """
+
+    Input = InputSlot()
+    Output = OutputSlot()
+
+    def setupOutputs(self):
+        self.Output.meta.assignFrom(self.Input.meta)
+        self.computed_pixels = 0
+
+    def execute(self, slot, subindex, roi, result):
+        self.computed_pixels += numpy.prod(numpy.array(roi.stop) - roi.start)
+        self.Input(roi.start, roi.stop).writeInto(result).wait()
+        return result
+
+    def propagateDirty(self, slot, subindex, roi):
+        self.Output.setDirty(roi.start, roi.stop)
+
+
+def test_multi_target_export(tmp_h5_single_dataset: Path, tmp_path, monkeypatch):
+    monkeypatch.setattr(MultiTargetExporter, "BLOCK_VOLUME", 20 * 20)
+    graph = Graph()
+
+    data = numpy.random.RandomState(0).random_sample((100, 80, 2)).astype(numpy.float32)
+    data = vigra.taggedView(data, "yxc")
+
+    opCount = OpCountPixels(graph=graph)
+    opCount.Input.setValue(data)
+    opShared = OpSharedResultBuffer(graph=graph)
+    opShared.Input.connect(opCount.Output)
+    opShared.Capacity.setValue(64)
+    opThreshold = OpPixelOperator(graph=graph)
+    opThreshold.Input.connect(opShared.Output)
+    opThreshold.Function.setValue(lambda a: (a > 0.5).astype(numpy.uint8))
+
+    opExport = OpDataExport(graph=graph)
+    opExport.TransactionSlot.setValue(True)
+    opExport.WorkingDirectory.setValue(str(tmp_path))
+    opExport.RawDatasetInfo.setValue(
+        FilesystemDatasetInfo(filePath=str(tmp_h5_single_dataset / "test_group/test_data"), nickname="nick")
+    )
+    opExport.SelectionNames.setValue(["Probabilities", "Segmentation"])
+    opExport.Inputs.resize(2)
+    opExport.Inputs[0].connect(opShared.Output)
+    opExport.Inputs[1].connect(opThreshold.Output)
+    opExport.OutputFormat.setValue("hdf5")
+    opExport.OutputFilenameFormat.setValue(str(tmp_path / "{nickname}_{result_type}"))
+    opExport.ExportTargets.setValue(
+        [ExportTarget("probabilities"), ExportTarget("Segmentation", internal_path="seg/data")]
+    )
+
+    opCount.computed_pixels = 0
+    opExport.run_export()
+
+    # Both targets were computed from a single pass over the input
+    assert opCount.computed_pixels == data.size
+    assert opShared.hits > 0
+
+    with h5py.File(tmp_path / "nick_Probabilities.h5", "r") as f:
+        numpy.testing.assert_array_equal(f["exported_data"][()], data)
+    with h5py.File(tmp_path / "nick_Segmentation.h5", "r") as f:
+        numpy.testing.assert_array_equal(f["seg/data"][()], (data > 0.5).astype(numpy.uint8))
+    assert [os.path.normpath(path) for path in opExport.TargetExportPaths.value] == [
+        os.path.normpath(tmp_path / "nick_Probabilities.h5/exported_data"),
+        os.path.normpath(tmp_path / "nick_Segmentation.h5/seg/data"),
+    ]
+
+
+def _make_two_input_export_op(tmp_h5_single_dataset, tmp_path):
+    graph = Graph()
+    opExport = OpDataExport(graph=graph)
+    opExport.TransactionSlot.setValue(True)
+    opExport.WorkingDirectory.setValue(str(tmp_path))
+    opExport.RawDatasetInfo.setValue(
+        FilesystemDatasetInfo(filePath=str(tmp_h5_single_dataset / "test_group/test_data"), nickname="nick")
+    )
+    opExport.SelectionNames.setValue(["A", "B"])
+    opExport.Inputs.resize(2)
+    for slot in opExport.Inputs:
+        slot.setValue(vigra.taggedView(numpy.zeros((10, 10, 1), dtype=numpy.uint8), "yxc"))
+    return opExport
+
+
+def test_multi_target_export_rejects_clashing_paths(tmp_h5_single_dataset: Path, tmp_path):
+    opExport = _make_two_input_export_op(tmp_h5_single_dataset, tmp_path)
+    opExport.OutputFilenameFormat.setValue(str(tmp_path / "same_file"))
+    opExport.ExportTargets.setValue([ExportTarget("A"), ExportTarget("B")])
+
+    with pytest.raises(ValueError):
+        opExport.run_export()
+
+
+def test_multi_target_export_rejects_other_formats(tmp_h5_single_dataset: Path, tmp_path):
+    opExport = _make_two_input_export_op(tmp_h5_single_dataset, tmp_path)
+    opExport.OutputFilenameFormat.setValue(str(tmp_path / "{result_type}"))
+    opExport.ExportTargets.setValue([ExportTarget("A"), ExportTarget("B", output_format="tif")])
+
+    with pytest.raises(ValueError):
+        opExport.run_export()
+    assert not (tmp_path / "A.h5").exists()
+
+
+def test_multi_target_export_hdf5_compression(tmp_h5_single_dataset: Path, tmp_path):
+    opExport = _make_two_input_export_op(tmp_h5_single_dataset, tmp_path)
+    opExport.OutputFilenameFormat.setValue(str(tmp_path / "{result_type}"))
+    opExport.ExportTargets.setValue([ExportTarget("A"), ExportTarget("B", output_format="compressed hdf5")])
+    opExport.run_export()
+
+    with h5py.File(tmp_path / "A.h5", "r") as f:
+        assert f["exported_data"].compression is None
+    with h5py.File(tmp_path / "B.h5", "r") as f:
+        assert f["exported_data"].compression == "gzip"
+
+
+@pytest.mark.parametrize(
+    "description,expected",
+    [
+        ("Probabilities", ("Probabilities", None, None, None)),
+        ("Simple Segmentation, dtype=uint8, internal_path=seg", ("Simple Segmentation", None, numpy.uint8, "seg")),
+        ("Uncertainty,format=hdf5", ("Uncertainty", "hdf5", None, None)),
+    ],
+)
+def test_export_target_from_string(description, expected):
+    target = ExportTarget.from_string(description)
+    assert (target.selection_name, target.output_format, target.export_dtype, target.internal_path) == expected
+
+
+@pytest.mark.parametrize("description", ["", ",dtype=uint8", "Probabilities,compression=gzip", "Probabilities,dtype"])
+def test_export_target_from_string_invalid(description):
+    with pytest.raises(ValueError):
+        ExportTarget.from_string(description)
+
+
 class TestDataExportPathFormatter:
     class DummyDSInfo:
         def __init__(self, filePath, nickname, default_output_dir):
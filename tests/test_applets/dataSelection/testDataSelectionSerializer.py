@@ -34,6 +34,7 @@ from ilastik.applets.dataSelection.opDataSelection import (
 )
 from ilastik.applets.dataSelection.opDataSelection import ProjectInternalDatasetInfo
 from ilastik.applets.dataSelection.dataSelectionSerializer import DataSelectionSerializer
+from ilastik.applets.dataSelection.stackImport import StackImportSettings
 
 
 import logging
@@ -101,3 +102,34 @@ def test06(serializer, internal_datasetinfo, empty_project_file, graph):
 
     assert operatorToLoad.Image[0].meta.shape == serializer.topLevelOperator.Image[0].meta.shape
     assert operatorToLoad.Image[0].meta.axistags == serializer.topLevelOperator.Image[0].meta.axistags
+
+
+@pytest.mark.parametrize("compression", StackImportSettings.COMPRESSIONS)
+@pytest.mark.parametrize("chunk_layout", StackImportSettings.CHUNK_LAYOUTS)
+def test_stack_import_settings(serializer, png_image, another_png_image, compression, chunk_layout):
+    settings = StackImportSettings(chunk_layout=chunk_layout, compression=compression, num_workers=2)
+    paths = [str(png_image), str(another_png_image)]
+    inner_path = serializer.importStackAsLocalDataset(paths, sequence_axis="z", import_settings=settings)
+
+    project_file = serializer.topLevelOperator.ProjectFile.value
+    dataset = project_file[inner_path]
+    assert dataset.compression == ("gzip" if compression == "gzip" else None)
+    assert dataset.chunks is not None
+
+    tagged_chunks = dict(zip(vigra.AxisTags.fromJSON(dataset.attrs["axistags"]).keys(), dataset.chunks))
+    if chunk_layout == "2d":
+        assert tagged_chunks["z"] == 1
+    elif chunk_layout in ("3d", "auto"):
+        assert tagged_chunks["z"] == 2
+
+    expected = numpy.stack([vigra.impex.readImage(p).withAxes("yxc").view(numpy.ndarray) for p in paths])
+    assert numpy.array_equal(dataset[...], expected.reshape(dataset.shape))
+
+
+def test_stack_import_settings_validation():
+    with pytest.raises(ValueError):
+        StackImportSettings(chunk_layout="4d")
+    with pytest.raises(ValueError):
+        StackImportSettings(compression="lz4")
+    with pytest.raises(ValueError):
+        StackImportSettings(num_workers=0)
@@ -0,0 +1,112 @@
+import numpy
+import pytest
+import vigra
+
+from lazyflow.graph import Graph
+from ilastik.applets.deepLearningClassification.opTiledPrediction import OpTiledPixelwisePredict, blend_weights_1d
+
+torch = pytest.importorskip("torch")
+
+
+class TinyTorchClassifier(object):
+    """
+    Minimal pixelwise classifier around a 3x3 convolution, i.e. it needs one pixel of context on each side.
+    """
+
+    def __init__(self, num_classes=2):
+        torch.manual_seed(42)
+        self.net = torch.nn.Conv2d(1, num_classes, kernel_size=3, padding=1)
+        self.calls = 0
+
+    def predict_probabilities_pixelwise(self, feature_image, roi, axistags=None):
+        self.calls += 1
+        data = torch.from_numpy(numpy.asarray(feature_image, dtype=numpy.float32))
+        data = data.permute(2, 0, 1)[None]  # yxc -> 1cyx
+        with torch.no_grad():
+            probabilities = torch.softmax(self.net(data), dim=1)
+        return probabilities[0].permute(1, 2, 0).numpy()
+
+
+@pytest.fixture
+def image():
+    data = numpy.random.RandomState(0).rand(70, 90, 1).astype(numpy.float32)
+    return vigra.taggedView(data, "yxc")
+
+
+def make_operator(image, classifier, tile_size, halo):
+    op = OpTiledPixelwisePredict(graph=Graph())
+    op.Image.setValue(image)
+    op.Classifier.setValue(classifier)
+    op.LabelsCount.setValue(2)
+    op.TileShape.setValue(tile_size)
+    op.Halo.setValue(halo)
+    op.TileBatchSize.setValue(3)
+    return op
+
+
+def test_tiled_prediction_matches_full_image(image):
+    classifier = TinyTorchClassifier()
+    expected = classifier.predict_probabilities_pixelwise(image, None)
+
+    op = make_operator(image, classifier, tile_size=16, halo=4)
+    classifier.calls = 0
+    tiled = op.PMaps[:].wait()
+
+    assert classifier.calls > 1
+    numpy.testing.assert_allclose(tiled, expected, rtol=1e-5, atol=1e-6)
+
+
+def test_tiled_prediction_does_not_depend_on_roi(image):
+    op = make_operator(image, TinyTorchClassifier(), tile_size=16, halo=4)
+    full = op.PMaps[:].wait()
+
+    # Requests that cut through tiles must give the same result as the full image
+    left = op.PMaps[:, :37, :].wait()
+    right = op.PMaps[:, 37:, 1:2].wait()
+    numpy.testing.assert_allclose(left, full[:, :37, :], rtol=1e-5, atol=1e-6)
+    numpy.testing.assert_allclose(right, full[:, 37:, 1:2], rtol=1e-5, atol=1e-6)
+
+
+def test_tiles_are_predicted_once_for_neighbouring_blocks(image):
+    classifier = TinyTorchClassifier()
+    op = make_operator(image, classifier, tile_size=16, halo=4)
+    op.MaxCachedBytes.setValue(100 * 1024 ** 2)
+    classifier.calls = 0
+
+    # Each block also needs its neighbouring tiles, which must come from the tile cache
+    for y in range(0, 70, 16):
+        for x in range(0, 90, 16):
+            op.PMaps[y : y + 16, x : x + 16, :].wait()
+    assert classifier.calls == 5 * 6
+
+    op.Image.setDirty()
+    op.PMaps[0:16, 0:16, :].wait()
+    assert classifier.calls > 5 * 6
+
+
+def test_tile_cache_is_bounded_by_bytes(image):
+    classifier = TinyTorchClassifier()
+    op = make_operator(image, classifier, tile_size=16, halo=4)
+    max_bytes = 3 * 24 * 24 * 4 * 3  # About three tiles of weighted probabilities and weights
+    op.MaxCachedBytes.setValue(max_bytes)
+
+    op.PMaps[:].wait()
+    assert 0 < op._cached_bytes <= max_bytes
+    assert op._cached_bytes == sum(w.nbytes + ws.nbytes for w, ws in op._tile_cache.values())
+
+    op.MaxCachedBytes.setValue(0)
+    assert op._cached_bytes == 0 and not op._tile_cache
+
+
+def test_blend_weights_cover_overlap():
+    size, tile_size, halo = 100, 30, 6
+    total = numpy.zeros(size)
+    for begin in range(0, size, tile_size):
+        start, stop = max(0, begin - halo), min(size, begin + tile_size + halo)
+        total[start:stop] += blend_weights_1d(start, stop, size, halo)
+    assert (total > 0).all()
+
+    weights = blend_weights_1d(24, 66, size, halo)
+    assert (weights[: halo // 2] == 0).all()
+    assert (weights[-(halo // 2) :] == 0).all()
+    assert (weights[2 * halo : -2 * halo] == 1).all()
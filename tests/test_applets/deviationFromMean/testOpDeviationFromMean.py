@@ -0,0 +1,78 @@
+import numpy
+import pytest
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators.opArrayPiper import OpArrayPiper
+from ilastik.applets.deviationFromMean.opDeviationFromMean import OpDeviationFromMean
+
+
+class OpCountingPiper(OpArrayPiper):
+    """
+    Counts the requests for its output.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(OpCountingPiper, self).__init__(*args, **kwargs)
+        self.executeCount = 0
+
+    def execute(self, slot, subindex, roi, result):
+        self.executeCount += 1
+        return super(OpCountingPiper, self).execute(slot, subindex, roi, result)
+
+
+@pytest.fixture
+def images():
+    rng = numpy.random.RandomState(0)
+    return [vigra.taggedView(rng.rand(20, 30).astype(numpy.float32), "yx") for _ in range(5)]
+
+
+def make_operator(images, lane_batch_size=4):
+    graph = Graph()
+    op = OpDeviationFromMean(graph=graph)
+    op.ScalingFactor.setValue(5)
+    op.Offset.setValue(10)
+    op.LaneBatchSize.setValue(lane_batch_size)
+
+    pipers = []
+    op.Input.resize(len(images))
+    for index, image in enumerate(images):
+        piper = OpCountingPiper(graph=graph)
+        piper.Input.setValue(image)
+        op.Input[index].connect(piper.Output)
+        pipers.append(piper)
+    return op, pipers
+
+
+@pytest.mark.parametrize("lane_batch_size", [1, 2, 4])
+def test_deviation_from_mean(images, lane_batch_size):
+    op, _ = make_operator(images, lane_batch_size)
+    mean = numpy.mean(images, axis=0)
+
+    numpy.testing.assert_allclose(op.Mean[:].wait(), mean, rtol=1e-6)
+    for index, image in enumerate(images):
+        expected = 10 + 5 * (image - mean)
+        numpy.testing.assert_allclose(op.Output[index][:].wait(), expected, rtol=1e-5, atol=1e-5)
+        numpy.testing.assert_allclose(op.Output[index][3:7, 10:20].wait(), expected[3:7, 10:20], rtol=1e-5, atol=1e-5)
+
+
+def test_mean_is_computed_once(images):
+    op, pipers = make_operator(images)
+    for lane in op.Output:
+        lane[:].wait()
+
+    # Every input is read once for the cached mean, and once for its own deviation image
+    assert [piper.executeCount for piper in pipers] == [2] * len(images)
+
+
+def test_dirty_lane_invalidates_mean(images):
+    op, pipers = make_operator(images)
+    op.Output[0][:].wait()
+
+    changed = images[2].copy()
+    changed[:] += 1
+    pipers[2].Input.setValue(changed)
+    images[2] = changed
+
+    mean = numpy.mean(images, axis=0)
+    numpy.testing.assert_allclose(op.Output[0][:].wait(), 10 + 5 * (images[0] - mean), rtol=1e-5, atol=1e-5)
@@ -1,3 +1,5 @@
+import threading
+
 import numpy as np
 import pandas as pd
 
@@ -5,6 +7,7 @@ from ilastikrag.util import generate_random_voronoi
 
 from lazyflow.graph import Graph
 from ilastik.applets.edgeTraining import OpEdgeTraining
+from ilastik.applets.edgeTraining.opEdgeTraining import OpTrainEdgeClassifier
 
 import logging
 
@@ -55,3 +58,98 @@ class TestOpEdgeTraining(object):
         # ON
         assert edge_prob_dict[edge_C] > 0.5, "Expected > 0.5, got {}".format(edge_prob_dict[edge_C])
         assert edge_prob_dict[edge_D] > 0.5, "Expected > 0.5, got {}".format(edge_prob_dict[edge_D])
+
+
+class TestOpTrainEdgeClassifier(object):
+    def setup_method(self, method):
+        rng = np.random.RandomState(0)
+        edge_ids = np.array([(i, j) for i in range(1, 20) for j in range(i + 1, 20)], dtype=np.uint32)
+        self.edge_ids = edge_ids
+        self.features_df = pd.DataFrame(edge_ids, columns=["sp1", "sp2"])
+        self.features_df["Grayscale standard_edge_mean"] = rng.rand(len(edge_ids)).astype(np.float32)
+
+        self.op = OpTrainEdgeClassifier(graph=Graph())
+        self.op.EdgeLabelsDict.resize(1)
+        self.op.EdgeFeaturesDataFrame.resize(1)
+        self.op.EdgeFeaturesDataFrame[0].setValue(self.features_df)
+
+    def labels(self, indices, label):
+        return {tuple(self.edge_ids[i]): label for i in indices}
+
+    def check_training_data(self, labels_dict):
+        data = self.op._lane_data[0]
+        expected = {edge: label for edge, label in labels_dict.items() if label != 0}
+        assert data.labels.to_dict() == expected
+        row_of_edge = {edge: row for row, edge in enumerate(map(tuple, self.edge_ids))}
+        rows = [row_of_edge[edge] for edge in data.labels.keys()]
+        np.testing.assert_array_equal(data.feature_matrix, self.features_df.iloc[rows, 2:].values)
+
+    def testIncrementalUpdates(self):
+        labels = {**self.labels(range(0, 10), 1), **self.labels(range(100, 110), 2)}
+        self.op.EdgeLabelsDict[0].setValue(labels)
+        assert self.op.EdgeClassifier.value is not None
+        self.check_training_data(labels)
+
+        # Change, remove and add labels
+        labels = dict(labels)
+        labels.update(self.labels(range(5, 8), 2))
+        labels.update(self.labels(range(150, 155), 1))
+        labels.update(self.labels(range(100, 103), 0))
+        del labels[tuple(self.edge_ids[109])]
+        self.op.EdgeLabelsDict[0].setValue(labels)
+        assert self.op.EdgeClassifier.value is not None
+        self.check_training_data(labels)
+
+        self.op.EdgeLabelsDict[0].setValue({})
+        assert self.op.EdgeClassifier.value is None
+
+    def testDebounce(self):
+        self.op.RetrainLabelThreshold.setValue(5)
+        self.op.RetrainInterval.setValue(3600)
+        labels = {**self.labels(range(0, 10), 1), **self.labels(range(100, 110), 2)}
+        self.op.EdgeLabelsDict[0].setValue(labels)
+        first = self.op.EdgeClassifier.value
+
+        labels = {**labels, **self.labels(range(10, 13), 1)}
+        self.op.EdgeLabelsDict[0].setValue(labels)
+        assert self.op.EdgeClassifier.value is first
+
+        labels = {**labels, **self.labels(range(13, 15), 1)}
+        self.op.EdgeLabelsDict[0].setValue(labels)
+        assert self.op.EdgeClassifier.value is not first
+
+    def testChangedFeaturesAreNotHeldBack(self):
+        self.op.RetrainLabelThreshold.setValue(100)
+        self.op.RetrainInterval.setValue(3600)
+        labels = {**self.labels(range(0, 10), 1), **self.labels(range(100, 110), 2)}
+        self.op.EdgeLabelsDict[0].setValue(labels)
+        first = self.op.EdgeClassifier.value
+
+        # e.g. after changing the feature selection
+        rng = np.random.RandomState(1)
+        self.features_df = pd.DataFrame(self.edge_ids, columns=["sp1", "sp2"])
+        self.features_df["Grayscale standard_edge_mean"] = rng.rand(len(self.edge_ids)).astype(np.float32)
+        self.features_df["Grayscale standard_edge_count"] = rng.rand(len(self.edge_ids)).astype(np.float32)
+        self.op.EdgeFeaturesDataFrame[0].setValue(self.features_df)
+
+        classifier = self.op.EdgeClassifier.value
+        assert classifier is not first
+        assert list(self.op._trained_feature_names) == list(self.features_df.columns[2:])
+        self.check_training_data(labels)
+
+    def testHeldBackChangesAreTrainedLater(self):
+        self.op.RetrainLabelThreshold.setValue(100)
+        self.op.TRAILING_RETRAIN_DELAY = 0.05
+        labels = {**self.labels(range(0, 10), 1), **self.labels(range(100, 110), 2)}
+        self.op.EdgeLabelsDict[0].setValue(labels)
+        first = self.op.EdgeClassifier.value
+
+        labels = {**labels, **self.labels(range(10, 13), 1)}
+        self.op.EdgeLabelsDict[0].setValue(labels)
+        dirty = threading.Event()
+        self.op.EdgeClassifier.notifyDirty(lambda *args: dirty.set())
+        assert self.op.EdgeClassifier.value is first
+
+        assert dirty.wait(timeout=10)
+        assert self.op.EdgeClassifier.value is not first
+        self.check_training_data(labels)
@@ -0,0 +1,94 @@
+import numpy
+import pytest
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators import OpCompressedUserLabelArray
+from lazyflow.operators.opArrayPiper import OpArrayPiper
+
+from ilastik.applets.labeling.blockwiseLabelImport import (
+    count_block_labels,
+    count_labels,
+    merge_label_counts,
+    write_labels,
+)
+
+
+@pytest.fixture
+def imported_labels():
+    data = numpy.zeros((20, 30, 40, 1), dtype=numpy.uint32)
+    data[2:5, 3:7, 4:9] = 7
+    data[10:12, 20:25, 30:35] = 3_000_000_000
+    data[15, 0, 0] = 42
+    return vigra.taggedView(data, "zyxc")
+
+
+@pytest.fixture
+def source(imported_labels):
+    op = OpArrayPiper(graph=Graph())
+    op.Input.setValue(imported_labels)
+    return op
+
+
+@pytest.fixture
+def label_array():
+    op = OpCompressedUserLabelArray(graph=Graph())
+    op.Input.setValue(vigra.taggedView(numpy.zeros((30, 30, 40, 1), dtype=numpy.uint8), "zyxc"))
+    op.shape.setValue((30, 30, 40, 1))
+    op.eraser.setValue(255)
+    op.deleteLabel.setValue(-1)
+    op.blockShape.setValue((10, 10, 10, 1))
+    return op
+
+
+def test_count_block_labels():
+    labels, counts = count_block_labels(numpy.array([0, 5, 5, 2, 0, 0], dtype=numpy.uint8))
+    numpy.testing.assert_array_equal(labels, [0, 2, 5])
+    numpy.testing.assert_array_equal(counts, [3, 1, 2])
+
+    labels, counts = count_block_labels(numpy.array([2 ** 40, 1, 2 ** 40], dtype=numpy.uint64))
+    numpy.testing.assert_array_equal(labels, [1, 2 ** 40])
+    numpy.testing.assert_array_equal(counts, [1, 2])
+
+
+def test_merge_label_counts():
+    labels, counts = merge_label_counts([numpy.array([0, 3]), numpy.array([1, 3])], [[5, 1], [2, 2]])
+    numpy.testing.assert_array_equal(labels, [0, 1, 3])
+    numpy.testing.assert_array_equal(counts, [5, 2, 3])
+
+
+def test_count_labels(source, imported_labels):
+    labels, counts = count_labels(source.Output, blockshape=(7, 11, 13, 1))
+    expected_labels, expected_counts = numpy.unique(imported_labels, return_counts=True)
+    assert labels.dtype == imported_labels.dtype
+    numpy.testing.assert_array_equal(labels, expected_labels)
+    numpy.testing.assert_array_equal(counts, expected_counts)
+
+
+def test_write_labels_with_mapping(source, label_array, imported_labels):
+    read_labels, _ = count_labels(source.Output)
+    mapping = {0: 0, 7: 2, 42: 0, 3_000_000_000: 1}
+    offset = (5, 0, 0, 0)
+
+    num_written = write_labels(
+        source.Output, label_array.Input, offset, read_labels, mapping, blockshape=(5, 10, 10, 1)
+    )
+    assert num_written == 2
+
+    expected = numpy.zeros((30, 30, 40, 1), dtype=numpy.uint8)
+    expected[7:10, 3:7, 4:9] = 2
+    expected[15:17, 20:25, 30:35] = 1
+    numpy.testing.assert_array_equal(label_array.Output[:].wait(), expected)
+
+
+def test_write_labels_keeps_existing_labels(source, label_array):
+    label_array.Input[0:1, 0:1, 0:2, 0:1] = numpy.array([[[[4], [5]]]], dtype=numpy.uint8)
+    read_labels, _ = count_labels(source.Output)
+
+    write_labels(source.Output, label_array.Input, (0, 0, 0, 0), read_labels, {0: 0, 7: 1, 42: 3, 3_000_000_000: 0})
+
+    result = label_array.Output[:].wait()
+    numpy.testing.assert_array_equal(result[0, 0, 0:2, 0], [4, 5])
+    assert (result[2:5, 3:7, 4:9] == 1).all()
+    assert result[15, 0, 0] == 3
+    assert (result[10:12, 20:25, 30:35] == 0).all()
@@ -0,0 +1,64 @@
+import numpy
+import pytest
+
+from ilastik.applets.pixelClassification.featureCost import (
+    feature_set_cost,
+    measure_feature_costs,
+    projected_throughput,
+    select_cheapest_feature_set,
+)
+
+
+def test_measure_feature_costs():
+    sample = numpy.random.RandomState(0).rand(64, 64).astype(numpy.float32)
+    feature_ids = ["GaussianSmoothing", "HessianOfGaussianEigenvalues"]
+    scales = [0.7, 5.0]
+    mask = numpy.array([[True, True], [False, True]])
+
+    costs = measure_feature_costs(sample, feature_ids, scales, num_channels=2, mask=mask)
+
+    assert costs.shape == (2, 2)
+    assert (costs[mask] > 0).all()
+    assert costs[1, 0] == 0
+
+
+def test_feature_set_cost_counts_vector_valued_features_once():
+    # channels 1 and 2 are the eigenvalues of the same Hessian
+    channel_entries = [0, 1, 1, 2]
+    entry_costs = [1.0, 10.0, 100.0]
+    assert feature_set_cost([1, 2], channel_entries, entry_costs) == 10.0
+    assert feature_set_cost([0, 1, 2, 3], channel_entries, entry_costs) == 111.0
+
+
+def test_select_cheapest_feature_set():
+    channel_entries = [0, 1, 2, 3]
+    entry_costs = [100.0, 1.0, 2.0, 50.0]
+    # feature 0 alone is accurate, features 1 and 2 are cheap and accurate together
+    errors = {(0,): 1.0, (1,): 10.0, (1, 2): 1.5}
+    evaluated = []
+
+    def evaluate(feature_ids):
+        evaluated.append(tuple(feature_ids))
+        return errors.get(tuple(sorted(feature_ids)), 20.0)
+
+    by_importance = [0, 1, 2, 3]
+    by_importance_per_cost = [1, 2, 0, 3]
+    selection = select_cheapest_feature_set(
+        [by_importance, by_importance_per_cost], channel_entries, entry_costs, evaluate, max_error=2.0
+    )
+
+    assert sorted(selection.feature_ids) == [1, 2]
+    assert selection.cost == 3.0
+    assert selection.error == 1.5
+    assert (0, 1) not in evaluated  # more expensive than the best set found so far
+
+
+def test_select_cheapest_feature_set_falls_back_to_all_features():
+    selection = select_cheapest_feature_set([[1, 0]], [0, 1], [1.0, 2.0], lambda ids: 5.0, max_error=1.0)
+    assert selection.feature_ids == [1, 0]
+    assert selection.cost == 3.0
+
+
+def test_projected_throughput():
+    assert projected_throughput(0.5) == pytest.approx(2.0)
+    assert projected_throughput(0.5, num_workers=4) == pytest.approx(8.0)
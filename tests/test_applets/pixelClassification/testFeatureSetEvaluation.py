@@ -0,0 +1,50 @@
+import numpy
+import pytest
+
+from ilastik.applets.pixelClassification.featureSetEvaluation import FeatureSetSizeEvaluator, stratified_subsample
+
+pytest.importorskip("sklearn")
+
+
+def test_stratified_subsample_keeps_class_proportions():
+    labels = numpy.array([1] * 9000 + [2] * 900 + [3] * 10)
+    indices = stratified_subsample(labels, 1000, random_state=0)
+
+    assert (numpy.diff(indices) > 0).all()
+    counts = numpy.bincount(labels[indices])
+    assert counts[1] == pytest.approx(909, abs=1)
+    assert counts[2] == pytest.approx(91, abs=1)
+    assert counts[3] == 10  # rare classes are kept
+
+    assert (stratified_subsample(labels[:500], 1000) == numpy.arange(500)).all()
+
+
+@pytest.fixture
+def informative_data():
+    # only the first two features are informative
+    rng = numpy.random.RandomState(0)
+    Y = rng.randint(1, 3, size=2000)
+    X = rng.rand(2000, 10)
+    X[:, 0] += Y
+    X[:, 1] -= 0.5 * Y
+    return X, Y
+
+
+def test_evaluator_finds_informative_features(informative_data):
+    X, Y = informative_data
+    evaluator = FeatureSetSizeEvaluator(X, Y, complexity_penalty=0.1, max_workers=2)
+    progress = []
+
+    assert evaluator.run(numpy.arange(10), progress_callback=progress.append) in (1, 2)
+    # early stopping: the uninformative features are not all evaluated
+    assert progress[-1] < 1.0
+    assert progress == sorted(progress)
+
+
+def test_evaluator_cancel(informative_data):
+    X, Y = informative_data
+    evaluator = FeatureSetSizeEvaluator(X, Y, complexity_penalty=0.1, max_workers=2)
+    evaluator.cancel()
+
+    assert evaluator.evaluate([0, 1]) is None
+    assert evaluator.run(numpy.arange(10)) == 1
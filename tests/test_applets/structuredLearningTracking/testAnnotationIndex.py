@@ -0,0 +1,45 @@
+from ilastik.applets.tracking.structured.annotationIndex import AnnotationIndex
+
+
+def make_index():
+    # labels format: {timeframe: {object_id: set(track_ids)}}
+    labels = {0: {0: {1, 2}}, 1: {1: {1, 2}}, 2: {2: {1}, 3: {2}}, 4: {4: {2}, 5: {3}}}
+    return AnnotationIndex(labels)
+
+
+def test_lookups():
+    index = make_index()
+    assert index.objects(2) == [(0, 0), (1, 1), (2, 3), (4, 4)]
+    assert index.objects(7) == []
+    assert index.tracks(1, 1) == {1, 2}
+    assert index.tracks(3, 1) == set()
+    assert index.labels(2, 2) == [3]
+
+    # merged objects are not returned as the label of a single track
+    assert index.label(1, 1, default=-1) == -1
+    assert index.label(2, 1) == 2
+
+
+def test_previous_and_next():
+    index = make_index()
+    assert index.previous(2, 0) is None
+    assert index.previous(2, 2) == (1, 1)
+    assert index.previous(2, 4) == (2, 3)
+    assert index.next(2, 2) == (4, 4)
+    assert index.next(2, 4) is None
+
+
+def test_edits():
+    index = make_index()
+    index.add(3, 6, 2)
+    assert index.next(2, 2) == (3, 6)
+    assert index.previous(2, 4) == (3, 6)
+
+    index.remove(1, 1, 2)
+    assert index.tracks(1, 1) == {1}
+    assert index.label(1, 1) == 1
+    assert index.previous(2, 2) == (0, 0)
+
+    index.remove(1, 1, 1)
+    assert index.tracks(1, 1) == set()
+    assert index.objects(1) == [(0, 0), (2, 2)]
@@ -0,0 +1,36 @@
+import numpy
+
+from ilastik.applets.tracking.base.trackLabelLookup import TrackLabelLookup
+
+
+def test_track_and_untracked_images():
+    volume = numpy.array([[0, 1, 2], [3, 4, 4]], dtype=numpy.uint32)
+    labels_at = {1: {5}, 2: {-1}, 4: {7, 7}}
+    lookup = TrackLabelLookup()
+
+    tracks = lookup.track_image(0, labels_at, volume)
+    assert tracks.dtype == volume.dtype
+    numpy.testing.assert_array_equal(tracks, [[0, 5, TrackLabelLookup.MISDETECTION_VALUE], [0, 7, 7]])
+    numpy.testing.assert_array_equal(lookup.untracked_image(0, labels_at, volume), [[0, 0, 0], [1, 0, 0]])
+
+
+def test_frames_without_annotations():
+    volume = numpy.array([0, 1, 2], dtype=numpy.uint16)
+    lookup = TrackLabelLookup()
+    numpy.testing.assert_array_equal(lookup.track_image(3, {}, volume), [0, 0, 0])
+    numpy.testing.assert_array_equal(lookup.untracked_image(3, {}, volume), [0, 1, 1])
+
+
+def test_invalidate_picks_up_changed_annotations():
+    volume = numpy.array([1, 2], dtype=numpy.uint32)
+    labels_at = {1: {3}}
+    lookup = TrackLabelLookup()
+    numpy.testing.assert_array_equal(lookup.track_image(0, labels_at, volume), [3, 0])
+
+    labels_at[2] = {4}
+    numpy.testing.assert_array_equal(lookup.track_image(0, labels_at, volume), [3, 0])
+    lookup.invalidate([0])
+    numpy.testing.assert_array_equal(lookup.track_image(0, labels_at, volume), [3, 4])
+
+    # A replaced annotation dict is detected without invalidation
+    numpy.testing.assert_array_equal(lookup.track_image(0, {2: {9}}, volume), [0, 9])
@@ -0,0 +1,85 @@
+import numpy
+import pytest
+
+from ilastik.applets.trackingFeatureExtraction.trackingFeatures import CenterGrid, FeatureManager
+
+
+def brute_force_best(manager, coms_cur, coms_next, sizes_next, image_shape):
+    """
+    Reference: check every pair of objects.
+    """
+    half = manager.template_size // 2
+    best = {}
+    for label_cur in range(1, len(coms_cur)):
+        center = numpy.round(coms_cur[label_cur]).astype(int)
+        start = numpy.maximum(center - half, 0)
+        stop = numpy.minimum(center + half, image_shape)
+        candidates = []
+        for label_next in range(1, len(coms_next)):
+            position = numpy.round(coms_next[label_next])
+            if sizes_next[label_next] >= manager.size_filter and ((start <= position) & (position < stop)).all():
+                distance = numpy.linalg.norm(coms_next[label_next] - coms_cur[label_cur])
+                candidates.append((distance, label_next))
+        best[label_cur] = sorted(candidates)[: manager.n_best]
+    return best
+
+
+@pytest.fixture
+def frames():
+    random = numpy.random.RandomState(42)
+    image_shape = (300, 200)
+    n_cur, n_next = 400, 500
+    coms_cur = random.uniform(0, 1, (n_cur, 2)) * image_shape
+    coms_next = random.uniform(0, 1, (n_next, 2)) * image_shape
+    sizes_next = random.randint(0, 20, n_next).astype(numpy.float64)
+    return image_shape, coms_cur, coms_next, sizes_next
+
+
+def test_best_distances_match_brute_force(frames):
+    image_shape, coms_cur, coms_next, sizes_next = frames
+    manager = FeatureManager(n_best=3, template_size=50, ndim=2, size_filter=4)
+
+    labels, distances = manager._getBestSquaredDistances(coms_cur, coms_next, sizes_next, image_shape)
+    expected = brute_force_best(manager, coms_cur, coms_next, sizes_next, image_shape)
+
+    assert (labels[0] == -1).all()
+    for label_cur, candidates in expected.items():
+        found = [(d, l) for d, l in zip(distances[label_cur], labels[label_cur]) if l != -1]
+        assert [l for _, l in found] == [l for _, l in candidates]
+        numpy.testing.assert_allclose([d for d, _ in found], [d for d, _ in candidates], rtol=1e-6)
+        assert (distances[label_cur][len(candidates) :] == manager.squared_distance_default).all()
+
+
+def test_center_grid_query_boxes():
+    centers = numpy.array([[0, 0], [5, 5], [9.6, 3], [20, 20]])
+    grid = CenterGrid(numpy.arange(4), centers, cell_size=4)
+    queries, objects = grid.query_boxes([[0, 0], [8, 0], [30, 30]], [[6, 6], [12, 12], [40, 40]])
+    found = sorted(zip(queries.tolist(), grid.labels[objects].tolist()))
+    assert found == [(0, 0), (0, 1), (1, 2)]
+
+
+def test_division_features():
+    feats_cur = {
+        "RegionCenter": numpy.array([[0.0, 0.0], [10.0, 10.0]]),
+        "Count": numpy.array([[0.0], [100.0]]),
+    }
+    # Two children left and right of the parent, a third one too small to count
+    feats_next = {
+        "RegionCenter": numpy.array([[0.0, 0.0], [10.0, 6.0], [10.0, 15.0], [11.0, 10.0]]),
+        "Count": numpy.array([[0.0], [40.0], [60.0], [2.0]]),
+    }
+    feat_names = ["ParentChildrenRatio_Count", "ChildrenRatio_Count", "ParentChildrenAngle_RegionCenter"]
+    manager = FeatureManager(n_best=3, template_size=50, ndim=2, size_filter=4)
+    result = manager.computeFeatures_at(feats_cur, feats_next, numpy.zeros((50, 50, 1, 1)), feat_names)
+
+    numpy.testing.assert_allclose(result["SquaredDistances_0"][1], [4.0])
+    numpy.testing.assert_allclose(result["SquaredDistances_1"][1], [5.0])
+    numpy.testing.assert_allclose(result["SquaredDistances_2"][1], [9999])
+    numpy.testing.assert_allclose(result["ParentChildrenRatio_Count"][1], [1.0])
+    numpy.testing.assert_allclose(result["ChildrenRatio_Count"][1], [40.0 / 60.0])
+    numpy.testing.assert_allclose(result["ParentChildrenAngle_RegionCenter"][1], [180.0])
+
+    # Without a next frame, all features have their default values
+    result = manager.computeFeatures_at(feats_cur, None, None, feat_names)
+    numpy.testing.assert_allclose(result["ParentChildrenRatio_Count"][1], [0.0])
+    numpy.testing.assert_allclose(result["SquaredDistances_0"][1], [9999])
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "benchmarks")
+sys.path.insert(0, BENCHMARK_DIR)
+
+import benchmarkSuite  # noqa: E402
+
+
+@pytest.mark.parametrize("case_name", list(benchmarkSuite.CASES))
+def test_case_runs_on_tiny_data(case_name, tmp_path):
+    case = benchmarkSuite.CASES[case_name]
+    try:
+        case.setup(str(tmp_path), "tiny")
+        seconds, counts = case.run(str(tmp_path), "tiny")
+    except benchmarkSuite.CaseSkipped as e:
+        pytest.skip(str(e))
+
+    assert seconds > 0
+    assert counts and all(count > 0 for count in counts.values())
+
+
+def test_case_runs_in_child_process(tmp_path):
+    result = benchmarkSuite.run_case("data_selection_import", str(tmp_path), "tiny", repeat=1, verbose=False)
+    assert "error" not in result, result["error"]
+    assert result["seconds"] > 0
+    assert len(result["runs"]) == 1
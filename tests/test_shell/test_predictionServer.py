@@ -0,0 +1,142 @@
+import socket
+import threading
+
+import numpy
+import pytest
+
+from ilastik.shell.headless.predictionServer import (
+    PredictionClient,
+    PredictionServer,
+    PredictionServerError,
+    parse_address,
+    shared_memory,
+)
+
+
+class FakeBatchApplet(object):
+    role_names = ["Raw Data"]
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def run_export_concurrently(self, role_data_dict, export_to_array=False):
+        inputs = role_data_dict["Raw Data"]
+        self.batch_sizes.append(len(inputs))
+        if not export_to_array:
+            return [path + "_Probabilities.h5" for path in inputs]
+        if any(info.preloaded_array.max() < 0 for info in inputs):
+            raise ValueError("negative input")
+        return [numpy.asarray(info.preloaded_array, dtype=numpy.float32) * 2 for info in inputs]
+
+
+class FakeShell(object):
+    class projectManager(object):
+        currentProjectPath = "/tmp/MyProject.ilp"
+
+    def __init__(self):
+        self.workflow = type("FakeWorkflow", (), {})()
+        self.workflow.batchProcessingApplet = FakeBatchApplet()
+
+
+@pytest.fixture
+def server():
+    shell = FakeShell()
+    server = PredictionServer(shell, ("127.0.0.1", 0), batch_window=0.05)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+
+
+needs_shared_memory = pytest.mark.skipif(shared_memory is None, reason="needs multiprocessing.shared_memory")
+
+
+@pytest.mark.parametrize("use_shared_memory", [False, pytest.param(True, marks=needs_shared_memory)])
+def test_predict_array(server, use_shared_memory):
+    image = numpy.random.RandomState(0).randint(0, 255, (64, 48, 1)).astype(numpy.uint8)
+    with PredictionClient(server.address) as client:
+        result = client.predict_array(image, axes="yxc", use_shared_memory=use_shared_memory)
+    assert result.dtype == numpy.float32
+    numpy.testing.assert_array_equal(result, image * 2.0)
+
+
+def test_predict_file_and_info(server):
+    with PredictionClient(server.address) as client:
+        assert client.predict_file("/data/image.h5") == "/data/image.h5_Probabilities.h5"
+        info = client.info()
+    assert info["workflow"] == "FakeWorkflow"
+    assert info["roles"] == ["Raw Data"]
+
+
+def test_concurrent_requests_are_batched(server):
+    images = [numpy.full((8, 8, 1), i, dtype=numpy.uint8) for i in range(6)]
+    results = [None] * len(images)
+
+    def predict(index):
+        with PredictionClient(server.address) as client:
+            results[index] = client.predict_array(images[index], axes="yxc")
+
+    threads = [threading.Thread(target=predict, args=(i,)) for i in range(len(images))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for image, result in zip(images, results):
+        numpy.testing.assert_array_equal(result, image * 2.0)
+    batch_sizes = server._batch_applet.batch_sizes
+    assert sum(batch_sizes) == len(images)
+    assert max(batch_sizes) > 1
+
+
+def test_failing_request_does_not_break_server(server):
+    with PredictionClient(server.address) as client:
+        with pytest.raises(PredictionServerError):
+            client.predict_array(numpy.full((4, 4, 1), -1, dtype=numpy.int8), axes="yxc")
+        result = client.predict_array(numpy.ones((4, 4, 1), dtype=numpy.int8), axes="yxc")
+    numpy.testing.assert_array_equal(result, 2.0)
+
+
+@pytest.mark.parametrize(
+    "address,expected",
+    [("5555", ("127.0.0.1", 5555)), ("localhost:80", ("localhost", 80)), ("[::1]:80", ("::1", 80))],
+)
+def test_parse_address(address, expected):
+    assert parse_address(address) == expected
+
+
+@pytest.mark.parametrize("address", ["0.0.0.0:80", "192.168.1.2:80", "example.org:80", "80a"])
+def test_parse_address_rejects_non_loopback(address):
+    with pytest.raises(ValueError):
+        parse_address(address)
+
+
+def _ipv6_loopback_available():
+    try:
+        with socket.socket(socket.AF_INET6, socket.SOCK_STREAM) as sock:
+            sock.bind(("::1", 0))
+        return True
+    except OSError:
+        return False
+
+
+@pytest.mark.skipif(not _ipv6_loopback_available(), reason="needs an IPv6 loopback interface")
+def test_ipv6_loopback_server():
+    server = PredictionServer(FakeShell(), parse_address("[::1]:0"))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        assert server.address[0] == "::1"
+        with PredictionClient(server.address) as client:
+            result = client.predict_array(numpy.ones((4, 4, 1), dtype=numpy.int8), axes="yxc")
+        numpy.testing.assert_array_equal(result, 2.0)
+    finally:
+        server.shutdown()
+        thread.join(timeout=10)
+
+
+def test_server_refuses_non_loopback_address():
+    with pytest.raises(ValueError):
+        PredictionServer(FakeShell(), ("0.0.0.0", 0))
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from ilastik.utility.edgeTable import EdgeTable
+
+
+@pytest.fixture
+def table():
+    edge_ids = np.array([[1, 2], [1, 5], [2, 3], [4, 7]], dtype=np.uint32)
+    return EdgeTable(edge_ids, np.array([0.1, 0.5, 0.9, 0.3], dtype=np.float32))
+
+
+def test_indices(table):
+    np.testing.assert_array_equal(table.indices([[2, 3], [1, 2], [3, 4], [4, 7]]), [2, 0, -1, 3])
+    np.testing.assert_array_equal(table.lookup([[1, 5], [9, 9]], default=-1), [0.5, -1])
+
+
+def test_unsorted_edges():
+    table = EdgeTable([[4, 7], [1, 2], [2, 3]], [1, 2, 3])
+    np.testing.assert_array_equal(table.indices([[1, 2], [2, 3], [4, 7], [1, 3]]), [1, 2, 0, -1])
+
+
+def test_dict_interface(table):
+    assert len(table) == 4
+    assert (2, 3) in table
+    assert (3, 2) not in table
+    assert table[(1, 5)] == pytest.approx(0.5)
+    assert table.get((3, 4)) is None
+    with pytest.raises(KeyError):
+        table[(3, 4)]
+
+    assert table.to_dict() == dict(table.items())
+    assert table.select(table.values > 0.4).to_dict(["a", "b"]) == {(1, 5): "a", (2, 3): "b"}
+
+
+def test_from_dict():
+    table = EdgeTable.from_dict({(3, 4): 2, (1, 2): 1}, dtype=np.uint8)
+    assert table.values.dtype == np.uint8
+    assert table.to_dict() == {(3, 4): 2, (1, 2): 1}
+
+    empty = EdgeTable.from_dict({})
+    assert len(empty) == 0 and not empty
+    np.testing.assert_array_equal(empty.indices([[1, 2]]), [-1])
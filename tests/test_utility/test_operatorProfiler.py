@@ -0,0 +1,76 @@
+import json
+
+import numpy
+import pytest
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators import OpArrayPiper
+from lazyflow.operators.opSimpleBlockedArrayCache import OpSimpleBlockedArrayCache
+
+from ilastik.utility.operatorProfiler import OperatorProfiler
+
+
+@pytest.fixture
+def profiler():
+    profiler = OperatorProfiler()
+    profiler.install()
+    yield profiler
+    profiler.uninstall()
+
+
+@pytest.fixture
+def cached_pipeline():
+    graph = Graph()
+    data = vigra.taggedView(numpy.random.rand(64, 64).astype(numpy.float32), "yx")
+    op_piper = OpArrayPiper(graph=graph)
+    op_piper.Input.setValue(data)
+    op_cache = OpSimpleBlockedArrayCache(graph=graph)
+    op_cache.Input.connect(op_piper.Output)
+    op_cache.BlockShape.setValue((32, 32))
+    return op_cache
+
+
+def summary_row(profiler, operator, slot):
+    rows = [row for row in profiler.summary() if row["operator"] == operator and row["slot"] == slot]
+    assert len(rows) == 1
+    return rows[0]
+
+
+def test_records_execute_calls(profiler, cached_pipeline):
+    cached_pipeline.Output[:].wait()
+
+    row = summary_row(profiler, "OpArrayPiper", "Output")
+    assert row["calls"] >= 1
+    assert row["mbytes"] == pytest.approx(64 * 64 * 4 / 1024 ** 2)
+    assert row["total_s"] >= 0
+
+
+def test_cache_hits_and_misses(profiler, cached_pipeline):
+    cached_pipeline.Output[:].wait()
+    cached_pipeline.Output[:].wait()
+
+    assert summary_row(profiler, "OpSimpleBlockedArrayCache", "Output")["cache_hit_ratio"] == pytest.approx(0.5)
+    assert summary_row(profiler, "OpArrayPiper", "Output")["cache_hit_ratio"] is None
+
+
+def test_write_trace(profiler, cached_pipeline, tmp_path):
+    cached_pipeline.Output[:].wait()
+    path = tmp_path / "trace.json"
+    profiler.write(str(path))
+
+    with open(path) as f:
+        trace = json.load(f)
+    names = {event["name"] for event in trace["traceEvents"]}
+    assert {"OpArrayPiper.Output", "OpSimpleBlockedArrayCache.Output"} <= names
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in trace["traceEvents"])
+    assert trace["otherData"]["summary"] == json.loads(json.dumps(profiler.summary()))
+    assert "OpSimpleBlockedArrayCache.Output" in profiler.format_summary()
+
+
+def test_uninstall_stops_recording(cached_pipeline):
+    profiler = OperatorProfiler()
+    profiler.install()
+    profiler.uninstall()
+    cached_pipeline.Output[:].wait()
+    assert profiler.summary() == []
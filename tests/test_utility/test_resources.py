@@ -0,0 +1,140 @@
+import pytest
+
+from ilastik.utility.resources import (
+    MemoryPressureMonitor,
+    ResourceLimits,
+    cgroup_cpu_limit,
+    cgroup_memory_limit,
+    cgroup_paths,
+    parse_cpu_list,
+    probe_resource_limits,
+    slurm_limits,
+)
+
+
+@pytest.fixture
+def cgroup_v2(tmp_path):
+    (tmp_path / "cpu.max").write_text("250000 100000\n")
+    (tmp_path / "memory.max").write_text(str(4 * 1024 ** 3) + "\n")
+    return str(tmp_path)
+
+
+@pytest.fixture
+def cgroup_v1(tmp_path):
+    (tmp_path / "cpu,cpuacct").mkdir()
+    (tmp_path / "cpu,cpuacct" / "cpu.cfs_quota_us").write_text("-1\n")
+    (tmp_path / "cpu,cpuacct" / "cpu.cfs_period_us").write_text("100000\n")
+    (tmp_path / "memory").mkdir()
+    (tmp_path / "memory" / "memory.limit_in_bytes").write_text("9223372036854771712\n")
+    return str(tmp_path)
+
+
+def test_cgroup_v2(cgroup_v2):
+    assert cgroup_cpu_limit(cgroup_v2) == 2.5
+    assert cgroup_memory_limit(cgroup_v2) == 4 * 1024 ** 3
+
+
+def test_cgroup_v1_unlimited(cgroup_v1):
+    assert cgroup_cpu_limit(cgroup_v1) is None
+    assert cgroup_memory_limit(cgroup_v1) is None
+
+
+def test_cgroup_paths(tmp_path):
+    proc_cgroup = tmp_path / "cgroup"
+    proc_cgroup.write_text("12:memory:/job/task\n4:cpu,cpuacct:/job\n0::/user.slice/job\n")
+    assert cgroup_paths(str(proc_cgroup)) == {
+        "memory": "/job/task",
+        "cpu": "/job",
+        "cpuacct": "/job",
+        "": "/user.slice/job",
+    }
+
+
+def test_cgroup_v2_nested(tmp_path):
+    root = tmp_path / "sys"
+    job = root / "user.slice" / "job"
+    job.mkdir(parents=True)
+    (root / "user.slice" / "cpu.max").write_text("max 100000\n")
+    (root / "user.slice" / "memory.max").write_text(str(1024 ** 3) + "\n")
+    (job / "cpu.max").write_text("150000 100000\n")
+    (job / "memory.max").write_text("max\n")
+    proc_cgroup = tmp_path / "cgroup"
+    proc_cgroup.write_text("0::/user.slice/job\n")
+
+    assert cgroup_cpu_limit(str(root), str(proc_cgroup)) == 1.5
+    assert cgroup_memory_limit(str(root), str(proc_cgroup)) == 1024 ** 3
+
+
+def test_cgroup_v1_nested(cgroup_v1, tmp_path):
+    job_cpu = tmp_path / "cpu,cpuacct" / "job"
+    job_cpu.mkdir()
+    (job_cpu / "cpu.cfs_quota_us").write_text("200000\n")
+    (job_cpu / "cpu.cfs_period_us").write_text("100000\n")
+    job_memory = tmp_path / "memory" / "job" / "task"
+    job_memory.mkdir(parents=True)
+    (job_memory / "memory.limit_in_bytes").write_text(str(2 * 1024 ** 3) + "\n")
+    proc_cgroup = tmp_path / "cgroup"
+    proc_cgroup.write_text("4:cpu,cpuacct:/job\n3:memory:/job/task\n")
+
+    assert cgroup_cpu_limit(cgroup_v1, str(proc_cgroup)) == 2
+    assert cgroup_memory_limit(cgroup_v1, str(proc_cgroup)) == 2 * 1024 ** 3
+
+
+def test_cgroup_not_visible(cgroup_v2, tmp_path):
+    # e.g. in a container, the cgroup of the process is mounted as the root
+    proc_cgroup = tmp_path / "cgroup"
+    proc_cgroup.write_text("0::/docker/0123abcd\n")
+    assert cgroup_cpu_limit(cgroup_v2, str(proc_cgroup)) == 2.5
+    assert cgroup_memory_limit(cgroup_v2, str(proc_cgroup)) == 4 * 1024 ** 3
+
+
+def test_no_cgroup(tmp_path):
+    assert cgroup_cpu_limit(str(tmp_path)) is None
+    assert cgroup_memory_limit(str(tmp_path)) is None
+
+
+def test_parse_cpu_list():
+    assert parse_cpu_list("0-3,8,10-11\n") == 7
+
+
+def test_slurm_limits():
+    assert slurm_limits({}) == ResourceLimits(None, None)
+    assert slurm_limits({"SLURM_CPUS_PER_TASK": "4", "SLURM_MEM_PER_CPU": "1000"}) == ResourceLimits(
+        4, 4000 * 1024 ** 2
+    )
+    assert slurm_limits({"SLURM_CPUS_ON_NODE": "8", "SLURM_MEM_PER_NODE": "2048"}).memory_bytes == 2 * 1024 ** 3
+
+
+def test_probe_uses_tightest_limit(cgroup_v2):
+    limits = probe_resource_limits(cgroup_v2, {"SLURM_CPUS_PER_TASK": "2", "SLURM_MEM_PER_NODE": "8192"})
+    assert limits.cpus <= 2
+    assert limits.memory_bytes == 4 * 1024 ** 3
+    assert limits.thread_count() <= 2
+    assert limits.total_ram_mb() == 4096
+
+
+def test_memory_pressure_monitor():
+    state = {"rss": 0, "budget": 1000}
+    monitor = MemoryPressureMonitor(
+        memory_limit=2000,
+        get_rss=lambda: state["rss"],
+        get_cache_budget=lambda: 1000,
+        set_cache_budget=lambda budget: state.update(budget=budget),
+    )
+
+    state["rss"] = 1000
+    assert monitor.check() == 1000
+
+    # close to the limit: shrink
+    state["rss"] = 1950
+    assert monitor.check() == 750
+    assert state["budget"] == monitor.budget
+    for _ in range(20):
+        monitor.check()
+    assert monitor.budget == 100  # not below the minimum
+
+    # plenty of room again: grow back to the original budget
+    state["rss"] = 500
+    for _ in range(20):
+        monitor.check()
+    assert monitor.budget == 1000
@@ -0,0 +1,54 @@
+import h5py
+import numpy
+
+from ilastik.workflows.carving.carvingObjectStore import read_object_store, write_object_store
+
+
+class FakeMst(object):
+    def __init__(self):
+        self.object_names = {}
+        self.object_seeds_fg_voxels = {}
+        self.object_seeds_bg_voxels = {}
+        self.object_lut = {}
+        self.bg_priority = {}
+        self.no_bias_below = {}
+
+
+def make_mst():
+    mst = FakeMst()
+    rng = numpy.random.RandomState(0)
+    for number, name in [(1, "Object 1"), (4, "Object 2"), (2, "Nucleus µ")]:
+        mst.object_names[name] = number
+        mst.object_seeds_fg_voxels[name] = list(rng.randint(0, 100, size=(3, 10 * number)))
+        mst.object_seeds_bg_voxels[name] = list(rng.randint(0, 100, size=(3, 5 * number)))
+        mst.object_lut[name] = numpy.where(rng.rand(50) > 0.5)
+        mst.bg_priority[name] = 0.9
+        mst.no_bias_below[name] = 64 + number
+    return mst
+
+
+def test_roundtrip(tmp_path):
+    mst = make_mst()
+    with h5py.File(tmp_path / "objects.h5", "w") as f:
+        write_object_store(f.create_group("object_store"), mst)
+
+    loaded = FakeMst()
+    with h5py.File(tmp_path / "objects.h5", "r") as f:
+        names = read_object_store(f["object_store"], loaded)
+
+    assert names == list(mst.object_names.keys())
+    assert loaded.object_names == mst.object_names
+    for name in names:
+        numpy.testing.assert_array_equal(loaded.object_seeds_fg_voxels[name], mst.object_seeds_fg_voxels[name])
+        numpy.testing.assert_array_equal(loaded.object_seeds_bg_voxels[name], mst.object_seeds_bg_voxels[name])
+        numpy.testing.assert_array_equal(loaded.object_lut[name][0], mst.object_lut[name][0])
+        assert loaded.bg_priority[name] == numpy.float32(0.9)
+        assert loaded.no_bias_below[name] == mst.no_bias_below[name]
+
+
+def test_empty_store(tmp_path):
+    with h5py.File(tmp_path / "objects.h5", "w") as f:
+        write_object_store(f.create_group("object_store"), FakeMst())
+        loaded = FakeMst()
+        assert read_object_store(f["object_store"], loaded) == []
+        assert loaded.object_names == {}
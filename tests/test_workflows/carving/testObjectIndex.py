@@ -0,0 +1,53 @@
+import h5py
+import numpy
+
+from ilastik.workflows.carving.objectIndex import SupervoxelObjectIndex
+
+
+def build_index():
+    index = SupervoxelObjectIndex(10)
+    index.add(1, (numpy.array([1, 2, 3]),))  # like numpy.where
+    index.add(2, numpy.array([[3, 4]]))  # like the "sv" dataset in project files
+    index.add(3, [3, 9])
+    return index
+
+
+def test_objects_at():
+    index = build_index()
+    assert index.objects_at(0) == []
+    assert index.objects_at(1) == [1]
+    assert index.objects_at(3) == [1, 2, 3]
+    assert index.objects_at(9) == [3]
+    assert index.object_numbers() == {1, 2, 3}
+
+
+def test_owner_lut():
+    index = build_index()
+    numpy.testing.assert_array_equal(index.owner_lut(), [0, 1, 1, 3, 2, 0, 0, 0, 0, 3, 0])
+    numpy.testing.assert_array_equal(index.owner_lut(exclude=3), [0, 1, 1, 2, 2, 0, 0, 0, 0, 0, 0])
+    numpy.testing.assert_array_equal(index.owner_lut([9, 3, 5], exclude=2), [3, 3, 0])
+
+
+def test_remove():
+    index = build_index()
+    index.remove(3, [3, 9])
+    assert index.objects_at(3) == [1, 2]
+    assert index.objects_at(9) == []
+    index.remove(1, (numpy.array([1, 2, 3]),))
+    assert index.objects_at(3) == [2]
+    numpy.testing.assert_array_equal(index.owner_lut(), [0, 0, 0, 2, 2, 0, 0, 0, 0, 0, 0])
+
+    expected = SupervoxelObjectIndex.from_objects(10, {"b": [3, 4]}, {"b": 2})
+    numpy.testing.assert_array_equal(index.owner_lut(), expected.owner_lut())
+
+
+def test_serialization(tmp_path):
+    index = build_index()
+    with h5py.File(tmp_path / "index.h5", "w") as f:
+        index.serialize(f.create_group("object_index"))
+    with h5py.File(tmp_path / "index.h5", "r") as f:
+        restored = SupervoxelObjectIndex.deserialize(f["object_index"])
+
+    assert restored.num_nodes == 10
+    numpy.testing.assert_array_equal(restored.owner_lut(), index.owner_lut())
+    assert restored.objects_at(3) == [1, 2, 3]
@@ -0,0 +1,44 @@
+import numpy
+
+from ilastik.workflows.carving.seedIndex import SparseSeedIndex
+
+ERASER = 100
+
+
+def apply_write(volume, start, labels):
+    """Reference implementation of the label array write semantics"""
+    target = volume[tuple(slice(s, s + n) for s, n in zip(start, labels.shape))]
+    target[labels == ERASER] = 0
+    target[(labels != 0) & (labels != ERASER)] = labels[(labels != 0) & (labels != ERASER)]
+
+
+def assert_matches(index, volume):
+    for label in (1, 2):
+        expected = numpy.nonzero(volume == label)
+        coords = index.label_coordinates(label)
+        assert sorted(zip(*coords)) == sorted(zip(*expected))
+
+
+def test_write_overwrite_and_erase():
+    shape = (20, 30, 25)
+    volume = numpy.zeros(shape, dtype=numpy.uint8)
+    index = SparseSeedIndex(shape, block_shape=(8, 8, 8))
+    rng = numpy.random.RandomState(0)
+
+    for _ in range(30):
+        size = rng.randint(1, 12, size=3)
+        start = [rng.randint(0, s - n + 1) for s, n in zip(shape, size)]
+        labels = rng.choice([0, 0, 1, 2, ERASER], size=size).astype(numpy.uint8)
+        apply_write(volume, start, labels)
+        index.write(start, labels, ERASER)
+        assert_matches(index, volume)
+
+
+def test_empty_and_clear():
+    index = SparseSeedIndex((10, 10, 10))
+    assert [len(c) for c in index.label_coordinates(1)] == [0, 0, 0]
+
+    index.write((9, 9, 0), numpy.ones((1, 1, 10), dtype=numpy.uint8))
+    assert len(index.label_coordinates(1)[0]) == 10
+    index.clear()
+    assert len(index.label_coordinates(1)[0]) == 0
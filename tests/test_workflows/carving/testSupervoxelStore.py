@@ -0,0 +1,35 @@
+import gc
+import os
+
+import numpy
+import pytest
+
+from ilastik.workflows.carving.supervoxelStore import ChunkedSupervoxels
+
+
+@pytest.fixture
+def supervoxels():
+    return numpy.random.RandomState(0).randint(0, 1000, size=(70, 130, 90)).astype(numpy.uint32)
+
+
+def test_slicing_matches_array(supervoxels, tmp_path):
+    volume = ChunkedSupervoxels.from_array(supervoxels, directory=str(tmp_path), cache_chunks=4)
+    assert volume.shape == supervoxels.shape
+    assert volume.dtype == supervoxels.dtype
+
+    numpy.testing.assert_array_equal(volume[3:60, 1:129, 5:7], supervoxels[3:60, 1:129, 5:7])
+    numpy.testing.assert_array_equal(volume[5, :, -10:], supervoxels[5, :, -10:])
+    numpy.testing.assert_array_equal(volume[...], supervoxels)
+    assert volume[(5, 6, 7)] == supervoxels[5, 6, 7]
+    assert volume[10:10].shape == (0, 130, 90)
+
+    lut = numpy.arange(1000) * 2
+    numpy.testing.assert_array_equal(lut[volume[...]], lut[supervoxels])
+
+
+def test_temporary_file_is_removed(supervoxels, tmp_path):
+    volume = ChunkedSupervoxels.from_array(supervoxels, directory=str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 1
+    del volume
+    gc.collect()
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,31 @@
+import numpy as np
+
+from ilastik.workflows.newAutocontext.labelDistribution import partition_block
+
+
+def test_partition_block_is_disjoint_and_complete():
+    block = np.random.RandomState(0).randint(0, 4, size=(10, 12, 14, 1)).astype(np.uint8)
+    blocks = partition_block(block, [0, 2, 3], np.random.RandomState(1))
+
+    assert sorted(blocks.keys()) == [0, 2, 3]
+    stacked = np.stack(list(blocks.values()))
+    # Every labeled pixel goes to exactly one destination, with its original label
+    assert ((stacked != 0).sum(axis=0) == (block != 0)).all()
+    assert (stacked.sum(axis=0) == block).all()
+    # ... and the destinations get roughly equal shares
+    shares = [(b != 0).sum() for b in blocks.values()]
+    assert min(shares) > 0.25 * (block != 0).sum()
+
+
+def test_partition_block_erases_moved_labels_from_source():
+    block = np.array([[0, 1, 2, 1, 2, 1]], dtype=np.uint8)
+    blocks = partition_block(block, [0, 1], np.random.RandomState(3), eraser_value=100, source=1)
+
+    kept = blocks[1][blocks[1] != 100]
+    assert set(np.unique(kept)) <= {0, 1, 2}
+    assert blocks[1][0, 0] == 0
+    # Labeled pixels are either kept in the source or erased there and moved to the other stage
+    moved = blocks[1] == 100
+    assert (blocks[0][moved] == block[moved]).all()
+    assert (blocks[0][~moved] == 0).all()
+    assert (blocks[1][(block != 0) & ~moved] == block[(block != 0) & ~moved]).all()
@@ -0,0 +1,62 @@
+import subprocess
+import sys
+
+import pytest
+
+import ilastik.config
+import ilastik.workflows
+from ilastik.workflow import getWorkflowFromName
+
+
+def test_importing_registry_does_not_import_workflows():
+    snippet = (
+        "import sys, ilastik.workflows\n"
+        "loaded = [m for m in sys.modules if m.startswith('ilastik.workflows.')]\n"
+        "print(','.join(loaded))\n"
+    )
+    output = subprocess.check_output([sys.executable, "-c", snippet]).decode("utf-8").strip()
+    assert output == ""
+
+
+def test_get_workflow_from_name_only_imports_requested_workflow():
+    snippet = (
+        "import sys\n"
+        "from ilastik.workflow import getWorkflowFromName\n"
+        "assert getWorkflowFromName('Pixel Classification').__name__ == 'PixelClassificationWorkflow'\n"
+        "print(any(m.startswith(('ilastik.workflows.tracking', 'ilastik.workflows.carving')) for m in sys.modules))\n"
+    )
+    output = subprocess.check_output([sys.executable, "-c", snippet]).decode("utf-8").strip()
+    assert output == "False"
+
+
+@pytest.mark.parametrize("entry", list(ilastik.workflows.available_workflow_entries()), ids=repr)
+def test_registry_metadata_matches_workflow_class(entry):
+    try:
+        workflow_class = entry.load()
+    except ImportError as e:
+        pytest.skip(f"workflow dependencies not available: {e}")
+
+    assert workflow_class.__name__ == entry.class_name
+    if isinstance(workflow_class.workflowName, str):
+        assert workflow_class.workflowName == entry.name
+    if workflow_class.workflowDisplayName is not None:
+        assert workflow_class.workflowDisplayName == entry.display_name
+
+
+@pytest.mark.parametrize("name", ["Pixel Classification", "PixelClassificationWorkflow"])
+def test_get_workflow_from_name(name):
+    assert getWorkflowFromName(name) is ilastik.workflows.pixelClassification.PixelClassificationWorkflow
+
+
+def test_unknown_workflow():
+    assert getWorkflowFromName("Not a workflow") is None
+
+
+@pytest.mark.parametrize("enabled", ["true", "false"])
+def test_find_workflow_entry_respects_config_flag(monkeypatch, enabled):
+    monkeypatch.setitem(ilastik.config.cfg["ilastik"], "debug", enabled)
+    entry = ilastik.workflows.find_workflow_entry("AutocontextThreeStage")
+    if enabled == "true":
+        assert entry.class_name == "AutocontextThreeStage"
+    else:
+        assert entry is None